@@ -0,0 +1,153 @@
+"""analyzeSentiment 결과 캐시 벤치마크: 첫 분석 vs HEAD + 메모리 hit vs ETag를 아는 요청 vs 새 컨테이너 (AWS 호출 없음).
+
+S3(HEAD/GET/사이드카)와 Nova Pro를 지연만 흉내 내는 stub으로 바꿔 끼우고 --images개 이미지를 차례로 요청해
+경우마다 핸들러 응답 지연 분위수와 S3/Bedrock 호출 수를 비교한다.
+- first: 캐시가 비어 있는 첫 요청 (GET + Nova Pro)
+- repeat (HEAD): 같은 컨테이너에서 bucket/key만 다시 보낸 요청, 기억한 ETag가 없거나 만료됨 (HEAD 한 번 + 메모리 LRU)
+- repeat (TTL): 바로 이어서 다시 보낸 요청, RESULT_ETAG_TTL 안이라 HEAD 없이 메모리 LRU
+- etag: 이전 응답의 ETag를 If-None-Match로 보낸 요청 (기억한 ETag와 같으면 304)
+- new container: 메모리를 비운 뒤 다시 보낸 요청 (HEAD + S3 사이드카)
+
+    superpower$ python benchmarks/analyze_sentiment_result_cache.py --images 50
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda')
+ANALYZE_DIR = os.path.join(LAMBDA_DIR, 'analyzeSentiment')
+COMMON_DIR = os.path.join(LAMBDA_DIR, 'common')
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class _StubS3:
+    """호출 종류별 지연만 흉내 낸다. 이미지와 캐시 사이드카를 메모리에 둔다."""
+
+    def __init__(self, head_seconds, get_seconds, sidecar_seconds):
+        self.head_seconds = head_seconds
+        self.get_seconds = get_seconds
+        self.sidecar_seconds = sidecar_seconds
+        self.objects = {}
+        self.calls = {'head': 0, 'get': 0, 'sidecar_get': 0, 'put': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def head_object(self, Bucket, Key):
+        self._count('head')
+        time.sleep(self.head_seconds)
+        return {'ETag': self.objects[(Bucket, Key)][1]}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        from botocore.exceptions import ClientError
+        sidecar = Key.endswith('.json')
+        self._count('sidecar_get' if sidecar else 'get')
+        time.sleep(self.sidecar_seconds if sidecar else self.get_seconds)
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'not found'}}, 'GetObject')
+        data, etag = self.objects[(Bucket, Key)]
+        return {'Body': _Body(data), 'ETag': etag}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._count('put')
+        time.sleep(self.sidecar_seconds)
+        self.objects[(Bucket, Key)] = (Body, '"sidecar"')
+        return {}
+
+
+class _StubBedrock:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = 0
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self.calls += 1
+        time.sleep(self.seconds)
+        text = ('a small orange fox\nEMOTIONS: '
+                '{"emotions":[{"name":"joy","score":9},{"name":"평온","score":5},{"name":"설렘","score":3}]}')
+        return {'body': _Body(json.dumps({'output': {'message': {'content': [{'text': text}]}}}).encode())}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--head-latency', type=float, default=0.015, help='S3 HEAD 1회 지연(초)')
+    parser.add_argument('--get-latency', type=float, default=0.04, help='이미지 GET 1회 지연(초)')
+    parser.add_argument('--sidecar-latency', type=float, default=0.02, help='캐시 사이드카 GET/PUT 1회 지연(초)')
+    parser.add_argument('--model-latency', type=float, default=0.8, help='Nova Pro 호출 1회 지연(초)')
+    args = parser.parse_args()
+
+    os.environ.update({'PROGRESS_ENABLED': 'false', 'BEDROCK_RATE_LIMIT_ENABLED': 'false'})
+    sys.path[:0] = [ANALYZE_DIR, COMMON_DIR]
+    import app
+    from PIL import Image
+    from sp_common.bedrock_pool import RegionalBedrockPool
+    from sp_common.cache import LRUCache
+
+    stub_s3 = _StubS3(args.head_latency, args.get_latency, args.sidecar_latency)
+    for i in range(args.images):
+        buffer = io.BytesIO()
+        # 이미지마다 내용이 달라야 vision 캐시(내용 해시)에 걸리지 않는다
+        Image.frombytes('RGB', (128, 128), random.Random(i).randbytes(128 * 128 * 3)).save(buffer, format='JPEG')
+        stub_s3.objects[('sp-user-input-temporary-bucket', f'bench/{i}.jpg')] = (buffer.getvalue(), f'"etag-{i}"')
+    stub_bedrock = _StubBedrock(args.model_latency)
+    app.s3 = stub_s3
+    app.result_cache.persistent.s3 = stub_s3
+    app.vision_cache.persistent.s3 = stub_s3
+    app.bedrock = RegionalBedrockPool(['stub'], client_factory=lambda region, budget_ms: stub_bedrock)
+
+    def request(i, headers=None):
+        body = {'bucket': 'sp-user-input-temporary-bucket', 'key': f'bench/{i}.jpg'}
+        started = time.perf_counter()
+        response = app.lambda_handler({'body': json.dumps(body), 'headers': headers or {}}, None)
+        return (time.perf_counter() - started) * 1000, response
+
+    def run(name, headers_for=lambda i: None):
+        calls_before, model_before = dict(stub_s3.calls), stub_bedrock.calls
+        latencies, statuses = [], {}
+        real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        for i in range(args.images):
+            elapsed, response = request(i, headers_for(i))
+            latencies.append(elapsed)
+            statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+        sys.stdout = real_stdout
+        calls = {field: stub_s3.calls[field] - calls_before[field] for field in stub_s3.calls}
+        print(f"{name:<14} p50 {_percentile(latencies, 0.5):7.1f} ms  p99 {_percentile(latencies, 0.99):7.1f} ms  "
+              f"status {statuses}  s3 {calls}  nova {stub_bedrock.calls - model_before}")
+
+    def forget_etags():
+        # 첫 분석은 Nova Pro 지연 때문에 RESULT_ETAG_TTL보다 오래 걸리므로 기억한 ETag를 비우고 다시 잰다
+        app.current_etags = LRUCache(app.RESULT_CACHE_ENTRIES, app.RESULT_ETAG_TTL)
+
+    run('first')
+    forget_etags()
+    run('repeat (HEAD)')
+    run('repeat (TTL)')
+    run('etag', lambda i: {'If-None-Match': f'"etag-{i}"'})
+    app.result_cache.memory = type(app.result_cache.memory)(app.RESULT_CACHE_ENTRIES, app.RESULT_CACHE_TTL)
+    app.vision_cache.memory = type(app.vision_cache.memory)(app.VISION_CACHE_ENTRIES, app.VISION_CACHE_TTL)
+    forget_etags()
+    run('new container')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Bedrock 속도 제한 벤치마크: 제한 없음 vs 컨테이너별 제한 vs 공유 제한 (AWS 호출 없음).
+
+--containers개 프로세스가 각각 --calls번 모델을 부른다. 가짜 Bedrock은 모든 프로세스를 합쳐 초당 --quota번만
+받고 넘으면 ThrottlingException을 낸다 (할당량 상태도 파일 잠금으로 프로세스끼리 공유).
+- none: 제한 없이 바로 호출 (스로틀 = 실패)
+- local: 프로세스마다 자기 메모리 안에서만 --quota로 제한 (합치면 할당량을 넘는다)
+- shared: FileLimiterStore 하나를 모든 프로세스가 같이 써서 --quota로 제한
+
+    superpower$ python benchmarks/bedrock_rate_limit.py --containers 6 --calls 20 --quota 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+COMMON_DIR = os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda', 'common')
+MODEL_ID = 'amazon.nova-pro-v1:0'
+
+
+def _server_call(quota_store, quota, latency):
+    """모든 프로세스가 나눠 쓰는 초당 quota 토큰 버킷. 토큰이 없으면 스로틀."""
+    from botocore.exceptions import ClientError
+
+    def take(state):
+        now = time.time()
+        state = state or {'tokens': quota, 'updated_at': now, 'throttled': 0, 'served': 0}
+        state['tokens'] = min(quota, state['tokens'] + (now - state['updated_at']) * quota)
+        state['updated_at'] = now
+        if state['tokens'] < 1:
+            state['throttled'] += 1
+            return state, False
+        state['tokens'] -= 1
+        state['served'] += 1
+        return state, True
+
+    if not quota_store.update('server', take):
+        raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests'}}, 'InvokeModel')
+    time.sleep(latency)
+    return {'ok': True}
+
+
+def _container(mode, calls, quota, latency, quota_dir, limiter_dir, results):
+    sys.path.insert(0, COMMON_DIR)
+    from sp_common.rate_limit import FileLimiterStore, InMemoryLimiterStore, RateLimiter
+
+    quota_store = FileLimiterStore(quota_dir)
+    limiter = None
+    if mode != 'none':
+        store = FileLimiterStore(limiter_dir) if mode == 'shared' else InMemoryLimiterStore()
+        limiter = RateLimiter(store, {MODEL_ID: {'rate': quota, 'burst': quota, 'concurrency': quota}},
+                              max_wait_ms=30000, max_attempts=4)
+
+    succeeded = failed = 0
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    for _ in range(calls):
+        try:
+            if limiter is None:
+                _server_call(quota_store, quota, latency)
+            else:
+                limiter.call(MODEL_ID, lambda: _server_call(quota_store, quota, latency), scope='bench')
+            succeeded += 1
+        except Exception:
+            failed += 1
+    sys.stdout = real_stdout
+    results.put({'succeeded': succeeded, 'failed': failed,
+                 'limiter': limiter.snapshot() if limiter and mode == 'local' else None})
+
+
+def _run(mode, args):
+    sys.path.insert(0, COMMON_DIR)
+    from sp_common.rate_limit import FileLimiterStore, RateLimiter
+
+    with tempfile.TemporaryDirectory() as quota_dir, tempfile.TemporaryDirectory() as limiter_dir:
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_container, args=(mode, args.calls, args.quota, args.latency,
+                                                             quota_dir, limiter_dir, results))
+            for _ in range(args.containers)
+        ]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        server = FileLimiterStore(quota_dir).items().get('server', {})
+        succeeded = sum(outcome['succeeded'] for outcome in outcomes)
+        failed = sum(outcome['failed'] for outcome in outcomes)
+        print(f"{mode:<7} succeeded {succeeded:4d}  failed {failed:4d}  throttled at server {server.get('throttled', 0):4d}  "
+              f"in {elapsed:5.2f} s")
+        if mode == 'shared':
+            counts = RateLimiter(FileLimiterStore(limiter_dir)).snapshot()[f"bench/{MODEL_ID}"]
+            print(f"{'':<7} admitted {counts['admitted']}  delayed {counts['delayed']}  rejected {counts['rejected']}  "
+                  f"throttled {counts['throttled']}")
+        elif mode == 'local':
+            totals = {'admitted': 0, 'delayed': 0, 'rejected': 0, 'throttled': 0}
+            for outcome in outcomes:
+                for field in totals:
+                    totals[field] += outcome['limiter'][f"bench/{MODEL_ID}"][field]
+            print(f"{'':<7} admitted {totals['admitted']}  delayed {totals['delayed']}  rejected {totals['rejected']}  "
+                  f"throttled {totals['throttled']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--containers', type=int, default=6)
+    parser.add_argument('--calls', type=int, default=20, help='컨테이너당 호출 수')
+    parser.add_argument('--quota', type=float, default=8, help='가짜 Bedrock 초당 허용 호출 수 (전체 합)')
+    parser.add_argument('--latency', type=float, default=0.05, help='호출 1회 지연(초)')
+    args = parser.parse_args()
+
+    for mode in ('none', 'local', 'shared'):
+        _run(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Bedrock 리전 라우팅 벤치마크: us-east-1 고정 vs 다중 리전 풀 (+ hedge) (AWS 호출 없음).
+
+리전마다 지연(평균/꼬리)과 스로틀 확률을 흉내 내는 stub 클라이언트를 RegionalBedrockPool에 끼워
+--requests개 호출을 --concurrency개 스레드로 보내고 지연 분위수와 실패율, 리전별 호출 수를 비교한다.
+
+    superpower$ python benchmarks/bedrock_region_routing.py --requests 400 --concurrency 16
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+COMMON_DIR = os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda', 'common')
+
+# (평균 지연 초, 꼬리 확률, 꼬리 배수, 스로틀 확률)
+REGION_PROFILES = {
+    'us-east-1': (0.40, 0.05, 4.0, 0.10),
+    'ap-northeast-2': (0.15, 0.05, 6.0, 0.02),
+    'ap-northeast-1': (0.20, 0.03, 4.0, 0.02),
+}
+
+
+class _StubRegionClient:
+    def __init__(self, region, scale, rng, lock):
+        self.region = region
+        self.mean, self.tail_p, self.tail_x, self.throttle_p = REGION_PROFILES[region]
+        self.scale = scale
+        self.rng = rng
+        self.lock = lock
+
+    def invoke_model(self, modelId, **kwargs):
+        from botocore.exceptions import ClientError
+        with self.lock:
+            throttled = self.rng.random() < self.throttle_p
+            slow = self.rng.random() < self.tail_p
+            jitter = self.rng.uniform(0.8, 1.2)
+        if throttled:
+            time.sleep(0.01 * self.scale)
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'InvokeModel')
+        time.sleep(self.mean * jitter * (self.tail_x if slow else 1) * self.scale)
+        return {'region': self.region}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _run(name, pool, requests, concurrency):
+    latencies, regions, failures = [], {}, 0
+    lock = threading.Lock()
+
+    def call(_):
+        nonlocal failures
+        started = time.perf_counter()
+        try:
+            response = pool.invoke_model(modelId='amazon.nova-pro-v1:0', body='{}')
+        except Exception:
+            with lock:
+                failures += 1
+            return
+        with lock:
+            latencies.append((time.perf_counter() - started) * 1000)
+            regions[response['region']] = regions.get(response['region'], 0) + 1
+
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(requests)))
+    sys.stdout = real_stdout
+
+    print(f"{name:<22} p50 {_percentile(latencies, 0.5):7.1f} ms  p95 {_percentile(latencies, 0.95):7.1f} ms  "
+          f"p99 {_percentile(latencies, 0.99):7.1f} ms  failed {failures}/{requests}  served by {regions}")
+    snapshot = pool.snapshot()
+    print(f"{'':<22} failovers {snapshot['failovers']}  hedges {snapshot['hedges']} (won {snapshot['hedgeWins']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--scale', type=float, default=0.25, help='지연 배율 (1이면 위 프로필 그대로)')
+    parser.add_argument('--hedge-percentile', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    sys.path.insert(0, COMMON_DIR)
+    from sp_common.bedrock_pool import RegionalBedrockPool
+
+    def factory(seed):
+        rng, lock, clients = random.Random(seed), threading.Lock(), {}
+
+        def client_for(region, budget_ms):
+            if region not in clients:
+                clients[region] = _StubRegionClient(region, args.scale, rng, lock)
+            return clients[region]
+        return client_for
+
+    regions = ['ap-northeast-2', 'ap-northeast-1', 'us-east-1']
+    _run('pinned us-east-1', RegionalBedrockPool(['us-east-1'], client_factory=factory(args.seed)),
+         args.requests, args.concurrency)
+    _run('multi-region', RegionalBedrockPool(regions, client_factory=factory(args.seed)),
+         args.requests, args.concurrency)
+    _run('multi-region + hedge', RegionalBedrockPool(regions, client_factory=factory(args.seed),
+                                                     hedge_percentile=args.hedge_percentile,
+                                                     hedge_workers=args.concurrency * 2),
+         args.requests, args.concurrency)
+
+
+if __name__ == '__main__':
+    main()
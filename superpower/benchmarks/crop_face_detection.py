@@ -0,0 +1,166 @@
+"""crop_face 검출 경로 벤치마크: 원본 전송 vs 축소 프록시 전송 (+ 로컬 검출기).
+
+각 모드를 별도 프로세스에서 실행해 Rekognition으로 보낸 바이트 수와 peak RSS를 비교한다.
+AWS 호출은 하지 않는다 (S3/Rekognition 클라이언트를 로컬 stub으로 바꿔 끼움).
+--local을 주면 OpenCV 로컬 검출기 경로도 함께 잰다 (opencv-python-headless 필요).
+
+    superpower$ python benchmarks/crop_face_detection.py --width 4032 --height 3024 --images 5 --local
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda')
+CROP_FACE_DIR = os.path.join(LAMBDA_DIR, 'crop_face')
+# 배포 시 CommonLayer로 올라가는 sp_common 패키지
+COMMON_DIR = os.path.join(LAMBDA_DIR, 'common')
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class _StubS3:
+    def __init__(self, image_data):
+        self.image_data = image_data
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        data = self.image_data
+        response = {'ETag': '"bench"', 'ContentType': 'image/jpeg'}
+        if Range:
+            # admission의 헤더 probe(ranged GET)는 앞부분과 Content-Range만 받는다
+            start, end = (int(part) for part in Range.split('=')[1].split('-'))
+            end = min(end, len(data) - 1)
+            response['ContentRange'] = f"bytes {start}-{end}/{len(data)}"
+            data = data[start:end + 1]
+        return dict(response, Body=_Body(data), ContentLength=len(data))
+
+    def put_object(self, **kwargs):
+        return {}
+
+
+class _StubRekognition:
+    def __init__(self, faces):
+        self.faces = faces
+        self.bytes_sent = 0
+        self.calls = 0
+
+    def detect_faces(self, Image, Attributes):
+        self.calls += 1
+        self.bytes_sent += len(Image['Bytes'])
+        return {'FaceDetails': [
+            {'BoundingBox': {'Left': 0.1 + 0.25 * i, 'Top': 0.3, 'Width': 0.12, 'Height': 0.16}, 'Confidence': 99.0}
+            for i in range(self.faces)
+        ]}
+
+
+def _make_jpeg(path, width, height):
+    from PIL import Image
+
+    random.seed(0)
+    # 노이즈가 섞인 그라디언트로 실제 사진에 가까운 압축률을 만든다
+    tile = Image.frombytes('RGB', (256, 256), bytes(random.getrandbits(8) for _ in range(256 * 256 * 3)))
+    image = Image.linear_gradient('L').convert('RGB').resize((width, height))
+    noise = tile.resize((width, height))
+    Image.blend(image, noise, 0.35).save(path, format='JPEG', quality=92)
+
+
+def _run_child(args):
+    os.environ['CROP_FACE_DETECT_MAX_EDGE'] = str(args.max_edge)
+    os.environ['CROP_FACE_CROP_MIN_EDGE'] = str(args.crop_min_edge)
+    os.environ['CROP_FACE_DETECTION_CACHE'] = 'false'
+    os.environ['CROP_FACE_DETECTOR'] = args.detector
+    sys.path[:0] = [CROP_FACE_DIR, COMMON_DIR]
+    import app
+
+    with open(args.image, 'rb') as handle:
+        image_data = handle.read()
+
+    app.s3 = _StubS3(image_data)
+    rekognition = _StubRekognition(args.faces)
+    app.detector_policy.remote.client = rekognition
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    for index in range(args.images):
+        prepared = app._prepare_image_faces('bench-bucket', f'bench/{index}.jpg')
+    elapsed = time.perf_counter() - started
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(json.dumps({
+        'max_edge': args.max_edge,
+        'face_edge': max(max(face['image'].size) for face in prepared['faces']) if prepared['faces'] else 0,
+        'source_bytes': len(image_data),
+        'bytes_sent_per_image': rekognition.bytes_sent // max(1, rekognition.calls),
+        'baseline_rss_mb': round(baseline_rss / 1024, 1),
+        'peak_rss_mb': round(peak_rss / 1024, 1),
+        'seconds_per_image': round(elapsed / args.images, 3),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=4032)
+    parser.add_argument('--height', type=int, default=3024)
+    parser.add_argument('--images', type=int, default=5)
+    parser.add_argument('--faces', type=int, default=1, help='stub이 돌려줄 이미지당 얼굴 수 (0이면 크롭 단계 생략)')
+    parser.add_argument('--max-edge', type=int, default=1600)
+    parser.add_argument('--crop-min-edge', type=int, default=256, help='after 모드의 CROP_FACE_CROP_MIN_EDGE')
+    parser.add_argument('--local', action='store_true', help='로컬 (OpenCV) 검출기 경로도 측정')
+    parser.add_argument('--detector', default='rekognition', help=argparse.SUPPRESS)
+    parser.add_argument('--image', help=argparse.SUPPRESS)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--make-image', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.make_image:
+        _make_jpeg(args.image, args.width, args.height)
+        return
+    if args.child:
+        _run_child(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_path = os.path.join(tmp_dir, 'source.jpg')
+        # ru_maxrss는 fork 시점 값을 물려받으므로 원본 생성도 별도 프로세스에서 한다
+        subprocess.run(
+            [sys.executable, __file__, '--make-image', '--image', image_path,
+             '--width', str(args.width), '--height', str(args.height)],
+            check=True
+        )
+
+        # before: 원본을 그대로 보내고 원본 해상도로 자른다. after: 프록시로 검출하고 줄여 디코딩한 이미지에서 자른다
+        modes = [('before (original bytes)', 0, 0, 'rekognition'),
+                 ('after (proxy)', args.max_edge, args.crop_min_edge, 'rekognition')]
+        if args.local:
+            modes.append(('local detector', args.max_edge, args.crop_min_edge, 'local'))
+
+        rows = []
+        for label, max_edge, crop_min_edge, detector in modes:
+            output = subprocess.run(
+                [sys.executable, __file__, '--child', '--image', image_path, '--detector', detector,
+                 '--images', str(args.images), '--faces', str(args.faces), '--max-edge', str(max_edge),
+                 '--crop-min-edge', str(crop_min_edge)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            rows.append((label, json.loads(output.strip().splitlines()[-1])))
+
+    print(f"source: {args.width}x{args.height} JPEG, {rows[0][1]['source_bytes']} bytes, {args.faces} face(s)/image")
+    print(f"{'mode':<26}{'bytes sent':>12}{'RSS before MB':>15}{'peak RSS MB':>14}{'face px':>9}{'s/image':>10}")
+    for label, row in rows:
+        print(f"{label:<26}{row['bytes_sent_per_image']:>12}{row['baseline_rss_mb']:>15}{row['peak_rss_mb']:>14}"
+              f"{row['face_edge']:>9}{row['seconds_per_image']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""make_pet 비동기 작업 모드 부하 테스트 (AWS 호출 없음).
+
+JOB_QUEUE=local / JOB_STORE=memory로 핸들러를 띄우고, S3/Bedrock을 지연만 흉내 내는 stub으로 바꿔 끼운다.
+--requests개의 HTTP 요청을 --concurrency개 스레드로 동시에 보내서
+요청 응답(202) 지연과 작업이 끝나기까지의 시간/처리량을 비교한다 (--sync면 기존처럼 끝까지 기다리는 경로).
+
+    superpower$ python benchmarks/make_pet_jobs_load.py --requests 200 --concurrency 50 --workers 8
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda')
+MAKE_PET_DIR = os.path.join(LAMBDA_DIR, 'make_pet')
+COMMON_DIR = os.path.join(LAMBDA_DIR, 'common')
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class _StubS3:
+    def __init__(self, image_data):
+        self.image_data = image_data
+
+    def get_object(self, Bucket, Key, **kwargs):
+        return {'Body': _Body(self.image_data)}
+
+    def put_object(self, **kwargs):
+        return {}
+
+
+class _StubBedrock:
+    """Nova Pro / Nova Canvas 응답을 지정한 지연 후 돌려준다."""
+
+    def __init__(self, text_seconds, canvas_seconds, image_base64):
+        self.text_seconds = text_seconds
+        self.canvas_seconds = canvas_seconds
+        self.image_base64 = image_base64
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        if 'canvas' in modelId:
+            time.sleep(self.canvas_seconds)
+            return {'body': _Body(json.dumps({'images': [self.image_base64]}).encode())}
+        time.sleep(self.text_seconds)
+        text = '{"text": "a baby fox", "navigationText": "아기 여우"}' if 'system' in request else 'a small orange fox'
+        return {'body': _Body(json.dumps({'output': {'message': {'content': [{'text': text}]}}}).encode())}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=8, help='LocalJobQueue 스레드 수')
+    parser.add_argument('--text-latency', type=float, default=0.2, help='Nova Pro 호출 1회 지연(초)')
+    parser.add_argument('--canvas-latency', type=float, default=0.5, help='Nova Canvas 호출 1회 지연(초)')
+    parser.add_argument('--sync', action='store_true', help='작업 모드 대신 끝까지 기다리는 기존 경로를 잰다')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'JOB_MODE': 'sync' if args.sync else 'async',
+        'JOB_QUEUE': 'local',
+        'JOB_STORE': 'memory',
+        'JOB_LOCAL_WORKERS': str(args.workers),
+        'PROMPT_CACHE_ENABLED': 'false',
+        'PROGRESS_ENABLED': 'false',
+        'STREAM_ANALYSIS': 'false',
+    })
+    sys.path[:0] = [MAKE_PET_DIR, COMMON_DIR]
+    import app
+    from PIL import Image
+    from sp_common.bedrock_pool import RegionalBedrockPool
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, format='PNG')
+    app.s3 = _StubS3(buffer.getvalue())
+    stub_bedrock = _StubBedrock(args.text_latency, args.canvas_latency, base64.b64encode(buffer.getvalue()).decode())
+    app.bedrock = RegionalBedrockPool(['stub'], client_factory=lambda region, budget_ms: stub_bedrock)
+
+    response_ms = []
+    lock = threading.Lock()
+
+    def send(i):
+        event = {'httpMethod': 'POST', 'body': json.dumps({'bucket': 'sp-user-input-temporary-bucket', 'key': f'load/{i}.png'})}
+        started = time.perf_counter()
+        response = app.lambda_handler(event, None)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            response_ms.append(elapsed)
+        return response
+
+    # stdout 로그는 버리고 결과만 출력한다
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        responses = list(pool.map(send, range(args.requests)))
+    accepted_seconds = time.perf_counter() - started
+    if not args.sync:
+        app.job_queue.join()
+    done_seconds = time.perf_counter() - started
+    sys.stdout = real_stdout
+
+    statuses = {}
+    for response in responses:
+        statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+    if not args.sync:
+        job_ids = [json.loads(response['body'])['jobId'] for response in responses if response['statusCode'] == 202]
+        jobs = [app.job_store.get(job_id) for job_id in job_ids]
+        succeeded = sum(1 for job in jobs if job and job['status'] == 'succeeded')
+        print(f"jobs succeeded: {succeeded}/{len(job_ids)}")
+
+    print(f"mode: {'sync' if args.sync else 'async'}  requests: {args.requests}  concurrency: {args.concurrency}  "
+          f"status codes: {statuses}")
+    print(f"response latency: p50 {_percentile(response_ms, 0.5):,.1f} ms  p99 {_percentile(response_ms, 0.99):,.1f} ms")
+    print(f"all responses in {accepted_seconds:.2f} s, all work done in {done_seconds:.2f} s "
+          f"({args.requests / done_seconds:.1f} images/s)")
+
+
+if __name__ == '__main__':
+    main()
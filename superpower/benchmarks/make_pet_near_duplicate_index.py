@@ -0,0 +1,67 @@
+"""make_pet near-duplicate 인덱스 조회 비용 벤치마크 (기본 1M 항목).
+
+multi-index hashing 조회와 전체 선형 탐색을 같은 질의로 비교한다. AWS 호출은 없다.
+
+    superpower$ python benchmarks/make_pet_near_duplicate_index.py --entries 1000000 --queries 2000
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda', 'make_pet'))
+
+from near_duplicates import MultiIndexHash, hamming  # noqa: E402
+
+
+def _flip_bits(value, count, rng):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--max-distance', type=int, default=6)
+    parser.add_argument('--linear-queries', type=int, default=20, help='선형 탐색은 느려서 질의 수를 따로 줄인다')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(args.entries)]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index = MultiIndexHash()
+    for i, value in enumerate(hashes):
+        index.add(value, {'content_hash': f'{i:064x}', 'generated_key': None})
+    build_seconds = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # 절반은 기존 항목에서 1~max_distance 비트를 뒤집은 근접 질의, 절반은 무작위(대부분 miss) 질의
+    queries = []
+    for _ in range(args.queries // 2):
+        queries.append(_flip_bits(rng.choice(hashes), rng.randint(1, args.max_distance), rng))
+        queries.append(rng.getrandbits(64))
+
+    started = time.perf_counter()
+    found = sum(1 for query in queries if index.search(query, args.max_distance) is not None)
+    mih_seconds = time.perf_counter() - started
+
+    linear_queries = queries[:args.linear_queries]
+    started = time.perf_counter()
+    for query in linear_queries:
+        min((hamming(query, value) for value in index.hashes), default=None)
+    linear_seconds = time.perf_counter() - started
+
+    print(f"entries: {len(index):,}  build: {build_seconds:.1f} s  index RSS: +{(rss_after - rss_before) / 1024:.0f} MB")
+    print(f"multi-index lookup (d<={args.max_distance}): {mih_seconds / len(queries) * 1e6:,.0f} us/query "
+          f"({found}/{len(queries)} matched)")
+    print(f"linear scan:                  {linear_seconds / len(linear_queries) * 1e6:,.0f} us/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""resize_image 요청 시 리사이즈 벤치마크: cold(원본에서 생성) vs warm(S3에 저장된 사본) vs hot(/tmp LRU) (AWS 호출 없음).
+
+원본 이미지 --images장에 대해 --sizes의 크기/포맷 요청을 차례로 보내 경우마다 핸들러 응답 지연 분위수와
+S3 호출 수를 비교한다. S3는 호출 종류별 지연만 흉내 내는 stub이고 /tmp 캐시는 임시 디렉터리를 쓴다.
+- cold: /tmp도 S3 사본도 없는 첫 요청 (ranged GET + 원본 GET + 디코딩/인코딩 + PUT)
+- hot: 같은 컨테이너에서 같은 요청을 다시 보낸 경우 (/tmp 파일 읽기, 원본 ETag는 메모리에 있으면 HEAD도 없음)
+- warm: 새 컨테이너(/tmp 비어 있음)에서 보낸 경우 (원본 HEAD + S3에 저장된 사본 GET)
+
+    superpower$ python benchmarks/resize_image_on_read.py --images 8 --sizes 256x256:webp,512x:jpeg
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda')
+RESIZE_DIR = os.path.join(LAMBDA_DIR, 'resize_image')
+COMMON_DIR = os.path.join(LAMBDA_DIR, 'common')
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class _StubS3:
+    """GET 1회 지연 + 전송량에 비례한 지연만 흉내 낸다."""
+
+    def __init__(self, request_seconds, mb_per_second):
+        self.request_seconds = request_seconds
+        self.mb_per_second = mb_per_second
+        self.objects = {}
+        self.calls = {'head': 0, 'range_get': 0, 'get': 0, 'miss': 0, 'put': 0}
+        self._lock = threading.Lock()
+
+    def _wait(self, name, size):
+        with self._lock:
+            self.calls[name] += 1
+        time.sleep(self.request_seconds + size / (self.mb_per_second * 1e6))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        from botocore.exceptions import ClientError
+        if (Bucket, Key) not in self.objects:
+            self._wait('miss', 0)
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        self._wait('head', 0)
+        return {'ETag': '"stub"', 'ContentLength': len(self.objects[(Bucket, Key)][0])}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        from botocore.exceptions import ClientError
+        if (Bucket, Key) not in self.objects:
+            self._wait('miss', 0)
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'not found'}}, 'GetObject')
+        data, content_type = self.objects[(Bucket, Key)]
+        response = {'ContentType': content_type, 'ETag': '"stub"'}
+        if Range:
+            start, end = (int(part) for part in Range.split('=')[1].split('-'))
+            response['ContentRange'] = f"bytes {start}-{min(end, len(data) - 1)}/{len(data)}"
+            data = data[start:end + 1]
+        self._wait('range_get' if Range else 'get', len(data))
+        return dict(response, Body=_Body(data), ContentLength=len(data))
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, **kwargs):
+        self._wait('put', len(Body))
+        self.objects[(Bucket, Key)] = (Body, ContentType)
+        return {}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _make_originals(count, seed):
+    """사진처럼 그라데이션 + 잡음이 섞인 4032x3024 JPEG."""
+    from PIL import Image, ImageFilter
+    rng = random.Random(seed)
+    originals = []
+    for _ in range(count):
+        size = (4032, 3024)
+        base = Image.linear_gradient('L').resize(size).convert('RGB')
+        noise = Image.effect_noise((size[0] // 4, size[1] // 4), 40 + rng.random() * 20).resize(size).convert('RGB')
+        buffer = io.BytesIO()
+        Image.blend(base, noise, 0.5).filter(ImageFilter.SMOOTH).save(buffer, format='JPEG', quality=90)
+        originals.append(buffer.getvalue())
+    return originals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--sizes', default='256x256:webp,512x:jpeg,x128:png',
+                        help="'너비x높이:포맷' 목록 (한쪽은 비워도 된다, 값은 RESIZE_ALLOWED_SIZES 중 하나)")
+    parser.add_argument('--request-latency', type=float, default=0.02, help='S3 요청 1회 지연(초)')
+    parser.add_argument('--throughput', type=float, default=80.0, help='S3 전송 속도(MB/s)')
+    parser.add_argument('--tmp-cache-mb', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='renditions-')
+    os.environ.update({'BUCKET_NAME': 'bench-resized', 'RESIZE_TMP_CACHE_DIR': directory,
+                       'RESIZE_TMP_CACHE_MAX_BYTES': str(args.tmp_cache_mb * 1024 * 1024)})
+    sys.path[:0] = [RESIZE_DIR, COMMON_DIR]
+    import app
+    from sp_common.cache import DiskLRUCache, LRUCache
+
+    stub_s3 = _StubS3(args.request_latency, args.throughput)
+    originals = _make_originals(args.images, args.seed)
+    for index, data in enumerate(originals):
+        stub_s3.objects[('sp-complete-bucket', f'bench/{index}.jpg')] = (data, 'image/jpeg')
+    app.s3 = stub_s3
+    print(f"originals: {args.images} JPEG 4032x3024, {sum(map(len, originals)) / 1e6:.1f} MB")
+
+    requests = []
+    for index in range(args.images):
+        for item in args.sizes.split(','):
+            box, _, fmt = item.partition(':')
+            width, _, height = box.partition('x')
+            requests.append({'key': f'bench/{index}.jpg', 'width': width, 'height': height, 'format': fmt or 'webp'})
+
+    def run(name, expected):
+        calls_before = dict(stub_s3.calls)
+        latencies, tiers = [], {}
+        real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        for params in requests:
+            started = time.perf_counter()
+            response = app.lambda_handler({'httpMethod': 'GET', 'queryStringParameters': params, 'headers': {}}, None)
+            latencies.append((time.perf_counter() - started) * 1000)
+            tier = response['headers'].get('X-Cache', response['statusCode'])
+            tiers[tier] = tiers.get(tier, 0) + 1
+        sys.stdout = real_stdout
+        calls = {field: stub_s3.calls[field] - calls_before[field] for field in stub_s3.calls}
+        print(f"{name:<5} p50 {_percentile(latencies, 0.5):7.1f} ms  p99 {_percentile(latencies, 0.99):7.1f} ms  "
+              f"served {tiers}  s3 {calls}" + ('' if set(tiers) == {expected} else f"  (expected {expected})"))
+
+    run('cold', 'cold')
+    run('hot', 'hot')
+    # 새 컨테이너: /tmp가 비어 있고 S3에 저장된 사본만 남아 있다
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    app.tmp_cache = DiskLRUCache(directory, args.tmp_cache_mb * 1024 * 1024)
+    app.source_etags = LRUCache(4096, app.SOURCE_ETAG_TTL_SECONDS)
+    run('warm', 'warm')
+    run('hot', 'hot')
+    print(f"/tmp cache: {len(app.tmp_cache)} files, {app.tmp_cache.size_bytes / 1e6:.2f} MB, {app.tmp_cache.stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""resize_image 벤치마크: 기존 핸들러(verify 후 다시 열기 + thumbnail 1장) vs 한 번 디코딩하는 rendition 엔진 (AWS 호출 없음).
+
+큰 JPEG/PNG 코퍼스를 만들어 두고 모드마다 별도 프로세스에서 전부 처리해 이미지당 디코딩 시간, 전체 시간,
+처리 중 최대 메모리(RSS) 증가량을 비교한다. S3는 업로드 지연만 흉내 내는 stub이다.
+- legacy: 바뀌기 전 핸들러 그대로 (300px 1장, 순차 업로드). 디코딩은 verify + 다시 열기 + thumbnail(디코딩+축소)
+- engine: RESIZE_RENDITIONS=300:original (같은 결과 1장)
+- legacy ladder: --ladder의 크기마다 기존 핸들러를 한 번씩 (디코딩 시간은 사본 한 장 기준)
+- engine ladder: --ladder의 여러 크기/포맷을 한 번에 (동시 업로드)
+
+    superpower$ python benchmarks/resize_image_renditions.py --jpegs 6 --pngs 4
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', 'stack', 'lambda')
+RESIZE_DIR = os.path.join(LAMBDA_DIR, 'resize_image')
+COMMON_DIR = os.path.join(LAMBDA_DIR, 'common')
+
+
+class _Body:
+    def __init__(self, data):
+        self._data = data
+
+    def read(self):
+        return self._data
+
+
+class _StubS3:
+    def __init__(self, objects, upload_seconds):
+        self.objects = objects
+        self.upload_seconds = upload_seconds
+
+    def get_object(self, Bucket, Key, **kwargs):
+        data, content_type = self.objects[Key]
+        return {'Body': _Body(data), 'ContentType': content_type}
+
+    def put_object(self, **kwargs):
+        time.sleep(self.upload_seconds)
+        return {}
+
+
+class _RssSampler:
+    """현재 RSS(/proc/self/statm)를 짧은 간격으로 읽어 최댓값을 기록한다.
+
+    ru_maxrss는 exec 전 부모 프로세스의 최댓값을 이어받아서 쓰지 않는다.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.baseline = self.peak = self._rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self):
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * self.page_size
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def _make_corpus(directory, jpegs, pngs, seed):
+    """사진처럼 그라데이션 + 잡음이 섞인 큰 이미지들."""
+    from PIL import Image, ImageFilter
+    rng = random.Random(seed)
+    paths = []
+    for index, (fmt, size) in enumerate([('JPEG', (4032, 3024))] * jpegs + [('PNG', (2400, 1800))] * pngs):
+        base = Image.linear_gradient('L').resize(size).convert('RGB')
+        noise = Image.effect_noise((size[0] // 4, size[1] // 4), 40 + rng.random() * 20).resize(size).convert('RGB')
+        image = Image.blend(base, noise, 0.5).filter(ImageFilter.SMOOTH)
+        path = os.path.join(directory, f"{index}.{'jpg' if fmt == 'JPEG' else 'png'}")
+        image.save(path, format=fmt, quality=90)
+        paths.append(path)
+    return paths
+
+
+def _legacy_handler(s3, bucket_name, key, edge=300, fmt=None):
+    """바뀌기 전 resize_image.lambda_handler의 처리 순서 (결과 비교용). edge/fmt로 다른 크기를 한 장 만든다."""
+    from PIL import Image
+    response = s3.get_object(Bucket='input', Key=key)
+    body = response['Body'].read()
+    content_type = response['ContentType']
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(body))
+    img.verify()
+    img = Image.open(io.BytesIO(body))
+    img.thumbnail((edge, edge))
+    decode_ms = (time.perf_counter() - started) * 1000
+    buffer = io.BytesIO()
+    if fmt == 'jpeg' and img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.save(buffer, format=fmt or img.format)
+    s3.put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue(), ContentType=content_type)
+    return decode_ms
+
+
+def _worker(mode, ladder, paths, upload_seconds, results):
+    os.environ['BUCKET_NAME'] = 'bench-resized'
+    os.environ['RESIZE_RENDITIONS'] = '300:original' if mode == 'engine' else ladder
+    sys.path[:0] = [RESIZE_DIR, COMMON_DIR]
+    import json
+    import app
+    from sp_common.output_keys import parse_ladder
+
+    objects = {}
+    for path in paths:
+        with open(path, 'rb') as handle:
+            objects[os.path.basename(path)] = (handle.read(), 'image/png' if path.endswith('.png') else 'image/jpeg')
+    s3 = _StubS3(objects, upload_seconds)
+    app.s3 = s3
+
+    decode_ms, outputs = [], 0
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    started = time.perf_counter()
+    with _RssSampler() as rss:
+        for key in objects:
+            if mode == 'legacy':
+                decode_ms.append(_legacy_handler(s3, 'bench-resized', key))
+                outputs += 1
+                continue
+            if mode == 'legacy ladder':
+                # 크기마다 기존 핸들러를 한 번씩 (그때마다 받고 디코딩)
+                source = 'png' if key.endswith('.png') else 'jpeg'
+                for edge, fmt in parse_ladder(ladder.replace('original', source)):
+                    decode_ms.append(_legacy_handler(s3, 'bench-resized', key, edge, fmt))
+                    outputs += 1
+                continue
+            response = app.lambda_handler({'detail': {'bucket': {'name': 'input'}, 'object': {'key': key}}}, None)
+            body = json.loads(response['body'])
+            decode_ms.append(body['timings'].get('decode_ms', 0))
+            outputs += len(body['renditions'])
+    wall = time.perf_counter() - started
+    sys.stdout = real_stdout
+    results.put({'decode_ms': sum(decode_ms) / len(decode_ms), 'wall': wall,
+                 'peak_mb': (rss.peak - rss.baseline) / 2 ** 20, 'outputs': outputs})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jpegs', type=int, default=6)
+    parser.add_argument('--pngs', type=int, default=4)
+    parser.add_argument('--ladder', default='1024:webp,512:webp,300:original,128:jpeg')
+    parser.add_argument('--upload-latency', type=float, default=0.03, help='S3 PutObject 1회 지연(초)')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = _make_corpus(directory, args.jpegs, args.pngs, args.seed)
+        print(f"corpus: {args.jpegs} JPEG 4032x3024 + {args.pngs} PNG 2400x1800, "
+              f"{sum(os.path.getsize(path) for path in paths) / 1e6:.1f} MB")
+        # 모드끼리 메모리/모듈 상태가 섞이지 않게 새 프로세스에서 돌린다
+        context = multiprocessing.get_context('spawn')
+        for mode in ('legacy', 'engine', 'legacy ladder', 'engine ladder'):
+            results = context.Queue()
+            process = context.Process(target=_worker, args=(mode, args.ladder, paths, args.upload_latency, results))
+            process.start()
+            outcome = results.get()
+            process.join()
+            print(f"{mode:<14} decode {outcome['decode_ms']:7.1f} ms/image  total {outcome['wall']:6.2f} s  "
+                  f"peak RSS +{outcome['peak_mb']:6.1f} MB  outputs {outcome['outputs']}")
+
+
+if __name__ == '__main__':
+    main()
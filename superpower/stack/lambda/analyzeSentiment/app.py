@@ -1,18 +1,97 @@
 import base64
 import json
+import os
 import random
 import re
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
+from botocore.exceptions import ClientError
+from sp_common import admission, image_prep, vision
+from sp_common.cache import LRUCache, S3JsonStore, TieredCache, cache_key
+from sp_common.bedrock_pool import RegionalBedrockPool, parse_model_regions, parse_regions
+from sp_common.deadline import Deadline, parse_budgets
+from sp_common.progress import DEFAULT_WEBSOCKET_ENDPOINT, ProgressNotifier, connection_id_from_key
+from sp_common.rate_limit import RateLimiter, build_store, parse_limits
 
 s3 = boto3.client("s3", region_name="ap-northeast-2")
-bedrock_nova = boto3.client("bedrock-runtime", region_name="us-east-1")
+
+# make_pet과 같은 설정으로 Nova Pro를 가까운/빠른 리전에 보내고 스로틀이 나면 다음 리전으로 넘긴다
+BEDROCK_REGIONS = parse_regions(os.environ.get("BEDROCK_REGIONS"), "us-east-1")
+BEDROCK_MODEL_REGIONS = parse_model_regions(os.environ.get("BEDROCK_MODEL_REGIONS"))
+BEDROCK_HEDGE_PERCENTILE = float(os.environ.get("BEDROCK_HEDGE_PERCENTILE", "0")) or None
+
+# 리전/모델별 토큰 버킷 + 동시 호출 수 상한. 스로틀이 나면 속도를 줄이고 backoff 뒤에 재시도한다.
+# BEDROCK_RATE_LIMITS: {"<model id>": {"rate": 초당, "burst": 버킷 크기, "concurrency": 동시 호출}}
+# 상태 저장소 BEDROCK_LIMITER_STORE: dynamodb(BEDROCK_LIMITER_TABLE을 모든 컨테이너가 공유, 배포 기본값) |
+# memory(컨테이너별) | file(BEDROCK_LIMITER_DIR. Lambda의 /tmp는 컨테이너별이므로 로컬 실험용)
+BEDROCK_RATE_LIMIT_ENABLED = os.environ.get("BEDROCK_RATE_LIMIT_ENABLED", "true").lower() == "true"
+BEDROCK_RATE_LIMITS = parse_limits(os.environ.get("BEDROCK_RATE_LIMITS"))
+BEDROCK_LIMITER_STORE = os.environ.get("BEDROCK_LIMITER_STORE", "memory")
+BEDROCK_LIMITER_DIR = os.environ.get("BEDROCK_LIMITER_DIR", "/tmp/bedrock-limiter")
+BEDROCK_LIMITER_TABLE = os.environ.get("BEDROCK_LIMITER_TABLE")
+bedrock_limiter = RateLimiter(
+    build_store(BEDROCK_LIMITER_STORE, BEDROCK_LIMITER_DIR, BEDROCK_LIMITER_TABLE),
+    BEDROCK_RATE_LIMITS
+) if BEDROCK_RATE_LIMIT_ENABLED else None
+bedrock = RegionalBedrockPool(BEDROCK_REGIONS, BEDROCK_MODEL_REGIONS, hedge_percentile=BEDROCK_HEDGE_PERCENTILE,
+                              limiter=bedrock_limiter)
+
+# 단계별 최대 예산/최소 시간 (ms). 분석에 쓸 시간이 최소보다 적으면 모델을 부르지 않고 기본 감정을 돌려준다
+STAGE_BUDGETS = parse_budgets(os.environ.get("STAGE_BUDGETS_MS"), {"s3_read": 3000, "analysis": 15000})
+STAGE_MINIMUMS = parse_budgets(os.environ.get("STAGE_MINIMUMS_MS"), {"analysis": 3000})
+
+# Nova Pro에 보내기 전 긴 변을 이 크기로 줄이고 실제 포맷을 알려준다
+MODEL_IMAGE_MAX_EDGE = int(os.environ.get("MODEL_IMAGE_MAX_EDGE", "1280"))
+
+# 앞부분만 먼저 받아 이미지가 아니거나 너무 큰(픽셀 수/바이트) 객체는 내려받거나 모델에 보내기 전에 거른다
+ADMISSION_PROBE_BYTES = int(os.environ.get("ADMISSION_PROBE_BYTES", str(64 * 1024)))
+ADMISSION_MAX_PIXELS = int(os.environ.get("ADMISSION_MAX_PIXELS", "40000000"))
+ADMISSION_MAX_BYTES = int(os.environ.get("ADMISSION_MAX_BYTES", str(25 * 1024 * 1024)))
+
+# 비전 분석(펫 설명 + 감정)은 make_pet과 같은 지시문/캐시를 쓴다. 같은 이미지를 make_pet이 먼저 분석했으면 모델을 부르지 않는다
+VISION_CACHE_ENABLED = os.environ.get("VISION_CACHE_ENABLED", "true").lower() == "true"
+VISION_CACHE_BUCKET = os.environ.get("VISION_CACHE_BUCKET", "sp-pet-cache-bucket")
+VISION_CACHE_ENTRIES = int(os.environ.get("VISION_CACHE_ENTRIES", "256"))
+VISION_CACHE_TTL = float(os.environ.get("VISION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+vision_cache = vision.build_vision_cache(s3, VISION_CACHE_BUCKET, VISION_CACHE_ENTRIES, VISION_CACHE_TTL) \
+    if VISION_CACHE_ENABLED else None
+
+# 결과 캐시: bucket/key/ETag별 최종 감정. EventBridge 이벤트나 목록 조회로 현재 ETag를 이미 알면 S3를 부르지 않고,
+# HTTP 요청은 HEAD 한 번으로 현재 ETag를 확인한 뒤 GET 없이 돌려준다 (클라이언트가 보낸 ETag는 304 비교에만 쓴다)
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_ENTRIES = int(os.environ.get("RESULT_CACHE_ENTRIES", "1024"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+result_cache = TieredCache(
+    "emotions",
+    memory_entries=RESULT_CACHE_ENTRIES,
+    ttl_seconds=RESULT_CACHE_TTL,
+    persistent_store=S3JsonStore(s3, VISION_CACHE_BUCKET, "emotions/")
+) if RESULT_CACHE_ENABLED else None
+# HEAD로 확인한 현재 ETag를 이 시간(초) 동안 기억해 같은 컨테이너의 반복 요청은 HEAD 없이 메모리 결과로 돌려준다.
+# 그 사이 원본이 바뀌면 이 시간만큼 이전 버전 결과가 나갈 수 있다 (0이면 매번 HEAD)
+RESULT_ETAG_TTL = float(os.environ.get("RESULT_ETAG_TTL_SECONDS", "10"))
+current_etags = LRUCache(RESULT_CACHE_ENTRIES, RESULT_ETAG_TTL) if RESULT_CACHE_ENABLED and RESULT_ETAG_TTL > 0 else None
+
+# 배치 모드: keys(목록) 또는 prefix로 여러 이미지를 한 번에 분석한다.
+# S3 읽기와 Nova Pro 호출을 BATCH_MAX_WORKERS개까지 동시에 하고 (Bedrock 동시 호출 수는 limiter가 따로 제한),
+# 이미지가 BATCH_STREAM_MIN_KEYS개 이상이면 끝나는 대로 WebSocket으로 결과를 하나씩 보낸다
+BATCH_MAX_KEYS = int(os.environ.get("BATCH_MAX_KEYS", "100"))
+# keys가 이보다 많으면 (중복을 빼기 전에) 400으로 거른다. 이하이면 중복을 뺀 뒤 BATCH_MAX_KEYS개까지만 분석한다
+BATCH_MAX_REQUEST_KEYS = int(os.environ.get("BATCH_MAX_REQUEST_KEYS", "1000"))
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+BATCH_STREAM_MIN_KEYS = int(os.environ.get("BATCH_STREAM_MIN_KEYS", "10"))
+PROGRESS_ENABLED = os.environ.get("PROGRESS_ENABLED", "true").lower() == "true"
+WEBSOCKET_ENDPOINT = os.environ.get("WEBSOCKET_ENDPOINT", DEFAULT_WEBSOCKET_ENDPOINT)
+apigateway = boto3.client("apigatewaymanagementapi", endpoint_url=WEBSOCKET_ENDPOINT) if PROGRESS_ENABLED else None
 
 cors_headers = {
     "Access-Control-Allow-Origin": "*",
     "Access-Control-Allow-Headers": "*",
     "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
+    "Access-Control-Expose-Headers": "ETag",
     "Content-Type": "application/json",
 }
 
@@ -31,8 +110,13 @@ EMOTION_POOL = [
 ]
 
 
-def _success(status_code, payload):
-    return {"statusCode": status_code, "headers": cors_headers, "body": json.dumps(payload, ensure_ascii=False)}
+def _success(status_code, payload, headers=None):
+    return {"statusCode": status_code, "headers": dict(cors_headers, **(headers or {})),
+            "body": json.dumps(payload, ensure_ascii=False)}
+
+
+def _not_modified(etag):
+    return {"statusCode": 304, "headers": dict(cors_headers, ETag=f'"{etag}"'), "body": ""}
 
 
 def _error(status_code, message):
@@ -68,32 +152,6 @@ def _extract_bucket_key(event):
     return bucket, key
 
 
-def _build_request(base64_image):
-    instruction = (
-        "너는 이미지의 감정을 평가하는 심리분석가다. 반드시 JSON만 반환해라. "
-        "항상 joy(기쁨)를 포함한 총 3개의 감정을 돌려줘야 한다. joy 점수는 0~15 정수. "
-        "나머지 2개 감정은 이미지에서 느껴지는 감정 중에서 임의로 골라 한국어 이름을 쓰고, 각 점수도 0~15 정수로 준다. "
-        '출력 형식: {"emotions":[{"name":"joy","score":int},{"name":"<감정1>","score":int},{"name":"<감정2>","score":int}]} '
-        "JSON만 응답하고 불필요한 텍스트는 쓰지 마라."
-    )
-    return {
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "image": {
-                            "format": "jpeg",
-                            "source": {"bytes": base64_image},
-                        }
-                    },
-                    {"text": instruction},
-                ],
-            }
-        ]
-    }
-
-
 def _clean_score(score):
     try:
         val = int(score)
@@ -103,22 +161,124 @@ def _clean_score(score):
 
 
 def _parse_emotion_response(text):
-    try:
-        data = json.loads(text)
-        emotions = data.get("emotions") or []
-        parsed = []
-        for item in emotions:
-            name = item.get("name")
-            score = _clean_score(item.get("score"))
-            if name:
-                parsed.append({"name": name, "score": score})
-        return parsed
-    except Exception:
-        return []
+    """비전 분석 응답에서 감정 목록만 꺼낸다 (읽을 수 없으면 빈 목록)."""
+    return vision.parse_response(text)["emotions"]
+
+
+def _normalize_etag(etag):
+    """'"abc"', 'W/"abc"', 'abc' → 'abc' (없으면 None)."""
+    etag = (etag or "").strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"') or None
+
+
+def _extract_etag(event):
+    """믿을 수 있는 현재 ETag: EventBridge detail에 온 값만 쓴다.
+
+    HTTP 요청의 ETag(If-None-Match 등)는 클라이언트가 예전에 받은 버전일 수 있으므로 None을 돌려 HEAD로 확인하게 한다.
+    """
+    if "detail" in event:
+        return _normalize_etag(event["detail"]["object"].get("etag"))
+    return None
 
 
-def _fallback_emotions():
-    others = random.sample(EMOTION_POOL, 2)
+def _if_none_match(event):
+    headers = {name.lower(): value for name, value in (event.get("headers") or {}).items()}
+    return _normalize_etag(headers.get("if-none-match"))
+
+
+def _result_cache_key(bucket, key, etag):
+    return cache_key(bucket, key, etag, vision.VISION_VERSION)
+
+
+class BadBatchRequest(ValueError):
+    """배치 요청 형식이 잘못됐다 (400)."""
+
+
+def _extract_batch(event):
+    """HTTP 요청의 keys(목록) 또는 prefix → (bucket, keys, prefix, connectionId). 배치 요청이 아니면 None.
+
+    keys가 문자열 목록이 아니거나, prefix가 문자열이 아니거나, keys가 BATCH_MAX_REQUEST_KEYS개를 넘으면 BadBatchRequest.
+    """
+    if "detail" in event:
+        return None
+    body = _parse_http_body(event)
+    qs = event.get("queryStringParameters") or {}
+    keys = body.get("keys") or body.get("Keys")
+    prefix = body.get("prefix") or body.get("Prefix") or qs.get("prefix")
+    if not keys and not prefix:
+        return None
+    # 문자열 하나를 그대로 받으면 글자마다 key로 보게 되므로 목록만 받는다
+    if keys and (not isinstance(keys, list) or not all(isinstance(key, str) and key for key in keys)):
+        raise BadBatchRequest("keys는 비어 있지 않은 문자열 목록이어야 합니다")
+    if keys and len(keys) > BATCH_MAX_REQUEST_KEYS:
+        raise BadBatchRequest(f"keys는 한 번에 {BATCH_MAX_REQUEST_KEYS}개까지 보낼 수 있습니다 ({len(keys)}개)")
+    if prefix and not isinstance(prefix, str):
+        raise BadBatchRequest("prefix는 문자열이어야 합니다")
+    bucket = body.get("bucket") or body.get("Bucket") or qs.get("bucket")
+    connection_id = body.get("connectionId") or qs.get("connectionId")
+    return bucket, list(keys or []), prefix, connection_id
+
+
+def _list_image_keys(bucket, prefix, limit):
+    """prefix 아래 [(key, ETag)] (폴더 표시 객체 제외). limit개를 넘으면 (앞의 limit개, True)."""
+    keys = []
+    continuation_token = None
+    while True:
+        params = {"Bucket": bucket, "Prefix": prefix}
+        if continuation_token:
+            params["ContinuationToken"] = continuation_token
+        response = s3.list_objects_v2(**params)
+        for obj in response.get("Contents", []):
+            if obj["Key"].endswith("/"):
+                continue
+            keys.append((obj["Key"], _normalize_etag(obj.get("ETag"))))
+            if len(keys) > limit:
+                return keys[:limit], True
+        if not response.get("IsTruncated"):
+            return keys, False
+        continuation_token = response.get("NextContinuationToken")
+
+
+def _analyze_vision(image_bytes, deadline):
+    """캐시된 비전 분석이 있으면 쓰고, 없으면 Nova Pro를 불러 {'description', 'emotions'}를 만든다.
+
+    캐시에 없고 분석할 시간도 남지 않았으면 (None, "skipped")를 돌려준다.
+    """
+    cache_key = vision.vision_cache_key(vision.content_hash(image_bytes))
+    cached = vision_cache.get(cache_key) if vision_cache else None
+    if cached is not None:
+        print("[INFO] Vision analysis cache hit, skipping Nova Pro")
+        return cached, "cache"
+    if not deadline.allows("analysis"):
+        return None, "skipped"
+
+    prepared = image_prep.prepare_for_model(image_bytes, MODEL_IMAGE_MAX_EDGE)
+    print(f"[INFO] Image prep: {image_prep.describe(prepared)}")
+    base64_image = base64.b64encode(prepared["bytes"]).decode("utf-8")
+
+    request_body = vision.build_request(base64_image, prepared["format"])
+    with deadline.run("analysis") as budget:
+        response = bedrock.invoke_model(
+            budget_ms=budget,
+            modelId=vision.VISION_MODEL_ID,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps(request_body),
+        )
+        result = json.loads(response["body"].read())
+    text = result["output"]["message"]["content"][0]["text"]
+    analysis = {"description": vision.description_of(text), "emotions": _parse_emotion_response(text)}
+    # 감정을 읽지 못한 응답은 캐시하지 않는다 (다음 호출에서 다시 분석)
+    if vision_cache and vision.cacheable(analysis):
+        vision_cache.put(cache_key, analysis)
+    return analysis, "model"
+
+
+def _fallback_emotions(seed=None):
+    # seed(객체 식별자)를 주면 같은 객체에는 매번 같은 기본 감정을 돌려준다
+    others = (random.Random(seed) if seed is not None else random).sample(EMOTION_POOL, 2)
     return [
         {"name": "joy", "score": 0},
         {"name": others[0], "score": 0},
@@ -126,46 +286,182 @@ def _fallback_emotions():
     ]
 
 
+def _normalize_emotions(emotions):
+    """joy 포함 3개, 점수 0~15로 맞춘다."""
+    emotions = [dict(emotion) for emotion in emotions]
+
+    # 보정: joy가 없으면 강제로 추가, 점수 범위 보정
+    names = {e["name"] for e in emotions}
+    if "joy" not in names:
+        emotions.insert(0, {"name": "joy", "score": 0})
+    emotions = emotions[:3]
+    if len(emotions) < 3:
+        # 부족하면 랜덤 감정으로 채우기
+        pool = [e for e in EMOTION_POOL if e not in {emo["name"] for emo in emotions}]
+        while len(emotions) < 3 and pool:
+            emotions.append({"name": pool.pop(), "score": 0})
+
+    # 점수 범위 고정
+    for emo in emotions:
+        emo["score"] = _clean_score(emo.get("score", 0))
+    return emotions
+
+
+def _read_object(bucket, key, etag):
+    """etag를 알면 그 버전일 때만 받는다. 그 사이 객체가 바뀌었으면(412) 현재 버전을 받는다."""
+    if etag:
+        try:
+            return s3.get_object(Bucket=bucket, Key=key, IfMatch=f'"{etag}"')
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "412"):
+                raise
+            print(f"[INFO] s3://{bucket}/{key} changed since ETag {etag}, reading current version")
+    return s3.get_object(Bucket=bucket, Key=key)
+
+
+def _analyze_object(bucket, key, deadline, etag=None):
+    """이미지 한 장 → {"key", "etag", "emotions", "source", ["warning"]}.
+
+    실패하거나 분석할 시간이 없으면 기존과 같이 기본 감정(_fallback_emotions)과 warning을 돌려준다.
+    결과 캐시에 있으면 이미지를 받지 않는다 (etag를 모르면 HEAD 한 번, RESULT_ETAG_TTL 안에 확인한 적이 있으면 HEAD도 생략).
+    etag는 EventBridge 이벤트나 목록 조회처럼 현재 버전임을 믿을 수 있는 값만 넘긴다.
+    source: result-cache | model | cache | skipped | rejected | fallback
+    """
+    try:
+        if result_cache:
+            if etag is None and current_etags is not None:
+                etag = current_etags.get((bucket, key))
+            if etag is None:
+                with deadline.run("s3_head"):
+                    etag = _normalize_etag(s3.head_object(Bucket=bucket, Key=key).get("ETag"))
+            if etag and current_etags is not None:
+                current_etags.put((bucket, key), etag)
+            cached = result_cache.get(_result_cache_key(bucket, key, etag))
+            if cached is not None:
+                return {"key": key, "etag": etag, "emotions": cached["emotions"], "source": "result-cache"}
+
+        print(f"[INFO] Processing file: s3://{bucket}/{key}")
+        with deadline.run("s3_read"):
+            admitted = admission.admit(s3, bucket, key, ADMISSION_PROBE_BYTES, max_pixels=ADMISSION_MAX_PIXELS,
+                                       max_bytes=ADMISSION_MAX_BYTES, formats=admission.MODEL_INPUT_FORMATS)
+            image_bytes = admitted["body"]
+            if image_bytes is None:
+                obj = _read_object(bucket, key, etag)
+                etag = _normalize_etag(obj.get("ETag")) or etag
+                image_bytes = obj["Body"].read()
+            else:
+                etag = _normalize_etag(admitted["etag"]) or etag
+        analysis, source = _analyze_vision(image_bytes, deadline)
+        if analysis is None:
+            return {"key": key, "etag": etag, "emotions": _fallback_emotions(f"{bucket}/{key}/{etag}"),
+                    "source": source, "warning": "not enough time left for analysis"}
+        emotions = _normalize_emotions(analysis["emotions"])
+        if etag and current_etags is not None:
+            current_etags.put((bucket, key), etag)
+        # 모델이 감정을 주지 않아 전부 채워 넣은 결과는 캐시하지 않는다 (다음 호출에서 다시 분석)
+        if result_cache and etag and analysis["emotions"]:
+            result_cache.put(_result_cache_key(bucket, key, etag), {"emotions": emotions})
+        print(f"[SUCCESS] Emotions for {key}: {emotions}")
+        return {"key": key, "etag": etag, "emotions": emotions, "source": source}
+    except admission.Rejected as rejected:
+        print(f"[WARNING] Skipping {key} ({rejected.reason}): {rejected}")
+        return {"key": key, "etag": etag, "emotions": _fallback_emotions(f"{bucket}/{key}/{etag}"),
+                "source": "rejected", "warning": f"{rejected.reason}: {rejected}"}
+    except Exception as exc:
+        print(f"[ERROR] Failed to analyze emotion for {key}: {exc}")
+        return {"key": key, "etag": etag, "emotions": _fallback_emotions(f"{bucket}/{key}/{etag}"),
+                "source": "fallback", "warning": str(exc)}
+
+
+def _summarize(results, elapsed_ms):
+    """배치 결과 집계: source별 개수, 분석된 이미지의 평균 joy, 많이 나온 감정."""
+    summary = {"total": len(results), "elapsedMs": round(elapsed_ms, 1)}
+    for source in ("result-cache", "model", "cache", "skipped", "rejected", "fallback"):
+        summary[source] = sum(1 for result in results if result["source"] == source)
+
+    analyzed = [result for result in results if result["source"] in ("result-cache", "model", "cache")]
+    joy = [emotion["score"] for result in analyzed for emotion in result["emotions"] if emotion["name"] == "joy"]
+    summary["meanJoy"] = round(sum(joy) / len(joy), 2) if joy else None
+
+    others = {}
+    for result in analyzed:
+        for emotion in result["emotions"]:
+            if emotion["name"] != "joy":
+                others.setdefault(emotion["name"], []).append(emotion["score"])
+    ranked = sorted(others.items(), key=lambda item: (-len(item[1]), item[0]))[:5]
+    summary["topEmotions"] = [
+        {"name": name, "count": len(scores), "meanScore": round(sum(scores) / len(scores), 2)} for name, scores in ranked
+    ]
+    return summary
+
+
+def _handle_batch(bucket, keys, prefix, connection_id, deadline):
+    started = time.perf_counter()
+    truncated = False
+    # 목록 조회로 얻은 ETag는 그대로 써서 결과 캐시 확인에 HEAD를 하지 않는다
+    etags = {}
+    if not keys:
+        entries, truncated = _list_image_keys(bucket, prefix, BATCH_MAX_KEYS)
+        keys, etags = [key for key, _ in entries], dict(entries)
+    else:
+        # 중복 key가 BATCH_MAX_KEYS 자리를 차지하지 않도록 먼저 중복을 뺀다
+        keys = list(dict.fromkeys(keys))
+        if len(keys) > BATCH_MAX_KEYS:
+            keys, truncated = keys[:BATCH_MAX_KEYS], True
+    print(f"[INFO] Batch emotion analysis: {len(keys)} images from s3://{bucket}/{prefix or ''} (truncated: {truncated})")
+
+    stream = len(keys) >= BATCH_STREAM_MIN_KEYS
+    connection_id = connection_id or connection_id_from_key(prefix or (keys[0] if keys else ""))
+    progress = ProgressNotifier(apigateway if stream else None, connection_id, prefix)
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, BATCH_MAX_WORKERS)) as executor:
+            futures = {executor.submit(_analyze_object, bucket, key, deadline, etags.get(key)): key for key in keys}
+            for future in as_completed(futures):
+                result = future.result()
+                results[result["key"]] = result
+                progress.send("emotions", completed=len(results), total=len(keys), **result)
+        ordered = [results[key] for key in keys]
+        summary = _summarize(ordered, (time.perf_counter() - started) * 1000)
+        summary["truncated"] = truncated
+        progress.send("summary", summary=summary)
+    finally:
+        progress.close()
+
+    print(f"[METRIC] {json.dumps({'batch': summary, 'streamed': progress.sent, 'resultCache': result_cache.stats if result_cache else None, 'bedrock': bedrock.snapshot()}, ensure_ascii=False)}")
+    return _success(200, {"results": ordered, "summary": summary, "stages": deadline.report()})
+
+
 def lambda_handler(event, context):
+    deadline = Deadline(context, STAGE_BUDGETS, STAGE_MINIMUMS)
+    if result_cache:
+        result_cache.reset_stats()
     try:
+        try:
+            batch = _extract_batch(event)
+        except BadBatchRequest as bad_request:
+            return _error(400, str(bad_request))
+        if batch is not None:
+            bucket, keys, prefix, connection_id = batch
+            if not bucket:
+                return _error(400, "배치 분석에는 bucket을 전달해야 합니다")
+            return _handle_batch(bucket, keys, prefix, connection_id, deadline)
+
         bucket, key = _extract_bucket_key(event)
         if not bucket or not key:
             return _error(400, "bucket과 key를 전달해야 합니다 (body 혹은 query 혹은 EventBridge detail)")
 
-        print(f"[INFO] Processing file: s3://{bucket}/{key}")
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        image_bytes = obj["Body"].read()
-        base64_image = base64.b64encode(image_bytes).decode("utf-8")
-
-        request_body = _build_request(base64_image)
-        response = bedrock_nova.invoke_model(
-            modelId="amazon.nova-pro-v1:0",
-            contentType="application/json",
-            accept="application/json",
-            body=json.dumps(request_body),
-        )
-        result = json.loads(response["body"].read())
-        text = result["output"]["message"]["content"][0]["text"]
-        emotions = _parse_emotion_response(text)
-
-        # 보정: joy가 없으면 강제로 추가, 점수 범위 보정
-        names = {e["name"] for e in emotions}
-        if "joy" not in names:
-            emotions.insert(0, {"name": "joy", "score": 0})
-        emotions = emotions[:3]
-        if len(emotions) < 3:
-            # 부족하면 랜덤 감정으로 채우기
-            pool = [e for e in EMOTION_POOL if e not in {emo["name"] for emo in emotions}]
-            while len(emotions) < 3 and pool:
-                emotions.append({"name": pool.pop(), "score": 0})
-
-        # 점수 범위 고정
-        for emo in emotions:
-            emo["score"] = _clean_score(emo.get("score", 0))
-
-        print(f"[SUCCESS] Emotions: {emotions}")
-        return _success(200, {"emotions": emotions})
+        result = _analyze_object(bucket, key, deadline, _extract_etag(event))
+        print(f"[METRIC] {json.dumps({'visionSource': result['source'], 'resultCache': result_cache.stats if result_cache else None, 'bedrock': bedrock.snapshot()})}")
+        # 클라이언트가 가진 결과와 같은 버전이면 본문 없이 304
+        if result["source"] == "result-cache" and result["etag"] == _if_none_match(event):
+            return _not_modified(result["etag"])
+        payload = {"emotions": result["emotions"], "etag": result["etag"], "stages": deadline.report()}
+        if "warning" in result:
+            payload["warning"] = result["warning"]
+        return _success(200, payload, {"ETag": f'"{result["etag"]}"'} if result["etag"] and "warning" not in result else None)
 
     except Exception as exc:
         print(f"[ERROR] Failed to analyze emotion: {exc}")
-        return _success(200, {"emotions": _fallback_emotions(), "warning": str(exc)})
+        return _success(200, {"emotions": _fallback_emotions(), "warning": str(exc), "stages": deadline.report()})
@@ -0,0 +1,215 @@
+"""전체 이미지를 받기 전에 앞부분만 받아(ranged GET) 포맷과 크기를 읽고 처리할지 정한다.
+
+이미지가 아닌 객체, 허용하지 않는 포맷, 너무 큰 파일, 픽셀 수가 너무 많은 이미지(decompression bomb)는
+본문을 받거나 디코딩하기 전에 Rejected로 거른다. 헤더는 Pillow로 읽고 (디코딩하지 않음),
+잘린 데이터로는 Pillow가 열지 못하는 WebP, 첫 IFD가 파일 뒤쪽에 있는 TIFF(그 부분만 범위 요청으로 더 받는다),
+Pillow 플러그인이 없으면 열리지 않는 HEIC/AVIF(ispe 상자)는 직접 읽는다.
+JPEG 헤더가 probe_bytes 뒤에 있으면(큰 EXIF 등) max_probe_bytes까지 범위를 늘려 다시 받는다.
+
+허용 포맷은 호출하는 쪽이 formats=로 정한다. None이면 헤더를 읽을 수 있는 모든 포맷을 받는다.
+- MODEL_INPUT_FORMATS(기본값): image_prep.prepare_for_model이 모델 입력으로 바꿀 수 있는 포맷 (make_pet, analyzeSentiment)
+- None: Pillow로 여는 포맷은 모두 (crop_face, resize_image의 기존 동작)
+
+객체 전체가 probe 범위 안에 들어오면 받은 바이트를 body로 돌려주므로 호출하는 쪽은 다시 받지 않아도 된다.
+
+    info = admission.admit(s3, bucket, key, max_pixels=40_000_000)
+    body = info['body'] or s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+"""
+import io
+import struct
+import warnings
+
+from botocore.exceptions import ClientError
+from PIL import Image
+
+# Pillow format 이름. MPO는 여러 장이 든 (휴대폰 카메라) JPEG.
+# HEIF/AVIF는 헤더는 읽지만 함수에 pillow-heif가 없어 image_prep이 디코딩하지 못하므로 모델 입력으로 받지 않는다
+MODEL_INPUT_FORMATS = ('JPEG', 'MPO', 'PNG', 'GIF', 'WEBP', 'BMP', 'TIFF')
+DEFAULT_FORMATS = MODEL_INPUT_FORMATS
+
+_TIFF_MAGIC = (b'II*\x00', b'MM\x00*')
+# 헤더(SOF/IFD)가 앞쪽 메타데이터 뒤에 올 수 있어 더 받아 볼 만한 포맷의 시작 바이트 (JPEG, TIFF)
+_LATE_HEADER_MAGIC = (b'\xff\xd8',) + _TIFF_MAGIC
+_HEIF_BRANDS = {b'heic': 'HEIF', b'heix': 'HEIF', b'hevc': 'HEIF', b'hevx': 'HEIF', b'mif1': 'HEIF', b'msf1': 'HEIF',
+                b'avif': 'AVIF', b'avis': 'AVIF'}
+# 첫 IFD를 따로 받을 때 읽을 최대 항목 수
+_TIFF_MAX_ENTRIES = 256
+
+
+class Rejected(Exception):
+    """reason: not_image | unsupported_format | too_large | too_many_pixels"""
+
+    def __init__(self, reason: str, message: str, info: dict = None):
+        super().__init__(message)
+        self.reason = reason
+        self.info = info or {}
+
+
+def _webp_size(data: bytes):
+    """RIFF/WEBP 헤더에서 (width, height). 아니면 None."""
+    if len(data) < 30 or data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return width, height
+    if chunk == b'VP8L' and data[20] == 0x2f:
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3fff, height & 0x3fff
+    return None
+
+
+def _tiff_size(data: bytes, read_at=None):
+    """TIFF 헤더와 첫 IFD의 ImageWidth(256)/ImageLength(257) → (width, height). 아니면 None.
+
+    IFD가 data 밖에 있으면 read_at(offset, length)로 그 부분만 받아 읽는다.
+    """
+    if len(data) < 8 or data[:4] not in _TIFF_MAGIC:
+        return None
+    order = '<' if data[:2] == b'II' else '>'
+    offset = struct.unpack(order + 'I', data[4:8])[0]
+    ifd = data[offset:offset + 2 + 12 * _TIFF_MAX_ENTRIES]
+    count = struct.unpack(order + 'H', ifd[:2])[0] if len(ifd) >= 2 else None
+    if count is None or len(ifd) < 2 + 12 * min(count, _TIFF_MAX_ENTRIES):
+        if read_at is None:
+            return None
+        ifd = read_at(offset, 2 + 12 * _TIFF_MAX_ENTRIES)
+        if len(ifd) < 2:
+            return None
+        count = struct.unpack(order + 'H', ifd[:2])[0]
+    size = {}
+    for index in range(min(count, _TIFF_MAX_ENTRIES)):
+        entry = ifd[2 + 12 * index:14 + 12 * index]
+        if len(entry) < 12:
+            break
+        tag, kind = struct.unpack(order + 'HH', entry[:4])
+        if tag not in (256, 257):
+            continue
+        if kind == 3:
+            size[tag] = struct.unpack(order + 'H', entry[8:10])[0]
+        elif kind == 4:
+            size[tag] = struct.unpack(order + 'I', entry[8:12])[0]
+    if size.get(256) and size.get(257):
+        return size[256], size[257]
+    return None
+
+
+def _heif_size(data: bytes):
+    """HEIC/AVIF ftyp 상자와 ispe(이미지 크기) 상자들 → (format, width, height). 가장 큰 ispe를 쓴다. 아니면 None."""
+    if len(data) < 12 or data[4:8] != b'ftyp' or data[8:12] not in _HEIF_BRANDS:
+        return None
+    sizes = []
+    index = data.find(b'ispe')
+    while index != -1 and index + 16 <= len(data):
+        sizes.append(struct.unpack('>II', data[index + 8:index + 16]))
+        index = data.find(b'ispe', index + 4)
+    if not sizes:
+        return None
+    width, height = max(sizes, key=lambda size: size[0] * size[1])
+    return _HEIF_BRANDS[data[8:12]], width, height
+
+
+def inspect(data: bytes):
+    """이미지 앞부분 → {'format', 'width', 'height'}. 이미지로 읽을 수 없으면 None.
+
+    데이터가 모자라 헤더를 다 읽지 못한 경우도 None이다 (호출하는 쪽에서 더 받아 다시 부른다).
+    """
+    size = _webp_size(data)
+    if size is not None:
+        return {'format': 'WEBP', 'width': size[0], 'height': size[1]}
+    try:
+        with warnings.catch_warnings():
+            # 픽셀 수 판단은 호출하는 쪽 max_pixels로 한다. 잘린 데이터라 나는 EXIF 경고(UserWarning)도 무시한다
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            warnings.simplefilter('ignore', UserWarning)
+            image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as error:
+        # Pillow 한도(기본 약 1.8억 픽셀의 2배)를 넘으면 열지도 않는다. 크기는 모르지만 거르는 데는 충분하다
+        return {'format': None, 'width': None, 'height': None, 'bomb': str(error)}
+    except (OSError, SyntaxError, ValueError, struct.error):
+        size = _tiff_size(data)
+        if size is not None:
+            return {'format': 'TIFF', 'width': size[0], 'height': size[1]}
+        heif = _heif_size(data)
+        if heif is not None:
+            return {'format': heif[0], 'width': heif[1], 'height': heif[2]}
+        return None
+    return {'format': image.format, 'width': image.width, 'height': image.height}
+
+
+def check(info: dict, total_bytes: int = None, max_pixels: int = 40_000_000, max_bytes: int = 25 * 1024 * 1024,
+          formats=DEFAULT_FORMATS):
+    """inspect() 결과를 기준과 비교해 통과하지 못하면 Rejected."""
+    if info is None:
+        raise Rejected('not_image', 'not an image (unrecognized header)')
+    if info.get('bomb'):
+        raise Rejected('too_many_pixels', info['bomb'], info)
+    if formats and info['format'] not in formats:
+        raise Rejected('unsupported_format', f"unsupported image format {info['format']}", info)
+    if total_bytes is not None and max_bytes and total_bytes > max_bytes:
+        raise Rejected('too_large', f"{total_bytes} bytes > {max_bytes}", info)
+    pixels = info['width'] * info['height']
+    if max_pixels and pixels > max_pixels:
+        raise Rejected('too_many_pixels', f"{info['width']}x{info['height']} = {pixels} pixels > {max_pixels}", info)
+    return info
+
+
+def admit_bytes(data: bytes, **limits):
+    """이미 받은 바이트에 같은 기준을 적용한다."""
+    return check(inspect(data), len(data), **limits)
+
+
+def _total_size(response, received: int):
+    # 'bytes 0-65535/1234567' → 1234567. 범위보다 작은 객체는 Content-Range 없이 전체가 온다
+    content_range = response.get('ContentRange') or ''
+    if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+        return int(content_range.rsplit('/', 1)[1])
+    return response.get('ContentLength', received)
+
+
+def _read_range(s3_client, bucket: str, key: str, offset: int, length: int) -> bytes:
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}")
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') == 'InvalidRange':
+            return b''
+        raise
+    return response['Body'].read()
+
+
+def admit(s3_client, bucket: str, key: str, probe_bytes: int = 64 * 1024, max_probe_bytes: int = 512 * 1024,
+          **limits):
+    """앞부분만 받아 헤더를 확인한다.
+
+    {'format', 'width', 'height', 'total_bytes', 'probed_bytes', 'content_type', 'etag', 'body'}를 돌려준다.
+    body는 객체 전체를 이미 받은 경우에만 bytes, 아니면 None. 거를 대상이면 Rejected.
+    """
+    length = probe_bytes
+    while True:
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{length - 1}")
+        except ClientError as error:
+            # 빈 객체에 범위를 요청하면 InvalidRange
+            if error.response.get('Error', {}).get('Code') == 'InvalidRange':
+                raise Rejected('not_image', 'empty object')
+            raise
+        data = response['Body'].read()
+        total = _total_size(response, len(data))
+        complete = len(data) >= total
+        info = inspect(data)
+        if info is None and not complete and data.startswith(_TIFF_MAGIC):
+            # 첫 IFD가 파일 끝에 있는 TIFF는 범위를 늘리지 않고 IFD만 받는다
+            size = _tiff_size(data, lambda offset, length: _read_range(s3_client, bucket, key, offset, length))
+            if size is not None:
+                info = {'format': 'TIFF', 'width': size[0], 'height': size[1]}
+        if info is not None or complete or length >= max_probe_bytes or not data.startswith(_LATE_HEADER_MAGIC):
+            break
+        length = min(length * 4, max_probe_bytes)
+
+    info = check(info, total, **limits)
+    return dict(info, total_bytes=total, probed_bytes=len(data), content_type=response.get('ContentType'),
+                etag=response.get('ETag'), body=data if complete else None)
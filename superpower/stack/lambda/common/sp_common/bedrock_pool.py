@@ -0,0 +1,290 @@
+"""여러 리전의 bedrock-runtime 클라이언트에 요청을 나눠 보낸다.
+
+리전별로 응답 지연 이동평균(EWMA)과 오류율을 기록해 점수(지연 + 오류율 x error_penalty_ms)가 낮은 리전부터 시도한다.
+스로틀/일시 오류가 난 리전은 cooldown_seconds 동안 뒤로 미루고 바로 다음 리전으로 넘어간다 (failover).
+hedge_percentile을 주면 첫 리전의 응답이 그 리전 지연 분포의 해당 분위수보다 늦을 때 다음 리전에도 같은 요청을 보내
+먼저 온 응답을 쓴다 (늦은 쪽 호출은 취소되지 않으므로 그만큼 호출 수가 늘어난다).
+
+    pool = RegionalBedrockPool(['ap-northeast-2', 'us-east-1'], model_regions={
+        'amazon.nova-pro-v1:0': {'ap-northeast-2': 'apac.amazon.nova-pro-v1:0', 'us-east-1': 'amazon.nova-pro-v1:0'},
+    })
+    pool.invoke_model(modelId='amazon.nova-pro-v1:0', body=..., budget_ms=8000)
+
+model_regions에 없는 모델은 regions 전체에서 같은 model id로 호출한다.
+client_factory(region, budget_ms)로 클라이언트를 바꿔 끼울 수 있다 (지연을 흉내 내는 stub 테스트/벤치마크용).
+limiter(RateLimiter)를 주면 리전/모델별 속도와 동시 호출 수를 제한한다. 다음 리전이 남아 있으면 스로틀 난 리전에서
+기다려 재시도하지 않고 바로 넘기고, 마지막 리전에서만 backoff 후 재시도한다.
+"""
+import functools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from sp_common.deadline import TimeoutClientPool
+from sp_common.rate_limit import RateLimited, is_throttle, wrap_stream
+
+# 다른 리전에서 다시 시도할 만한 오류 (요청 자체가 잘못된 ValidationException 등은 바로 올린다)
+RETRYABLE_ERRORS = (
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+    'ModelTimeoutException',
+    'InternalServerException',
+)
+
+
+def error_code(error: Exception) -> str:
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code', '')
+    return type(error).__name__
+
+
+def is_retryable(error: Exception) -> bool:
+    # 연결/읽기 타임아웃은 BotoCoreError로 온다. RateLimited는 이 컨테이너가 자리를 못 얻은 경우
+    return isinstance(error, (BotoCoreError, RateLimited)) or error_code(error) in RETRYABLE_ERRORS
+
+
+def parse_regions(spec: str, default: str = 'us-east-1'):
+    """'ap-northeast-2,us-east-1' → ['ap-northeast-2', 'us-east-1'] (선호 순서)."""
+    regions = [region.strip() for region in (spec or '').split(',') if region.strip()]
+    return regions or [default]
+
+
+def parse_model_regions(spec: str):
+    """BEDROCK_MODEL_REGIONS JSON: {"<model id>": {"<region>": "<그 리전에서 쓸 model/inference profile id>"}}"""
+    return json.loads(spec) if spec else {}
+
+
+class _RegionStats:
+    def __init__(self, window: int):
+        self.latency_ms = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=window)
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.errors = 0
+
+
+class RegionalBedrockPool:
+    def __init__(self, regions, model_regions: dict = None, client_factory=None, alpha: float = 0.2,
+                 error_penalty_ms: float = 10000, cooldown_seconds: float = 5, hedge_percentile: float = None,
+                 hedge_min_samples: int = 20, hedge_workers: int = 16, window: int = 100, limiter=None):
+        self.regions = list(regions)
+        self.limiter = limiter
+        self.model_regions = model_regions or {}
+        self.alpha = alpha
+        self.error_penalty_ms = error_penalty_ms
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.window = window
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._client_factory = client_factory or self._default_client
+        self._clients = {}
+        self._timeout_clients = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        # hedge할 때는 첫 호출도 이 풀에서 돌리므로 동시 호출 수의 두 배 정도가 있어야 줄을 서지 않는다
+        self._hedge_executor = ThreadPoolExecutor(max_workers=hedge_workers) if hedge_percentile else None
+
+    def _default_client(self, region: str, budget_ms):
+        with self._lock:
+            if budget_ms is None:
+                if region not in self._clients:
+                    self._clients[region] = boto3.client('bedrock-runtime', region_name=region)
+                return self._clients[region]
+            if region not in self._timeout_clients:
+                self._timeout_clients[region] = TimeoutClientPool('bedrock-runtime', region)
+            pool = self._timeout_clients[region]
+        return pool.get(budget_ms)
+
+    def _region_stats(self, region: str) -> _RegionStats:
+        with self._lock:
+            return self._stats.setdefault(region, _RegionStats(self.window))
+
+    def _score(self, region: str) -> float:
+        stats = self._region_stats(region)
+        # 아직 호출해 보지 않은 리전은 한 번은 시도해 보도록 지연 0으로 본다
+        return (stats.latency_ms or 0.0) + stats.error_rate * self.error_penalty_ms
+
+    def candidates(self, model_id: str):
+        """[(region, 그 리전의 model id)]를 시도할 순서대로 돌려준다."""
+        mapping = self.model_regions.get(model_id)
+        if mapping:
+            regions = [r for r in self.regions if r in mapping] + [r for r in mapping if r not in self.regions]
+        else:
+            regions = list(self.regions)
+        now = time.monotonic()
+        preference = {region: index for index, region in enumerate(regions)}
+        regions.sort(key=lambda r: (self._region_stats(r).cooldown_until > now, self._score(r), preference[r]))
+        return [(region, mapping[region] if mapping else model_id) for region in regions]
+
+    def _hedge_delay_ms(self, region: str):
+        stats = self._region_stats(region)
+        with self._lock:
+            samples = sorted(stats.samples)
+        if len(samples) < self.hedge_min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile))]
+
+    def _record_success(self, region: str, elapsed_ms: float):
+        stats = self._region_stats(region)
+        with self._lock:
+            stats.calls += 1
+            stats.samples.append(elapsed_ms)
+            stats.latency_ms = elapsed_ms if stats.latency_ms is None else \
+                (1 - self.alpha) * stats.latency_ms + self.alpha * elapsed_ms
+            stats.error_rate *= (1 - self.alpha)
+
+    def _record_error(self, region: str):
+        stats = self._region_stats(region)
+        with self._lock:
+            stats.calls += 1
+            stats.errors += 1
+            stats.error_rate = (1 - self.alpha) * stats.error_rate + self.alpha
+            stats.cooldown_until = time.monotonic() + self.cooldown_seconds
+
+    def _attempt(self, operation: str, budget_ms, kwargs: dict, region: str, model_id: str, last: bool = True):
+        stream = operation == 'invoke_model_with_response_stream'
+        started = time.perf_counter()
+
+        def invoke():
+            # 클라이언트(read timeout)는 limiter에서 기다린 뒤 남은 예산으로 고른다
+            remaining = None if budget_ms is None else budget_ms - (time.perf_counter() - started) * 1000
+            client = self._client_factory(region, remaining)
+            return getattr(client, operation)(**dict(kwargs, modelId=model_id))
+
+        try:
+            if self.limiter is None:
+                response = invoke()
+            else:
+                # 자리를 기다리는 데는 예산의 절반까지만 쓴다
+                response = self.limiter.call(kwargs['modelId'], invoke, scope=region,
+                                             max_wait_ms=None if budget_ms is None else budget_ms / 2,
+                                             attempts=None if last else 1, stream=stream)
+        except RateLimited:
+            raise
+        except Exception as error:
+            # 요청이 잘못된 경우는 리전 탓이 아니므로 점수에 넣지 않는다
+            if is_retryable(error):
+                self._record_error(region)
+            raise
+        if stream:
+            # 지연은 헤더가 온 때가 아니라 스트림을 다 받은 때까지로 잰다
+            return wrap_stream(response, functools.partial(self._finish_stream, region, started))
+        self._record_success(region, (time.perf_counter() - started) * 1000)
+        return response
+
+    def _finish_stream(self, region: str, started: float, error):
+        if error is None:
+            self._record_success(region, (time.perf_counter() - started) * 1000)
+        elif is_retryable(error) or is_throttle(error, stream=True):
+            self._record_error(region)
+
+    def _hedged(self, operation: str, budget_ms, kwargs: dict, primary, secondary, delay_ms: float):
+        started = time.monotonic()
+
+        def remaining_budget():
+            return None if budget_ms is None else budget_ms - (time.monotonic() - started) * 1000
+
+        first = self._hedge_executor.submit(self._attempt, operation, budget_ms, kwargs, *primary, False)
+        done, _ = wait([first], timeout=delay_ms / 1000)
+        if done:
+            error = first.exception()
+            if error is None:
+                return first.result()
+            if not is_retryable(error):
+                raise error
+            # 기다리기 전에 실패했으면 hedge가 아니라 바로 다음 리전으로
+            return self._attempt(operation, remaining_budget(), kwargs, *secondary)
+
+        with self._lock:
+            self.hedges += 1
+        second = self._hedge_executor.submit(self._attempt, operation, remaining_budget(), kwargs, *secondary)
+        pending = {first, second}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as error:
+                    if not is_retryable(error):
+                        raise
+                    last_error = error
+                    continue
+                if future is second:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return response
+        raise last_error
+
+    def _call(self, operation: str, budget_ms, kwargs: dict, hedge: bool):
+        candidates = self.candidates(kwargs['modelId'])
+        started = time.monotonic()
+        last_error = None
+
+        def remaining_budget():
+            return None if budget_ms is None else budget_ms - (time.monotonic() - started) * 1000
+
+        if hedge and self._hedge_executor is not None and len(candidates) > 1:
+            delay_ms = self._hedge_delay_ms(candidates[0][0])
+            if delay_ms is not None:
+                try:
+                    return self._hedged(operation, budget_ms, kwargs, candidates[0], candidates[1], delay_ms)
+                except Exception as error:
+                    if not is_retryable(error):
+                        raise
+                    last_error = error
+                    candidates = candidates[2:]
+
+        for position, (region, model_id) in enumerate(candidates):
+            budget = remaining_budget()
+            if budget is not None and budget <= 0:
+                break
+            try:
+                return self._attempt(operation, budget, kwargs, region, model_id, position + 1 == len(candidates))
+            except Exception as error:
+                if not is_retryable(error):
+                    raise
+                last_error = error
+                if position + 1 < len(candidates):
+                    with self._lock:
+                        self.failovers += 1
+                    print(f"[WARNING] Bedrock {kwargs['modelId']} failed in {region} ({error_code(error)}), trying next region")
+        if last_error is None:
+            raise ValueError(f"no region available for {kwargs['modelId']}")
+        raise last_error
+
+    def invoke_model(self, budget_ms=None, **kwargs):
+        return self._call('invoke_model', budget_ms, kwargs, hedge=True)
+
+    def invoke_model_with_response_stream(self, budget_ms=None, **kwargs):
+        # 스트림은 첫 응답까지만 failover 한다 (받는 도중의 오류는 호출하는 쪽이 처리)
+        return self._call('invoke_model_with_response_stream', budget_ms, kwargs, hedge=False)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            regions = {
+                region: {
+                    'latencyMs': None if stats.latency_ms is None else round(stats.latency_ms, 1),
+                    'errorRate': round(stats.error_rate, 3),
+                    'calls': stats.calls,
+                    'errors': stats.errors,
+                    'coolingDown': stats.cooldown_until > now,
+                }
+                for region, stats in self._stats.items()
+            }
+            snapshot = {'regions': regions, 'failovers': self.failovers, 'hedges': self.hedges, 'hedgeWins': self.hedge_wins}
+        if self.limiter is not None:
+            snapshot['limiter'] = self.limiter.snapshot()
+        return snapshot
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+
+def cache_key(*parts) -> str:
+    """버킷/키/ETag 같은 식별자 조합을 고정 길이 해시 키로 만든다."""
+    raw = '\x1f'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """warm 컨테이너 안에서 유지되는 스레드 안전 LRU (항목 수 상한 + TTL)."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, stored_at = item
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value, stored_at: float = None):
+        with self._lock:
+            self._items[key] = (value, stored_at or time.time())
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+        return None if item is None else item[0]
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskLRUCache:
+    """Lambda /tmp 같은 로컬 디스크에 bytes 값을 두는 용량 상한 LRU (warm 컨테이너 호출 사이에 유지된다).
+
+    항목마다 파일 하나({directory}/{key})를 쓰고 전체 크기가 max_bytes를 넘으면 가장 오래 안 쓴 파일부터 지운다.
+    디렉터리에 이미 있던 파일은 수정 시각 순서로 다시 읽어 들인다. 디스크 오류는 miss로만 처리한다.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'errors': 0}
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+            elif os.path.isfile(path):
+                existing.append((os.path.getmtime(path), name, os.path.getsize(path)))
+        for _, name, size in sorted(existing):
+            self._items[name] = size
+            self._bytes += size
+        with self._lock:
+            self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._items:
+            name, size = self._items.popitem(last=False)
+            self._bytes -= size
+            self.stats['evictions'] += 1
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._items:
+                self.stats['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as handle:
+                data = handle.read()
+        except OSError:
+            with self._lock:
+                self._bytes -= self._items.pop(key, 0)
+                self.stats['errors'] += 1
+                self.stats['misses'] += 1
+            return None
+        with self._lock:
+            self.stats['hits'] += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        # 다른 스레드가 읽는 중에 반쯤 쓴 파일이 보이지 않도록 임시 파일에 쓰고 바꿔 넣는다
+        temporary = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, 'wb') as handle:
+                handle.write(data)
+            os.replace(temporary, self._path(key))
+        except OSError as error:
+            print(f"[WARNING] disk cache write failed: {error}")
+            with self._lock:
+                self.stats['errors'] += 1
+            return
+        with self._lock:
+            self._bytes += len(data) - self._items.pop(key, 0)
+            self._items[key] = len(data)
+            self.stats['writes'] += 1
+            self._evict()
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self):
+        return len(self._items)
+
+
+class S3JsonStore:
+    """값을 {bucket}/{prefix}{key}.json 사이드카 객체로 보관하는 영속 계층.
+
+    캐시 버킷은 이 스택(template.yaml) 밖에서 만든 버킷이라 lifecycle 규칙을 여기서 걸 수 없다.
+    만료된 항목은 읽을 때 지우고(TieredCache), 다시 읽히지 않는 항목(원본이 바뀌거나 지워진 경우)은
+    스케줄 호출의 sweep()이 LastModified 기준으로 지운다. 그래서 prefix 크기는 TTL 동안 쓴 양으로 묶인다.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        document = json.loads(response['Body'].read())
+        return document.get('value'), document.get('stored_at', 0)
+
+    def put(self, key, value, stored_at: float):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{key}.json",
+            Body=json.dumps({'stored_at': stored_at, 'value': value}, ensure_ascii=False).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+    def delete(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=f"{self.prefix}{key}.json")
+
+    def sweep(self, max_age_seconds: float, limit: int = 10000) -> int:
+        """LastModified가 max_age_seconds보다 오래된 항목을 최대 limit개 지우고 지운 수를 돌려준다."""
+        cutoff = time.time() - max_age_seconds
+        params = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        deleted = 0
+        while deleted < limit:
+            response = self.s3.list_objects_v2(**params)
+            expired = [{'Key': item['Key']} for item in response.get('Contents', [])
+                       if item['LastModified'].timestamp() < cutoff][:limit - deleted]
+            # DeleteObjects는 한 번에 1000개까지 (list_objects_v2 한 페이지도 최대 1000개)
+            if expired:
+                self.s3.delete_objects(Bucket=self.bucket, Delete={'Objects': expired, 'Quiet': True})
+                deleted += len(expired)
+            if not response.get('IsTruncated'):
+                break
+            params['ContinuationToken'] = response['NextContinuationToken']
+        return deleted
+
+
+class TieredCache:
+    """메모리 LRU 앞단 + 영속 JSON 계층 뒷단 캐시.
+
+    영속 계층 항목도 TTL이 지나면 miss로 취급하고 그 자리에서 지운다. max_item_bytes보다 큰 값은 영속 계층에 쓰지 않는다.
+    영속 계층 오류는 캐시 miss로만 처리하고 호출자에게 올리지 않는다.
+    """
+
+    def __init__(self, name: str, memory_entries: int = 256, ttl_seconds: float = 0,
+                 persistent_store=None, max_item_bytes: int = 256 * 1024):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_item_bytes = max_item_bytes
+        self.memory = LRUCache(memory_entries, ttl_seconds)
+        self.persistent = persistent_store
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'writes': 0, 'expired': 0, 'errors': 0}
+
+    def _count(self, field: str):
+        with self._stats_lock:
+            self.stats[field] += 1
+
+    def _expired(self, stored_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        if self.persistent is not None:
+            try:
+                found = self.persistent.get(key)
+            except Exception as error:
+                print(f"[WARNING] {self.name} cache read failed: {error}")
+                self._count('errors')
+                found = None
+            if found is not None and found[0] is not None and not self._expired(found[1]):
+                value, stored_at = found
+                self.memory.put(key, value, stored_at)
+                self._count('persistent_hits')
+                return value
+            if found is not None and self._expired(found[1]):
+                self._delete_expired(key)
+
+        self._count('misses')
+        return None
+
+    def _delete_expired(self, key):
+        try:
+            self.persistent.delete(key)
+            self._count('expired')
+        except Exception as error:
+            print(f"[WARNING] {self.name} cache delete failed: {error}")
+            self._count('errors')
+
+    def sweep(self, limit: int = 10000) -> int:
+        """영속 계층에서 TTL이 지난 항목을 지운다 (스케줄 호출용). TTL이 없으면 아무것도 지우지 않는다."""
+        if self.persistent is None or not self.ttl_seconds:
+            return 0
+        deleted = self.persistent.sweep(self.ttl_seconds, limit)
+        print(f"[INFO] {self.name} cache sweep: {deleted} expired entries deleted")
+        return deleted
+
+    def put(self, key, value):
+        stored_at = time.time()
+        self.memory.put(key, value, stored_at)
+        if self.persistent is None:
+            return
+        if len(json.dumps(value, ensure_ascii=False).encode('utf-8')) > self.max_item_bytes:
+            return
+        try:
+            self.persistent.put(key, value, stored_at)
+            self._count('writes')
+        except Exception as error:
+            print(f"[WARNING] {self.name} cache write failed: {error}")
+            self._count('errors')
+
+    def log_stats(self):
+        stats = dict(self.stats)
+        lookups = stats['memory_hits'] + stats['persistent_hits'] + stats['misses']
+        hits = stats['memory_hits'] + stats['persistent_hits']
+        print(f"[INFO] {self.name} cache: {hits}/{lookups} hits "
+              f"(memory={stats['memory_hits']}, persistent={stats['persistent_hits']}, "
+              f"misses={stats['misses']}, writes={stats['writes']}, expired={stats['expired']}, errors={stats['errors']})")
+        return stats
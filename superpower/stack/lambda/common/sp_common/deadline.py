@@ -0,0 +1,138 @@
+"""Lambda 남은 실행 시간을 기준으로 단계별 시간 예산을 나누고, 끝낼 수 없는 단계는 건너뛴다.
+
+    deadline = Deadline(context, budgets={'analysis': 20000}, minimums={'analysis': 3000})
+    if deadline.allows('analysis', reserve_ms=...):   # 뒤 단계가 쓸 시간을 남겨 두고도 최소 시간이 되는지
+        with deadline.run('analysis') as budget_ms:   # budget_ms: 이 단계에 줄 수 있는 시간 (None이면 제한 없음)
+            client = clients.get(budget_ms)           # 그 시간을 read timeout으로 쓰는 클라이언트
+    deadline.report()  # 어떤 단계가 실행/실패/건너뛰기 되었는지
+
+context가 없으면 (로컬 실행, 벤치마크) 남은 시간은 무제한으로 보고 예산/타임아웃을 걸지 않는다.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import boto3
+from botocore.config import Config
+
+
+class StageSkipped(Exception):
+    """남은 시간이 모자라 단계를 시작하지 않았다 (호출하는 쪽이 대체 경로로 넘어가도록)."""
+
+
+def parse_budgets(spec: str, defaults: dict = None):
+    """'analysis:20000,generation:25000' → {'analysis': 20000, 'generation': 25000} (defaults 위에 덮어씀)."""
+    budgets = dict(defaults or {})
+    for item in (spec or '').split(','):
+        stage, _, value = item.strip().partition(':')
+        if stage and value.strip().isdigit():
+            budgets[stage.strip()] = int(value)
+    return budgets
+
+
+class Deadline:
+    def __init__(self, context=None, budgets: dict = None, minimums: dict = None, safety_ms: int = 500):
+        self.budgets = budgets or {}
+        self.minimums = minimums or {}
+        self.safety_ms = safety_ms
+        self._started = time.monotonic()
+        remaining = None
+        if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+            remaining = context.get_remaining_time_in_millis()
+        # 종료 직전 응답/로그를 쓸 시간(safety_ms)은 남겨 둔다
+        self._expires_at = None if remaining is None else self._started + (remaining - safety_ms) / 1000
+        self.stages = []
+        self._lock = threading.Lock()
+
+    @property
+    def bounded(self) -> bool:
+        return self._expires_at is not None
+
+    def remaining_ms(self):
+        if self._expires_at is None:
+            return None
+        return max(0, int((self._expires_at - time.monotonic()) * 1000))
+
+    def budget_ms(self, stage: str, reserve_ms: int = 0):
+        """이 단계에 줄 수 있는 시간 = min(단계 예산, 남은 시간 - 뒤 단계 몫). 제한이 없으면 None."""
+        remaining = self.remaining_ms()
+        configured = self.budgets.get(stage)
+        if remaining is None:
+            return None
+        available = remaining - reserve_ms
+        return available if configured is None else min(configured, available)
+
+    def allows(self, stage: str, reserve_ms: int = 0, label: str = None) -> bool:
+        """단계 최소 시간이 안 되면 skipped로 기록하고 False. label이 있으면 그 이름으로 기록한다 (예: 이미지 key)."""
+        budget = self.budget_ms(stage, reserve_ms)
+        if budget is None or budget >= self.minimums.get(stage, 0):
+            return True
+        self.skip(label or stage, f"budget {budget}ms < minimum {self.minimums.get(stage, 0)}ms")
+        return False
+
+    def skip(self, stage: str, reason: str):
+        print(f"[WARNING] Stage '{stage}' skipped: {reason}")
+        self._record({'stage': stage, 'status': 'skipped', 'reason': reason, 'remainingMs': self.remaining_ms()})
+
+    @contextmanager
+    def run(self, stage: str, reserve_ms: int = 0):
+        budget = self.budget_ms(stage, reserve_ms)
+        started = time.monotonic()
+        entry = {'stage': stage, 'status': 'ran', 'budgetMs': budget}
+        try:
+            yield budget
+        except Exception as error:
+            entry.update(status='failed', reason=str(error)[:200])
+            raise
+        finally:
+            entry['elapsedMs'] = round((time.monotonic() - started) * 1000, 1)
+            self._record(entry)
+
+    def _record(self, entry):
+        with self._lock:
+            self.stages.append(entry)
+
+    def report(self):
+        with self._lock:
+            stages = list(self.stages)
+        return {'remainingMs': self.remaining_ms(), 'stages': stages}
+
+
+class TimeoutClientPool:
+    """같은 서비스/리전의 boto3 클라이언트를 read timeout 단계별로 하나씩 만들어 재사용한다.
+
+    get(budget_ms)는 예산을 넘지 않는 가장 긴 timeout 단계의 클라이언트를 돌려준다.
+    예산이 가장 짧은 단계보다도 작으면 예산 안에 끝난다고 볼 수 없으므로 StageSkipped를 올린다.
+    재시도하면 예산 안에 끝나지 않으므로 재시도하지 않는다. 예산이 없으면(None) 호출하는 쪽의 기본 클라이언트를 쓴다.
+    """
+
+    STEPS_SECONDS = (1, 2, 3, 5, 8, 13, 20, 30, 45, 60)
+
+    def __init__(self, service: str, region: str, connect_timeout: float = 2, **client_kwargs):
+        self.service = service
+        self.region = region
+        self.connect_timeout = connect_timeout
+        self.client_kwargs = client_kwargs
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def timeout_for(self, budget_ms):
+        seconds = budget_ms / 1000
+        fitting = [step for step in self.STEPS_SECONDS if step <= seconds]
+        if not fitting:
+            raise StageSkipped(f"budget {budget_ms:.0f}ms < smallest client timeout {self.STEPS_SECONDS[0]}s")
+        return fitting[-1]
+
+    def get(self, budget_ms):
+        read_timeout = self.timeout_for(budget_ms)
+        with self._lock:
+            client = self._clients.get(read_timeout)
+            if client is None:
+                config = Config(
+                    connect_timeout=min(self.connect_timeout, read_timeout),
+                    read_timeout=read_timeout,
+                    retries={'total_max_attempts': 1}
+                )
+                client = boto3.client(self.service, region_name=self.region, config=config, **self.client_kwargs)
+                self._clients[read_timeout] = client
+            return client
@@ -0,0 +1,101 @@
+"""Bedrock 비전 모델에 보내기 전 입력 이미지를 정규화한다.
+
+실제 포맷을 매직 바이트로 판별하고, 긴 변이 max_edge를 넘거나 모델이 받지 않는 포맷이면
+RGB JPEG으로 축소/재인코딩한다. 이미 작고 지원되는 포맷이면 원본 바이트를 그대로 쓴다.
+"""
+import io
+import time
+
+from PIL import Image, ImageOps
+
+# Nova 이미지 입력이 받는 포맷 (Bedrock image.format 값)
+MODEL_FORMATS = ('jpeg', 'png', 'gif', 'webp')
+
+
+def sniff_format(data: bytes):
+    """매직 바이트로 실제 포맷을 판별한다. 모르면 None."""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[4:8] == b'ftyp':
+        brand = data[8:12]
+        if brand in (b'heic', b'heix', b'hevc', b'hevx', b'mif1', b'msf1'):
+            return 'heic'
+        if brand in (b'avif', b'avis'):
+            return 'avif'
+    if data[:2] == b'BM':
+        return 'bmp'
+    if data[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+
+def prepare_for_model(image_bytes: bytes, max_edge: int = 1280, max_bytes: int = 1024 * 1024, quality: int = 85):
+    """모델 입력용 이미지를 만든다.
+
+    {'bytes', 'format', 'original_format', 'original_bytes', 'prepared_bytes', 'saved_bytes',
+     'width', 'height', 'reencoded', 'elapsed_ms'}를 돌려준다.
+    디코딩할 수 없는 이미지는 원본 바이트를 그대로 돌려준다 (포맷을 모르면 'jpeg').
+    """
+    started = time.perf_counter()
+    original_format = sniff_format(image_bytes)
+    result = {
+        'bytes': image_bytes,
+        'format': original_format if original_format in MODEL_FORMATS else 'jpeg',
+        'original_format': original_format,
+        'original_bytes': len(image_bytes),
+        'width': None,
+        'height': None,
+        'reencoded': False,
+    }
+
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = image.size
+        result['width'], result['height'] = width, height
+
+        if original_format in MODEL_FORMATS and max(width, height) <= max_edge and len(image_bytes) <= max_bytes:
+            return _finish(result, started)
+
+        scale = min(1.0, max_edge / max(width, height))
+        target_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        image.draft('RGB', target_size)
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # 투명 영역은 흰 배경으로 합친다 (JPEG은 알파가 없음)
+            rgba = image.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        # exif_transpose로 가로/세로가 바뀔 수 있으므로 긴 변 기준으로 맞춘다
+        image.thumbnail((max_edge, max_edge))
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+        if buffer.tell() < len(image_bytes) or original_format not in MODEL_FORMATS:
+            result.update(bytes=buffer.getvalue(), format='jpeg', reencoded=True,
+                          width=image.width, height=image.height)
+    except Exception as prep_error:
+        print(f"[WARNING] Image preprocessing skipped: {prep_error}")
+
+    return _finish(result, started)
+
+
+def _finish(result, started):
+    result['prepared_bytes'] = len(result['bytes'])
+    result['saved_bytes'] = result['original_bytes'] - result['prepared_bytes']
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def describe(result) -> str:
+    return (f"{result['original_format'] or 'unknown'} {result['original_bytes']}B -> "
+            f"{result['format']} {result['prepared_bytes']}B (saved {result['saved_bytes']}B) "
+            f"in {result['elapsed_ms']}ms")
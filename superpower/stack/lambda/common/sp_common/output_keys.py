@@ -0,0 +1,56 @@
+"""sp-complete-bucket에 make_pet 결과를 두는 키 규칙 (make_pet과 image_complete가 함께 쓴다).
+
+- 변형:     0번은 원래 키, 나머지는 '{이름}_v{index}{확장자}'
+- 미리보기: '{이름}_preview{확장자}'
+- 전송용 사본(rendition): '{이름}_{긴 변}.{포맷}'
+- 요청 시 만든 사본: '{이름}_{너비}x{높이}.{원본 버전}.{포맷}' (지정하지 않은 쪽은 비움, 버전은 원본 ETag)
+"""
+import os
+
+RENDITION_FORMATS = {
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def variant_key(key: str, index: int) -> str:
+    if index == 0:
+        return key
+    root, ext = os.path.splitext(key)
+    return f"{root}_v{index}{ext}"
+
+
+def preview_key(key: str) -> str:
+    root, ext = os.path.splitext(key)
+    return f"{root}_preview{ext}"
+
+
+def rendition_key(key: str, edge: int, fmt: str) -> str:
+    root, _ = os.path.splitext(key)
+    return f"{root}_{edge}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def box_rendition_key(key: str, width: int, height: int, fmt: str, version: str = None) -> str:
+    root, _ = os.path.splitext(key)
+    version = f".{version}" if version else ''
+    return f"{root}_{width or ''}x{height or ''}{version}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def parse_ladder(spec: str):
+    """'512:webp,256:webp,256:jpeg' → [(512, 'webp'), (256, 'webp'), (256, 'jpeg')]. 잘못된 항목은 건너뛴다."""
+    ladder = []
+    for item in (spec or '').split(','):
+        edge, _, fmt = item.strip().partition(':')
+        fmt = (fmt or 'webp').strip().lower()
+        if fmt == 'jpg':
+            fmt = 'jpeg'
+        if not edge.strip().isdigit() or int(edge) <= 0 or fmt not in RENDITION_FORMATS:
+            continue
+        if (int(edge), fmt) not in ladder:
+            ladder.append((int(edge), fmt))
+    return ladder
+
+
+def format_ladder(ladder) -> str:
+    return ','.join(f"{edge}:{fmt}" for edge, fmt in ladder)
@@ -0,0 +1,92 @@
+"""업로드한 사용자의 WebSocket 연결로 처리 중간 상황을 보낸다.
+
+업로드 키의 첫 폴더가 connectionId다 (image_complete와 같은 규칙).
+post_to_connection은 별도 스레드 하나에서 순서대로 보내므로 호출한 쪽(모델 스트림 소비 등)을 막지 않는다.
+부분 텍스트(partial)는 min_interval_ms 간격으로만, 이전 전송이 끝났을 때만 보낸다 (다음 전송이 더 긴 텍스트를 담는다).
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+DEFAULT_WEBSOCKET_ENDPOINT = 'https://8eycp5n6sf.execute-api.ap-northeast-2.amazonaws.com/production/'
+
+
+def connection_id_from_key(key: str):
+    """'{connectionId}/{fileName}' 형태의 키에서 connectionId를 꺼낸다. 폴더가 없으면 None."""
+    parts = (key or '').split('/')
+    return parts[0] if len(parts) > 1 and parts[0] else None
+
+
+class ProgressNotifier:
+    """client나 connection_id가 없으면 아무것도 보내지 않는다 (호출하는 쪽은 분기할 필요 없음).
+
+    extra는 모든 메시지에 함께 실어 보낼 필드다 (예: {'jobId': ...}).
+    """
+
+    def __init__(self, client=None, connection_id: str = None, file_name: str = None, min_interval_ms: float = 400,
+                 extra: dict = None):
+        self.client = client
+        self.connection_id = connection_id
+        self.file_name = file_name
+        self.min_interval_ms = min_interval_ms
+        self.extra = extra or {}
+        self.enabled = bool(client and connection_id)
+        self.sent = 0
+        self.first_sent_ms = None
+        self._started = time.perf_counter()
+        self._last_partial = 0.0
+        self._partial_in_flight = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1) if self.enabled else None
+
+    def send(self, stage: str, **fields):
+        """단계 이벤트는 항상 보낸다."""
+        if not self.enabled:
+            return None
+        message = {'type': 'progress', 'stage': stage, 'fileName': self.file_name, **self.extra, **fields}
+        return self._executor.submit(self._post, message)
+
+    def partial(self, stage: str, text: str):
+        """스트리밍 중인 부분 텍스트. 너무 자주 부르면 건너뛴다."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            if (now - self._last_partial) * 1000 < self.min_interval_ms:
+                return
+            if self._partial_in_flight is not None and not self._partial_in_flight.done():
+                return
+            self._last_partial = now
+            self._partial_in_flight = self.send(stage, partial=text)
+
+    def _post(self, message):
+        if not self.enabled:
+            return
+        try:
+            self.client.post_to_connection(
+                ConnectionId=self.connection_id,
+                Data=json.dumps(message, ensure_ascii=False).encode('utf-8')
+            )
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') == 'GoneException':
+                print(f"[INFO] Connection {self.connection_id} is no longer available, progress disabled")
+                self.enabled = False
+                return
+            print(f"[WARNING] Progress message failed: {error}")
+            return
+        except Exception as error:
+            print(f"[WARNING] Progress message failed: {error}")
+            return
+        self.sent += 1
+        if self.first_sent_ms is None:
+            self.first_sent_ms = round((time.perf_counter() - self._started) * 1000, 1)
+
+    def close(self):
+        """남은 메시지를 모두 보낼 때까지 기다린다 (Lambda가 반환 후 얼기 전에 호출)."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self.enabled = False
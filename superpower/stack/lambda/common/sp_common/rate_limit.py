@@ -0,0 +1,389 @@
+"""모델(리전별) 호출 속도를 토큰 버킷과 동시 호출 수 상한으로 제한하고, 스로틀이 나면 속도를 줄인다.
+
+상태는 store에 키별 dict로 두고 store.update(key, fn)로 한 번에 읽고 고친다. 컨테이너/프로세스끼리 상태를 나누려면
+같은 store를 보면 된다.
+- InMemoryLimiterStore: 한 컨테이너 안의 스레드끼리만 공유
+- FileLimiterStore: 같은 호스트의 여러 프로세스가 파일 잠금으로 공유. Lambda의 /tmp는 컨테이너마다 따로이므로
+  배포 환경에서는 memory와 마찬가지로 컨테이너별 제한이다 (로컬 벤치마크용)
+- DynamoDBLimiterStore: 모든 컨테이너가 한 테이블을 조건부 UpdateItem으로 공유. 컨테이너 수와 관계없이 설정한 속도를 지키려면
+  이것을 써야 한다 (template.yaml은 BEDROCK_LIMITER_STORE=dynamodb)
+
+스로틀(ThrottlingException)이 나면 속도를 절반으로 줄이고 지수 backoff(+jitter) 동안 새 호출을 막는다.
+성공하면 설정 속도까지 조금씩 되돌린다 (AIMD). 동시 호출 수는 만료 시간이 있는 lease로 세므로
+호출 도중 컨테이너가 죽어도 lease_seconds 뒤에는 자리가 풀린다.
+기다려야 하는 시간이 max_wait_ms를 넘으면 기다리지 않고 RateLimited를 올린다.
+
+스트림 응답(call(..., stream=True))은 fn()이 돌아온 뒤가 아니라 body를 다 읽거나 닫을 때 lease를 돌려준다.
+받는 도중 스로틀/ModelStreamErrorException이 나면 그때 속도를 줄인다 (이미 받은 부분이 있으므로 재시도는 하지 않는다).
+"""
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import boto3
+from botocore.exceptions import ClientError
+
+THROTTLE_ERRORS = ('ThrottlingException', 'TooManyRequestsException')
+# 스트림 도중에는 과부하가 ModelStreamErrorException으로도 온다
+STREAM_THROTTLE_ERRORS = THROTTLE_ERRORS + ('ModelStreamErrorException',)
+
+
+class RateLimited(Exception):
+    """호출 자리가 max_wait_ms 안에 나지 않아 호출하지 않았다."""
+
+
+def is_throttle(error: Exception, stream: bool = False) -> bool:
+    if not isinstance(error, ClientError):
+        return False
+    # 이벤트 스트림 오류 코드는 'throttlingException'처럼 첫 글자가 소문자다
+    code = error.response.get('Error', {}).get('Code', '').lower()
+    return code in {name.lower() for name in (STREAM_THROTTLE_ERRORS if stream else THROTTLE_ERRORS)}
+
+
+class StreamBody:
+    """스트림 응답 body를 감싸 다 읽거나 닫을 때 on_finish(error 또는 None)를 한 번 부른다.
+
+    boto3 EventStream은 모델 오류를 예외로 올리지만 {'throttlingException': {...}} 같은 이벤트로 오는 경우도
+    ClientError로 바꿔 on_finish에 넘긴다 (이벤트는 그대로 호출하는 쪽에 전달한다).
+    """
+
+    def __init__(self, stream, on_finish):
+        self._stream = stream
+        self._on_finish = on_finish
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def _finish(self, error=None):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+        self._on_finish(error)
+
+    def __iter__(self):
+        iterator = iter(self._stream)
+        error = None
+        try:
+            for event in iterator:
+                name = next((key for key in event if key.endswith('Exception')), None) \
+                    if isinstance(event, dict) and 'chunk' not in event else None
+                if name and error is None:
+                    error = ClientError({'Error': {'Code': name[0].upper() + name[1:],
+                                                   'Message': (event[name] or {}).get('message', '')}},
+                                        'InvokeModelWithResponseStream')
+                yield event
+        except Exception as raised:
+            self._finish(raised)
+            raise
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            self._finish(error)
+
+    def close(self):
+        try:
+            close = getattr(self._stream, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._finish()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def wrap_stream(response: dict, on_finish):
+    """invoke_model_with_response_stream 응답의 body를 StreamBody로 바꾼 사본."""
+    return dict(response, body=StreamBody(response['body'], on_finish))
+
+
+def parse_limits(spec: str):
+    """BEDROCK_RATE_LIMITS JSON: {"<model id>": {"rate": 초당 호출, "burst": 버킷 크기, "concurrency": 동시 호출 수}}
+
+    값은 모두 0보다 커야 한다 (rate 0은 대기 시간 계산에서 0으로 나누게 된다). 아니면 ValueError.
+    """
+    limits = json.loads(spec) if spec else {}
+    for model_id, model_limits in limits.items():
+        for name in ('rate', 'burst', 'concurrency'):
+            value = model_limits.get(name)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+                raise ValueError(f"BEDROCK_RATE_LIMITS {model_id}.{name} must be a positive number, got {value!r}")
+    return limits
+
+
+class InMemoryLimiterStore:
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def update(self, key: str, fn):
+        """fn(state 또는 None) → (새 state, 돌려줄 값)"""
+        with self._lock:
+            state, result = fn(self._states.get(key))
+            self._states[key] = state
+            return result
+
+    def items(self):
+        with self._lock:
+            return json.loads(json.dumps(self._states))
+
+
+class FileLimiterStore:
+    """키마다 {directory}/{hash}.json 파일 하나를 flock으로 잠그고 고친다."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.json')
+
+    def update(self, key: str, fn):
+        # flock은 같은 프로세스의 다른 스레드는 막지 않으므로 프로세스 안에서는 lock을 한 번 더 건다
+        with self._lock, open(self._path(key), 'a+') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                handle.seek(0)
+                raw = handle.read()
+                state, result = fn(json.loads(raw) if raw else None)
+                handle.seek(0)
+                handle.truncate()
+                handle.write(json.dumps(dict(state, key=key)))
+                handle.flush()
+                return result
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def items(self):
+        states = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.directory, name)) as handle:
+                raw = handle.read()
+            if raw:
+                state = json.loads(raw)
+                states[state.pop('key', name)] = state
+        return states
+
+
+class DynamoDBLimiterStore:
+    """키마다 DynamoDB 항목 하나({'limiter_key', 'state'(JSON), 'version'})를 낙관적 잠금으로 고친다.
+
+    마지막으로 쓰거나 받은 항목을 컨테이너 안에 두고 그 state로 fn을 부른 뒤, version이 그대로일 때만
+    UpdateItem으로 쓴다. 그 사이 다른 컨테이너가 고쳤으면 조건 실패 응답(ReturnValuesOnConditionCheckFailure)에
+    실린 최신 항목으로 fn을 다시 부르므로 GetItem 없이 호출마다 한 번(겹치면 그만큼 더) 쓴다.
+    max_retries번 안에 못 쓰면 RateLimited (다음 리전으로 넘기거나 호출하지 않는다).
+    """
+
+    def __init__(self, table_name: str, client=None, max_retries: int = 20):
+        self.table_name = table_name
+        self.client = client or boto3.client('dynamodb')
+        self.max_retries = max_retries
+        # 키 → (version, state JSON). 없으면 항목이 없다고 보고 attribute_not_exists 조건으로 쓴다
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _remember(self, key: str, item):
+        if item:
+            with self._lock:
+                self._items[key] = (int(item['version']['N']), item['state']['S'])
+
+    def update(self, key: str, fn):
+        for attempt in range(self.max_retries):
+            with self._lock:
+                version, raw = self._items.get(key, (0, None))
+            state, result = fn(json.loads(raw) if raw is not None else None)
+            encoded = json.dumps(state)
+            request = {
+                'TableName': self.table_name,
+                'Key': {'limiter_key': {'S': key}},
+                'UpdateExpression': 'SET #state = :state, version = :next',
+                'ExpressionAttributeNames': {'#state': 'state'},
+                'ExpressionAttributeValues': {':state': {'S': encoded}, ':next': {'N': str(version + 1)}},
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD',
+            }
+            if raw is not None:
+                request['ConditionExpression'] = 'version = :version'
+                request['ExpressionAttributeValues'][':version'] = {'N': str(version)}
+            else:
+                request['ConditionExpression'] = 'attribute_not_exists(limiter_key)'
+            try:
+                self.client.update_item(**request)
+            except ClientError as error:
+                if error.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+                # 다른 컨테이너가 쓴 최신 항목으로 다시 계산한다
+                self._remember(key, error.response.get('Item'))
+                time.sleep(random.uniform(0, 0.005 * 2 ** min(attempt, 5)))
+                continue
+            with self._lock:
+                self._items[key] = (version + 1, encoded)
+            return result
+        raise RateLimited(f"{key}: limiter state is contended")
+
+    def items(self):
+        # 테이블을 다시 읽지 않고 이 컨테이너가 마지막으로 쓰거나 받은 state를 돌려준다 (지표용)
+        with self._lock:
+            return {key: json.loads(raw) for key, (_, raw) in sorted(self._items.items())}
+
+
+def build_store(kind: str, directory: str = '/tmp/bedrock-limiter', table_name: str = None):
+    """BEDROCK_LIMITER_STORE(memory | file | dynamodb) → store."""
+    if kind == 'dynamodb':
+        if not table_name:
+            raise ValueError("BEDROCK_LIMITER_TABLE is required for the dynamodb limiter store")
+        return DynamoDBLimiterStore(table_name)
+    if kind == 'file':
+        return FileLimiterStore(directory)
+    return InMemoryLimiterStore()
+
+
+class RateLimiter:
+    DEFAULT_LIMITS = {'rate': 10.0, 'burst': 20, 'concurrency': 16}
+
+    def __init__(self, store=None, limits: dict = None, default_limits: dict = None, max_wait_ms: float = 10000,
+                 max_attempts: int = 3, base_backoff_ms: float = 200, max_backoff_ms: float = 5000,
+                 min_rate: float = 0.1, recovery: float = 0.1, lease_seconds: float = 120, poll_ms: float = 50,
+                 max_poll_ms: float = 1000):
+        self.store = store or InMemoryLimiterStore()
+        self.limits = limits or {}
+        self.default_limits = dict(self.DEFAULT_LIMITS, **(default_limits or {}))
+        self.max_wait_ms = max_wait_ms
+        self.max_attempts = max_attempts
+        self.base_backoff_ms = base_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.lease_seconds = lease_seconds
+        self.poll_ms = poll_ms
+        self.max_poll_ms = max_poll_ms
+
+    def _limits(self, model_id: str):
+        return dict(self.default_limits, **self.limits.get(model_id, {}))
+
+    def _fresh(self, state, limits, now):
+        if state is None:
+            state = {'tokens': limits['burst'], 'rate': limits['rate'], 'updated_at': now, 'blocked_until': 0,
+                     'throttle_streak': 0, 'leases': {},
+                     'admitted': 0, 'delayed': 0, 'rejected': 0, 'throttled': 0}
+        elapsed = max(0.0, now - state['updated_at'])
+        state['tokens'] = min(limits['burst'], state['tokens'] + elapsed * state['rate'])
+        state['updated_at'] = now
+        state['leases'] = {lease: expires for lease, expires in state['leases'].items() if expires > now}
+        return state
+
+    def acquire(self, model_id: str, scope: str = '', max_wait_ms: float = None):
+        """자리가 나면 lease id를 돌려준다. max_wait_ms(없으면 self.max_wait_ms) 안에 안 나면 RateLimited."""
+        key = f"{scope}/{model_id}"
+        limits = self._limits(model_id)
+        max_wait = self.max_wait_ms if max_wait_ms is None else max_wait_ms
+        started = time.time()
+        waited = False
+        polls = 0
+
+        while True:
+            def try_take(state):
+                now = time.time()
+                state = self._fresh(state, limits, now)
+                waits = [state['blocked_until'] - now]
+                if state['tokens'] < 1:
+                    waits.append((1 - state['tokens']) / state['rate'])
+                if len(state['leases']) >= limits['concurrency']:
+                    # 언제 끝날지 모르므로 poll_ms부터 두 배씩(최대 max_poll_ms, 가장 이른 lease 만료까지) 늘려 다시 본다
+                    poll = min(self.max_poll_ms, self.poll_ms * 2 ** polls) / 1000
+                    waits.append(min(poll, min(state['leases'].values()) - now) * random.uniform(0.5, 1.0))
+                wait = max(waits)
+                if wait > 0:
+                    if (now - started + wait) * 1000 > max_wait:
+                        state['rejected'] += 1
+                        return state, ('rejected', wait)
+                    return state, ('wait', wait)
+                lease = uuid.uuid4().hex
+                state['tokens'] -= 1
+                state['leases'][lease] = now + self.lease_seconds
+                state['admitted'] += 1
+                if waited:
+                    state['delayed'] += 1
+                return state, ('admitted', lease)
+
+            outcome, value = self.store.update(key, try_take)
+            if outcome == 'admitted':
+                return value
+            if outcome == 'rejected':
+                raise RateLimited(f"{key}: no slot within {max_wait:.0f}ms (next in {value * 1000:.0f}ms)")
+            waited = True
+            polls += 1
+            time.sleep(value)
+
+    def release(self, model_id: str, lease: str, scope: str = '', throttled: bool = False):
+        """호출이 끝나면 lease를 돌려주고, 스로틀 여부에 따라 속도를 조정한다."""
+        limits = self._limits(model_id)
+
+        def finish(state):
+            now = time.time()
+            state = self._fresh(state, limits, now)
+            state['leases'].pop(lease, None)
+            if throttled:
+                state['throttled'] += 1
+                state['throttle_streak'] += 1
+                state['rate'] = max(self.min_rate, state['rate'] / 2)
+                state['tokens'] = min(state['tokens'], 0)
+                backoff = min(self.max_backoff_ms, self.base_backoff_ms * 2 ** (state['throttle_streak'] - 1))
+                state['blocked_until'] = max(state['blocked_until'], now + backoff * random.uniform(0.5, 1.0) / 1000)
+            else:
+                state['throttle_streak'] = 0
+                state['rate'] = min(limits['rate'], state['rate'] + limits['rate'] * self.recovery)
+            return state, None
+
+        self.store.update(f"{scope}/{model_id}", finish)
+
+    def call(self, model_id: str, fn, scope: str = '', max_wait_ms: float = None, attempts: int = None,
+             stream: bool = False):
+        """자리를 얻어 fn()을 부른다. 스로틀이 나면 backoff가 끝난 뒤 attempts번까지 다시 시도한다.
+
+        max_wait_ms는 자리를 기다리는 시간 전체(재시도 포함)의 상한이다.
+        stream=True면 fn()의 응답 body를 감싸 스트림이 끝날 때 lease를 돌려준다.
+        """
+        attempts = self.max_attempts if attempts is None else attempts
+        max_wait = self.max_wait_ms if max_wait_ms is None else max_wait_ms
+        started = time.time()
+        for attempt in range(attempts):
+            remaining = max_wait - (time.time() - started) * 1000
+            lease = self.acquire(model_id, scope, max(0.0, remaining))
+            try:
+                result = fn()
+            except Exception as error:
+                self.release(model_id, lease, scope, throttled=is_throttle(error))
+                if is_throttle(error) and attempt + 1 < attempts:
+                    print(f"[WARNING] {scope}/{model_id} throttled, backing off (attempt {attempt + 1}/{attempts})")
+                    continue
+                raise
+            if stream:
+                return wrap_stream(result, functools.partial(self._release_stream, model_id, lease, scope))
+            self.release(model_id, lease, scope)
+            return result
+
+    def _release_stream(self, model_id: str, lease: str, scope: str, error):
+        self.release(model_id, lease, scope, throttled=is_throttle(error, stream=True))
+
+    def snapshot(self):
+        return {
+            key: {
+                'admitted': state['admitted'],
+                'delayed': state['delayed'],
+                'rejected': state['rejected'],
+                'throttled': state['throttled'],
+                'rate': round(state['rate'], 3),
+                'inFlight': len(state['leases']),
+            }
+            for key, state in self.store.items().items()
+        }
@@ -0,0 +1,75 @@
+"""한 번 디코딩한 이미지로 크기/포맷별 전송용 사본(rendition)을 만든다.
+
+큰 크기부터 차례로 줄이면서 (작은 사본은 바로 위 크기에서 축소) 같은 크기의 포맷들은 한 번 줄인 이미지를 함께 쓴다.
+JPEG 원본은 draft 모드로 필요한 크기 근처까지만 디코딩한다. 원본보다 크게 늘리지는 않는다.
+"""
+import io
+
+from PIL import Image
+
+from sp_common.output_keys import RENDITION_FORMATS
+
+
+def _encode(image, fmt: str, quality: int, optimize: bool = True) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == 'jpeg':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG은 알파가 없으므로 흰 배경에 합친다
+            rgba = image.convert('RGBA')
+            flattened = Image.new('RGB', rgba.size, (255, 255, 255))
+            flattened.paste(rgba, mask=rgba.getchannel('A'))
+            image = flattened
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(buffer, format='JPEG', quality=quality, optimize=optimize, progressive=True)
+    elif fmt == 'webp':
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+        image.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(buffer, format='PNG', optimize=optimize)
+    return buffer.getvalue()
+
+
+def decode_for_ladder(image, ladder):
+    """열어 둔 이미지를 ladder의 가장 큰 크기에 필요한 만큼만 디코딩한다 (JPEG은 draft로 1/2~1/8 축소 디코딩)."""
+    width, height = image.size
+    largest = min(max(edge for edge, _ in ladder), max(width, height))
+    if image.format == 'JPEG':
+        scale = largest / max(width, height)
+        image.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+    image.load()
+    return image
+
+
+def render_image(image, ladder, quality: int = 80, optimize: bool = True):
+    """디코딩된 이미지 → [{'edge', 'format', 'content_type', 'bytes', 'width', 'height'}] (ladder 순서).
+
+    optimize=False면 PNG/JPEG 엔트로피 최적화를 건너뛴다 (조금 커지는 대신 인코딩이 빠르다).
+    """
+    encoded = {}
+    current = image
+    for edge in sorted({edge for edge, _ in ladder}, reverse=True):
+        if max(current.size) > edge:
+            # thumbnail()은 제자리에서 줄이므로 원본을 지키려면 전체 크기 사본이 필요하다. resize는 줄인 새 이미지만 만든다
+            scale = edge / max(current.size)
+            size = (max(1, round(current.width * scale)), max(1, round(current.height * scale)))
+            current = current.resize(size, Image.LANCZOS, reducing_gap=2.0)
+        for fmt in [fmt for e, fmt in ladder if e == edge]:
+            encoded[(edge, fmt)] = {
+                'edge': edge,
+                'format': fmt,
+                'content_type': RENDITION_FORMATS[fmt],
+                'bytes': _encode(current, fmt, quality, optimize),
+                'width': current.width,
+                'height': current.height,
+            }
+    return [encoded[(edge, fmt)] for edge, fmt in ladder]
+
+
+def render_ladder(image_bytes: bytes, ladder, quality: int = 80):
+    """ladder: [(긴 변, 포맷)]. [{'edge', 'format', 'content_type', 'bytes', 'width', 'height'}]를 ladder 순서로 돌려준다."""
+    if not ladder:
+        return []
+    image = decode_for_ladder(Image.open(io.BytesIO(image_bytes)), ladder)
+    return render_image(image, ladder, quality)
@@ -0,0 +1,102 @@
+"""업로드 이미지 한 장에 대한 Nova Pro 비전 분석을 한 번만 하고 make_pet과 analyzeSentiment가 같이 쓴다.
+
+응답은 펫 설명(자유 텍스트) 뒤에 EMOTIONS_MARKER 줄과 감정 JSON이 오는 형식이다.
+설명이 앞에 오므로 make_pet은 스트리밍으로 받으며 설명 부분만 진행 상황으로 보내거나 프롬프트 변환을 먼저 시작할 수 있다.
+
+결과 {'description', 'emotions'}는 원본 바이트의 sha256과 지시문 버전으로 캐시한다 (vision_cache).
+같은 업로드를 두 함수가 거의 동시에 처리하면 둘 다 모델을 부를 수 있다 (먼저 끝난 쪽 결과가 남는다).
+"""
+import hashlib
+import json
+import re
+
+from sp_common.cache import S3JsonStore, TieredCache, cache_key
+
+VISION_MODEL_ID = 'amazon.nova-pro-v1:0'
+EMOTIONS_MARKER = 'EMOTIONS:'
+
+VISION_INSTRUCTION = (
+    "전달된 이미지를 두 가지 용도로 분석해줘.\n"
+    "1) 성장형 게임에서 사용할 아기 펫 이미지를 생성하려고 한다. 이미지를 분석한 뒤 그것을 바탕으로 생성할 아기 펫에 대해 "
+    "구체적으로 설명해줘. 이 설명을 먼저 자유 형식의 문장으로 쓴다.\n"
+    "2) 설명이 끝나면 새 줄에 '" + EMOTIONS_MARKER + "'를 쓰고 바로 뒤에 이미지에서 느껴지는 감정을 JSON 한 줄로 쓴다. "
+    "항상 joy(기쁨)를 포함한 총 3개의 감정을 돌려줘야 한다. 점수는 모두 0~15 정수. "
+    "나머지 2개 감정은 이미지에서 느껴지는 감정 중에서 골라 한국어 이름을 쓴다. "
+    '형식: {"emotions":[{"name":"joy","score":int},{"name":"<감정1>","score":int},{"name":"<감정2>","score":int}]} '
+    "JSON 뒤에는 아무것도 쓰지 마라."
+)
+VISION_VERSION = cache_key(VISION_MODEL_ID, VISION_INSTRUCTION)
+
+
+def content_hash(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def vision_cache_key(image_hash: str) -> str:
+    return cache_key(image_hash, VISION_VERSION)
+
+
+def build_vision_cache(s3_client, bucket: str, memory_entries: int = 256, ttl_seconds: float = 30 * 24 * 3600):
+    return TieredCache('vision', memory_entries=memory_entries, ttl_seconds=ttl_seconds,
+                       persistent_store=S3JsonStore(s3_client, bucket, 'vision/'))
+
+
+def build_request(base64_image: str, image_format: str = 'jpeg'):
+    return {
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "image": {
+                            "format": image_format,
+                            "source": {"bytes": base64_image},
+                        }
+                    },
+                    {"text": VISION_INSTRUCTION},
+                ],
+            }
+        ]
+    }
+
+
+def description_of(text: str) -> str:
+    """(스트리밍 도중일 수도 있는) 응답에서 펫 설명 부분만 돌려준다."""
+    return text.split(EMOTIONS_MARKER, 1)[0].strip()
+
+
+def _clean_score(score):
+    try:
+        value = int(score)
+    except Exception:
+        value = 0
+    return max(0, min(15, value))
+
+
+def parse_emotions(text: str):
+    """{"emotions": [...]} JSON에서 [{'name', 'score'}]를 꺼낸다. 읽을 수 없으면 빈 목록."""
+    cleaned = re.sub(r"^```(?:json)?\s*|\s*```$", "", (text or '').strip())
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start == -1 or end <= start:
+        return []
+    try:
+        data = json.loads(cleaned[start:end + 1])
+    except json.JSONDecodeError:
+        return []
+    emotions = data.get("emotions") if isinstance(data, dict) else None
+    parsed = []
+    for item in emotions or []:
+        if isinstance(item, dict) and item.get("name"):
+            parsed.append({"name": str(item["name"]), "score": _clean_score(item.get("score"))})
+    return parsed
+
+
+def parse_response(text: str):
+    """모델 응답 → {'description': str, 'emotions': [{'name', 'score'}]}"""
+    description, _, emotions_text = text.partition(EMOTIONS_MARKER)
+    return {"description": description.strip(), "emotions": parse_emotions(emotions_text)}
+
+
+def cacheable(analysis: dict) -> bool:
+    """두 함수가 모두 쓸 수 있는 결과만 캐시한다."""
+    return bool(analysis.get("description")) and bool(analysis.get("emotions"))
@@ -1,13 +1,84 @@
 import boto3
 import json
+import math
 import urllib.parse
 import os
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import io
 
+from atlas import build_atlas, crop_decode_scale, face_crop_boxes, scale_boxes, slice_atlas
+from detectors import DetectorPolicy, LocalFaceDetector, RekognitionDetector
+from manifest import InMemoryManifestStore, S3ManifestStore, pending_entries, record_results
+from sp_common import admission
+from sp_common.cache import S3JsonStore, TieredCache, cache_key
+from sp_common.deadline import Deadline, StageSkipped, parse_budgets
+
 s3 = boto3.client('s3', region_name='ap-northeast-2')
 rekognition = boto3.client('rekognition', region_name='ap-northeast-2')
 
+# 1이면 기존처럼 이미지를 하나씩 순차 처리한다
+MAX_WORKERS = int(os.environ.get('CROP_FACE_MAX_WORKERS', '8'))
+
+# 증분 모드: connectionId별 manifest에 처리한 key/ETag와 마지막 얼굴 번호를 남기고
+# 새로 올라왔거나 바뀐 이미지만 처리한다
+INCREMENTAL = os.environ.get('CROP_FACE_INCREMENTAL', 'false').lower() == 'true'
+MANIFEST_STORE = os.environ.get('CROP_FACE_MANIFEST_STORE', 's3')
+MANIFEST_BUCKET = os.environ.get('CROP_FACE_MANIFEST_BUCKET', 'sp-croped-faces-bucket')
+
+# 검출은 긴 변이 DETECT_MAX_EDGE 이하인 프록시 이미지로 한다 (0이면 원본 전송)
+DETECT_MAX_EDGE = int(os.environ.get('CROP_FACE_DETECT_MAX_EDGE', '1600'))
+# 크롭용 디코딩도 얼굴 크롭의 긴 변이 CROP_MIN_EDGE 이상 남는 만큼만 (JPEG draft로) 줄여서 한다.
+# 그보다 작은 얼굴이 있으면 원본 해상도로 디코딩한다. 0이면 항상 원본 해상도로 자른다
+CROP_MIN_EDGE = int(os.environ.get('CROP_FACE_CROP_MIN_EDGE', '256'))
+
+# 검출 백엔드: rekognition | local (OpenCV, 네트워크 호출 없음) | auto
+# auto는 픽셀 수가 LOCAL_MAX_PIXELS 이하이거나 Rekognition 지연 이동평균이 LOCAL_LATENCY_MS를 넘으면 로컬을 쓴다
+DETECTOR = os.environ.get('CROP_FACE_DETECTOR', 'rekognition')
+LOCAL_DETECT_MAX_EDGE = int(os.environ.get('CROP_FACE_LOCAL_DETECT_MAX_EDGE', '800'))
+LOCAL_MAX_PIXELS = int(os.environ.get('CROP_FACE_LOCAL_MAX_PIXELS', str(640 * 640)))
+LOCAL_LATENCY_MS = float(os.environ.get('CROP_FACE_LOCAL_LATENCY_MS', '0'))
+
+# objects: 얼굴마다 connectionId/N.jpg 로 저장 (기존 방식)
+# atlas: connection의 모든 얼굴을 connectionId/atlas.jpg 한 장과 atlas.json 인덱스로 저장.
+# 증분 모드에서 이전 얼굴을 다시 쓸 때는 JPEG이 아니라 함께 올린 무손실 타일(atlas.png)에서 잘라 쓰므로
+# 업로드가 이어져도 예전 얼굴의 화질이 떨어지지 않는다
+OUTPUT_MODE = os.environ.get('CROP_FACE_OUTPUT_MODE', 'objects')
+ATLAS_MAX_WIDTH = int(os.environ.get('CROP_FACE_ATLAS_MAX_WIDTH', '2048'))
+ATLAS_TILE_EDGE = int(os.environ.get('CROP_FACE_ATLAS_TILE_EDGE', '512'))
+FACES_BUCKET = 'sp-croped-faces-bucket'
+
+# Lambda 남은 시간이 image 최소 시간 + finish(atlas/manifest 저장) 몫보다 적으면 남은 이미지는 시작하지 않고
+# skipped로 돌려준다 (증분 모드에서는 manifest에 기록되지 않아 다음 호출에서 처리된다)
+STAGE_MINIMUMS = parse_budgets(os.environ.get('STAGE_MINIMUMS_MS'), {'image': 3000, 'finish': 2000})
+
+# 앞부분만 먼저 받아 이미지가 아니거나 너무 큰(픽셀 수/바이트) 객체는 내려받기 전에 거른다
+ADMISSION_PROBE_BYTES = int(os.environ.get('CROP_FACE_ADMISSION_PROBE_BYTES', str(64 * 1024)))
+MAX_PIXELS = int(os.environ.get('CROP_FACE_MAX_PIXELS', '40000000'))
+MAX_BYTES = int(os.environ.get('CROP_FACE_MAX_BYTES', str(25 * 1024 * 1024)))
+
+# 같은 bucket/key/ETag 이미지는 Rekognition을 다시 부르지 않고 저장해 둔 FaceDetails를 쓴다
+DETECTION_CACHE_ENABLED = os.environ.get('CROP_FACE_DETECTION_CACHE', 'true').lower() == 'true'
+DETECTION_CACHE_BUCKET = os.environ.get('CROP_FACE_DETECTION_CACHE_BUCKET', 'sp-croped-faces-bucket')
+DETECTION_CACHE_ENTRIES = int(os.environ.get('CROP_FACE_DETECTION_CACHE_ENTRIES', '512'))
+DETECTION_CACHE_TTL = int(os.environ.get('CROP_FACE_DETECTION_CACHE_TTL', str(7 * 24 * 3600)))
+
+detection_cache = TieredCache(
+    'detection',
+    memory_entries=DETECTION_CACHE_ENTRIES,
+    ttl_seconds=DETECTION_CACHE_TTL,
+    persistent_store=S3JsonStore(s3, DETECTION_CACHE_BUCKET, '_detections/')
+) if DETECTION_CACHE_ENABLED else None
+
+detector_policy = DetectorPolicy(
+    RekognitionDetector(rekognition, DETECT_MAX_EDGE),
+    LocalFaceDetector(max_edge=LOCAL_DETECT_MAX_EDGE),
+    mode=DETECTOR,
+    local_max_pixels=LOCAL_MAX_PIXELS,
+    latency_threshold_ms=LOCAL_LATENCY_MS
+)
+manifest_store = None
+
 cors_headers = {
     "Access-Control-Allow-Origin": "*",
     "Access-Control-Allow-Headers": "Content-Type",
@@ -46,8 +117,8 @@ def _extract_connection_id(key: str) -> str:
     return filename.split('.')[0]
 
 
-def _list_objects(bucket: str, prefix: str):
-    keys = []
+def _list_object_entries(bucket: str, prefix: str):
+    entries = []
     continuation_token = None
 
     while True:
@@ -61,98 +132,453 @@ def _list_objects(bucket: str, prefix: str):
             obj_key = obj['Key']
             if obj_key.endswith('/'):
                 continue
-            keys.append(obj_key)
+            entries.append({'Key': obj_key, 'ETag': obj.get('ETag')})
 
         if not response.get('IsTruncated'):
             break
 
         continuation_token = response.get('NextContinuationToken')
 
-    return keys
+    return entries
+
+
+def _build_manifest_store():
+    if MANIFEST_STORE == 'memory':
+        return InMemoryManifestStore()
+    return S3ManifestStore(s3, MANIFEST_BUCKET)
 
 
-def _crop_faces_from_image(bucket: str, key: str, connection_id: str, start_index: int = 0):
-    response = s3.get_object(Bucket=bucket, Key=key)
-    image_data = response['Body'].read()
+def _prepare_image_faces(bucket: str, key: str, deadline: Deadline = None):
+    """이미지를 내려받아 얼굴을 검출하고 얼굴 영역을 잘라 둔다 (번호는 아직 부여하지 않음)."""
+    if deadline is not None and not deadline.allows('image', STAGE_MINIMUMS.get('finish', 0), label=key):
+        raise StageSkipped(f"not enough time left to process {key}")
+    # 포맷은 가리지 않는다 (Pillow로 열리면 기존처럼 처리)
+    admitted = admission.admit(s3, bucket, key, ADMISSION_PROBE_BYTES, max_pixels=MAX_PIXELS, max_bytes=MAX_BYTES,
+                               formats=None)
+    image_data, etag = admitted['body'], admitted['etag']
+    if image_data is None:
+        response = s3.get_object(Bucket=bucket, Key=key)
+        image_data, etag = response['Body'].read(), response.get('ETag')
 
     image = Image.open(io.BytesIO(image_data))
     image_width, image_height = image.size
     print(f"[INFO] Image loaded: {image_width}x{image_height} from {key}")
 
-    try:
-        detection_response = rekognition.detect_faces(
-            Image={'Bytes': image_data},
-            Attributes=['DEFAULT']
-        )
-        face_details = detection_response['FaceDetails']
-        print(f"[SUCCESS] Detected {len(face_details)} faces in {key} using AWS Rekognition")
-    except Exception as detection_error:
-        print(f"[ERROR] Face detection failed for {key}: {detection_error}")
-        face_details = []
-
-    face_index = start_index
-    uploaded_faces = []
-
-    for face_detail in face_details:
-        face_index += 1
-
-        bbox = face_detail['BoundingBox']
-        left = int(bbox['Left'] * image_width)
-        top = int(bbox['Top'] * image_height)
-        width = int(bbox['Width'] * image_width)
-        height = int(bbox['Height'] * image_height)
-
-        margin = int(min(width, height) * 0.1)
-        x1_crop = max(0, left - margin)
-        y1_crop = max(0, top - margin)
-        x2_crop = min(image_width, left + width + margin)
-        y2_crop = min(image_height, top + height + margin)
-
-        face_image = image.crop((x1_crop, y1_crop, x2_crop, y2_crop))
-        confidence = face_detail['Confidence']
-
-        img_buffer = io.BytesIO()
-        face_image.save(img_buffer, format='JPEG', quality=90)
-        img_buffer.seek(0)
-
-        # 요청: connectionId/face_count.jpg 형태로만 저장
-        face_key = f"{connection_id}/{face_index}.jpg"
-
-        s3.put_object(
-            Bucket='sp-croped-faces-bucket',
-            Key=face_key,
-            Body=img_buffer.getvalue(),
-            ContentType='image/jpeg',
-            Metadata={
-                'original-file': key,
-                'connection-id': connection_id,
-                'face-number': str(face_index),
-                'detection-method': 'aws-rekognition',
-                'confidence': str(confidence),
-                'bbox': f"{x1_crop},{y1_crop},{x2_crop},{y2_crop}"
-            }
-        )
+    detector = detector_policy.choose(image_width, image_height)
+    # 백엔드나 프록시 크기가 바뀌면 검출 결과도 달라질 수 있으므로 키에 포함한다
+    detection_key = cache_key(bucket, key, etag, detector.cache_tag)
+    face_details = detection_cache.get(detection_key) if detection_cache and etag else None
+
+    if face_details is not None:
+        print(f"[INFO] Using cached detection for {key}: {len(face_details)} faces")
+    else:
+        try:
+            face_details = detector_policy.detect(detector, image, image_data)
+            print(f"[SUCCESS] Detected {len(face_details)} faces in {key} using {detector.name}")
+            if detection_cache and etag:
+                detection_cache.put(detection_key, face_details)
+        except Exception as detection_error:
+            print(f"[ERROR] Face detection failed for {key}: {detection_error}")
+            face_details = []
+    del image
+
+    if not face_details:
+        return {
+            'source_key': key,
+            'faces': []
+        }
 
-        uploaded_faces.append({
-            'face_number': face_index,
-            'detection_method': 'aws-rekognition',
-            'confidence': confidence,
-            'bbox': [x1_crop, y1_crop, x2_crop, y2_crop],
-            's3_key': face_key,
-            'source_image': key
+    # BoundingBox는 비율 좌표라 프록시 기준 결과를 그대로 원본 크기에 매핑할 수 있다.
+    # 크롭용 디코딩은 얼굴이 있는 이미지에서만, 모든 크롭이 CROP_MIN_EDGE 이상 남는 배율로 한 번 한다
+    crop_boxes = face_crop_boxes(face_details, image_width, image_height)
+    scale = crop_decode_scale(crop_boxes, CROP_MIN_EDGE)
+    image = Image.open(io.BytesIO(image_data))
+    if scale < 1.0:
+        image.draft('RGB', (max(1, math.ceil(image_width * scale)), max(1, math.ceil(image_height * scale))))
+    decoded_boxes = scale_boxes(crop_boxes, image.width / image_width, image.height / image_height)
+    prepared_faces = []
+
+    for face_detail, crop_box, decoded_box in zip(face_details, crop_boxes.tolist(), decoded_boxes.tolist()):
+        prepared_faces.append({
+            'image': image.crop(tuple(decoded_box)),
+            'confidence': face_detail['Confidence'],
+            'detection_method': detector.name,
+            'bbox': crop_box
         })
 
-        print(f"[SUCCESS] Face {face_index} from {key} uploaded: s3://sp-croped-faces-bucket/{face_key}")
-
     return {
         'source_key': key,
-        'faces_found': face_index - start_index,
-        'faces': uploaded_faces,
-        'last_index': face_index
+        'faces': prepared_faces
+    }
+
+
+def _upload_face(source_key: str, connection_id: str, face_index: int, face: dict):
+    # 요청: connectionId/face_count.jpg 형태로만 저장
+    face_key = f"{connection_id}/{face_index}.jpg"
+    x1_crop, y1_crop, x2_crop, y2_crop = face['bbox']
+
+    img_buffer = io.BytesIO()
+    face['image'].save(img_buffer, format='JPEG', quality=90)
+
+    s3.put_object(
+        Bucket=FACES_BUCKET,
+        Key=face_key,
+        Body=img_buffer.getvalue(),
+        ContentType='image/jpeg',
+        Metadata={
+            'original-file': source_key,
+            'connection-id': connection_id,
+            'face-number': str(face_index),
+            'detection-method': face['detection_method'],
+            'confidence': str(face['confidence']),
+            'bbox': f"{x1_crop},{y1_crop},{x2_crop},{y2_crop}"
+        }
+    )
+
+    print(f"[SUCCESS] Face {face_index} from {source_key} uploaded: s3://{FACES_BUCKET}/{face_key}")
+
+    return {
+        'face_number': face_index,
+        'detection_method': face['detection_method'],
+        'confidence': face['confidence'],
+        'bbox': face['bbox'],
+        's3_key': face_key,
+        'source_image': source_key
+    }
+
+
+def _collect_atlas_face(source_key: str, connection_id: str, face_index: int, face: dict):
+    """atlas 모드에서는 얼굴을 바로 올리지 않고 번호만 붙여 모아 둔다. 업로드는 _write_face_atlas에서 한 번에 한다."""
+    return {
+        'face_number': face_index,
+        'detection_method': face['detection_method'],
+        'confidence': face['confidence'],
+        'bbox': face['bbox'],
+        's3_key': f"{connection_id}/atlas.jpg",
+        'source_image': source_key,
+        'image': face['image']
+    }
+
+
+def _discard_faces(emit_face, faces):
+    """업로드 중 실패한 이미지에서 이미 올라간 얼굴을 지운다 (결과에 남지 않는 얼굴이 S3에 남지 않도록).
+
+    atlas 모드는 아직 올린 것이 없으므로 지울 것도 없다.
+    """
+    if emit_face is not _upload_face:
+        return
+    for face in faces:
+        try:
+            s3.delete_object(Bucket=FACES_BUCKET, Key=face['s3_key'])
+        except Exception as delete_error:
+            print(f"[WARNING] Failed to remove partial upload {face['s3_key']}: {delete_error}")
+
+
+def _image_result(object_key: str, start: int, last_index: int, faces):
+    return {
+        'source_key': object_key,
+        'faces_found': last_index - start,
+        'faces': faces,
+        'last_index': last_index
+    }
+
+
+def _error_result(object_key: str, error: Exception):
+    result = {
+        'source_key': object_key,
+        'faces_found': 0,
+        'faces': [],
+        'error': str(error)
+    }
+    if isinstance(error, StageSkipped):
+        result['skipped'] = True
+    elif isinstance(error, admission.Rejected):
+        result['rejected'] = error.reason
+        print(f"[WARNING] Skipping {object_key} ({error.reason}): {error}")
+    else:
+        print(f"[ERROR] Failed processing {object_key}: {error}")
+    return result
+
+
+def _process_images_sequentially(bucket: str, object_keys, connection_id: str, start_index: int = 0, emit_face=_upload_face,
+                                 deadline: Deadline = None, prepare=None):
+    """이미지를 하나씩 처리한다. 번호 규칙은 _process_images_concurrently와 같다."""
+    prepare = prepare or _prepare_image_faces
+    total_faces = start_index
+    processed_results = []
+
+    for object_key in object_keys:
+        try:
+            prepared = prepare(bucket, object_key, deadline)
+        except Exception as image_error:
+            processed_results.append(_error_result(object_key, image_error))
+            continue
+
+        start = total_faces
+        total_faces += len(prepared['faces'])
+        uploaded_faces = []
+        try:
+            for face_index, face in enumerate(prepared['faces'], start=start + 1):
+                uploaded_faces.append(emit_face(object_key, connection_id, face_index, face))
+        except Exception as upload_error:
+            _discard_faces(emit_face, uploaded_faces)
+            processed_results.append(_error_result(object_key, upload_error))
+            continue
+        processed_results.append(_image_result(object_key, start, total_faces, uploaded_faces))
+
+    return processed_results, total_faces
+
+
+def _process_images_concurrently(bucket: str, object_keys, connection_id: str, start_index: int, max_workers: int,
+                                 emit_face=_upload_face, deadline: Deadline = None, prepare=None):
+    """다운로드/검출/크롭과 업로드를 이미지 사이에서 겹쳐 실행한다.
+
+    얼굴 번호는 이미지가 끝나는 순서가 아니라 object_keys 순서대로 부여하므로
+    순차 처리와 같은 connectionId/N.jpg 번호가 나온다. 두 경로 모두 검출까지 실패한 이미지는 번호를 쓰지 않고,
+    번호가 부여된 뒤 업로드에 실패한 이미지는 에러 결과로 남기고 이미 올린 얼굴을 지운다
+    (그 번호는 다음 이미지에 재사용하지 않으므로 빈 번호가 생긴다).
+    """
+    prepare = prepare or _prepare_image_faces
+    total_faces = start_index
+    processed_results = []
+
+    # 업로드가 남은 다운로드 작업 뒤에 줄 서지 않도록 단계별로 풀을 나눈다
+    with ThreadPoolExecutor(max_workers=max_workers) as prepare_pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as upload_pool:
+        prepare_futures = [
+            prepare_pool.submit(prepare, bucket, object_key, deadline)
+            for object_key in object_keys
+        ]
+
+        # 1) key 순서대로 검출 결과를 받아 번호를 확정하고 업로드를 바로 제출
+        pending_uploads = []
+        for object_key, prepare_future in zip(object_keys, prepare_futures):
+            try:
+                prepared = prepare_future.result()
+            except Exception as image_error:
+                pending_uploads.append((object_key, None, image_error))
+                continue
+
+            start = total_faces
+            upload_futures = []
+            for face in prepared['faces']:
+                total_faces += 1
+                upload_futures.append(
+                    upload_pool.submit(emit_face, object_key, connection_id, total_faces, face)
+                )
+            pending_uploads.append((object_key, (start, total_faces, upload_futures), None))
+
+        # 2) 업로드 완료를 모아 순차 처리와 같은 형태의 결과를 만든다
+        for object_key, upload_state, image_error in pending_uploads:
+            if image_error is not None:
+                processed_results.append(_error_result(object_key, image_error))
+                continue
+
+            start, last_index, upload_futures = upload_state
+            uploaded_faces, upload_error = [], None
+            for future in upload_futures:
+                try:
+                    uploaded_faces.append(future.result())
+                except Exception as error:
+                    upload_error = upload_error or error
+            if upload_error is not None:
+                _discard_faces(emit_face, uploaded_faces)
+                processed_results.append(_error_result(object_key, upload_error))
+                continue
+
+            processed_results.append(_image_result(object_key, start, last_index, uploaded_faces))
+
+    return processed_results, total_faces
+
+
+def _process_images(bucket: str, object_keys, connection_id: str, start_index: int = 0, max_workers: int = MAX_WORKERS,
+                    emit_face=None, deadline: Deadline = None, prepare=None):
+    """prepare(bucket, key, deadline)는 기본으로 _prepare_image_faces이고, 미리 검출해 둔 결과를 넘길 때만 바꾼다."""
+    if emit_face is None:
+        emit_face = _collect_atlas_face if OUTPUT_MODE == 'atlas' else _upload_face
+    if max_workers > 1 and len(object_keys) > 1:
+        print(f"[INFO] Processing {len(object_keys)} images with {max_workers} workers")
+        return _process_images_concurrently(bucket, object_keys, connection_id, start_index, max_workers, emit_face,
+                                            deadline, prepare)
+    return _process_images_sequentially(bucket, object_keys, connection_id, start_index, emit_face, deadline, prepare)
+
+
+def _prepare_all(bucket: str, object_keys, deadline: Deadline = None, max_workers: int = MAX_WORKERS):
+    """번호를 정하기 전에 이미지마다 검출/크롭까지 해 둔다. {key: prepared 또는 그 이미지의 예외}."""
+    def prepare(object_key):
+        try:
+            return _prepare_image_faces(bucket, object_key, deadline)
+        except Exception as image_error:
+            return image_error
+
+    if not object_keys:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(object_keys)))) as pool:
+        return dict(zip(object_keys, pool.map(prepare, object_keys)))
+
+
+def _face_count(prepared):
+    return 0 if isinstance(prepared, Exception) else len(prepared['faces'])
+
+
+def _skipped_keys(processed_results):
+    return [result['source_key'] for result in processed_results if result.get('skipped')]
+
+
+def _load_face_atlas(connection_id: str):
+    try:
+        index_response = s3.get_object(Bucket=FACES_BUCKET, Key=f"{connection_id}/atlas.json")
+        index = json.loads(index_response['Body'].read())
+        # tiles_key가 없는 예전 인덱스만 JPEG atlas에서 자른다
+        atlas_response = s3.get_object(Bucket=FACES_BUCKET, Key=index.get('tiles_key') or index['atlas_key'])
+        atlas_image = Image.open(io.BytesIO(atlas_response['Body'].read()))
+        atlas_image.load()
+        return slice_atlas(atlas_image, index)
+    except Exception as load_error:
+        print(f"[WARNING] No previous atlas for {connection_id}: {load_error}")
+        return []
+
+
+def _write_face_atlas(connection_id: str, processed_results, include_previous: bool = False):
+    """모아 둔 얼굴을 atlas 한 장 + JSON 인덱스로 업로드하고, 결과에서 이미지 객체를 떼어 낸다."""
+    new_faces = []
+    for result in processed_results:
+        for face in result['faces']:
+            new_faces.append({
+                'face_number': face['face_number'],
+                'source_key': face['source_image'],
+                'bbox': face['bbox'],
+                'confidence': face['confidence'],
+                'image': face.pop('image')
+            })
+
+    if not new_faces:
+        return None
+
+    # 증분 모드에서는 이전 atlas의 얼굴을 앞에 두고 새 얼굴을 뒤에 이어 붙인다
+    previous_faces = _load_face_atlas(connection_id) if include_previous else []
+    new_numbers = {face['face_number'] for face in new_faces}
+    faces = [face for face in previous_faces if face['face_number'] not in new_numbers] + new_faces
+    faces.sort(key=lambda face: face['face_number'])
+
+    atlas_key = f"{connection_id}/atlas.jpg"
+    atlas_image, index = build_atlas(faces, connection_id, atlas_key, ATLAS_MAX_WIDTH, ATLAS_TILE_EDGE)
+
+    # 같은 배치를 무손실로도 올려 둔다. 다음 증분 호출은 이것을 잘라 쓰고 JPEG은 매번 여기서 한 번만 인코딩한다
+    index['tiles_key'] = f"{connection_id}/atlas.png"
+    tiles_buffer = io.BytesIO()
+    atlas_image.save(tiles_buffer, format='PNG', compress_level=3)
+    s3.put_object(
+        Bucket=FACES_BUCKET,
+        Key=index['tiles_key'],
+        Body=tiles_buffer.getvalue(),
+        ContentType='image/png',
+        Metadata={'connection-id': connection_id, 'face-count': str(len(faces))}
+    )
+
+    atlas_buffer = io.BytesIO()
+    atlas_image.save(atlas_buffer, format='JPEG', quality=90)
+    s3.put_object(
+        Bucket=FACES_BUCKET,
+        Key=atlas_key,
+        Body=atlas_buffer.getvalue(),
+        ContentType='image/jpeg',
+        Metadata={
+            'connection-id': connection_id,
+            'face-count': str(len(faces)),
+            'detection-method': detector_policy.name
+        }
+    )
+    s3.put_object(
+        Bucket=FACES_BUCKET,
+        Key=f"{connection_id}/atlas.json",
+        Body=json.dumps(index, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+    print(f"[SUCCESS] Atlas with {len(faces)} faces uploaded: s3://{FACES_BUCKET}/{atlas_key} ({index['width']}x{index['height']})")
+
+    rects = {face['face_number']: face['rect'] for face in index['faces']}
+    for result in processed_results:
+        for face in result['faces']:
+            face['atlas_rect'] = rects[face['face_number']]
+
+    return {'atlas_key': atlas_key, 'index_key': f"{connection_id}/atlas.json", 'face_count': len(faces)}
+
+
+def _handle_incremental(bucket: str, prefix: str, connection_id: str, object_entries, deadline: Deadline = None):
+    global manifest_store
+    if manifest_store is None:
+        manifest_store = _build_manifest_store()
+
+    manifest = manifest_store.load(connection_id)
+    start_index = manifest.get('last_index', 0)
+    pending = pending_entries(manifest, object_entries)
+    print(f"[INFO] Manifest for {connection_id}: last_index={start_index}, {len(pending)} new/changed, "
+          f"{len(object_entries) - len(pending)} already processed")
+
+    # 얼굴 수를 먼저 알아야 번호를 예약할 수 있으므로 검출/크롭을 업로드보다 먼저 끝낸다
+    prepared = _prepare_all(bucket, [entry['Key'] for entry in pending], deadline)
+
+    def reserve(current):
+        # 같은 connectionId의 다른 호출이 그 사이 처리한 이미지는 빼고, 남은 얼굴 수만큼 번호를 가져간다
+        still_pending = pending_entries(current, pending)
+        start = current.get('last_index', 0)
+        current['last_index'] = start + sum(_face_count(prepared[entry['Key']]) for entry in still_pending)
+        return start, still_pending
+
+    if any(_face_count(result) for result in prepared.values()):
+        manifest, (start_index, pending) = manifest_store.update(connection_id, reserve)
+        print(f"[INFO] Reserved face numbers {start_index + 1}..{manifest['last_index']} for {connection_id}")
+    skipped = len(object_entries) - len(pending)
+
+    def prepared_result(bucket_name, object_key, deadline=None):
+        result = prepared[object_key]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    processed_results, last_index = _process_images(
+        bucket, [entry['Key'] for entry in pending], connection_id, start_index=start_index, deadline=deadline,
+        prepare=prepared_result
+    )
+
+    atlas = _write_face_atlas(connection_id, processed_results, include_previous=True) if OUTPUT_MODE == 'atlas' else None
+
+    if pending:
+        manifest, _ = manifest_store.update(
+            connection_id, lambda current: record_results(current, pending, processed_results, last_index)
+        )
+
+    new_faces = sum(result['faces_found'] for result in processed_results)
+    print(f"[SUCCESS] {new_faces} new faces cropped from {len(pending)} images under {prefix} (last_index={manifest['last_index']})")
+
+    return {
+        "statusCode": 200,
+        "headers": cors_headers,
+        "body": {
+            "message": "Face cropping completed",
+            "connection_id": connection_id,
+            "faces_found": new_faces,
+            "last_index": manifest['last_index'],
+            "skipped_images": skipped,
+            "deferred_images": _skipped_keys(processed_results),
+            "detection_method": detector_policy.name,
+            "atlas": atlas,
+            "results": processed_results,
+            "stages": deadline.report() if deadline else None
+        }
     }
 
 
 def lambda_handler(event, context):
+    if detection_cache:
+        detection_cache.reset_stats()
+    # 만료된 검출 캐시 항목 지우기 (EventBridge 스케줄). 캐시 버킷은 이 스택 밖이라 lifecycle 규칙 대신 쓴다
+    if event.get('sweepDetectionCache'):
+        deleted = detection_cache.sweep() if detection_cache else 0
+        print(f"[METRIC] {json.dumps({'detectionCacheSweep': {'deleted': deleted}})}")
+        return {"deleted": deleted}
+    deadline = Deadline(context, minimums=STAGE_MINIMUMS)
     try:
         bucket, key = _extract_bucket_and_key(event)
         print(f"Processing file: s3://{bucket}/{key}")
@@ -160,7 +586,8 @@ def lambda_handler(event, context):
         connection_id = _extract_connection_id(key)
         prefix = f"{connection_id}/"
         print(f"Extracted connectionId: {connection_id}. Listing all objects under prefix {prefix}")
-        object_keys = _list_objects(bucket, prefix)
+        object_entries = _list_object_entries(bucket, prefix)
+        object_keys = [entry['Key'] for entry in object_entries]
 
         if not object_keys:
             print(f"[INFO] No objects found under {prefix}")
@@ -175,22 +602,11 @@ def lambda_handler(event, context):
                 })
             }
 
-        total_faces = 0
-        processed_results = []
+        if INCREMENTAL:
+            return _handle_incremental(bucket, prefix, connection_id, object_entries, deadline)
 
-        for object_key in object_keys:
-            try:
-                result = _crop_faces_from_image(bucket, object_key, connection_id, start_index=total_faces)
-                processed_results.append(result)
-                total_faces = result['last_index']
-            except Exception as image_error:
-                print(f"[ERROR] Failed processing {object_key}: {image_error}")
-                processed_results.append({
-                    'source_key': object_key,
-                    'faces_found': 0,
-                    'faces': [],
-                    'error': str(image_error)
-                })
+        processed_results, total_faces = _process_images(bucket, object_keys, connection_id, deadline=deadline)
+        atlas = _write_face_atlas(connection_id, processed_results) if OUTPUT_MODE == 'atlas' else None
 
         if total_faces == 0:
             print(f"[INFO] No faces detected for any images under {prefix}")
@@ -204,8 +620,11 @@ def lambda_handler(event, context):
                 "message": "Face cropping completed",
                 "connection_id": connection_id,
                 "faces_found": total_faces,
-                "detection_method": "aws-rekognition",
-                "results": processed_results
+                "deferred_images": _skipped_keys(processed_results),
+                "detection_method": detector_policy.name,
+                "atlas": atlas,
+                "results": processed_results,
+                "stages": deadline.report()
             }
         }
 
@@ -219,3 +638,6 @@ def lambda_handler(event, context):
                 "connection_id": connection_id if 'connection_id' in locals() else 'unknown'
             }
         }
+    finally:
+        if detection_cache:
+            detection_cache.log_stats()
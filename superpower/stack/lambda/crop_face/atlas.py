@@ -0,0 +1,120 @@
+import numpy as np
+from PIL import Image
+
+ATLAS_VERSION = 1
+
+
+def face_crop_boxes(face_details, image_width: int, image_height: int):
+    """Rekognition BoundingBox(비율 좌표) 목록을 여백 10%를 더한 픽셀 크롭 박스 (N, 4)로 한 번에 변환한다."""
+    if not face_details:
+        return np.empty((0, 4), dtype=np.int64)
+
+    relative = np.array(
+        [[f['BoundingBox']['Left'], f['BoundingBox']['Top'], f['BoundingBox']['Width'], f['BoundingBox']['Height']]
+         for f in face_details],
+        dtype=np.float64
+    )
+    scale = np.array([image_width, image_height, image_width, image_height], dtype=np.float64)
+    left, top, width, height = (relative * scale).astype(np.int64).T
+
+    margin = (np.minimum(width, height) * 0.1).astype(np.int64)
+    return np.stack([
+        np.maximum(0, left - margin),
+        np.maximum(0, top - margin),
+        np.minimum(image_width, left + width + margin),
+        np.minimum(image_height, top + height + margin),
+    ], axis=1)
+
+
+def crop_decode_scale(crop_boxes, min_edge: int) -> float:
+    """크롭 박스 (N, 4)가 모두 긴 변 min_edge 이상(원래 그보다 작으면 원래 크기) 남는 가장 작은 디코딩 배율 (0~1].
+
+    min_edge가 0 이하이거나 박스가 없으면 1.0 (원본 해상도).
+    """
+    boxes = np.asarray(crop_boxes, dtype=np.float64).reshape(-1, 4)
+    if min_edge <= 0 or len(boxes) == 0:
+        return 1.0
+    long_edges = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+    return float(np.minimum(1.0, min_edge / np.maximum(long_edges, 1)).max())
+
+
+def scale_boxes(crop_boxes, scale_x: float, scale_y: float):
+    """원본 좌표 크롭 박스 (N, 4)를 축소 디코딩한 이미지 좌표로 옮긴다 (빈 박스가 되지 않게 최소 1px)."""
+    boxes = np.asarray(crop_boxes, dtype=np.float64).reshape(-1, 4)
+    scaled = np.rint(boxes * np.array([scale_x, scale_y, scale_x, scale_y])).astype(np.int64)
+    scaled[:, 2] = np.maximum(scaled[:, 2], scaled[:, 0] + 1)
+    scaled[:, 3] = np.maximum(scaled[:, 3], scaled[:, 1] + 1)
+    return scaled
+
+
+def tile_sizes(sizes, max_edge: int):
+    """(N, 2) 얼굴 크기를 긴 변이 max_edge 이하가 되도록 비율 유지 축소한다."""
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    if max_edge <= 0 or len(sizes) == 0:
+        return sizes.astype(np.int64)
+    scale = np.minimum(1.0, max_edge / np.maximum(sizes.max(axis=1), 1))
+    return np.maximum(1, np.floor(sizes * scale[:, None])).astype(np.int64)
+
+
+def pack_shelves(sizes, max_width: int):
+    """타일을 입력 순서대로 왼쪽→오른쪽, 줄이 차면 아래로 쌓는다. (N, 2) 좌상단 좌표와 전체 크기를 돌려준다."""
+    positions = np.zeros((len(sizes), 2), dtype=np.int64)
+    x = y = shelf_height = atlas_width = 0
+    for i, (width, height) in enumerate(sizes):
+        if x > 0 and x + width > max_width:
+            y += shelf_height
+            x = shelf_height = 0
+        positions[i] = (x, y)
+        x += width
+        shelf_height = max(shelf_height, height)
+        atlas_width = max(atlas_width, x)
+    return positions, (int(atlas_width), int(y + shelf_height))
+
+
+def build_atlas(faces, connection_id: str, atlas_key: str, max_width: int, tile_edge: int):
+    """faces: face_number 순으로 정렬된 {'face_number', 'source_key', 'bbox', 'confidence', 'image'} 목록.
+
+    얼굴 타일을 한 장으로 합친 이미지와, 각 얼굴의 atlas 내 위치(rect=[x, y, w, h])를 담은 인덱스를 만든다.
+    """
+    sizes = tile_sizes([face['image'].size for face in faces], tile_edge)
+    positions, atlas_size = pack_shelves(sizes, max_width)
+
+    atlas_image = Image.new('RGB', (max(1, atlas_size[0]), max(1, atlas_size[1])))
+    index_faces = []
+    for face, (x, y), (width, height) in zip(faces, positions.tolist(), sizes.tolist()):
+        tile = face['image']
+        if tile.size != (width, height):
+            tile = tile.resize((width, height), Image.LANCZOS)
+        atlas_image.paste(tile.convert('RGB'), (x, y))
+        index_faces.append({
+            'face_number': face['face_number'],
+            'source_key': face['source_key'],
+            'bbox': face['bbox'],
+            'confidence': face['confidence'],
+            'rect': [x, y, width, height]
+        })
+
+    index = {
+        'version': ATLAS_VERSION,
+        'connection_id': connection_id,
+        'atlas_key': atlas_key,
+        'width': atlas_image.width,
+        'height': atlas_image.height,
+        'faces': index_faces
+    }
+    return atlas_image, index
+
+
+def slice_atlas(atlas_image, index: dict):
+    """기존 atlas를 다시 얼굴 타일 목록으로 되돌린다 (증분 모드에서 새 얼굴과 합칠 때 사용)."""
+    faces = []
+    for entry in index.get('faces', []):
+        x, y, width, height = entry['rect']
+        faces.append({
+            'face_number': entry['face_number'],
+            'source_key': entry['source_key'],
+            'bbox': entry['bbox'],
+            'confidence': entry['confidence'],
+            'image': atlas_image.crop((x, y, x + width, y + height))
+        })
+    return faces
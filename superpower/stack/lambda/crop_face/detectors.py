@@ -0,0 +1,190 @@
+"""crop_face 얼굴 검출 백엔드.
+
+모든 백엔드는 detect(image, image_data)로 Rekognition FaceDetails와 같은 모양
+([{'BoundingBox': {'Left', 'Top', 'Width', 'Height'}, 'Confidence'}], 비율 좌표)을 돌려준다.
+image는 Image.open()만 한 (아직 디코딩 전인) 원본, image_data는 원본 바이트다.
+"""
+import io
+import threading
+import time
+
+from PIL import Image
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:  # 로컬 검출기는 opencv-python-headless가 있을 때만 사용
+    cv2 = None
+
+REKOGNITION_MAX_BYTES = 5 * 1024 * 1024
+
+
+def build_jpeg_proxy(image, image_data: bytes, max_edge: int, max_bytes: int = REKOGNITION_MAX_BYTES) -> bytes:
+    """검출용 축소 JPEG을 만든다.
+
+    JPEG은 draft 모드로 DCT 단계에서 1/2~1/8로 줄여 디코딩하므로 원본 전체를
+    메모리에 풀지 않는다. 이미 충분히 작은 이미지는 원본 바이트를 그대로 쓴다.
+    """
+    width, height = image.size
+    if max_edge <= 0 or (max(width, height) <= max_edge and len(image_data) <= max_bytes):
+        return image_data
+
+    proxy = _downscale(image, max_edge, 'RGB')
+
+    quality = 85
+    while True:
+        buffer = io.BytesIO()
+        proxy.save(buffer, format='JPEG', quality=quality)
+        if buffer.tell() <= max_bytes or quality <= 40:
+            return buffer.getvalue()
+        quality -= 15
+
+
+def _downscale(image, max_edge: int, mode: str):
+    """긴 변이 max_edge 이하인 새 이미지를 돌려준다. 넘겨받은 이미지의 픽셀은 바꾸지 않는다.
+
+    아직 디코딩 전인 JPEG이면 draft로 필요한 만큼만 줄여 디코딩하도록 설정한다 (이후 image.size도 그 크기가 된다).
+    """
+    width, height = image.size
+    scale = min(1.0, max_edge / max(width, height))
+    target_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    image.draft(mode, target_size)
+    proxy = image if image.mode == mode else image.convert(mode)
+    if proxy.size != target_size:
+        return proxy.resize(target_size, Image.LANCZOS, reducing_gap=3.0)
+    return proxy.copy() if proxy is image else proxy
+
+
+class RekognitionDetector:
+    name = 'aws-rekognition'
+
+    def __init__(self, client, max_edge: int):
+        self.client = client
+        self.max_edge = max_edge
+        self.cache_tag = f"{self.name}:{max_edge}"
+
+    def detect(self, image, image_data: bytes):
+        detection_bytes = build_jpeg_proxy(image, image_data, self.max_edge)
+        response = self.client.detect_faces(
+            Image={'Bytes': detection_bytes},
+            Attributes=['DEFAULT']
+        )
+        print(f"[INFO] Rekognition request: {len(detection_bytes)} of {len(image_data)} bytes sent")
+        return [
+            {'BoundingBox': face['BoundingBox'], 'Confidence': face['Confidence']}
+            for face in response['FaceDetails']
+        ]
+
+
+class LocalFaceDetector:
+    """OpenCV Haar cascade로 프로세스 안에서 검출한다 (네트워크 호출 없음).
+
+    Haar cascade는 확률을 주지 않으므로 Confidence는 stage 가중치를 0~100으로 눌러 담은 근사값이다.
+    """
+
+    name = 'local-haar'
+
+    def __init__(self, max_edge: int = 800, scale_factor: float = 1.1, min_neighbors: int = 5):
+        self.max_edge = max_edge
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.cache_tag = f"{self.name}:{max_edge}:{scale_factor}:{min_neighbors}"
+        self._local = threading.local()
+
+    @property
+    def available(self) -> bool:
+        return cv2 is not None
+
+    def _classifier(self):
+        # CascadeClassifier는 스레드 간 공유가 안전하지 않아 스레드마다 하나씩 둔다
+        classifier = getattr(self._local, 'classifier', None)
+        if classifier is None:
+            classifier = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+            self._local.classifier = classifier
+        return classifier
+
+    def detect(self, image, image_data: bytes):
+        if cv2 is None:
+            raise RuntimeError("opencv-python-headless is not installed")
+
+        gray = _downscale(image, self.max_edge, 'L')
+        width, height = gray.size
+        pixels = cv2.equalizeHist(np.asarray(gray))
+
+        rects, _, weights = self._classifier().detectMultiScale3(
+            pixels,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            outputRejectLevels=True
+        )
+
+        faces = []
+        for (x, y, w, h), weight in zip(rects, weights):
+            faces.append({
+                'BoundingBox': {
+                    'Left': float(x) / width,
+                    'Top': float(y) / height,
+                    'Width': float(w) / width,
+                    'Height': float(h) / height
+                },
+                'Confidence': round(100.0 * float(weight) / (abs(float(weight)) + 1.0), 3) if weight > 0 else 0.0
+            })
+        return faces
+
+
+class DetectorPolicy:
+    """이미지마다 검출 백엔드를 고른다.
+
+    mode='rekognition' / 'local'은 고정, 'auto'는 작은 이미지(픽셀 수 ≤ local_max_pixels)이거나
+    최근 Rekognition 지연의 이동평균이 latency_threshold_ms를 넘으면 로컬 검출기를 쓴다.
+    지연 때문에 로컬로 돌린 동안에도 probe_every번에 한 번은 Rekognition을 불러 이동평균을 갱신한다.
+    """
+
+    def __init__(self, remote, local, mode: str = 'rekognition', local_max_pixels: int = 0,
+                 latency_threshold_ms: float = 0, smoothing: float = 0.2, probe_every: int = 10):
+        self.remote = remote
+        self.local = local
+        self.mode = mode
+        self.local_max_pixels = local_max_pixels
+        self.latency_threshold_ms = latency_threshold_ms
+        self.smoothing = smoothing
+        self.probe_every = probe_every
+        self.remote_latency_ms = None
+        self._diverted = 0
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        if self.mode == 'local':
+            return self.local.name
+        if self.mode == 'auto':
+            return 'auto'
+        return self.remote.name
+
+    def choose(self, width: int, height: int):
+        if self.mode == 'local':
+            return self.local
+        if self.mode != 'auto' or not self.local.available:
+            return self.remote
+        if self.local_max_pixels and width * height <= self.local_max_pixels:
+            return self.local
+        if self.latency_threshold_ms and self.remote_latency_ms is not None \
+                and self.remote_latency_ms > self.latency_threshold_ms:
+            with self._lock:
+                self._diverted += 1
+                if self._diverted % self.probe_every:
+                    return self.local
+        return self.remote
+
+    def detect(self, detector, image, image_data: bytes):
+        started = time.perf_counter()
+        faces = detector.detect(image, image_data)
+        if detector is self.remote:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                if self.remote_latency_ms is None:
+                    self.remote_latency_ms = elapsed_ms
+                else:
+                    self.remote_latency_ms += self.smoothing * (elapsed_ms - self.remote_latency_ms)
+        return faces
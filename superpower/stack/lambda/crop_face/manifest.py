@@ -0,0 +1,132 @@
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+MANIFEST_VERSION = 1
+# 다른 호출이 먼저 manifest를 고쳤을 때 다시 읽어 적용하는 최대 횟수
+UPDATE_ATTEMPTS = 8
+# S3 조건부 쓰기가 실패했을 때의 오류 코드 (412: ETag 불일치, 409: 같은 키에 동시 쓰기)
+_CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+
+class ManifestConflict(Exception):
+    """UPDATE_ATTEMPTS번 모두 다른 호출과 겹쳐 manifest를 고치지 못했다."""
+
+
+def empty_manifest(connection_id: str):
+    return {
+        'version': MANIFEST_VERSION,
+        'connection_id': connection_id,
+        'last_index': 0,
+        'processed': {}
+    }
+
+
+def pending_entries(manifest: dict, entries):
+    """manifest에 같은 ETag로 기록되지 않은 (새로 올라왔거나 바뀐) 객체만 돌려준다."""
+    processed = manifest.get('processed', {})
+    return [
+        entry for entry in entries
+        if processed.get(entry['Key'], {}).get('etag') != entry.get('ETag')
+    ]
+
+
+def record_results(manifest: dict, entries, processed_results, last_index: int):
+    """성공한 이미지만 manifest에 기록한다. 실패한 이미지는 다음 호출에서 다시 처리된다."""
+    etags = {entry['Key']: entry.get('ETag') for entry in entries}
+    for result in processed_results:
+        if 'error' in result:
+            continue
+        manifest['processed'][result['source_key']] = {
+            'etag': etags.get(result['source_key']),
+            'faces': [face['face_number'] for face in result['faces']]
+        }
+    manifest['last_index'] = max(manifest.get('last_index', 0), last_index)
+    return manifest
+
+
+class S3ManifestStore:
+    """manifest를 {bucket}/{prefix}{connectionId}.json 으로 보관한다.
+
+    같은 connectionId를 여러 호출(동시 업로드, Lambda 재시도)이 함께 고칠 수 있으므로 update()는
+    읽은 ETag와 같을 때만 쓰는 조건부 쓰기(IfMatch, 없던 객체는 IfNoneMatch='*')를 하고 겹치면 다시 읽는다.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str = '_manifests/'):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, connection_id: str) -> str:
+        return f"{self.prefix}{connection_id}.json"
+
+    def _load(self, connection_id: str):
+        """(manifest, ETag). 객체가 없으면 ETag는 None."""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self._key(connection_id))
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return empty_manifest(connection_id), None
+            raise
+        manifest = json.loads(response['Body'].read())
+        if manifest.get('version') != MANIFEST_VERSION:
+            print(f"[WARNING] Ignoring manifest with unknown version for {connection_id}")
+            return empty_manifest(connection_id), response.get('ETag')
+        return manifest, response.get('ETag')
+
+    def load(self, connection_id: str):
+        return self._load(connection_id)[0]
+
+    def save(self, connection_id: str, manifest: dict, **conditions):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._key(connection_id),
+            Body=json.dumps(manifest).encode('utf-8'),
+            ContentType='application/json',
+            **conditions
+        )
+
+    def update(self, connection_id: str, change, attempts: int = UPDATE_ATTEMPTS):
+        """manifest를 읽어 change(manifest)로 고치고, 그 사이 다른 호출이 쓰지 않았을 때만 저장한다.
+
+        겹치면 새로 읽은 manifest에 change를 다시 적용한다. (저장한 manifest, 마지막 change의 반환값)을 돌려준다.
+        """
+        for attempt in range(attempts):
+            manifest, etag = self._load(connection_id)
+            result = change(manifest)
+            try:
+                self.save(connection_id, manifest, **({'IfMatch': etag} if etag else {'IfNoneMatch': '*'}))
+                return manifest, result
+            except ClientError as error:
+                if error.response.get('Error', {}).get('Code') not in _CONFLICT_CODES:
+                    raise
+            print(f"[WARNING] Manifest for {connection_id} was updated concurrently, retrying ({attempt + 1}/{attempts})")
+            time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+        raise ManifestConflict(f"manifest for {connection_id} kept changing after {attempts} attempts")
+
+
+class InMemoryManifestStore:
+    """로컬 실행/테스트용. warm 컨테이너 안에서만 유지된다."""
+
+    def __init__(self):
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def load(self, connection_id: str):
+        manifest = self._manifests.get(connection_id)
+        if manifest is None:
+            return empty_manifest(connection_id)
+        return json.loads(json.dumps(manifest))
+
+    def save(self, connection_id: str, manifest: dict):
+        self._manifests[connection_id] = json.loads(json.dumps(manifest))
+
+    def update(self, connection_id: str, change, attempts: int = UPDATE_ATTEMPTS):
+        with self._lock:
+            manifest = self.load(connection_id)
+            result = change(manifest)
+            self.save(connection_id, manifest)
+        return manifest, result
@@ -2,6 +2,8 @@ import boto3
 import json
 import urllib.parse
 
+from sp_common.output_keys import RENDITION_FORMATS, parse_ladder, rendition_key, variant_key
+
 apigateway = boto3.client('apigatewaymanagementapi', 
                          endpoint_url='https://8eycp5n6sf.execute-api.ap-northeast-2.amazonaws.com/production/')
 s3 = boto3.client('s3', region_name='ap-northeast-2')
@@ -18,6 +20,32 @@ def lambda_handler(event, context):
         connection_id = path_parts[0]  # 폴더명이 connectionId로 사용됨
         file_name = path_parts[-1]     # 실제 파일명만 별도로 보관
         print(f"Extracted connectionId: {connection_id} from folder")
+
+        # make_pet이 여러 변형을 만들면 0번(원래 키)이 마지막에 저장되고 그 알림에 나머지 변형을 함께 싣는다
+        try:
+            obj_metadata = s3.head_object(Bucket=bucket, Key=object_key)
+            metadata = obj_metadata.get('Metadata', {})
+        except Exception as meta_error:
+            print(f"[WARNING] Could not get metadata: {meta_error}")
+            metadata = {}
+        if metadata.get('preview') == 'true':
+            print(f"[INFO] Preview of {metadata.get('variant-group')}, notification skipped (make_pet sends it over WebSocket)")
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "Preview object, notification skipped"})
+            }
+        if metadata.get('rendition'):
+            print(f"[INFO] Rendition {metadata['rendition']} of {metadata.get('variant-group')}, notification skipped")
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "Rendition object, notification skipped"})
+            }
+        if metadata.get('variant-index', '0') != '0':
+            print(f"[INFO] Variant {metadata['variant-index']} of {metadata.get('variant-group')}, notification skipped")
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "Variant object, notification skipped"})
+            }
         
         # 3. 완료된 파일에 대한 presigned URL 생성
         try:
@@ -32,14 +60,35 @@ def lambda_handler(event, context):
             presigned_url = None
         
         # 4. S3 메타데이터에서 AI 생성 정보 가져오기
-        try:
-            obj_metadata = s3.head_object(Bucket=bucket, Key=object_key)
-            ai_prompt = obj_metadata.get('Metadata', {}).get('ai-prompt', 'Unknown prompt')
-            generation_type = obj_metadata.get('Metadata', {}).get('generation-type', 'Unknown')
-        except Exception as meta_error:
-            print(f"[WARNING] Could not get metadata: {meta_error}")
-            ai_prompt = "Unknown prompt"
-            generation_type = "Unknown"
+        ai_prompt = metadata.get('ai-prompt', 'Unknown prompt')
+        generation_type = metadata.get('generation-type', 'Unknown')
+        variant_urls = []
+        for index in range(1, int(metadata.get('variant-count', '1'))):
+            try:
+                variant_urls.append(s3.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': bucket, 'Key': variant_key(object_key, index)},
+                    ExpiresIn=600
+                ))
+            except Exception as url_error:
+                print(f"[WARNING] Failed to generate presigned URL for variant {index}: {url_error}")
+
+        # 클라이언트가 화면에 맞는 크기/포맷만 받도록 전송용 사본 URL을 함께 알린다
+        renditions = []
+        for edge, fmt in parse_ladder(metadata.get('renditions', '')):
+            try:
+                renditions.append({
+                    "maxEdge": edge,
+                    "format": fmt,
+                    "contentType": RENDITION_FORMATS[fmt],
+                    "url": s3.generate_presigned_url(
+                        'get_object',
+                        Params={'Bucket': bucket, 'Key': rendition_key(object_key, edge, fmt)},
+                        ExpiresIn=600
+                    )
+                })
+            except Exception as url_error:
+                print(f"[WARNING] Failed to generate presigned URL for rendition {edge}:{fmt}: {url_error}")
 
         # 5. WebSocket으로 완료 메시지 전송
         message = {
@@ -49,6 +98,8 @@ def lambda_handler(event, context):
             "downloadUrl": presigned_url,
             "aiPrompt": ai_prompt,
             "generationType": generation_type,
+            "variantUrls": variant_urls,
+            "renditions": renditions,
             "reason": "업로드된 이미지를 Claude가 분석하여 Stable Diffusion 3.5 Large로 고품질 연관 이미지를 생성했습니다"
         }
 
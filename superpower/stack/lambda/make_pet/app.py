@@ -1,15 +1,198 @@
 import base64
+import hashlib
 import json
+import os
 import random
 import re
 import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import boto3
 
+from fallback_pool import S3FallbackPool
+from jobs import InMemoryJobStore, LambdaJobQueue, LocalJobQueue, S3JobStore, new_job, update_job
+from near_duplicates import S3NearDuplicateIndexStore, dhash
+from sp_common import admission, image_prep, vision
+from sp_common.bedrock_pool import RegionalBedrockPool, parse_model_regions, parse_regions
+from sp_common.cache import S3JsonStore, TieredCache, cache_key
+from sp_common.deadline import Deadline, StageSkipped, TimeoutClientPool, parse_budgets
+from sp_common.output_keys import format_ladder, parse_ladder, preview_key, rendition_key, variant_key
+from sp_common.progress import DEFAULT_WEBSOCKET_ENDPOINT, ProgressNotifier, connection_id_from_key
+from sp_common.rate_limit import RateLimiter, build_store, parse_limits
+from sp_common.renditions import render_ladder
+
 s3 = boto3.client('s3', region_name='ap-northeast-2')
-bedrock_nova = boto3.client("bedrock-runtime", region_name="us-east-1")
-bedrock_canvas = boto3.client("bedrock-runtime", region_name="us-east-1")
+# s3_read/upload 단계는 남은 예산을 read timeout으로 쓰는 클라이언트로 부른다 (기본 클라이언트는 60초 + 재시도)
+s3_timeout_clients = TimeoutClientPool('s3', 'ap-northeast-2')
+
+# Bedrock은 BEDROCK_REGIONS 중 지연/오류 점수가 좋은 리전으로 보내고, 스로틀이 나면 다음 리전으로 넘긴다.
+# BEDROCK_MODEL_REGIONS로 모델별 리전과 그 리전에서 쓸 id(교차 리전 inference profile 등)를 정한다.
+# BEDROCK_HEDGE_PERCENTILE(예: 0.95)을 주면 그 분위수보다 늦은 호출은 다음 리전에도 보낸다.
+BEDROCK_REGIONS = parse_regions(os.environ.get("BEDROCK_REGIONS"), "us-east-1")
+BEDROCK_MODEL_REGIONS = parse_model_regions(os.environ.get("BEDROCK_MODEL_REGIONS"))
+BEDROCK_HEDGE_PERCENTILE = float(os.environ.get("BEDROCK_HEDGE_PERCENTILE", "0")) or None
+
+# 리전/모델별 토큰 버킷 + 동시 호출 수 상한. 스로틀이 나면 속도를 줄이고 backoff 뒤에 재시도한다.
+# BEDROCK_RATE_LIMITS: {"<model id>": {"rate": 초당, "burst": 버킷 크기, "concurrency": 동시 호출}}
+# 상태 저장소 BEDROCK_LIMITER_STORE: dynamodb(BEDROCK_LIMITER_TABLE을 모든 컨테이너가 공유, 배포 기본값) |
+# memory(컨테이너별) | file(BEDROCK_LIMITER_DIR. Lambda의 /tmp는 컨테이너별이므로 로컬 실험용)
+BEDROCK_RATE_LIMIT_ENABLED = os.environ.get("BEDROCK_RATE_LIMIT_ENABLED", "true").lower() == "true"
+BEDROCK_RATE_LIMITS = parse_limits(os.environ.get("BEDROCK_RATE_LIMITS"))
+BEDROCK_LIMITER_STORE = os.environ.get("BEDROCK_LIMITER_STORE", "memory")
+BEDROCK_LIMITER_DIR = os.environ.get("BEDROCK_LIMITER_DIR", "/tmp/bedrock-limiter")
+BEDROCK_LIMITER_TABLE = os.environ.get("BEDROCK_LIMITER_TABLE")
+bedrock_limiter = RateLimiter(
+    build_store(BEDROCK_LIMITER_STORE, BEDROCK_LIMITER_DIR, BEDROCK_LIMITER_TABLE),
+    BEDROCK_RATE_LIMITS
+) if BEDROCK_RATE_LIMIT_ENABLED else None
+bedrock = RegionalBedrockPool(BEDROCK_REGIONS, BEDROCK_MODEL_REGIONS, hedge_percentile=BEDROCK_HEDGE_PERCENTILE,
+                              limiter=bedrock_limiter)
+
+# 단계별 최대 예산과, 이보다 남은 시간이 적으면 시작하지 않는 최소 시간 (ms)
+STAGE_BUDGETS = parse_budgets(os.environ.get("STAGE_BUDGETS_MS"), {
+    "s3_read": 5000, "analysis": 20000, "prompt": 10000, "generation": 30000,
+    "fallback_generation": 20000, "preview": 15000, "transcode": 3000, "upload": 5000,
+})
+STAGE_MINIMUMS = parse_budgets(os.environ.get("STAGE_MINIMUMS_MS"), {
+    "analysis": 4000, "prompt": 2000, "generation": 8000, "fallback_generation": 8000,
+    "preview": 4000, "transcode": 500, "upload": 1000,
+})
+
+# 업로드의 앞부분 ADMISSION_PROBE_BYTES만 먼저 받아 이미지가 아니거나 너무 큰(픽셀 수/바이트) 파일은 내려받기 전에 거른다
+ADMISSION_PROBE_BYTES = int(os.environ.get("ADMISSION_PROBE_BYTES", str(64 * 1024)))
+ADMISSION_MAX_PIXELS = int(os.environ.get("ADMISSION_MAX_PIXELS", "40000000"))
+ADMISSION_MAX_BYTES = int(os.environ.get("ADMISSION_MAX_BYTES", str(25 * 1024 * 1024)))
+
+# 업로드한 사용자의 WebSocket 연결로 단계/부분 분석 결과를 보낸다
+PROGRESS_ENABLED = os.environ.get("PROGRESS_ENABLED", "true").lower() == "true"
+PROGRESS_MIN_INTERVAL_MS = float(os.environ.get("PROGRESS_MIN_INTERVAL_MS", "400"))
+WEBSOCKET_ENDPOINT = os.environ.get("WEBSOCKET_ENDPOINT", DEFAULT_WEBSOCKET_ENDPOINT)
+apigateway = boto3.client("apigatewaymanagementapi", endpoint_url=WEBSOCKET_ENDPOINT) if PROGRESS_ENABLED else None
+
+# 분석(Nova Pro)을 스트리밍으로 받는다. 분석 텍스트가 STREAM_PROMPT_START_CHARS만큼 모이면
+# 나머지를 기다리지 않고 그 텍스트로 프롬프트 변환을 먼저 시작한다 (0이면 분석이 끝난 뒤 시작).
+STREAM_ANALYSIS = os.environ.get("STREAM_ANALYSIS", "true").lower() == "true"
+STREAM_PROMPT_START_CHARS = int(os.environ.get("STREAM_PROMPT_START_CHARS", "600"))
+prompt_executor = ThreadPoolExecutor(max_workers=2)
+
+ANALYSIS_MODEL_ID = vision.VISION_MODEL_ID
+CANVAS_MODEL_ID = "amazon.nova-canvas-v1:0"
+
+# two-stage의 1단계 분석은 analyzeSentiment와 같은 비전 분석(sp_common.vision)을 쓴다.
+# 펫 설명과 감정 점수를 한 번에 받아 vision 캐시에 두므로, 같은 업로드에 대해 두 함수 중 한쪽만 이미지를 분석한다.
+
+# 1. System Prompt에 명확한 JSON 스키마와 지시사항을 정의합니다.
+PROMPT_SYSTEM_INSTRUCTION = """
+            당신은 Nova Canvas를 위한 전문 프롬프트 엔지니어입니다.
+            사용자의 입력을 바탕으로 이미지 생성용 프롬프트를 작성하세요.
+
+            [제약 사항]
+            1. 스타일: SOFT_DIGITAL_PAINTING
+            2. 출력 형식: 오직 유효한 JSON 포맷으로만 응답하세요. Markdown, 코드 블록(```json), 기타 설명을 포함하지 마세요.
+            3. JSON 스키마:
+            {
+                "text": "영문으로 작성된 실제 이미지 생성 프롬프트 (1~2문장)",
+                "navigationText": "사용자에게 보여줄 한글 안내 문구 (매우 짧고 간결하게)"
+            }
+            """
+
+PROMPT_USER_TEMPLATE = (
+    "아래 분석 텍스트를 기반으로 캐릭터(아기 펫, 중앙 배치)를 포함한 프롬프트를 만들어줘.\n"
+    "분석 텍스트: {analyzed_prompt}"
+)
+
+# 단일 호출 모드: 이미지에서 바로 Canvas 프롬프트 JSON을 만든다 (Nova Pro 1회)
+SINGLE_CALL_INSTRUCTION = (
+    "성장형 게임에서 사용할 아기 펫 이미지를 생성하려고 한다. 전달된 이미지를 분석하고, "
+    "그것을 바탕으로 생성할 아기 펫(중앙 배치)을 구상한 뒤 위 JSON 스키마로만 응답해줘."
+)
+
+# two-stage: 분석 → 프롬프트 변환 (Nova Pro 2회, 기존 방식)
+# single: 이미지에서 바로 구조화된 프롬프트 (Nova Pro 1회)
+# ab: key 해시로 PROMPT_MODE_SINGLE_PERCENT 비율만 single로 보낸다
+PROMPT_MODE = os.environ.get("PROMPT_MODE", "two-stage")
+PROMPT_MODE_SINGLE_PERCENT = int(os.environ.get("PROMPT_MODE_SINGLE_PERCENT", "50"))
+PROMPT_MODES = ("two-stage", "single")
+
+# Nova Pro에 보내기 전 긴 변을 이 크기로 줄이고 실제 포맷을 알려준다
+MODEL_IMAGE_MAX_EDGE = int(os.environ.get("MODEL_IMAGE_MAX_EDGE", "1280"))
+
+# 한 번의 분석/프롬프트로 만들 변형 수 (요청의 variants가 우선, PET_MAX_VARIANTS까지)
+PET_VARIANTS = int(os.environ.get("PET_VARIANTS", "1"))
+PET_MAX_VARIANTS = int(os.environ.get("PET_MAX_VARIANTS", "8"))
+CANVAS_MAX_IMAGES_PER_CALL = 5
+CANVAS_MAX_SEED = 2147483646
+
+# 2단계 생성: 같은 프롬프트/seed로 작은 미리보기를 먼저 만들어 알리고, 최종 이미지는 동시에 생성한다
+PREVIEW_ENABLED = os.environ.get("PREVIEW_ENABLED", "false").lower() == "true"
+PREVIEW_SIZE = int(os.environ.get("PREVIEW_SIZE", "512"))
+
+# 모바일 클라이언트용 전송 사본: 0번 이미지를 한 번 디코딩해 '긴 변:포맷' 목록대로 만들어 옆에 저장한다 (빈 값이면 끔)
+PET_RENDITIONS = parse_ladder(os.environ.get("PET_RENDITIONS", "512:webp,256:webp,256:jpeg"))
+PET_RENDITION_QUALITY = int(os.environ.get("PET_RENDITION_QUALITY", "80"))
+
+FALLBACK_PROMPTS = [
+    "A creative artistic interpretation with vibrant colors",
+    "An abstract artistic version with modern style",
+    "A fantasy reimagining with magical elements",
+    "A minimalist artistic interpretation",
+    "A surreal artistic transformation"
+]
+FALLBACK_NEGATIVE_PROMPT = "real human baby, realistic adult features, extra limbs, distorted anatomy, scary expression, cluttered background"
+
+# 같은 이미지 바이트가 다시 올라오면 Nova Pro 두 번(분석 + 프롬프트 변환)을 건너뛰고 바로 Canvas로 간다.
+# 모델 ID나 지시문이 바뀌면 키가 달라지므로 이전 캐시는 자연히 무효화된다.
+PROMPT_CACHE_ENABLED = os.environ.get("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+PROMPT_CACHE_BUCKET = os.environ.get("PROMPT_CACHE_BUCKET", "sp-pet-cache-bucket")
+PROMPT_CACHE_ENTRIES = int(os.environ.get("PROMPT_CACHE_ENTRIES", "256"))
+PROMPT_CACHE_TTL = int(os.environ.get("PROMPT_CACHE_TTL", str(30 * 24 * 3600)))
+PROMPT_TEMPLATE_VERSIONS = {
+    "two-stage": cache_key(vision.VISION_VERSION, PROMPT_SYSTEM_INSTRUCTION, PROMPT_USER_TEMPLATE),
+    "single": cache_key(ANALYSIS_MODEL_ID, PROMPT_SYSTEM_INSTRUCTION, SINGLE_CALL_INSTRUCTION),
+}
+
+prompt_cache = TieredCache(
+    "prompt",
+    memory_entries=PROMPT_CACHE_ENTRIES,
+    ttl_seconds=PROMPT_CACHE_TTL,
+    persistent_store=S3JsonStore(s3, PROMPT_CACHE_BUCKET, "prompts/"),
+) if PROMPT_CACHE_ENABLED else None
+vision_cache = vision.build_vision_cache(s3, PROMPT_CACHE_BUCKET, PROMPT_CACHE_ENTRIES, PROMPT_CACHE_TTL) \
+    if PROMPT_CACHE_ENABLED else None
+
+# 재인코딩/리사이즈된 같은 사진은 perceptual hash 거리로 찾아 이전 분석/프롬프트(선택적으로 생성 이미지)를 재사용한다.
+# 재사용할 분석/프롬프트는 prompt_cache에서 꺼내므로 prompt 캐시가 켜져 있어야 동작한다.
+NEAR_DUP_ENABLED = os.environ.get("NEAR_DUP_ENABLED", "true").lower() == "true" and prompt_cache is not None
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get("NEAR_DUP_MAX_DISTANCE", "6"))
+NEAR_DUP_REUSE_IMAGE = os.environ.get("NEAR_DUP_REUSE_IMAGE", "false").lower() == "true"
+NEAR_DUP_REFRESH_SECONDS = int(os.environ.get("NEAR_DUP_REFRESH_SECONDS", "300"))
+
+# 분석 실패 경로는 미리 만들어 둔 이미지를 먼저 내준다 (비어 있을 때만 Canvas 실시간 생성).
+# 풀은 {"refillFallbackPool": true} 스케줄 호출이 프롬프트별 FALLBACK_POOL_TARGET장까지 채운다.
+FALLBACK_POOL_ENABLED = os.environ.get("FALLBACK_POOL_ENABLED", "true").lower() == "true"
+FALLBACK_POOL_BUCKET = os.environ.get("FALLBACK_POOL_BUCKET", PROMPT_CACHE_BUCKET)
+FALLBACK_POOL_TARGET = int(os.environ.get("FALLBACK_POOL_TARGET", "3"))
+FALLBACK_POOL_REFILL_WORKERS = int(os.environ.get("FALLBACK_POOL_REFILL_WORKERS", "4"))
+fallback_pool = S3FallbackPool(s3, FALLBACK_POOL_BUCKET, len(FALLBACK_PROMPTS)) if FALLBACK_POOL_ENABLED else None
+
+near_duplicate_store = S3NearDuplicateIndexStore(s3, PROMPT_CACHE_BUCKET)
+near_duplicate_index = None
+near_duplicate_loaded_at = 0.0
+# 인덱스 항목 쓰기는 응답을 기다리게 하지 않도록 백그라운드 스레드 하나에서 한다
+near_duplicate_writer = ThreadPoolExecutor(max_workers=1)
+
+# API Gateway 호출은 작업(job)만 등록하고 202 + jobId로 바로 돌려준다.
+# 실제 처리는 같은 함수를 비동기로 다시 호출해서(lambda) 또는 프로세스 안 스레드에서(local) 한다.
+JOB_MODE = os.environ.get("JOB_MODE", "async")
+JOB_QUEUE = os.environ.get("JOB_QUEUE", "lambda")
+JOB_STORE = os.environ.get("JOB_STORE", "s3")
+JOB_BUCKET = os.environ.get("JOB_BUCKET", PROMPT_CACHE_BUCKET)
+JOB_LOCAL_WORKERS = int(os.environ.get("JOB_LOCAL_WORKERS", "4"))
+JOB_FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "MakePetFunction")
+job_store = None
+job_queue = None
 
 cors_headers = {
     "Access-Control-Allow-Origin": "*",
@@ -68,243 +251,683 @@ def _safe_metadata_value(value, max_length=200):
     return ascii_only[:max_length]
 
 
-def lambda_handler(event, context):
+@contextmanager
+def _timed(timings, stage):
+    """with 블록 실행 시간을 timings[f"{stage}_ms"]에 누적한다."""
+    started = time.perf_counter()
     try:
-        # 1. 이벤트 유형에 따라 버킷 이름과 객체 키 추출 (EventBridge or API Gateway)
-        if "detail" in event:
-            bucket = event["detail"]["bucket"]["name"]
-            key = urllib.parse.unquote_plus(event["detail"]["object"]["key"])
-        else:
-            body = _parse_http_body(event)
-            query_params = event.get("queryStringParameters") or {}
-            bucket = body.get("bucket") or body.get("Bucket") or query_params.get("bucket")
-            key = body.get("key") or body.get("Key") or query_params.get("key")
-            if not bucket or not key:
-                return _error(400, "bucket과 key를 전달해야 합니다 (body 혹은 query)")
-        print(f"Processing file: s3://{bucket}/{key}")
+        yield
+    finally:
+        timings[f"{stage}_ms"] = timings.get(f"{stage}_ms", 0) + round((time.perf_counter() - started) * 1000, 1)
 
-        # 2. 업로드된 이미지 가져와서 분석
-        print(f"Analyzing uploaded image and generating related AI image...")
-        
-        # S3에서 업로드된 이미지 가져오기
-        response = s3.get_object(Bucket=bucket, Key=key)
-        original_image_data = response['Body'].read()
-        original_image_base64 = base64.b64encode(original_image_data).decode('utf-8')
-        
-        # 업로드된 이미지 분석 후 연관 이미지 생성
-        try:
-            start_time = time.time()
-            
-            # 1단계: Nova Pro를 사용해 이미지 분석 (us-east-1에서 호출)
-            analysis_request = {
-                "messages": [
+
+def _select_prompt_mode(key, requested=None):
+    if requested in PROMPT_MODES:
+        return requested
+    if PROMPT_MODE == "ab":
+        bucket = int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % 100
+        return "single" if bucket < PROMPT_MODE_SINGLE_PERCENT else "two-stage"
+    return PROMPT_MODE if PROMPT_MODE in PROMPT_MODES else "two-stage"
+
+
+def _repair_json_text(text):
+    """모델 응답을 JSON으로 읽을 수 있게 한 번만 손본다 (재호출 없음).
+
+    코드 블록 제거 → 첫 '{'부터 마지막 '}'까지 잘라내기 → 둥근 따옴표와 닫는 괄호 앞 쉼표 정리.
+    """
+    cleaned = text.strip()
+    cleaned = re.sub(r"^```(?:json)?\s*", "", cleaned)
+    cleaned = re.sub(r"\s*```$", "", cleaned)
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start != -1 and end > start:
+        cleaned = cleaned[start:end + 1]
+    cleaned = cleaned.replace("\u201c", '"').replace("\u201d", '"')
+    cleaned = re.sub(r",\s*([}\]])", r"\1", cleaned)
+    return cleaned
+
+
+def _parse_canvas_prompt(response_text):
+    """{"text": str, "navigationText": str} 스키마를 엄격하게 검사한다. 맞지 않으면 ValueError."""
+    try:
+        data = json.loads(response_text)
+    except json.JSONDecodeError:
+        data = json.loads(_repair_json_text(response_text))
+
+    if not isinstance(data, dict):
+        raise ValueError("Canvas prompt must be a JSON object")
+    text = data.get("text")
+    navigation_text = data.get("navigationText")
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError("Canvas prompt is missing 'text'")
+    if navigation_text is not None and not isinstance(navigation_text, str):
+        raise ValueError("Canvas prompt 'navigationText' must be a string")
+    return {"text": text.strip(), "navigationText": (navigation_text or "").strip()}
+
+
+def _reserve_ms(*stages):
+    """뒤에 올 단계들이 시작할 수 있도록 남겨 둘 시간."""
+    return sum(STAGE_MINIMUMS.get(stage, 0) for stage in stages)
+
+
+def _require_budget(deadline, stage, *later_stages):
+    """뒤 단계 몫을 남기고도 stage의 최소 시간이 안 되면 StageSkipped (호출하는 쪽은 대체 경로로 넘어간다)."""
+    if not deadline.allows(stage, _reserve_ms(*later_stages)):
+        raise StageSkipped(stage)
+
+
+def _invoke_nova_text(request, on_text=None, budget_ms=None):
+    """Nova Pro를 호출하고 첫 번째 텍스트 응답을 돌려준다.
+
+    on_text가 있고 STREAM_ANALYSIS가 켜져 있으면 스트리밍으로 받으며 지금까지 모인 텍스트로 on_text를 부른다.
+    budget_ms가 있으면 그 시간을 넘지 않는 read timeout으로 호출한다.
+    """
+    if on_text is not None and STREAM_ANALYSIS:
+        return _stream_nova_text(request, on_text, budget_ms)
+    response = bedrock.invoke_model(
+        budget_ms=budget_ms,
+        modelId=ANALYSIS_MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps(request)
+    )
+    result = json.loads(response["body"].read())
+    return result["output"]["message"]["content"][0]["text"].strip()
+
+
+def _stream_nova_text(request, on_text, budget_ms=None):
+    response = bedrock.invoke_model_with_response_stream(
+        budget_ms=budget_ms,
+        modelId=ANALYSIS_MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps(request)
+    )
+    text = ""
+    for event in response["body"]:
+        chunk = event.get("chunk")
+        if chunk is None:
+            # 스트림 도중 오류는 chunk 대신 *Exception 키로 온다
+            error_name = next((name for name in event if name.endswith("Exception")), None)
+            if error_name:
+                raise RuntimeError(f"Nova Pro stream failed: {error_name}: {event[error_name].get('message')}")
+            continue
+        delta = json.loads(chunk["bytes"]).get("contentBlockDelta", {}).get("delta", {}).get("text")
+        if delta:
+            text += delta
+            on_text(text)
+    return text.strip()
+
+
+def _analyze_image(image_base64, image_format="jpeg", on_text=None, budget_ms=None):
+    """1단계: Nova Pro 비전 분석 (BEDROCK_REGIONS 중 점수가 좋은 리전에서 호출).
+
+    {"description", "emotions"}를 돌려준다. on_text에는 지금까지 받은 원문 텍스트가 넘어간다.
+    """
+    response_text = _invoke_nova_text(vision.build_request(image_base64, image_format), on_text, budget_ms)
+    analysis = vision.parse_response(response_text)
+    if not analysis["description"]:
+        raise ValueError("Vision analysis returned no pet description")
+    return analysis
+
+
+def _build_canvas_prompt(analyzed_prompt, budget_ms=None):
+    """분석 텍스트를 Nova Canvas용 {"text", "navigationText"} JSON으로 바꾼다. 실패하면 예외를 올린다."""
+    llm_prompt_request = {
+        "system": [{"text": PROMPT_SYSTEM_INSTRUCTION}],
+        "messages": [
+            {
+                "role": "user",
+                "content": [
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "image": {
-                                    "format": "jpeg",
-                                    "source": {
-                                        "bytes": original_image_base64
-                                    }
-                                }
-                            },
-                            {
-                                "text": "성장형 게임에서 사용할 아기 펫 이미지를 생성하기 위해 전달 된 이미지를 분석 후 그것을 바탕으로 생성할 아기 펫에 대해 구체적으로 설명해줘"
-                            }
-                        ]
+                        "text": PROMPT_USER_TEMPLATE.format(analyzed_prompt=analyzed_prompt)
                     }
-                ]
+                ],
             }
-            
-            # Nova Pro로 이미지 분석
-            analysis_response = bedrock_nova.invoke_model(
-                modelId="amazon.nova-pro-v1:0",
-                contentType="application/json",
-                accept="application/json",
-                body=json.dumps(analysis_request)
-            )
-            
-            analysis_result = json.loads(analysis_response["body"].read())
-            analyzed_prompt = analysis_result["output"]["message"]["content"][0]["text"].strip()    
+        ],
+        # inferenceConfig를 통해 랜덤성을 줄여 구조적 안정성을 높입니다.
+        "inferenceConfig": {
+            "temperature": 0.0,  # 포맷 준수를 위해 0에 가깝게 설정
+            "topP": 0.9,
+            "maxTokens": 1000
+        }
+    }
 
-            # 1. System Prompt에 명확한 JSON 스키마와 지시사항을 정의합니다.
-            system_instruction = """
-            당신은 Nova Canvas를 위한 전문 프롬프트 엔지니어입니다.
-            사용자의 입력을 바탕으로 이미지 생성용 프롬프트를 작성하세요.
+    response_text = ""
+    try:
+        response_text = _invoke_nova_text(llm_prompt_request, budget_ms=budget_ms)
+        structured_data = _parse_canvas_prompt(response_text)
 
-            [제약 사항]
-            1. 스타일: SOFT_DIGITAL_PAINTING
-            2. 출력 형식: 오직 유효한 JSON 포맷으로만 응답하세요. Markdown, 코드 블록(```json), 기타 설명을 포함하지 마세요.
-            3. JSON 스키마:
-            {
-                "text": "영문으로 작성된 실제 이미지 생성 프롬프트 (1~2문장)",
-                "navigationText": "사용자에게 보여줄 한글 안내 문구 (매우 짧고 간결하게)"
-            }
-            """
+        print(f"[INFO] Text: {structured_data.get('text')}")
+        print(f"[INFO] Navigation: {structured_data.get('navigationText')}")
+        return structured_data
+
+    except (json.JSONDecodeError, ValueError):
+        print(f"[ERROR] 모델이 올바른 JSON을 반환하지 않았습니다. 응답: {response_text}")
+        raise
+    except Exception as transform_error:
+        print(f"[WARNING] 처리 중 오류 발생: {transform_error}")
+        raise
 
-            llm_prompt_request = {
-                "system": [{"text": system_instruction}],
-                "messages": [
+
+def _build_canvas_prompt_from_image(image_base64, image_format="jpeg", budget_ms=None):
+    """단일 호출 모드: 이미지에서 바로 Canvas 프롬프트 JSON을 만든다. 실패하면 예외를 올린다."""
+    request = {
+        "system": [{"text": PROMPT_SYSTEM_INSTRUCTION}],
+        "messages": [
+            {
+                "role": "user",
+                "content": [
                     {
-                        "role": "user",
-                        "content": [
-                            {
-                                "text": (
-                                    "아래 분석 텍스트를 기반으로 캐릭터(아기 펫, 중앙 배치)를 포함한 프롬프트를 만들어줘.\n"
-                                    f"분석 텍스트: {analyzed_prompt}"
-                                )
+                        "image": {
+                            "format": image_format,
+                            "source": {
+                                "bytes": image_base64
                             }
-                        ],
+                        }
+                    },
+                    {
+                        "text": SINGLE_CALL_INSTRUCTION
                     }
-                ],
-                # inferenceConfig를 통해 랜덤성을 줄여 구조적 안정성을 높입니다.
-                "inferenceConfig": {
-                    "temperature": 0.0,  # 포맷 준수를 위해 0에 가깝게 설정
-                    "topP": 0.9,
-                    "maxTokens": 1000
-                }
+                ]
             }
+        ],
+        "inferenceConfig": {
+            "temperature": 0.0,
+            "topP": 0.9,
+            "maxTokens": 1000
+        }
+    }
+
+    response_text = ""
+    try:
+        response_text = _invoke_nova_text(request, budget_ms=budget_ms)
+        structured_data = _parse_canvas_prompt(response_text)
+        print(f"[INFO] Text: {structured_data.get('text')}")
+        print(f"[INFO] Navigation: {structured_data.get('navigationText')}")
+        return structured_data
+    except (json.JSONDecodeError, ValueError):
+        print(f"[ERROR] 모델이 올바른 JSON을 반환하지 않았습니다. 응답: {response_text}")
+        raise
+
+
+def _load_near_duplicate_index():
+    """warm 컨테이너에서는 NEAR_DUP_REFRESH_SECONDS 동안 메모리 인덱스를 그대로 쓰고, 그 뒤에는 새 항목만 덧붙인다."""
+    global near_duplicate_index, near_duplicate_loaded_at
+    if near_duplicate_index is None or time.time() - near_duplicate_loaded_at > NEAR_DUP_REFRESH_SECONDS:
+        before = len(near_duplicate_index) if near_duplicate_index is not None else 0
+        near_duplicate_index = near_duplicate_store.load(near_duplicate_index)
+        near_duplicate_loaded_at = time.time()
+        print(f"[INFO] Near-duplicate index loaded: {len(near_duplicate_index)} entries (+{len(near_duplicate_index) - before})")
+    return near_duplicate_index
+
+
+def _find_near_duplicate(phash, template_version):
+    """가까운 이전 업로드의 (distance, record, cached_prompt)를 찾는다. 캐시가 만료된 항목은 건너뛴다."""
+    try:
+        match = _load_near_duplicate_index().search(phash, NEAR_DUP_MAX_DISTANCE)
+    except Exception as index_error:
+        print(f"[WARNING] Near-duplicate lookup failed: {index_error}")
+        return None
+    if match is None:
+        return None
+    distance, record = match
+    cached = prompt_cache.get(cache_key(record["content_hash"], template_version))
+    if cached is None:
+        return None
+    return distance, record, cached
+
+
+def _abandon_early_prompt(future):
+    """분석이 실패하면 미리 시작한 프롬프트 변환은 쓰지 않는다.
+
+    아직 시작 전이면 취소하고, 이미 Bedrock을 부르는 중이면 끝날 때 결과/예외를 버리도록 둔다 (호출 자체는 끊을 수 없다).
+    """
+    if future is None:
+        return
+    if future.cancel():
+        print("[INFO] Early prompt build cancelled because the analysis failed")
+        return
+
+    def discard(done):
+        if not done.cancelled() and done.exception() is not None:
+            print(f"[INFO] Ignored early prompt build error after failed analysis: {done.exception()}")
+
+    print("[INFO] Early prompt build already running; its result will be ignored")
+    future.add_done_callback(discard)
+
+
+def _analyze_and_build_prompt(image_base64, image_format, progress, prompt_info, timings, deadline):
+    """two-stage: 분석을 스트리밍으로 받으면서 부분 분석을 보내고, 충분히 모이면 프롬프트 변환을 먼저 시작한다.
 
+    설명 뒤에 감정 JSON이 오기 시작하면 설명은 끝난 것이므로 글자 수와 상관없이 프롬프트 변환을 시작한다.
+    """
+    early = {}
+
+    def on_text(text):
+        description = vision.description_of(text)
+        progress.partial("analysis", description)
+        description_done = vision.EMOTIONS_MARKER in text
+        if "future" not in early and (description_done or 0 < STREAM_PROMPT_START_CHARS <= len(description)):
+            budget = deadline.budget_ms("prompt", _reserve_ms("generation", "upload"))
+            early["future"] = prompt_executor.submit(_build_canvas_prompt, description, budget)
+            progress.send("prompt")
+
+    _require_budget(deadline, "analysis", "prompt", "generation", "upload")
+    try:
+        with _timed(timings, "analysis"), deadline.run("analysis", _reserve_ms("prompt", "generation", "upload")) as budget:
+            analysis = _analyze_image(image_base64, image_format, on_text, budget)
+    except Exception:
+        _abandon_early_prompt(early.get("future"))
+        raise
+    if vision_cache and vision.cacheable(analysis):
+        vision_cache.put(vision.vision_cache_key(prompt_info["content_hash"]), analysis)
+    analyzed_prompt = analysis["description"]
+
+    structured_data = None
+    with _timed(timings, "prompt"):
+        if "future" in early:
             try:
-                llm_response = bedrock_nova.invoke_model(
-                    modelId="amazon.nova-pro-v1:0",
-                    contentType="application/json",
-                    accept="application/json",
-                    body=json.dumps(llm_prompt_request),
-                )
-                
-                llm_result = json.loads(llm_response["body"].read())
-                response_text = llm_result["output"]["message"]["content"][0]["text"].strip()
-                
-                # [중요] 응답이 혹시 마크다운 코드블록(```json ...)으로 감싸져 있을 경우를 대비한 클린업
-                if response_text.startswith("```json"):
-                    response_text = response_text.replace("```json", "").replace("```", "").strip()
-                elif response_text.startswith("```"):
-                    response_text = response_text.replace("```", "").strip()
-
-                # 문자열을 JSON 객체로 파싱
-                structured_data = json.loads(response_text)
-                
-                print(f"[INFO] Text: {structured_data.get('text')}")
-                print(f"[INFO] Navigation: {structured_data.get('navigationText')}")
-
-            except json.JSONDecodeError:
-                print(f"[ERROR] 모델이 올바른 JSON을 반환하지 않았습니다. 응답: {response_text}")
-            except Exception as transform_error:
-                print(f"[WARNING] 처리 중 오류 발생: {transform_error}")
-
-
-            # 2단계: 분석 결과를 바탕으로 Nova Canvas로 연관 이미지 생성
-            canvas_request = {
-                "taskType": "TEXT_IMAGE",
-                "textToImageParams": {
-                    "text": structured_data.get('text'),
-                    "negativeText": structured_data.get('navigationText'),
-                    "style": "SOFT_DIGITAL_PAINTING",
-                },
-                "imageGenerationConfig": {
-                    "numberOfImages": 1,
-                    "width": 1024,
-                    "height": 1024
-                }
+                structured_data = early["future"].result()
+                prompt_info["early_prompt"] = True
+            except Exception as early_error:
+                print(f"[WARNING] Early prompt build failed, retrying with full analysis: {early_error}")
+        if structured_data is None:
+            _require_budget(deadline, "prompt", "generation", "upload")
+            progress.send("prompt")
+            with deadline.run("prompt", _reserve_ms("generation", "upload")) as budget:
+                structured_data = _build_canvas_prompt(analyzed_prompt, budget)
+    return analyzed_prompt, structured_data
+
+
+def _get_canvas_prompt(image_bytes, mode="two-stage", timings=None, progress=None, deadline=None):
+    """정확히 같은 이미지 → 비슷한 이미지 → 모델 호출 순서로 분석/프롬프트를 얻는다.
+
+    {"analysis", "prompt", "source", "content_hash", "phash", "reuse_record", "image_prep", "early_prompt"}를 돌려준다.
+    모델 호출 단계별 소요 시간은 timings에 기록한다 (preprocess_ms, analysis_ms, prompt_ms).
+    progress(ProgressNotifier)가 있으면 단계와 부분 분석 텍스트를 보낸다.
+    deadline의 남은 시간이 모자라 모델 호출을 시작할 수 없으면 StageSkipped를 올린다.
+    """
+    timings = {} if timings is None else timings
+    progress = ProgressNotifier() if progress is None else progress
+    deadline = Deadline() if deadline is None else deadline
+    template_version = PROMPT_TEMPLATE_VERSIONS[mode]
+    content_hash = vision.content_hash(image_bytes)
+    prompt_cache_key = cache_key(content_hash, template_version)
+    prompt_info = {"content_hash": content_hash, "phash": None, "reuse_record": None, "image_prep": None,
+                   "early_prompt": False}
+
+    cached = prompt_cache.get(prompt_cache_key) if prompt_cache else None
+    if cached is not None:
+        print(f"[INFO] Prompt cache hit, skipping Nova Pro analysis: {cached['prompt'].get('text')}")
+        return dict(prompt_info, analysis=cached["analysis"], prompt=cached["prompt"], source="cache")
+
+    if NEAR_DUP_ENABLED:
+        try:
+            prompt_info["phash"] = dhash(image_bytes)
+        except Exception as hash_error:
+            print(f"[WARNING] Perceptual hash failed: {hash_error}")
+        near = _find_near_duplicate(prompt_info["phash"], template_version) if prompt_info["phash"] is not None else None
+        if near is not None:
+            distance, record, near_cached = near
+            print(f"[INFO] Near-duplicate of {record['content_hash'][:12]} (distance {distance}), reusing analysis and prompt")
+            # 다음에 같은 바이트가 오면 정확히 일치하는 캐시로 바로 찾도록 이 이미지 키로도 저장한다
+            prompt_cache.put(prompt_cache_key, near_cached)
+            return dict(prompt_info, analysis=near_cached["analysis"], prompt=near_cached["prompt"],
+                        source="near-duplicate", reuse_record=record)
+
+    # analyzeSentiment가 이미 이 이미지를 분석했으면 이미지 분석 없이 설명에서 바로 프롬프트를 만든다
+    shared = vision_cache.get(vision.vision_cache_key(content_hash)) if vision_cache else None
+    if shared is not None:
+        print("[INFO] Vision analysis cache hit, skipping Nova Pro image analysis")
+        progress.send("prompt")
+        _require_budget(deadline, "prompt", "generation", "upload")
+        with _timed(timings, "prompt"), deadline.run("prompt", _reserve_ms("generation", "upload")) as budget:
+            structured_data = _build_canvas_prompt(shared["description"], budget)
+        analyzed_prompt, source = shared["description"], "vision-cache"
+    else:
+        with _timed(timings, "preprocess"):
+            prepared = image_prep.prepare_for_model(image_bytes, MODEL_IMAGE_MAX_EDGE)
+            image_base64 = base64.b64encode(prepared["bytes"]).decode('utf-8')
+        print(f"[INFO] Image prep: {image_prep.describe(prepared)}")
+        prompt_info["image_prep"] = {k: prepared[k] for k in ("original_format", "format", "original_bytes", "prepared_bytes", "saved_bytes")}
+
+        progress.send("analysis")
+        if mode == "single":
+            _require_budget(deadline, "prompt", "generation", "upload")
+            with _timed(timings, "prompt"), deadline.run("prompt", _reserve_ms("generation", "upload")) as budget:
+                structured_data = _build_canvas_prompt_from_image(image_base64, prepared["format"], budget)
+            analyzed_prompt = structured_data["text"]
+        else:
+            analyzed_prompt, structured_data = _analyze_and_build_prompt(
+                image_base64, prepared["format"], progress, prompt_info, timings, deadline)
+        source = "model"
+
+    # 생성에 쓸 수 없는 응답은 캐시하지 않는다
+    if prompt_cache and isinstance(structured_data, dict) and structured_data.get("text"):
+        prompt_cache.put(prompt_cache_key, {"analysis": analyzed_prompt, "prompt": structured_data})
+    return dict(prompt_info, analysis=analyzed_prompt, prompt=structured_data, source=source)
+
+
+def _load_reused_image(record):
+    """NEAR_DUP_REUSE_IMAGE일 때 비슷한 이전 업로드의 생성 이미지를 가져온다. 없으면 None."""
+    if not NEAR_DUP_REUSE_IMAGE or not record or not record.get("generated_key"):
+        return None
+    try:
+        response = s3.get_object(Bucket='sp-complete-bucket', Key=record["generated_key"])
+        print(f"[INFO] Reusing generated image sp-complete-bucket/{record['generated_key']}")
+        return response['Body'].read()
+    except Exception as reuse_error:
+        print(f"[WARNING] Could not reuse generated image {record['generated_key']}: {reuse_error}")
+        return None
+
+
+def _remember_near_duplicate(prompt_info, generated_key):
+    """생성에 성공한 업로드를 인덱스에 추가한다.
+
+    메모리 인덱스에는 바로 넣고, S3 항목 객체는 백그라운드로 쓴다 (돌려준 future는 테스트/벤치마크용).
+    Lambda가 응답 뒤 컨테이너를 얼리면 쓰기는 다음 호출 때 이어지고, 컨테이너가 회수되면 그 항목만 빠진다 (캐시 용도).
+    """
+    if not NEAR_DUP_ENABLED or prompt_info.get("phash") is None:
+        return None
+    record = {"content_hash": prompt_info["content_hash"], "generated_key": generated_key}
+    if near_duplicate_index is not None:
+        near_duplicate_store.remember(near_duplicate_index, prompt_info["phash"], record)
+
+    def append():
+        try:
+            near_duplicate_store.append(prompt_info["phash"], record)
+        except Exception as index_error:
+            print(f"[WARNING] Failed to update near-duplicate index: {index_error}")
+
+    return near_duplicate_writer.submit(append)
+
+
+def _extract_canvas_images(canvas_result):
+    """Canvas 응답에서 base64 이미지 목록을 꺼낸다 (응답 모양이 조금씩 달라도 처리)."""
+    base64_images = canvas_result.get("images") or canvas_result.get("image") or []
+    if not isinstance(base64_images, list):
+        base64_images = [base64_images]
+    extracted = []
+    for item in base64_images:
+        if isinstance(item, dict):
+            item = item.get("base64") or item.get("image") or item.get("data")
+        if item:
+            extracted.append(item)
+    return extracted
+
+
+def _invoke_canvas(text, negative_text, number_of_images=1, seed=None,
+                   error_message="Nova Canvas response did not include an image", size=1024, budget_ms=None):
+    """Nova Canvas로 size x size 이미지를 number_of_images장 만든다 (Nova Canvas를 제공하는 리전은 BEDROCK_MODEL_REGIONS로 정한다)."""
+    canvas_request = {
+        "taskType": "TEXT_IMAGE",
+        "textToImageParams": {
+            "text": text,
+            "negativeText": negative_text,
+            "style": "SOFT_DIGITAL_PAINTING",
+        },
+        "imageGenerationConfig": {
+            "numberOfImages": number_of_images,
+            "width": size,
+            "height": size
+        }
+    }
+    # Canvas는 빈 negativeText를 받지 않는다
+    if not negative_text:
+        del canvas_request["textToImageParams"]["negativeText"]
+    if seed is not None:
+        canvas_request["imageGenerationConfig"]["seed"] = seed
+
+    canvas_response = bedrock.invoke_model(
+        budget_ms=budget_ms,
+        modelId=CANVAS_MODEL_ID,
+        contentType="application/json",
+        accept="application/json",
+        body=json.dumps(canvas_request)
+    )
+
+    canvas_result = json.loads(canvas_response["body"].read())
+    base64_images = _extract_canvas_images(canvas_result)
+    if not base64_images:
+        raise ValueError(error_message)
+    return [base64.b64decode(image) for image in base64_images]
+
+
+def _generate_image(text, negative_text, error_message="Nova Canvas response did not include an image", budget_ms=None):
+    return _invoke_canvas(text, negative_text, error_message=error_message, budget_ms=budget_ms)[0]
+
+
+def _generate_variants(text, negative_text, count, seed, budget_ms=None):
+    """같은 프롬프트로 count장을 만든다.
+
+    Canvas 한 번에 CANVAS_MAX_IMAGES_PER_CALL장까지 요청하고, 그보다 많으면 seed를 하나씩 바꾼 호출을 병렬로 보낸다.
+    """
+    batch_sizes = [min(CANVAS_MAX_IMAGES_PER_CALL, count - start) for start in range(0, count, CANVAS_MAX_IMAGES_PER_CALL)]
+    if len(batch_sizes) == 1:
+        return _invoke_canvas(text, negative_text, count, seed, budget_ms=budget_ms)
+    with ThreadPoolExecutor(max_workers=len(batch_sizes)) as pool:
+        futures = [
+            pool.submit(_invoke_canvas, text, negative_text, size, (seed + i) % CANVAS_MAX_SEED, budget_ms=budget_ms)
+            for i, size in enumerate(batch_sizes)
+        ]
+        return [image for future in futures for image in future.result()]
+
+
+def _publish_preview(key, text, negative_text, seed, progress, timings, invocation_start, deadline=None):
+    """작은 미리보기를 만들어 sp-complete-bucket에 두고 presigned URL을 WebSocket으로 보낸다.
+
+    미리보기 객체에는 preview 메타데이터가 붙어 image_complete가 완료 알림을 보내지 않는다.
+    실패해도 최종 이미지 생성에는 영향을 주지 않는다.
+    """
+    try:
+        with (deadline or Deadline()).run("preview", _reserve_ms("upload")) as budget:
+            image = _invoke_canvas(text, negative_text, 1, seed, size=PREVIEW_SIZE, budget_ms=budget)[0]
+        s3.put_object(
+            Bucket='sp-complete-bucket',
+            Key=preview_key(key),
+            Body=image,
+            ContentType='image/png',
+            Metadata={'preview': 'true', 'variant-group': _safe_metadata_value(key)}
+        )
+        url = s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': 'sp-complete-bucket', 'Key': preview_key(key)},
+            ExpiresIn=600
+        )
+        timings["time_to_preview_ms"] = round((time.perf_counter() - invocation_start) * 1000, 1)
+        progress.send("preview", previewUrl=url, size=PREVIEW_SIZE)
+        print(f"[INFO] Preview published to sp-complete-bucket/{preview_key(key)} in {timings['time_to_preview_ms']}ms")
+        return preview_key(key)
+    except Exception as preview_error:
+        print(f"[WARNING] Preview generation failed: {preview_error}")
+        return None
+
+
+def _render_outputs(image_data):
+    """0번 이미지의 전송용 사본을 만든다. 실패하면 원본 PNG만 저장되도록 빈 목록을 돌려준다."""
+    if not PET_RENDITIONS:
+        return []
+    try:
+        return render_ladder(image_data, PET_RENDITIONS, PET_RENDITION_QUALITY)
+    except Exception as render_error:
+        print(f"[WARNING] Rendition transcoding failed: {render_error}")
+        return []
+
+
+def _s3_for(budget_ms):
+    """예산이 있으면 그 안에 끝나는 timeout의 S3 클라이언트, 없으면 (로컬 실행) 기본 클라이언트."""
+    return s3 if budget_ms is None else s3_timeout_clients.get(budget_ms)
+
+
+def _save_generated_images(key, images, metadata, renditions=(), budget_ms=None):
+    """변형들을 variant_key 위치에, 전송용 사본을 rendition_key 위치에 저장한다.
+
+    image_complete는 sp-complete-bucket의 새 객체마다 알림을 보내므로 0번(원래 키)을 마지막에 써서
+    알림 시점에 나머지 변형과 사본이 모두 있게 한다. 변형/사본 객체에는 variant-index/rendition이 붙어
+    image_complete가 건너뛰고, 0번의 renditions 메타데이터로 사본 목록을 알린다.
+    budget_ms가 있으면 각 PUT을 그 안에 끝나는 timeout으로 부른다.
+    """
+    client = _s3_for(budget_ms)
+
+    def put_rendition(rendition):
+        client.put_object(
+            Bucket='sp-complete-bucket',
+            Key=rendition_key(key, rendition['edge'], rendition['format']),
+            Body=rendition['bytes'],
+            ContentType=rendition['content_type'],
+            Metadata={
+                'rendition': f"{rendition['edge']}:{rendition['format']}",
+                'variant-group': _safe_metadata_value(key),
             }
-            
-            # Nova Canvas는 us-east-1에서 제공됨
-            canvas_response = bedrock_canvas.invoke_model(
-                modelId="amazon.nova-canvas-v1:0",
-                contentType="application/json",
-                accept="application/json",
-                body=json.dumps(canvas_request)
-            )
-            
-            canvas_result = json.loads(canvas_response["body"].read())
-            base64_image_data = canvas_result.get("images") or canvas_result.get("image")
-            if isinstance(base64_image_data, list):
-                first_image = base64_image_data[0] if base64_image_data else None
-                if isinstance(first_image, dict):
-                    base64_image_data = first_image.get("base64") or first_image.get("image") or first_image.get("data")
-                else:
-                    base64_image_data = first_image
-            elif isinstance(base64_image_data, dict):
-                base64_image_data = base64_image_data.get("base64") or base64_image_data.get("image") or base64_image_data.get("data")
-            if not base64_image_data:
-                raise ValueError("Nova Canvas response did not include an image")
-            generated_image_data = base64.b64decode(base64_image_data)
+        )
+
+    def put(index):
+        object_metadata = dict(metadata, **{
+            'variant-index': str(index),
+            'variant-count': str(len(images)),
+            'variant-group': _safe_metadata_value(key),
+        })
+        if index == 0 and renditions:
+            object_metadata['renditions'] = format_ladder((r['edge'], r['format']) for r in renditions)
+        client.put_object(
+            Bucket='sp-complete-bucket',
+            Key=variant_key(key, index),
+            Body=images[index],
+            ContentType='image/png',
+            Metadata=object_metadata
+        )
+
+    if len(images) > 1 or renditions:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [pool.submit(put, index) for index in range(1, len(images))]
+            futures += [pool.submit(put_rendition, rendition) for rendition in renditions]
+            for future in futures:
+                future.result()
+    put(0)
+    return [variant_key(key, index) for index in range(len(images))]
+
+
+def _read_upload(bucket, key, progress, budget_ms=None):
+    """헤더를 먼저 확인하고 업로드 이미지를 받는다. 거른 경우 진행 상황으로 알리고 admission.Rejected를 올린다."""
+    client = _s3_for(budget_ms)
+    try:
+        admitted = admission.admit(client, bucket, key, ADMISSION_PROBE_BYTES, max_pixels=ADMISSION_MAX_PIXELS,
+                                   max_bytes=ADMISSION_MAX_BYTES, formats=admission.MODEL_INPUT_FORMATS)
+    except admission.Rejected as rejected:
+        print(f"[WARNING] Upload rejected before download ({rejected.reason}): {rejected}")
+        progress.send("rejected", reason=rejected.reason)
+        raise
+    if admitted["body"] is not None:
+        return admitted["body"]
+    return client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+
+def _process_upload(bucket, key, prompt_mode, connection_id=None, job_id=None, variants=1, preview=False,
+                    deadline=None):
+    """업로드 이미지 하나로 펫 이미지를 만들어 sp-complete-bucket에 저장하고 응답 payload를 돌려준다.
+
+    variants > 1이면 분석/프롬프트는 한 번만 하고 Canvas에서 variants장을 받아 variant_key 위치에 저장한다.
+    preview면 최종 이미지와 같은 프롬프트/seed로 PREVIEW_SIZE 미리보기를 병렬로 만들어 먼저 알린다.
+    deadline(Lambda 남은 시간)이 모자라면 분석/생성을 건너뛰고 fallback으로, 미리보기/전송용 사본은 생략한다.
+    """
+    print(f"Processing file: s3://{bucket}/{key}")
+    deadline = Deadline() if deadline is None else deadline
+    timings = {}
+    invocation_start = time.perf_counter()
+    progress = ProgressNotifier(apigateway, connection_id or connection_id_from_key(key), key.split('/')[-1],
+                                PROGRESS_MIN_INTERVAL_MS, extra={"jobId": job_id} if job_id else None)
+    try:
+        progress.send("received")
+
+        # 2. 업로드된 이미지 가져와서 분석
+        print(f"Analyzing uploaded image and generating related AI image...")
+        
+        # S3에서 업로드된 이미지 가져오기
+        with _timed(timings, "s3_read"), deadline.run("s3_read", _reserve_ms("upload")) as budget:
+            original_image_data = _read_upload(bucket, key, progress, budget)
+        
+        # 업로드된 이미지 분석 후 연관 이미지 생성
+        generated_from_prompt = False
+        published_preview = None
+        try:
+            start_time = time.time()
+
+            prompt_info = _get_canvas_prompt(original_image_data, prompt_mode, timings, progress, deadline)
+            structured_data = prompt_info["prompt"]
+            progress.send("generation", navigationText=structured_data.get('navigationText'), variants=variants)
+
+            # 2단계: 분석 결과를 바탕으로 Nova Canvas로 연관 이미지 생성 (비슷한 이전 업로드의 이미지를 재사용할 수 있으면 생략)
+            reused_image = _load_reused_image(prompt_info["reuse_record"]) if variants == 1 else None
+            if reused_image is not None:
+                generated_images = [reused_image]
+            else:
+                # 같은 업로드는 같은 seed → 같은 변형 묶음
+                seed = int(prompt_info["content_hash"][:8], 16) % CANVAS_MAX_SEED
+                _require_budget(deadline, "generation", "upload")
+                preview_future = None
+                if preview and deadline.allows("preview", _reserve_ms("upload")):
+                    preview_future = prompt_executor.submit(
+                        _publish_preview, key, structured_data.get('text'), structured_data.get('navigationText'),
+                        seed, progress, timings, invocation_start, deadline)
+                with _timed(timings, "generation"), deadline.run("generation", _reserve_ms("upload")) as budget:
+                    generated_images = _generate_variants(
+                        structured_data.get('text'), structured_data.get('navigationText'), variants, seed, budget)
+                if preview_future is not None:
+                    published_preview = preview_future.result()
             
             generation_time = time.time() - start_time
             print(f"[SUCCESS] Related AI image generated with Nova Canvas in {generation_time:.2f} seconds")
             
             selected_prompt = structured_data.get('text')
+            generated_from_prompt = True
                 
         except Exception as bedrock_error:
             print(f"[WARNING] Bedrock analysis/generation failed: {bedrock_error}")
-            # 분석 실패 시 원본 파일 사용하고 기본 프롬프트로 새 이미지 생성
-            fallback_prompts = [
-                "A creative artistic interpretation with vibrant colors",
-                "An abstract artistic version with modern style",
-                "A fantasy reimagining with magical elements",
-                "A minimalist artistic interpretation",
-                "A surreal artistic transformation"
-            ]
-            
+            # 분석 실패 시 미리 만들어 둔 이미지, 없으면 기본 프롬프트로 새 이미지 생성
             try:
-                fallback_prompt = random.choice(fallback_prompts)
-                fallback_request = {
-                    "taskType": "TEXT_IMAGE",
-                    "textToImageParams": {
-                        "text": fallback_prompt,
-                        "negativeText": "real human baby, realistic adult features, extra limbs, distorted anatomy, scary expression, cluttered background",
-                        "style": "SOFT_DIGITAL_PAINTING",
-                    },
-                    "imageGenerationConfig": {
-                        "numberOfImages": 1,
-                        "width": 1024,
-                        "height": 1024
-                    }
-                }
-                
-                fallback_response = bedrock_canvas.invoke_model(
-                    modelId="amazon.nova-canvas-v1:0",
-                    contentType="application/json",
-                    accept="application/json",
-                    body=json.dumps(fallback_request)
-                )
-                
-                fallback_result = json.loads(fallback_response["body"].read())
-                base64_image_data = fallback_result.get("images") or fallback_result.get("image")
-                if isinstance(base64_image_data, list):
-                    first_image = base64_image_data[0] if base64_image_data else None
-                    if isinstance(first_image, dict):
-                        base64_image_data = first_image.get("base64") or first_image.get("image") or first_image.get("data")
-                    else:
-                        base64_image_data = first_image
-                elif isinstance(base64_image_data, dict):
-                    base64_image_data = base64_image_data.get("base64") or base64_image_data.get("image") or base64_image_data.get("data")
-                if not base64_image_data:
-                    raise ValueError("Fallback Nova Canvas response did not include an image")
-                generated_image_data = base64.b64decode(base64_image_data)
-                selected_prompt = fallback_prompt + " (fallback generation)"
+                fallback_prompt = random.choice(FALLBACK_PROMPTS)
+                with _timed(timings, "fallback_pool"):
+                    pooled = _take_pooled_fallback(FALLBACK_PROMPTS.index(fallback_prompt))
+                if pooled is not None:
+                    fallback_prompt, pooled_image = pooled
+                    generated_images = [pooled_image]
+                    selected_prompt = fallback_prompt + " (fallback pool)"
+                else:
+                    _require_budget(deadline, "fallback_generation", "upload")
+                    with _timed(timings, "fallback_generation"), \
+                            deadline.run("fallback_generation", _reserve_ms("upload")) as budget:
+                        generated_images = [_generate_image(
+                            fallback_prompt,
+                            FALLBACK_NEGATIVE_PROMPT,
+                            error_message="Fallback Nova Canvas response did not include an image",
+                            budget_ms=budget,
+                        )]
+                    selected_prompt = fallback_prompt + " (fallback generation)"
                 
             except Exception as fallback_error:
                 print(f"[ERROR] Fallback generation also failed: {fallback_error}")
                 # 모든 생성 실패 시 원본 이미지 사용
-                generated_image_data = original_image_data
+                generated_images = [original_image_data]
                 selected_prompt = "Original uploaded image (AI analysis and generation failed)"
 
-        # 4. sp-complete-bucket으로 생성된 이미지 저장
-        s3.put_object(
-            Bucket='sp-complete-bucket',
-            Key=key,
-            Body=generated_image_data,
-            ContentType='image/png',
-            Metadata={
+        # 4. sp-complete-bucket으로 생성된 이미지와 전송용 사본 저장
+        renditions = []
+        if deadline.allows("transcode", _reserve_ms("upload")):
+            with _timed(timings, "transcode"), deadline.run("transcode"):
+                renditions = _render_outputs(generated_images[0])
+        with _timed(timings, "upload"), deadline.run("upload") as budget:
+            saved_keys = _save_generated_images(key, generated_images, {
                 'ai-prompt': _safe_metadata_value(selected_prompt),
                 'generation-type': 'nova-canvas-v1',
-                'analysis-method': 'nova-pro-vision-analysis'
-            }
-        )
-        print(f"[SUCCESS] AI generated image saved to sp-complete-bucket/{key}")
+                'analysis-method': 'nova-pro-vision-analysis',
+                'prompt-mode': prompt_mode
+            }, renditions, budget)
+        print(f"[SUCCESS] AI generated image saved to sp-complete-bucket/{key} ({len(saved_keys)} variant(s))")
+        timings["time_to_final_ms"] = round((time.perf_counter() - invocation_start) * 1000, 1)
+        progress.send("saved")
+
+        if generated_from_prompt and prompt_info["source"] != "cache":
+            _remember_near_duplicate(prompt_info, key)
 
         # 5. 성공적으로 복사되면 원본 파일 삭제
         # try:
@@ -313,12 +936,228 @@ def lambda_handler(event, context):
         # except Exception as delete_error:
         #     print(f"[WARNING] Failed to delete original file {bucket}/{key}: {delete_error}")
 
-        return _success(200, {
+        timings["total_ms"] = round((time.perf_counter() - invocation_start) * 1000, 1)
+        progress.close()
+        timings["first_progress_ms"] = progress.first_sent_ms
+        print(f"[METRIC] {json.dumps({'promptMode': prompt_mode, 'promptSource': prompt_info['source'] if generated_from_prompt else 'fallback', 'imagePrep': prompt_info['image_prep'] if generated_from_prompt else None, 'earlyPrompt': generated_from_prompt and prompt_info['early_prompt'], 'variants': len(saved_keys), 'timings': timings, 'stages': deadline.report(), 'bedrock': bedrock.snapshot()})}")
+
+        return {
             "message": "AI image generated and saved successfully",
             "prompt": selected_prompt,
+            "promptMode": prompt_mode,
+            "output": {"bucket": "sp-complete-bucket", "key": key, "variants": saved_keys, "preview": published_preview,
+                       "renditions": [{"key": rendition_key(key, r['edge'], r['format']), "format": r['format'],
+                                       "width": r['width'], "height": r['height'], "bytes": len(r['bytes'])}
+                                      for r in renditions]},
+            "timings": timings,
+            "stages": deadline.report(),
             "reason": "업로드된 이미지를 Nova Pro가 분석한 뒤 Nova Canvas로 고품질 연관 이미지를 생성했습니다"
-        })
+        }
+    finally:
+        progress.close()
+
+
+def _take_pooled_fallback(preferred_index):
+    """풀에서 (prompt, image)를 꺼낸다. 풀이 꺼져 있거나 비었거나 S3 오류면 None."""
+    if fallback_pool is None:
+        return None
+    try:
+        pooled = fallback_pool.take(preferred_index)
+    except Exception as pool_error:
+        print(f"[WARNING] Fallback pool read failed: {pool_error}")
+        return None
+    stats = fallback_pool.stats()
+    if pooled is None:
+        print(f"[METRIC] {json.dumps({'fallbackPool': dict(stats, hit=False, depth=0)})}")
+        return None
+    prompt_index, image, remaining = pooled
+    print(f"[METRIC] {json.dumps({'fallbackPool': dict(stats, hit=True, promptIndex=prompt_index, depth=remaining)})}")
+    return FALLBACK_PROMPTS[prompt_index], image
+
+
+def _refill_fallback_pool(deadline=None):
+    """프롬프트별로 FALLBACK_POOL_TARGET장이 되도록 Canvas로 채운다 (스케줄 호출).
+
+    프롬프트들은 병렬로 채우고, 각 Canvas 호출은 남은 실행 시간 안에서 fallback_generation 예산만큼만 기다린다.
+    남은 시간이 최소 예산보다 적으면 더 부르지 않는다 (채우지 못한 만큼은 다음 스케줄 호출이 채운다).
+    """
+    if fallback_pool is None:
+        return {"message": "fallback pool disabled"}
+    deadline = deadline or Deadline(None, STAGE_BUDGETS, STAGE_MINIMUMS)
+    depth = fallback_pool.depth()
+
+    def refill(index):
+        prompt = FALLBACK_PROMPTS[index]
+        missing = FALLBACK_POOL_TARGET - depth.get(index, 0)
+        added = 0
+        while missing > 0:
+            # 받은 이미지를 풀에 올릴 시간은 남겨 둔다
+            if not deadline.allows("fallback_generation", _reserve_ms("upload"), label=f"refill-{index}"):
+                break
+            try:
+                with deadline.run("fallback_generation", _reserve_ms("upload")) as budget_ms:
+                    images = _invoke_canvas(prompt, FALLBACK_NEGATIVE_PROMPT, min(CANVAS_MAX_IMAGES_PER_CALL, missing),
+                                            budget_ms=budget_ms)
+            except Exception as refill_error:
+                print(f"[WARNING] Fallback pool refill failed for prompt {index}: {refill_error}")
+                break
+            for image in images:
+                fallback_pool.add(index, image)
+            added += len(images)
+            missing -= len(images)
+        return added
+
+    with ThreadPoolExecutor(max_workers=FALLBACK_POOL_REFILL_WORKERS) as pool:
+        added = dict(zip(range(len(FALLBACK_PROMPTS)), pool.map(refill, range(len(FALLBACK_PROMPTS)))))
+    result = {"depthBefore": depth, "added": added,
+              "depthAfter": {index: depth.get(index, 0) + added[index] for index in added},
+              "skipped": [stage["stage"] for stage in deadline.report()["stages"] if stage["status"] == "skipped"]}
+    print(f"[METRIC] {json.dumps({'fallbackPoolRefill': result})}")
+    return result
+
+
+def _compact_near_duplicate_index():
+    """쌓인 near-duplicate 항목 객체를 shard 스냅샷에 합친다 (스케줄 호출). cold start가 읽을 객체 수를 줄인다."""
+    if not NEAR_DUP_ENABLED:
+        return {"message": "near-duplicate index disabled"}
+    added = near_duplicate_store.compact()
+    result = {"added": sum(added.values()), "shards": {shard: count for shard, count in added.items() if count}}
+    print(f"[METRIC] {json.dumps({'nearDuplicateCompaction': result})}")
+    return result
+
+
+def _build_job_store():
+    if JOB_STORE == "memory":
+        return InMemoryJobStore()
+    return S3JobStore(s3, JOB_BUCKET)
+
+
+def _build_job_queue():
+    if JOB_QUEUE == "local":
+        return LocalJobQueue(_run_job, JOB_LOCAL_WORKERS)
+    return LambdaJobQueue(boto3.client("lambda"), JOB_FUNCTION_NAME)
+
+
+def _requested_variants(value):
+    try:
+        variants = int(value) if value not in (None, "") else PET_VARIANTS
+    except (TypeError, ValueError):
+        variants = PET_VARIANTS
+    return max(1, min(PET_MAX_VARIANTS, variants))
+
+
+def _requested_flag(value, default):
+    if value in (None, ""):
+        return default
+    return str(value).lower() == "true"
+
+
+def _submit_job(bucket, key, requested_mode, connection_id=None, variants=1, preview=False):
+    """작업을 저장하고 큐에 넣은 뒤 바로 202를 돌려준다."""
+    global job_store, job_queue
+    if job_store is None:
+        job_store = _build_job_store()
+    if job_queue is None:
+        job_queue = _build_job_queue()
+
+    job = new_job(bucket, key, requested_mode, connection_id, variants, preview)
+    job_store.put(job)
+    try:
+        job_queue.submit(job)
+    except Exception as submit_error:
+        job_store.put(update_job(job, "failed", error=f"enqueue failed: {submit_error}"))
+        raise
+    print(f"[INFO] Job {job['jobId']} queued for s3://{bucket}/{key}")
+    return _success(202, {"jobId": job["jobId"], "status": job["status"]})
+
+
+def _run_job(job, context=None):
+    """큐에서 꺼낸 작업을 실행한다. 실패도 작업 상태로 남기고 예외는 올리지 않는다 (Lambda 비동기 재시도 방지)."""
+    global job_store
+    if job_store is None:
+        job_store = _build_job_store()
+
+    job = update_job(job, "running")
+    job_store.put(job)
+    try:
+        prompt_mode = _select_prompt_mode(job["key"], job.get("promptMode"))
+        result = _process_upload(job["bucket"], job["key"], prompt_mode, job.get("connectionId"), job["jobId"],
+                                 _requested_variants(job.get("variants")), _requested_flag(job.get("preview"), PREVIEW_ENABLED),
+                                 Deadline(context, STAGE_BUDGETS, STAGE_MINIMUMS))
+        job = update_job(job, "succeeded", result=result)
+    except Exception as job_error:
+        print(f"[ERROR] Job {job['jobId']} failed: {job_error}")
+        job = update_job(job, "failed", error=str(job_error))
+    job_store.put(job)
+
+    # 완료/실패를 업로드한 사용자 연결로 알린다
+    notifier = ProgressNotifier(apigateway, job.get("connectionId") or connection_id_from_key(job["key"]),
+                                job["key"].split('/')[-1], extra={"jobId": job["jobId"]})
+    notifier.send(job["status"], result=job["result"], error=job["error"])
+    notifier.close()
+    return job
+
+
+def _get_job(job_id):
+    global job_store
+    if job_store is None:
+        job_store = _build_job_store()
+    job = job_store.get(job_id)
+    if job is None:
+        return _error(404, f"job {job_id}를 찾을 수 없습니다")
+    return _success(200, job)
+
+
+def lambda_handler(event, context):
+    if prompt_cache:
+        prompt_cache.reset_stats()
+    try:
+        # 비동기 작업 실행 (LambdaJobQueue가 같은 함수를 Event로 호출)
+        if "petJob" in event:
+            return _run_job(event["petJob"], context)
+
+        # fallback 이미지 풀 채우기 (EventBridge 스케줄)
+        if event.get("refillFallbackPool"):
+            return _refill_fallback_pool(Deadline(context, STAGE_BUDGETS, STAGE_MINIMUMS))
+
+        # near-duplicate 인덱스 항목을 shard 스냅샷으로 합치기 (EventBridge 스케줄)
+        if event.get("compactNearDuplicateIndex"):
+            return _compact_near_duplicate_index()
+
+        # 1. 이벤트 유형에 따라 버킷 이름과 객체 키 추출 (EventBridge or API Gateway)
+        if "detail" in event:
+            bucket = event["detail"]["bucket"]["name"]
+            key = urllib.parse.unquote_plus(event["detail"]["object"]["key"])
+            return _success(200, _process_upload(bucket, key, _select_prompt_mode(key), variants=_requested_variants(None),
+                                                 preview=PREVIEW_ENABLED,
+                                                 deadline=Deadline(context, STAGE_BUDGETS, STAGE_MINIMUMS)))
+
+        body = _parse_http_body(event)
+        query_params = event.get("queryStringParameters") or {}
+        job_id = (event.get("pathParameters") or {}).get("jobId") or query_params.get("jobId")
+        if job_id:
+            return _get_job(job_id)
+
+        bucket = body.get("bucket") or body.get("Bucket") or query_params.get("bucket")
+        key = body.get("key") or body.get("Key") or query_params.get("key")
+        requested_mode = body.get("promptMode") or query_params.get("promptMode")
+        variants = _requested_variants(body.get("variants") or query_params.get("variants"))
+        preview = _requested_flag(body.get("preview", query_params.get("preview")), PREVIEW_ENABLED)
+        if not bucket or not key:
+            return _error(400, "bucket과 key를 전달해야 합니다 (body 혹은 query)")
+
+        # HTTP 호출은 기본적으로 작업만 등록하고 바로 돌아간다 (sync=true면 기존처럼 끝까지 기다림)
+        if JOB_MODE == "async" and str(body.get("sync") or query_params.get("sync") or "").lower() != "true":
+            return _submit_job(bucket, key, requested_mode, body.get("connectionId"), variants, preview)
+        return _success(200, _process_upload(bucket, key, _select_prompt_mode(key, requested_mode),
+                                             variants=variants, preview=preview,
+                                             deadline=Deadline(context, STAGE_BUDGETS, STAGE_MINIMUMS)))
 
+    except admission.Rejected as rejected:
+        return _error(400, f"이미지를 처리할 수 없습니다 ({rejected.reason}): {rejected}")
     except Exception as e:
         print("Error processing file:", e)
         return _error(500, str(e))
+    finally:
+        if prompt_cache:
+            prompt_cache.log_stats()
@@ -0,0 +1,80 @@
+"""Bedrock 분석 실패 시 바로 내줄 미리 만들어 둔 fallback 이미지 풀.
+
+{bucket}/{prefix}{prompt_index}/{id}.png 형태로 FALLBACK_PROMPTS 항목별로 쌓아 둔다.
+take()는 하나를 꺼내고 지운다 (한 번 쓴 이미지는 다시 내주지 않음). 두 컨테이너가 같은 객체를 동시에
+꺼내면 같은 이미지가 두 번 나갈 수 있지만, 실패 경로용 대체 이미지라 허용한다.
+refill 작업(스케줄 호출)이 프롬프트별 target 개수까지 다시 채운다.
+"""
+import random
+import threading
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+class S3FallbackPool:
+    def __init__(self, s3_client, bucket: str, prompt_count: int, prefix: str = 'fallback-pool/'):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prompt_count = prompt_count
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _keys(self, prompt_index: int, limit: int = 1000):
+        response = self.s3.list_objects_v2(Bucket=self.bucket, Prefix=f"{self.prefix}{prompt_index}/", MaxKeys=limit)
+        return [item['Key'] for item in response.get('Contents', [])]
+
+    def depth(self):
+        """{prompt_index: 남은 이미지 수}"""
+        return {index: len(self._keys(index)) for index in range(self.prompt_count)}
+
+    def take(self, preferred_index: int = None):
+        """(prompt_index, image_bytes, 꺼낸 뒤 그 프롬프트의 남은 수)를 돌려준다. 풀이 비었으면 None."""
+        order = list(range(self.prompt_count))
+        random.shuffle(order)
+        if preferred_index is not None and preferred_index in order:
+            order.remove(preferred_index)
+            order.insert(0, preferred_index)
+
+        for index in order:
+            keys = self._keys(index)
+            random.shuffle(keys)
+            for key in keys:
+                try:
+                    image = self.s3.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+                except ClientError as error:
+                    # 다른 컨테이너가 먼저 꺼내 지운 경우
+                    if error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                        continue
+                    raise
+                self.s3.delete_object(Bucket=self.bucket, Key=key)
+                self._record(hit=True)
+                return index, image, len(keys) - 1
+        self._record(hit=False)
+        return None
+
+    def add(self, prompt_index: int, image: bytes):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{prompt_index}/{uuid.uuid4().hex}.png",
+            Body=image,
+            ContentType='image/png'
+        )
+
+    def _record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / total, 3) if total else None,
+            }
@@ -0,0 +1,127 @@
+"""make_pet HTTP 호출용 비동기 작업(job) 저장소와 큐.
+
+작업 레코드: {'jobId', 'status', 'bucket', 'key', 'promptMode', 'connectionId', 'variants',
+             'preview', 'createdAt', 'updatedAt', 'result', 'error'}
+status는 queued → running → succeeded | failed 순서로 바뀐다.
+
+- S3JobStore / InMemoryJobStore: 작업 상태 보관 (manifest 저장소와 같은 구성)
+- LambdaJobQueue: 같은 함수를 InvocationType='Event'로 다시 불러 작업을 실행한다
+- LocalJobQueue: 프로세스 안 스레드 풀에서 실행한다 (AWS 없이 부하 테스트/로컬 실행용)
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed')
+
+
+def new_job(bucket: str, key: str, prompt_mode: str = None, connection_id: str = None, variants: int = 1,
+            preview: bool = False):
+    now = time.time()
+    return {
+        'jobId': uuid.uuid4().hex,
+        'status': 'queued',
+        'bucket': bucket,
+        'key': key,
+        'promptMode': prompt_mode,
+        'connectionId': connection_id,
+        'variants': variants,
+        'preview': preview,
+        'createdAt': now,
+        'updatedAt': now,
+        'result': None,
+        'error': None,
+    }
+
+
+def update_job(job: dict, status: str, result=None, error: str = None):
+    job = dict(job, status=status, updatedAt=time.time())
+    if result is not None:
+        job['result'] = result
+    if error is not None:
+        job['error'] = error
+    return job
+
+
+class S3JobStore:
+    """작업 하나를 {bucket}/{prefix}{jobId}.json 객체로 보관한다."""
+
+    def __init__(self, s3_client, bucket: str, prefix: str = 'jobs/'):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, job_id: str):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{job_id}.json")
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def put(self, job: dict):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{job['jobId']}.json",
+            Body=json.dumps(job, ensure_ascii=False).encode('utf-8'),
+            ContentType='application/json'
+        )
+
+
+class InMemoryJobStore:
+    """로컬 실행/테스트용. warm 컨테이너 안에서만 유지된다."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else json.loads(json.dumps(job))
+
+    def put(self, job: dict):
+        with self._lock:
+            self._jobs[job['jobId']] = json.loads(json.dumps(job))
+
+
+class LambdaJobQueue:
+    """같은 Lambda 함수를 비동기(Event)로 호출한다. 함수는 {'petJob': job} 이벤트를 받아 실행한다."""
+
+    def __init__(self, lambda_client, function_name: str):
+        self.client = lambda_client
+        self.function_name = function_name
+
+    def submit(self, job: dict):
+        self.client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=json.dumps({'petJob': job}).encode('utf-8')
+        )
+
+
+class LocalJobQueue:
+    """프로세스 안에서 worker(job)를 실행하는 큐. join()으로 남은 작업이 끝날 때까지 기다릴 수 있다."""
+
+    def __init__(self, worker, max_workers: int = 4):
+        self.worker = worker
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, job: dict):
+        future = self._executor.submit(self.worker, job)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+
+    def join(self):
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
@@ -0,0 +1,286 @@
+"""재인코딩/리사이즈/가벼운 크롭으로 바뀐 같은 사진을 찾기 위한 perceptual hash 인덱스.
+
+- dhash: 64비트 difference hash (9x8 회색조 축소 후 인접 픽셀 밝기 비교)
+- MultiIndexHash: 64비트를 16비트 조각 4개로 나눠 조각별 테이블에 넣는다.
+  해밍 거리 d 이내인 두 해시는 적어도 한 조각이 d // 4 이내로 같으므로 (비둘기집 원리)
+  조각마다 그 반경 안의 값만 찾아 후보를 모으고, 후보만 전체 해밍 거리로 확인한다.
+- S3NearDuplicateIndexStore: 항목마다 객체 하나를 덧붙이기만 하고(append-only) 읽을 때 새 항목만 더 읽는다.
+"""
+import io
+import json
+import random
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+
+import numpy as np
+from botocore.exceptions import ClientError
+from PIL import Image
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+INDEX_VERSION = 1
+# 첫 조각(band)의 상위 4비트로 항목 객체와 스냅샷을 16개 shard로 나눈다
+SHARD_HEX_DIGITS = 1
+# 서로 다른 컨테이너의 시계 차이와 PUT이 목록에 보이기까지의 지연을 덮도록 커서보다 이만큼 앞에서부터 다시 나열한다
+LIST_LAG_MS = 60_000
+# S3 조건부 쓰기가 실패했을 때의 오류 코드 (412: ETag 불일치, 409: 같은 키에 동시 쓰기)
+_CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+
+def dhash(image_bytes: bytes) -> int:
+    image = Image.open(io.BytesIO(image_bytes))
+    # JPEG은 축소 디코딩으로 충분하다 (9x8까지 줄일 것이므로)
+    image.draft('L', (64, 64))
+    pixels = np.asarray(image.convert('L').resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    # 행마다 왼쪽 < 오른쪽이면 1, 위 행부터 큰 비트로 채운다
+    bits = pixels[:, :-1] < pixels[:, 1:]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _flip_masks(radius: int):
+    masks = [0]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            masks.append(mask)
+    return masks
+
+
+class MultiIndexHash:
+    def __init__(self):
+        self.hashes = array('Q')
+        self.records = []
+        self._tables = [dict() for _ in range(CHUNKS)]
+        self._mask_cache = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def _chunks(hash_value: int):
+        return [(hash_value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def add(self, hash_value: int, record):
+        entry_id = len(self.hashes)
+        self.hashes.append(hash_value)
+        self.records.append(record)
+        for table, chunk in zip(self._tables, self._chunks(hash_value)):
+            bucket = table.get(chunk)
+            if bucket is None:
+                table[chunk] = [entry_id]
+            else:
+                bucket.append(entry_id)
+
+    def search(self, hash_value: int, max_distance: int):
+        """max_distance 이내에서 가장 가까운 (distance, record)를 돌려준다. 없으면 None."""
+        radius = max_distance // CHUNKS
+        masks = self._mask_cache.get(radius)
+        if masks is None:
+            masks = self._mask_cache[radius] = _flip_masks(radius)
+
+        best = None
+        seen = set()
+        for table, chunk in zip(self._tables, self._chunks(hash_value)):
+            for mask in masks:
+                for entry_id in table.get(chunk ^ mask, ()):
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                    distance = hamming(hash_value, self.hashes[entry_id])
+                    if distance <= max_distance and (best is None or distance < best[0]):
+                        best = (distance, entry_id)
+                        if distance == 0:
+                            return 0, self.records[entry_id]
+        if best is None:
+            return None
+        return best[0], self.records[best[1]]
+
+    def to_document(self):
+        return {
+            'version': INDEX_VERSION,
+            'entries': [[format(h, '016x'), record] for h, record in zip(self.hashes, self.records)]
+        }
+
+    @classmethod
+    def from_document(cls, document):
+        index = cls()
+        if document.get('version') != INDEX_VERSION:
+            return index
+        for hash_hex, record in document.get('entries', []):
+            index.add(int(hash_hex, 16), record)
+        return index
+
+
+def _shard(hash_hex: str) -> str:
+    return hash_hex[:SHARD_HEX_DIGITS]
+
+
+def _entry_millis(key: str) -> int:
+    # .../{millis:013d}-{content_hash}.json
+    return int(key.rsplit('/', 1)[1].split('-', 1)[0])
+
+
+class S3NearDuplicateIndexStore:
+    """인덱스를 shard별 항목 객체(append-only)와 shard별 스냅샷으로 보관한다.
+
+    - append(): 항목 하나를 {prefix}entries/{shard}/{millis}-{content_hash}.json 새 객체로 쓴다 (IfNoneMatch='*').
+      기존 객체를 읽고 고쳐 쓰지 않으므로 동시에 쓰는 컨테이너끼리 항목을 덮어쓰지 않는다.
+    - compact(): 스케줄 호출이 shard마다 쌓인 항목을 {prefix}shards/{shard}.json 스냅샷에 합친다.
+      스냅샷은 읽은 ETag와 같을 때만 쓰고(IfMatch), 겹치면 다시 읽어 합친다.
+    - load(index): index가 None이면 스냅샷과 그 뒤 항목을 모두 읽고, 아니면 마지막으로 읽은 뒤 새로 생긴 항목만
+      나열해 index에 덧붙인다. shard들은 병렬로 읽는다.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str = 'near-duplicates/v2/', max_workers: int = 16,
+                 lag_ms: int = LIST_LAG_MS):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_workers = max_workers
+        self.lag_ms = lag_ms
+        self.shards = [format(value, f'0{SHARD_HEX_DIGITS}x') for value in range(16 ** SHARD_HEX_DIGITS)]
+        # 마지막 load()가 shard별로 어디까지 읽었는지 (millis)와 이미 넣은 content_hash
+        self._cursors = {}
+        self._known = set()
+
+    def _entry_prefix(self, shard: str) -> str:
+        return f"{self.prefix}entries/{shard}/"
+
+    def _snapshot_key(self, shard: str) -> str:
+        return f"{self.prefix}shards/{shard}.json"
+
+    def _read_json(self, key: str):
+        """(document, ETag). 객체가 없으면 (None, None)."""
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None, None
+            raise
+        return json.loads(response['Body'].read()), response.get('ETag')
+
+    def _list_entries(self, shard: str, after_millis: int):
+        """after_millis - lag_ms 뒤에 쓰인 항목 키 (오래된 순)."""
+        prefix = self._entry_prefix(shard)
+        params = {'Bucket': self.bucket, 'Prefix': prefix}
+        if after_millis > self.lag_ms:
+            params['StartAfter'] = f"{prefix}{after_millis - self.lag_ms:013d}"
+        keys = []
+        while True:
+            response = self.s3.list_objects_v2(**params)
+            keys += [item['Key'] for item in response.get('Contents', [])]
+            if not response.get('IsTruncated'):
+                return keys
+            params['ContinuationToken'] = response['NextContinuationToken']
+
+    def _read_entries(self, keys):
+        entries = []
+        for key in keys:
+            document, _ = self._read_json(key)
+            if document is not None and document.get('version') == INDEX_VERSION:
+                entries.append((document['hash'], document['record']))
+        return entries
+
+    def _load_shard(self, shard: str, cursor):
+        """(스냅샷 항목 + 새 항목, 새 커서). cursor가 None이면 스냅샷부터 읽는다."""
+        entries = []
+        if cursor is None:
+            snapshot, _ = self._read_json(self._snapshot_key(shard))
+            cursor = 0
+            if snapshot is not None and snapshot.get('version') == INDEX_VERSION:
+                entries = snapshot.get('entries', [])
+                cursor = snapshot.get('through', 0)
+        keys = self._list_entries(shard, cursor)
+        entries += self._read_entries(keys)
+        return entries, max([cursor] + [_entry_millis(key) for key in keys])
+
+    def load(self, index: MultiIndexHash = None) -> MultiIndexHash:
+        """index가 None이면 새로 읽은 인덱스, 아니면 새 항목을 덧붙인 그 index를 돌려준다."""
+        if index is None:
+            index = MultiIndexHash()
+            self._cursors = {}
+            self._known = set()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            loaded = list(pool.map(lambda shard: self._load_shard(shard, self._cursors.get(shard)), self.shards))
+        for shard, (entries, cursor) in zip(self.shards, loaded):
+            self._cursors[shard] = cursor
+            for hash_hex, record in entries:
+                if record.get('content_hash') not in self._known:
+                    index.add(int(hash_hex, 16), record)
+                    self._known.add(record.get('content_hash'))
+        return index
+
+    def remember(self, index: MultiIndexHash, hash_value: int, record: dict):
+        """이 컨테이너가 방금 덧붙인 항목을 다음 load()를 기다리지 않고 index에 넣는다."""
+        if record.get('content_hash') not in self._known:
+            index.add(hash_value, record)
+            self._known.add(record.get('content_hash'))
+
+    def append(self, hash_value: int, record: dict, now: float = None):
+        """항목 하나를 새 객체로 덧붙인다. 같은 키의 객체가 이미 있으면(같은 항목 재시도) 그대로 둔다."""
+        hash_hex = format(hash_value, '016x')
+        millis = int((now if now is not None else time.time()) * 1000)
+        try:
+            self.s3.put_object(
+                Bucket=self.bucket,
+                Key=f"{self._entry_prefix(_shard(hash_hex))}{millis:013d}-{record.get('content_hash')}.json",
+                Body=json.dumps({'version': INDEX_VERSION, 'hash': hash_hex, 'record': record},
+                                separators=(',', ':')).encode('utf-8'),
+                ContentType='application/json',
+                IfNoneMatch='*'
+            )
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') not in _CONFLICT_CODES:
+                raise
+
+    def _compact_shard(self, shard: str, attempts: int):
+        for attempt in range(attempts):
+            snapshot, etag = self._read_json(self._snapshot_key(shard))
+            if snapshot is None or snapshot.get('version') != INDEX_VERSION:
+                snapshot = {'version': INDEX_VERSION, 'through': 0, 'entries': []}
+            keys = self._list_entries(shard, snapshot['through'])
+            known = {record.get('content_hash') for _, record in snapshot['entries']}
+            added = 0
+            for hash_hex, record in self._read_entries(keys):
+                if record.get('content_hash') not in known:
+                    snapshot['entries'].append([hash_hex, record])
+                    known.add(record.get('content_hash'))
+                    added += 1
+            if not added:
+                return 0
+            snapshot['through'] = max([snapshot['through']] + [_entry_millis(key) for key in keys])
+            try:
+                self.s3.put_object(
+                    Bucket=self.bucket,
+                    Key=self._snapshot_key(shard),
+                    Body=json.dumps(snapshot, separators=(',', ':')).encode('utf-8'),
+                    ContentType='application/json',
+                    **({'IfMatch': etag} if etag else {'IfNoneMatch': '*'})
+                )
+                return added
+            except ClientError as error:
+                if error.response.get('Error', {}).get('Code') not in _CONFLICT_CODES:
+                    raise
+            print(f"[WARNING] Near-duplicate shard {shard} was compacted concurrently, retrying ({attempt + 1}/{attempts})")
+            time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+        print(f"[WARNING] Gave up compacting near-duplicate shard {shard} after {attempts} attempts")
+        return 0
+
+    def compact(self, attempts: int = 8):
+        """shard마다 새 항목을 스냅샷에 합친다. {shard: 합친 항목 수}를 돌려준다.
+
+        항목 객체는 지우지 않는다 (스냅샷을 먼저 읽은 다른 컨테이너가 아직 그 항목을 나열할 수 있으므로).
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            added = list(pool.map(lambda shard: self._compact_shard(shard, attempts), self.shards))
+        return dict(zip(self.shards, added))
@@ -1,63 +1,363 @@
+import base64
 import boto3
+import hashlib
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from botocore.exceptions import ClientError
 from PIL import Image
 import urllib.parse
 
+from sp_common import admission
+from sp_common.cache import DiskLRUCache, LRUCache, cache_key
+from sp_common.output_keys import RENDITION_FORMATS, box_rendition_key, parse_ladder, rendition_key
+from sp_common.renditions import decode_for_ladder, render_image
+
 s3 = boto3.client('s3', region_name='ap-northeast-2')
 BUCKET_NAME = os.environ['BUCKET_NAME']
 
+# 만들 크기/포맷 목록 '긴 변:포맷' (포맷: webp | jpeg | png | original=원본 포맷).
+# 첫 항목은 기존처럼 원래 키에, 나머지는 '{이름}_{긴 변}.{포맷}' 키에 저장한다
+RESIZE_RENDITIONS = os.environ.get('RESIZE_RENDITIONS', '300:original')
+RESIZE_QUALITY = int(os.environ.get('RESIZE_QUALITY', '85'))
+UPLOAD_WORKERS = int(os.environ.get('RESIZE_UPLOAD_WORKERS', '4'))
+# 기존 핸들러처럼 PNG/JPEG 최적화 인코딩은 기본으로 끈다 (작은 사본에서는 크기 차이보다 인코딩 시간이 크다)
+RESIZE_OPTIMIZE = os.environ.get('RESIZE_OPTIMIZE', 'false').lower() == 'true'
+
+# 앞부분 ADMISSION_PROBE_BYTES만 먼저 받아 이미지가 아니거나 너무 큰 객체는 전체를 받기 전에 건너뛴다
+ADMISSION_PROBE_BYTES = int(os.environ.get('ADMISSION_PROBE_BYTES', str(64 * 1024)))
+ADMISSION_MAX_PIXELS = int(os.environ.get('ADMISSION_MAX_PIXELS', '40000000'))
+ADMISSION_MAX_BYTES = int(os.environ.get('ADMISSION_MAX_BYTES', str(25 * 1024 * 1024)))
+
+# 요청 시 리사이즈 (GET /resize?key=&width=&height=&format=): 원본에서 만든 사본을 /tmp LRU와
+# {BUCKET_NAME}/{RESIZE_ON_DEMAND_PREFIX}{원본 버킷}/... 에 두고, 이후 요청은 /tmp(hot) → S3(warm) → 원본(cold) 순서로 찾는다.
+# 사본 키에는 원본 ETag가 들어가므로 make_pet이 같은 키를 다시 쓰면 예전 사본은 더 이상 쓰이지 않는다
+# 인증 없는 공개 엔드포인트이므로 원본은 결과 버킷(sp-complete-bucket)에서만 읽는다.
+# 사용자 업로드 원본(sp-user-input-temporary-bucket)은 presigned URL로만 접근하도록 여기에 넣지 않는다
+SOURCE_BUCKETS = [name.strip() for name in os.environ.get('RESIZE_SOURCE_BUCKETS', 'sp-complete-bucket').split(',')
+                  if name.strip()]
+ON_DEMAND_PREFIX = os.environ.get('RESIZE_ON_DEMAND_PREFIX', 'on-demand/')
+# 공개 엔드포인트라 아무 크기나 받으면 크기 조합마다 렌더링과 S3 사본이 생긴다. width/height는 이 목록의 값만 받는다
+ON_DEMAND_SIZES = sorted({int(size) for size in os.environ.get('RESIZE_ALLOWED_SIZES', '64,128,256,512,1024,2048').split(',')
+                          if size.strip().isdigit() and int(size) > 0})
+# 응답의 Cache-Control. 원본이 바뀌어도 URL은 같으므로 짧게 두고 이후에는 ETag(If-None-Match)로 다시 확인한다
+ON_DEMAND_CACHE_CONTROL = os.environ.get('RESIZE_CACHE_CONTROL', 'public, max-age=300')
+# S3 사본의 Cache-Control. 키에 원본 ETag가 들어가 내용이 바뀌지 않으므로 길게 둔다
+ON_DEMAND_STORED_CACHE_CONTROL = os.environ.get('RESIZE_STORED_CACHE_CONTROL', 'public, max-age=31536000, immutable')
+# 원본 ETag(HEAD) 결과를 warm 컨테이너에서 재사용하는 시간(초). 0이면 요청마다 HEAD한다
+SOURCE_ETAG_TTL_SECONDS = float(os.environ.get('RESIZE_SOURCE_ETAG_TTL_SECONDS', '10'))
+TMP_CACHE_DIR = os.environ.get('RESIZE_TMP_CACHE_DIR', '/tmp/renditions')
+TMP_CACHE_MAX_BYTES = int(os.environ.get('RESIZE_TMP_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+# API Gateway 응답 한도(6MB)를 넘지 않도록 이보다 큰 사본은 S3 presigned URL로 돌려보낸다 (base64로 약 4/3배)
+RESPONSE_MAX_BYTES = int(os.environ.get('RESIZE_RESPONSE_MAX_BYTES', str(4 * 1024 * 1024)))
+
+tmp_cache = DiskLRUCache(TMP_CACHE_DIR, TMP_CACHE_MAX_BYTES)
+source_etags = LRUCache(max_entries=4096, ttl_seconds=SOURCE_ETAG_TTL_SECONDS)
+
+cors_headers = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Content-Type, If-None-Match",
+    "Access-Control-Allow-Methods": "GET, OPTIONS",
+    "Access-Control-Expose-Headers": "ETag, X-Cache, X-Rendition-Key"
+}
+
+# Pillow format → rendition 포맷. 여기 없는 포맷(GIF, BMP 등)의 original은 png로 만든다
+SOURCE_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def _ladder_for(source_format):
+    return parse_ladder(RESIZE_RENDITIONS.replace('original', source_format))
+
+
+def _plan(img, source_format):
+    """(ladder, 그중 디코딩 없이 원본을 그대로 쓸 (긴 변, 포맷) 집합).
+
+    원본이 그 크기 이하이고 포맷도 같으면 다시 인코딩하지 않고 원본 바이트를 올린다 (기존 300x300 이하 복사 동작).
+    """
+    ladder = _ladder_for(source_format)
+    passthrough = {(edge, fmt) for edge, fmt in ladder if max(img.size) <= edge and fmt == source_format}
+    return ladder, passthrough
+
+
+def render(body, content_type):
+    """이미지를 한 번만 열고 필요한 크기까지만 디코딩해 ladder의 모든 사본을 만든다.
+
+    [{'edge', 'format', 'content_type', 'bytes', 'width', 'height'}] (ladder 순서)와 단계별 시간(ms)을 돌려준다.
+    이미지가 아니면 None.
+    """
+    timings = {}
+    started = time.perf_counter()
+    try:
+        img = Image.open(BytesIO(body))
+    except (Image.UnidentifiedImageError, OSError):
+        return None, timings
+    source_format = SOURCE_FORMATS.get(img.format, 'png')
+    ladder, passthrough = _plan(img, source_format)
+    to_render = [entry for entry in ladder if entry not in passthrough]
+
+    rendered = {}
+    if to_render:
+        try:
+            decode_for_ladder(img, to_render)
+        except (OSError, SyntaxError, ValueError):
+            # 헤더는 읽히지만 본문이 깨진 파일 (기존 verify() 실패와 같은 취급)
+            return None, timings
+        timings['decode_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        encode_started = time.perf_counter()
+        rendered = {(r['edge'], r['format']): r for r in render_image(img, to_render, RESIZE_QUALITY, RESIZE_OPTIMIZE)}
+        timings['encode_ms'] = round((time.perf_counter() - encode_started) * 1000, 1)
+
+    renditions = []
+    for edge, fmt in ladder:
+        if (edge, fmt) in passthrough:
+            renditions.append({'edge': edge, 'format': fmt, 'content_type': content_type or RENDITION_FORMATS[fmt],
+                               'bytes': body, 'width': img.width, 'height': img.height})
+        else:
+            renditions.append(rendered[(edge, fmt)])
+    return renditions, timings
+
+
+def _box_edge(size, width, height):
+    """원본 (가로, 세로)를 width x height 상자 안에 비율을 지켜 넣었을 때의 긴 변. 원본보다 키우지 않는다."""
+    scale = min(width / size[0] if width else 1, height / size[1] if height else 1, 1)
+    return max(1, round(max(size) * scale))
+
+
+def render_box(body, width, height, fmt):
+    """원본 바이트 → width x height 안에 들어가는 fmt 사본 하나 ({'bytes', 'content_type', 'width', 'height', ...}).
+
+    이미지가 아니거나 깨진 파일이면 None.
+    """
+    try:
+        img = Image.open(BytesIO(body))
+        ladder = [(_box_edge(img.size, width, height), fmt)]
+        decode_for_ladder(img, ladder)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    return render_image(img, ladder, RESIZE_QUALITY, RESIZE_OPTIMIZE)[0]
+
+
+def _http_response(status, body, headers=None):
+    return {
+        "statusCode": status,
+        "headers": {**cors_headers, "Content-Type": "application/json", **(headers or {})},
+        "body": json.dumps(body, ensure_ascii=False)
+    }
+
+
+def _parse_resize_request(params):
+    """쿼리 파라미터 → (bucket, key, width, height, format). 잘못된 요청이면 ValueError."""
+    key = params.get('key')
+    bucket = params.get('bucket') or SOURCE_BUCKETS[0]
+    if not key:
+        raise ValueError("key 파라미터가 필요합니다")
+    if bucket not in SOURCE_BUCKETS:
+        raise ValueError(f"허용하지 않는 버킷입니다: {bucket}")
+    sizes = []
+    for name in ('width', 'height'):
+        value = params.get(name)
+        if value in (None, ''):
+            sizes.append(None)
+        elif not value.isdigit() or int(value) not in ON_DEMAND_SIZES:
+            raise ValueError(f"{name}는 {', '.join(map(str, ON_DEMAND_SIZES))} 중 하나여야 합니다")
+        else:
+            sizes.append(int(value))
+    if not any(sizes):
+        raise ValueError("width 또는 height 중 하나는 필요합니다")
+    fmt = (params.get('format') or 'webp').lower()
+    fmt = 'jpeg' if fmt == 'jpg' else fmt
+    if fmt not in RENDITION_FORMATS:
+        raise ValueError(f"format은 {', '.join(RENDITION_FORMATS)} 중 하나여야 합니다")
+    return bucket, key, sizes[0], sizes[1], fmt
+
+
+def _version(etag):
+    # '"9b2c..."' → '9b2c...' (키에 넣을 수 있는 원본 버전)
+    return (etag or '').strip().strip('"') or None
+
+
+def _stored_key(bucket, key, width, height, fmt, version):
+    return f"{ON_DEMAND_PREFIX}{bucket}/{box_rendition_key(key, width, height, fmt, version)}"
+
+
+def _source_version(bucket, key):
+    """원본의 현재 ETag. SOURCE_ETAG_TTL_SECONDS 동안은 컨테이너 메모리의 값을 쓴다. 원본이 없으면 ClientError(404)."""
+    cache_id = (bucket, key)
+    version = source_etags.get(cache_id) if SOURCE_ETAG_TTL_SECONDS > 0 else None
+    if version is None:
+        version = _version(s3.head_object(Bucket=bucket, Key=key).get('ETag'))
+        if SOURCE_ETAG_TTL_SECONDS > 0 and version:
+            source_etags.put(cache_id, version)
+    return version
+
+
+def _read_stored_rendition(stored_key):
+    try:
+        return s3.get_object(Bucket=BUCKET_NAME, Key=stored_key)['Body'].read()
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def _render_from_original(bucket, key, width, height, fmt):
+    """원본을 받아 사본을 만들고 이후 요청이 S3에서 바로 받을 수 있도록 캐시 헤더와 함께 올린다.
+
+    (사본 바이트, S3에 저장되었는지, 저장 키)를 돌려준다. 저장 키는 실제로 받은 원본의 ETag로 정하므로
+    HEAD 뒤에 원본이 바뀌었더라도 사본이 다른 버전의 키에 저장되지 않는다.
+    """
+    admitted = admission.admit(s3, bucket, key, ADMISSION_PROBE_BYTES, max_pixels=ADMISSION_MAX_PIXELS,
+                               max_bytes=ADMISSION_MAX_BYTES, formats=None)
+    body = admitted['body']
+    if body is None:
+        # probe와 같은 버전만 받는다 (그 사이에 바뀌었으면 PreconditionFailed)
+        extra = {'IfMatch': admitted['etag']} if admitted['etag'] else {}
+        body = s3.get_object(Bucket=bucket, Key=key, **extra)['Body'].read()
+    stored_key = _stored_key(bucket, key, width, height, fmt, _version(admitted['etag']))
+    rendition = render_box(body, width, height, fmt)
+    if rendition is None:
+        raise admission.Rejected('not_image', 'image could not be decoded')
+    try:
+        s3.put_object(Bucket=BUCKET_NAME, Key=stored_key, Body=rendition['bytes'],
+                      ContentType=rendition['content_type'], CacheControl=ON_DEMAND_STORED_CACHE_CONTROL)
+    except ClientError as error:
+        # 저장에 실패해도 이번 응답은 줄 수 있다 (다음 cold 요청에서 다시 만든다)
+        print(f"[WARNING] Rendition write-back failed for {stored_key}: {error}")
+        return rendition['bytes'], False, stored_key
+    return rendition['bytes'], True, stored_key
+
+
+def resize_on_read(event):
+    """GET /resize?key=&width=&height=&format=&bucket= → 사본 이미지 (base64 본문).
+
+    먼저 원본의 현재 ETag를 HEAD로 확인하고(SOURCE_ETAG_TTL_SECONDS 동안 재사용), 그 버전의 사본을
+    /tmp LRU(hot) → S3에 저장해 둔 사본(warm) → 원본에서 새로 만들기(cold) 순서로 찾는다.
+    응답에는 짧은 Cache-Control과 내용 MD5 ETag(S3 단일 PUT의 ETag와 같은 값)를 붙이고
+    If-None-Match가 맞으면 304를 돌려준다. 저장 위치는 X-Rendition-Key 헤더로 알려준다.
+    /tmp에는 S3에 저장된 사본만 두므로 hot/warm 사본은 항상 S3에도 있다 (응답이 너무 크면 presigned URL로 보낸다).
+    """
+    started = time.perf_counter()
+    try:
+        bucket, key, width, height, fmt = _parse_resize_request(event.get('queryStringParameters') or {})
+    except ValueError as error:
+        return _http_response(400, {"error": str(error)})
+
+    tier, stored = 'hot', True
+    try:
+        stored_key = _stored_key(bucket, key, width, height, fmt, _source_version(bucket, key))
+        data = tmp_cache.get(cache_key(stored_key))
+        if data is None:
+            tier = 'warm'
+            data = _read_stored_rendition(stored_key)
+        if data is None:
+            tier = 'cold'
+            data, stored, stored_key = _render_from_original(bucket, key, width, height, fmt)
+    except admission.Rejected as rejected:
+        print(f"[WARNING] Resize rejected for s3://{bucket}/{key} ({rejected.reason}): {rejected}")
+        return _http_response(400, {"error": str(rejected), "reason": rejected.reason})
+    except ClientError as error:
+        code = error.response.get('Error', {}).get('Code')
+        if code in ('NoSuchKey', '404'):
+            source_etags.pop((bucket, key))
+            return _http_response(404, {"error": f"원본을 찾을 수 없습니다: {key}"})
+        if code in ('PreconditionFailed', '412'):
+            # 원본을 받는 도중에 바뀌었다. 예전 ETag를 버리고 다시 요청하게 한다
+            source_etags.pop((bucket, key))
+            return _http_response(409, {"error": f"원본이 바뀌는 중입니다. 다시 요청하세요: {key}"})
+        raise
+    if tier != 'hot' and stored:
+        tmp_cache.put(cache_key(stored_key), data)
+
+    etag = f'"{hashlib.md5(data).hexdigest()}"'
+    headers = {
+        "Content-Type": RENDITION_FORMATS[fmt],
+        "Cache-Control": ON_DEMAND_CACHE_CONTROL,
+        "ETag": etag,
+        "X-Cache": tier,
+        "X-Rendition-Key": f"{BUCKET_NAME}/{stored_key}",
+    }
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    print(f"[METRIC] {json.dumps({'resizeOnRead': tier, 'bytes': len(data), 'elapsedMs': elapsed_ms, 'tmpCacheBytes': tmp_cache.size_bytes})}")
+
+    request_headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    if request_headers.get('if-none-match') == etag:
+        return {"statusCode": 304, "headers": {**cors_headers, **headers}, "body": ""}
+    # 저장에 실패한 사본은 presigned URL이 404가 되므로 크더라도 본문으로 보낸다
+    if len(data) > RESPONSE_MAX_BYTES and stored:
+        url = s3.generate_presigned_url('get_object', Params={'Bucket': BUCKET_NAME, 'Key': stored_key},
+                                        ExpiresIn=300)
+        return {"statusCode": 302, "headers": {**cors_headers, **headers, "Location": url}, "body": ""}
+    return {
+        "statusCode": 200,
+        "headers": {**cors_headers, **headers},
+        "body": base64.b64encode(data).decode('ascii'),
+        "isBase64Encoded": True
+    }
+
+
 def lambda_handler(event, context):
+    # API Gateway 요청이면 요청 시 리사이즈, 아니면 EventBridge 업로드 이벤트
+    if 'httpMethod' in event or 'queryStringParameters' in event:
+        return resize_on_read(event)
     try:
         # 1. EventBridge 이벤트에서 버킷 이름과 객체 키 추출
         bucket = event['detail']['bucket']['name']
         key = urllib.parse.unquote_plus(event['detail']['object']['key'])
         print(f"Processing file: s3://{bucket}/{key}")
 
-        # 2. S3에서 파일 가져오기
-        response = s3.get_object(Bucket=bucket, Key=key)
-        body = response['Body'].read()
-        content_type = response['ContentType']
-        if not body or not content_type:
-            raise Exception("S3 object body or content type missing")
-
-        # 3. 파일이 이미지인지 확인
+        # 2. 앞부분만 받아 이미지인지/크기가 괜찮은지 확인한 뒤 S3에서 파일 가져오기
         try:
-            img = Image.open(BytesIO(body))
-            img.verify()  # 이미지 유효성 체크
-        except Exception:
-            print("Not an image, skipping")
+            admitted = admission.admit(s3, bucket, key, ADMISSION_PROBE_BYTES, max_pixels=ADMISSION_MAX_PIXELS,
+                                       max_bytes=ADMISSION_MAX_BYTES, formats=None)
+        except admission.Rejected as rejected:
+            print(f"Rejected before download ({rejected.reason}): {rejected}")
             return {
                 "statusCode": 200,
-                "body": '{"message": "Not an image, skipped."}'
+                "body": json.dumps({"message": "Not an image, skipped." if rejected.reason == 'not_image'
+                                    else "Image rejected, skipped.", "reason": rejected.reason})
             }
+        body = admitted['body']
+        content_type = admitted['content_type']
+        if body is None:
+            response = s3.get_object(Bucket=bucket, Key=key)
+            body = response['Body'].read()
+            content_type = response['ContentType']
+        if not body or not content_type:
+            raise Exception("S3 object body or content type missing")
 
-        # 4. 이미지 다시 열기 (verify() 후에는 reopen 필요)
-        img = Image.open(BytesIO(body))
-        width, height = img.size
-
-        # 5. 300x300보다 작은 경우 그대로 복사
-        if width <= 300 and height <= 300:
-            print("Image smaller than or equal to 300x300, skipping resize.")
-            upload_to_resized_bucket(key, body, content_type)
+        # 3. 한 번만 열어서 이미지인지 확인하고 모든 크기/포맷을 만든다
+        renditions, timings = render(body, content_type)
+        if renditions is None:
+            print("Not an image, skipping")
             return {
                 "statusCode": 200,
-                "body": '{"message": "Image copied without resizing."}'
+                "body": '{"message": "Not an image, skipped."}'
             }
 
-        # 6. 300x300 이상일 때 리사이즈
-        img.thumbnail((300, 300))  # 비율 유지하며 최대 300x300
-        buffer = BytesIO()
-        img.save(buffer, format=img.format)
-        buffer.seek(0)
-
-        # 7. 리사이즈된 이미지 S3 업로드
-        upload_to_resized_bucket(key, buffer.read(), content_type)
-        print(f"Resized image uploaded to {BUCKET_NAME}/{key}")
+        # 4. 동시에 업로드 (첫 항목은 원래 키)
+        upload_started = time.perf_counter()
+        keys = [key] + [rendition_key(key, r['edge'], r['format']) for r in renditions[1:]]
+        with ThreadPoolExecutor(max_workers=max(1, UPLOAD_WORKERS)) as pool:
+            list(pool.map(lambda item: upload_to_resized_bucket(item[0], item[1]['bytes'], item[1]['content_type']),
+                          zip(keys, renditions)))
+        timings['upload_ms'] = round((time.perf_counter() - upload_started) * 1000, 1)
+        print(f"Uploaded {len(renditions)} rendition(s) to {BUCKET_NAME}: {keys}")
+        print(f"[METRIC] {json.dumps({'renditions': len(renditions), 'sourceBytes': len(body), 'timings': timings})}")
 
         return {
             "statusCode": 200,
-            "body": '{"message": "Image resized and uploaded successfully."}'
+            "body": json.dumps({
+                "message": "Image copied without resizing." if 'decode_ms' not in timings
+                else "Image resized and uploaded successfully.",
+                "renditions": [
+                    {"key": stored_key, "format": r['format'], "width": r['width'], "height": r['height'],
+                     "bytes": len(r['bytes'])}
+                    for stored_key, r in zip(keys, renditions)
+                ],
+                "timings": timings
+            })
         }
 
     except Exception as e:
@@ -0,0 +1,215 @@
+import importlib.util
+import io
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+LAMBDA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'stack', 'lambda'))
+COMMON_DIR = os.path.join(LAMBDA_DIR, 'common')
+
+# 핸들러 모듈은 import 시점에 boto3 client를 만든다 (호출은 하지 않으므로 자격 증명은 필요 없다)
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-northeast-2')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+# sp_common과 함수별 보조 모듈(manifest, atlas, jobs, ...)을 바로 import할 수 있게 한다.
+# 핸들러(app.py)는 이름이 겹치므로 load_lambda로만 불러온다
+sys.path[:0] = [COMMON_DIR] + sorted(
+    os.path.join(LAMBDA_DIR, name) for name in os.listdir(LAMBDA_DIR)
+    if name != 'common' and os.path.isfile(os.path.join(LAMBDA_DIR, name, 'app.py'))
+)
+
+# 테스트 중에 실제 AWS를 부르지 않도록 네트워크를 쓰는 기본값은 끈다
+LAMBDA_ENV = {
+    'BUCKET_NAME': 'test-bucket',
+    'PROGRESS_ENABLED': 'false',
+    'BEDROCK_RATE_LIMIT_ENABLED': 'false',
+}
+
+
+class Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def read(self, *args):
+        return self._data
+
+
+def client_error(code: str, operation: str = 'GetObject', status: int = 400):
+    return ClientError({'Error': {'Code': code, 'Message': code},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+
+class FakeS3:
+    """테스트용 메모리 S3. Range/ContentRange, IfNoneMatch(304), 조건부 PUT(412), StartAfter 나열과 호출 기록만 흉내 낸다."""
+
+    def __init__(self):
+        self.objects = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def add(self, bucket, key, data, content_type='image/jpeg', etag=None, metadata=None):
+        self.objects[(bucket, key)] = {
+            'Body': data,
+            'ETag': etag or f'"{abs(hash(data)):x}"',
+            'ContentType': content_type,
+            'Metadata': metadata or {},
+            'LastModified': datetime.fromtimestamp(time.time(), timezone.utc),
+        }
+
+    def count(self, operation):
+        return sum(1 for call in self.calls if call[0] == operation)
+
+    def _record(self, operation, bucket, key, **params):
+        with self._lock:
+            self.calls.append((operation, bucket, key, params))
+
+    def _get(self, bucket, key, operation):
+        stored = self.objects.get((bucket, key))
+        if stored is None:
+            raise client_error('NoSuchKey', operation, 404)
+        return stored
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None, **kwargs):
+        self._record('get_object', Bucket, Key, Range=Range, IfNoneMatch=IfNoneMatch)
+        stored = self._get(Bucket, Key, 'GetObject')
+        if IfNoneMatch is not None and IfNoneMatch == stored['ETag']:
+            raise client_error('304', 'GetObject', 304)
+        data = stored['Body']
+        response = {'ETag': stored['ETag'], 'ContentType': stored['ContentType'], 'Metadata': stored['Metadata']}
+        if Range:
+            start, end = (int(part) for part in Range.split('=')[1].split('-'))
+            end = min(end, len(data) - 1)
+            response['ContentRange'] = f"bytes {start}-{end}/{len(data)}"
+            data = data[start:end + 1]
+        return dict(response, Body=Body(data), ContentLength=len(data))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._record('head_object', Bucket, Key)
+        stored = self._get(Bucket, Key, 'HeadObject')
+        return {'ETag': stored['ETag'], 'ContentType': stored['ContentType'],
+                'ContentLength': len(stored['Body']), 'Metadata': stored['Metadata']}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None, IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._record('put_object', Bucket, Key, ContentType=ContentType, IfMatch=IfMatch, IfNoneMatch=IfNoneMatch)
+        data = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        with self._lock:
+            stored = self.objects.get((Bucket, Key))
+            # 조건부 쓰기: IfMatch는 현재 ETag와 같을 때만, IfNoneMatch='*'는 객체가 없을 때만 쓴다
+            if (IfMatch is not None and (stored is None or stored['ETag'] != IfMatch)) or \
+                    (IfNoneMatch == '*' and stored is not None):
+                raise client_error('PreconditionFailed', 'PutObject', 412)
+            self.add(Bucket, Key, data, content_type=ContentType, metadata=Metadata)
+        return {'ETag': self.objects[(Bucket, Key)]['ETag']}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._record('delete_object', Bucket, Key)
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        for item in Delete['Objects']:
+            self.delete_object(Bucket, item['Key'])
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', **kwargs):
+        self._record('list_objects_v2', Bucket, Prefix, StartAfter=StartAfter)
+        contents = [{'Key': key, 'ETag': stored['ETag'], 'Size': len(stored['Body']), 'LastModified': stored['LastModified']}
+                    for (bucket, key), stored in sorted(self.objects.items())
+                    if bucket == Bucket and key.startswith(Prefix) and key > StartAfter]
+        return {'Contents': contents, 'IsTruncated': False}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **kwargs):
+        return f"https://{Params['Bucket']}.s3.amazonaws.com/{Params['Key']}?expires={ExpiresIn}"
+
+
+class FakeBedrock:
+    """RegionalBedrockPool 자리에 넣는 stub. 요청을 기록하고 respond(model_id, request)의 결과로 응답한다.
+
+    respond가 문자열을 돌려주면 Nova 텍스트 응답으로 감싸고, dict면 응답 본문 그대로 쓴다.
+    스트리밍 호출은 텍스트를 chunk_chars 글자씩 나눠 contentBlockDelta 이벤트로 돌려준다.
+    """
+
+    def __init__(self, respond, chunk_chars: int = 16):
+        self.respond = respond
+        self.chunk_chars = chunk_chars
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def _document(self, modelId, body):
+        request = json.loads(body)
+        with self._lock:
+            self.requests.append((modelId, request))
+        result = self.respond(modelId, request)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def invoke_model(self, budget_ms=None, modelId=None, body=None, **kwargs):
+        result = self._document(modelId, body)
+        if isinstance(result, str):
+            result = {'output': {'message': {'content': [{'text': result}]}}}
+        return {'body': Body(json.dumps(result).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, budget_ms=None, modelId=None, body=None, **kwargs):
+        text = self._document(modelId, body)
+        events = [{'chunk': {'bytes': json.dumps({'contentBlockDelta': {'delta': {'text': text[i:i + self.chunk_chars]}}})}}
+                  for i in range(0, len(text), self.chunk_chars)]
+        return {'body': iter(events)}
+
+    def snapshot(self):
+        return {}
+
+
+class LambdaContext:
+    def __init__(self, remaining_ms: int = 60000):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def image_bytes(size=(64, 48), fmt='JPEG', color=(200, 120, 40)):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def fake_s3():
+    return FakeS3()
+
+
+@pytest.fixture
+def load_lambda(monkeypatch):
+    """stack/lambda/<name>/app.py를 매번 새 모듈로 불러온다.
+
+    함수마다 파일 이름이 app.py라 sys.modules에 넣지 않고 '<name>_app'이라는 이름으로 따로 만들며,
+    설정 상수가 import 시점에 env에서 정해지므로 env를 먼저 바꾼 뒤 불러온다.
+    clients={'s3': fake_s3}처럼 주면 그 서비스의 boto3.client는 stub을 돌려준다.
+    """
+    def load(name, clients=None, **env):
+        for variable, value in {**LAMBDA_ENV, **env}.items():
+            monkeypatch.setenv(variable, value)
+        if clients:
+            # import 시점에 만든 client(캐시/저장소가 붙잡고 있는 것 포함)까지 stub을 쓰도록 boto3.client를 바꿔 둔다
+            real_client = boto3.client
+
+            def client(service, *args, **kwargs):
+                return clients[service] if service in clients else real_client(service, *args, **kwargs)
+
+            monkeypatch.setattr(boto3, 'client', client)
+        spec = importlib.util.spec_from_file_location(f'{name}_app', os.path.join(LAMBDA_DIR, name, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    return load
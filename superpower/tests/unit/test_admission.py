@@ -0,0 +1,213 @@
+import io
+import json
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from sp_common import admission
+
+from .conftest import image_bytes
+
+
+def _encode(image, fmt, **save_args):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **save_args)
+    return buffer.getvalue()
+
+
+def _tiff_with_ifd_at(offset, width, height, order='<'):
+    """첫 IFD를 offset에 둔 (본문 없는) TIFF 헤더. ImageWidth는 SHORT, ImageLength는 LONG으로 쓴다."""
+    magic = b'II*\x00' if order == '<' else b'MM\x00*'
+    header = magic + struct.pack(order + 'I', offset)
+    ifd = struct.pack(order + 'H', 3)
+    ifd += struct.pack(order + 'HHIH2x', 256, 3, 1, width)
+    ifd += struct.pack(order + 'HHII', 257, 4, 1, height)
+    ifd += struct.pack(order + 'HHII', 258, 3, 1, 8)
+    return header + b'\x00' * (offset - len(header)) + ifd + b'\x00' * 4
+
+
+def _heif(brand, *sizes):
+    data = struct.pack('>I', 24) + b'ftyp' + brand + b'\x00' * 12
+    for width, height in sizes:
+        data += struct.pack('>I', 20) + b'ispe' + b'\x00' * 4 + struct.pack('>II', width, height)
+    return data
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def _png_header(width, height):
+    """IHDR와 빈 IDAT만 있는 PNG (헤더만 읽히고 디코딩은 되지 않는다)."""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', ihdr) + _png_chunk(b'IDAT', b'')
+
+
+def _jpeg_with_late_header(padding_bytes):
+    """SOI 뒤에 큰 APP 세그먼트들을 넣어 SOF를 padding_bytes 뒤로 민 JPEG."""
+    jpeg = image_bytes((320, 240))
+    segments = b''
+    while len(segments) < padding_bytes:
+        segments += b'\xff\xe9' + struct.pack('>H', 65000) + b'\x00' * 64998
+    return jpeg[:2] + segments + jpeg[2:]
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG', 'GIF', 'BMP', 'TIFF', 'WEBP'])
+def test_inspect_reads_dimensions_without_decoding(fmt):
+    assert admission.inspect(image_bytes((321, 123), fmt=fmt)) == {'format': fmt, 'width': 321, 'height': 123}
+
+
+@pytest.mark.parametrize('save_args', [{'lossless': True}, {'quality': 80}])
+def test_webp_size_from_a_truncated_header(save_args):
+    data = _encode(Image.new('RGB', (513, 257), (1, 2, 3)), 'WEBP', **save_args)
+    assert admission._webp_size(data[:30]) == (513, 257)
+
+
+def test_webp_size_extended_header():
+    data = _encode(Image.new('RGBA', (300, 200), (1, 2, 3, 128)), 'WEBP', quality=80)
+    assert data[12:16] == b'VP8X'
+    assert admission._webp_size(data[:30]) == (300, 200)
+    assert admission._webp_size(b'RIFF' + b'\x00' * 26) is None
+
+
+@pytest.mark.parametrize('order', ['<', '>'])
+def test_tiff_size_reads_the_first_ifd(order):
+    assert admission._tiff_size(_tiff_with_ifd_at(8, 640, 70000, order)) == (640, 70000)
+
+
+def test_tiff_size_fetches_a_late_ifd_with_read_at():
+    data = _tiff_with_ifd_at(100_000, 800, 600)
+    reads = []
+
+    def read_at(offset, length):
+        reads.append((offset, length))
+        return data[offset:offset + length]
+
+    assert admission._tiff_size(data[:1024]) is None
+    assert admission._tiff_size(data[:1024], read_at) == (800, 600)
+    assert reads == [(100_000, 2 + 12 * 256)]
+
+
+def test_heif_size_uses_the_largest_ispe():
+    assert admission._heif_size(_heif(b'heic', (512, 512), (4032, 3024))) == ('HEIF', 4032, 3024)
+    assert admission._heif_size(_heif(b'avif', (100, 50))) == ('AVIF', 100, 50)
+    assert admission._heif_size(_heif(b'isom', (100, 50))) is None
+    assert admission._heif_size(_heif(b'heic')) is None
+    assert admission.inspect(_heif(b'heic', (4032, 3024))) == {'format': 'HEIF', 'width': 4032, 'height': 3024}
+
+
+def test_inspect_flags_decompression_bombs_and_non_images():
+    assert admission.inspect(_png_header(100_000, 100_000))['bomb']
+    assert admission.inspect(b'%PDF-1.7 not an image') is None
+    assert admission.inspect(b'') is None
+
+
+@pytest.mark.parametrize('info, kwargs, reason', [
+    (None, {}, 'not_image'),
+    ({'format': None, 'width': None, 'height': None, 'bomb': 'too big'}, {}, 'too_many_pixels'),
+    ({'format': 'ICO', 'width': 16, 'height': 16}, {}, 'unsupported_format'),
+    ({'format': 'JPEG', 'width': 16, 'height': 16}, {'total_bytes': 11, 'max_bytes': 10}, 'too_large'),
+    ({'format': 'JPEG', 'width': 5000, 'height': 5000}, {'max_pixels': 24_999_999}, 'too_many_pixels'),
+])
+def test_check_reasons(info, kwargs, reason):
+    with pytest.raises(admission.Rejected) as rejected:
+        admission.check(info, **kwargs)
+    assert rejected.value.reason == reason
+
+
+def test_check_limits_can_be_disabled():
+    info = {'format': 'ICO', 'width': 10_000, 'height': 10_000}
+    assert admission.check(info, total_bytes=10 ** 9, max_pixels=0, max_bytes=0, formats=None) is info
+
+
+def test_admit_bytes():
+    assert admission.admit_bytes(image_bytes((10, 10)))['format'] == 'JPEG'
+    with pytest.raises(admission.Rejected):
+        admission.admit_bytes(image_bytes((100, 100)), max_bytes=10)
+
+
+def test_admit_returns_the_body_of_small_objects(fake_s3):
+    data = image_bytes((64, 48), fmt='PNG')
+    fake_s3.add('uploads', 'a.png', data, content_type='image/png', etag='"e1"')
+    info = admission.admit(fake_s3, 'uploads', 'a.png', probe_bytes=4096)
+
+    assert info['body'] == data
+    assert (info['format'], info['width'], info['total_bytes'], info['content_type'], info['etag']) == \
+        ('PNG', 64, len(data), 'image/png', '"e1"')
+
+
+def test_admit_probes_only_the_header_of_large_objects(fake_s3):
+    data = _encode(Image.effect_noise((800, 600), 60).convert('RGB'), 'PNG')
+    fake_s3.add('uploads', 'big.png', data)
+    info = admission.admit(fake_s3, 'uploads', 'big.png', probe_bytes=1024)
+
+    assert info['body'] is None
+    assert (info['probed_bytes'], info['total_bytes']) == (1024, len(data))
+    [(_, _, _, params)] = fake_s3.calls
+    assert params['Range'] == 'bytes=0-1023'
+
+
+def test_admit_rejects_large_objects_before_downloading(fake_s3):
+    fake_s3.add('uploads', 'big.png', _encode(Image.effect_noise((800, 600), 60).convert('RGB'), 'PNG'))
+    with pytest.raises(admission.Rejected) as rejected:
+        admission.admit(fake_s3, 'uploads', 'big.png', probe_bytes=1024, max_bytes=10_000)
+    assert rejected.value.reason == 'too_large' and rejected.value.info['width'] == 800
+
+
+def test_admit_widens_the_probe_for_late_jpeg_headers(fake_s3):
+    data = _jpeg_with_late_header(120_000)
+    fake_s3.add('uploads', 'exif.jpg', data)
+    info = admission.admit(fake_s3, 'uploads', 'exif.jpg', probe_bytes=64 * 1024)
+
+    assert (info['format'], info['width'], info['height']) == ('JPEG', 320, 240)
+    assert [params['Range'] for _, _, _, params in fake_s3.calls] == ['bytes=0-65535', 'bytes=0-262143']
+
+
+def test_admit_reads_only_the_late_tiff_ifd(fake_s3):
+    data = _tiff_with_ifd_at(300_000, 9000, 9000)
+    fake_s3.add('uploads', 'scan.tif', data)
+
+    with pytest.raises(admission.Rejected) as rejected:
+        admission.admit(fake_s3, 'uploads', 'scan.tif', probe_bytes=4096, max_pixels=40_000_000)
+    assert rejected.value.reason == 'too_many_pixels'
+    assert [params['Range'] for _, _, _, params in fake_s3.calls] == ['bytes=0-4095', 'bytes=300000-303073']
+
+
+def test_admit_format_allowlist(fake_s3):
+    icon = image_bytes((16, 16), fmt='ICO')
+    fake_s3.add('uploads', 'favicon.ico', icon)
+
+    with pytest.raises(admission.Rejected) as rejected:
+        admission.admit(fake_s3, 'uploads', 'favicon.ico', formats=admission.MODEL_INPUT_FORMATS)
+    assert rejected.value.reason == 'unsupported_format'
+    assert admission.admit(fake_s3, 'uploads', 'favicon.ico', formats=None)['format'] == 'ICO'
+
+
+def test_heif_uploads_are_not_model_inputs(fake_s3):
+    # image_prep이 디코딩하지 못하는 HEIC/AVIF는 모델까지 보내지 않고 들어올 때 거른다
+    fake_s3.add('uploads', 'photo.heic', _heif(b'heic', (4032, 3024)))
+    with pytest.raises(admission.Rejected) as rejected:
+        admission.admit(fake_s3, 'uploads', 'photo.heic', formats=admission.MODEL_INPUT_FORMATS)
+    assert rejected.value.reason == 'unsupported_format'
+
+
+def test_admit_rejects_text_and_empty_objects(fake_s3):
+    fake_s3.add('uploads', 'notes.txt', b'hello')
+    fake_s3.add('uploads', 'empty.jpg', b'')
+    for key in ('notes.txt', 'empty.jpg'):
+        with pytest.raises(admission.Rejected) as rejected:
+            admission.admit(fake_s3, 'uploads', key)
+        assert rejected.value.reason == 'not_image'
+
+
+def test_make_pet_rejects_unsupported_uploads_before_calling_models(load_lambda, fake_s3):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false', FALLBACK_POOL_ENABLED='false')
+    fake_s3.add('uploads', 'c1/notes.txt', b'this is not an image')
+
+    body = json.dumps({'bucket': 'uploads', 'key': 'c1/notes.txt', 'sync': 'true'})
+    response = app.lambda_handler({'httpMethod': 'POST', 'body': body}, None)
+    assert response['statusCode'] == 400
+    assert 'not_image' in response['body']
+    assert ('sp-complete-bucket', 'c1/notes.txt') not in fake_s3.objects
@@ -0,0 +1,250 @@
+import json
+import time
+
+import pytest
+
+from sp_common import cache as cache_module
+
+from .conftest import FakeBedrock, image_bytes
+
+
+def emotions_model(model_id, request):
+    """이미지마다 joy 점수가 다르도록 base64 길이로 점수를 정한다."""
+    return 'A dragon.\nEMOTIONS: {"emotions":[{"name":"joy","score":%d},{"name":"설렘","score":4},{"name":"평온","score":2}]}' \
+        % (len(request['messages'][0]['content'][0]['image']['source']['bytes']) % 16)
+
+
+class FakeApiGateway:
+    def __init__(self):
+        self.messages = []
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.messages.append((ConnectionId, json.loads(Data)))
+
+
+@pytest.fixture
+def gateway():
+    return FakeApiGateway()
+
+
+@pytest.fixture
+def load_analyze(load_lambda, fake_s3, gateway, monkeypatch):
+    def load(respond=emotions_model, **env):
+        app = load_lambda('analyzeSentiment', clients={'s3': fake_s3, 'apigatewaymanagementapi': gateway}, **env)
+        monkeypatch.setattr(app, 'bedrock', FakeBedrock(respond))
+        return app
+
+    return load
+
+
+@pytest.fixture
+def analyze(load_analyze):
+    return load_analyze()
+
+
+def _batch(app, **body):
+    response = app.lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def _add_photos(fake_s3, count, prefix='c1/'):
+    keys = [f'{prefix}photo{i}.jpg' for i in range(count)]
+    for i, key in enumerate(keys):
+        fake_s3.add('uploads', key, image_bytes((64 + i, 48), color=(i * 20, 100, 100)))
+    return keys
+
+
+def test_prefix_batch_analyzes_listed_images_in_order(analyze, fake_s3):
+    keys = _add_photos(fake_s3, 3)
+    fake_s3.add('uploads', 'c1/', b'')
+    fake_s3.add('uploads', 'c2/other.jpg', image_bytes())
+
+    status, body = _batch(analyze, bucket='uploads', prefix='c1/')
+    assert status == 200
+    assert [result['key'] for result in body['results']] == keys
+    assert all(result['source'] == 'model' and len(result['emotions']) == 3 for result in body['results'])
+    summary = body['summary']
+    assert (summary['total'], summary['model'], summary['fallback'], summary['truncated']) == (3, 3, 0, False)
+    # 목록 조회의 ETag를 쓰므로 결과 캐시 확인에 HEAD를 하지 않는다
+    assert fake_s3.count('head_object') == 0
+
+
+def test_key_batch_is_deduplicated_and_truncated(load_analyze, fake_s3):
+    app = load_analyze(BATCH_MAX_KEYS='2')
+    keys = _add_photos(fake_s3, 3)
+
+    status, body = _batch(app, bucket='uploads', keys=[keys[0], keys[0], keys[1], keys[2]])
+    assert [result['key'] for result in body['results']] == [keys[0], keys[1]]
+    assert body['summary']['truncated'] is True
+
+    status, body = _batch(app, bucket='uploads', prefix='c1/')
+    assert [result['key'] for result in body['results']] == keys[:2]
+    assert body['summary']['truncated'] is True
+
+
+def test_batch_reports_rejected_and_failed_images(analyze, fake_s3):
+    _add_photos(fake_s3, 1)
+    fake_s3.add('uploads', 'c1/notes.txt', b'just some text, not an image at all')
+    fake_s3.add('uploads', 'c1/truncated.jpg', image_bytes()[:200])
+
+    status, body = _batch(analyze, bucket='uploads', prefix='c1/')
+    sources = {result['key']: result['source'] for result in body['results']}
+    assert sources['c1/photo0.jpg'] == 'model'
+    assert sources['c1/notes.txt'] == 'rejected'
+    assert all('warning' in result for result in body['results'] if result['source'] != 'model')
+    assert body['summary']['rejected'] >= 1
+
+
+def test_batch_without_bucket_is_rejected(analyze):
+    assert _batch(analyze, prefix='c1/')[0] == 400
+
+
+@pytest.mark.parametrize('body', [
+    {'keys': 'c1/photo0.jpg'},
+    {'keys': ['c1/photo0.jpg', 7]},
+    {'keys': ['c1/photo0.jpg', '']},
+    {'keys': {'c1/photo0.jpg': True}},
+    {'prefix': ['c1/']},
+])
+def test_malformed_batches_are_rejected(analyze, fake_s3, body):
+    status, payload = _batch(analyze, bucket='uploads', **body)
+    assert status == 400 and payload['message']
+    assert analyze.bedrock.requests == [] and fake_s3.calls == []
+
+
+def test_oversized_key_batches_are_rejected(load_analyze, fake_s3):
+    app = load_analyze(BATCH_MAX_KEYS='2', BATCH_MAX_REQUEST_KEYS='3')
+    keys = _add_photos(fake_s3, 4)
+
+    assert _batch(app, bucket='uploads', keys=keys)[0] == 400
+    assert _batch(app, bucket='uploads', keys=keys[:3])[1]['summary']['truncated'] is True
+
+
+def test_large_batches_stream_each_result(load_analyze, fake_s3, gateway):
+    app = load_analyze(PROGRESS_ENABLED='true', BATCH_STREAM_MIN_KEYS='3')
+    keys = _add_photos(fake_s3, 3)
+
+    _batch(app, bucket='uploads', prefix='c1/')
+    stages = [(connection_id, message['stage']) for connection_id, message in gateway.messages]
+    assert stages == [('c1', 'emotions')] * 3 + [('c1', 'summary')]
+    assert sorted(message['key'] for _, message in gateway.messages[:3]) == keys
+    assert [message['completed'] for _, message in gateway.messages[:3]] == [1, 2, 3]
+
+
+def test_small_batches_are_not_streamed(load_analyze, fake_s3, gateway):
+    app = load_analyze(PROGRESS_ENABLED='true', BATCH_STREAM_MIN_KEYS='3')
+    _add_photos(fake_s3, 2)
+
+    _batch(app, bucket='uploads', prefix='c1/')
+    assert gateway.messages == []
+
+
+def test_summarize_counts_sources_and_ranks_emotions(analyze):
+    results = [
+        {'source': 'model', 'emotions': [{'name': 'joy', 'score': 10}, {'name': '설렘', 'score': 4},
+                                         {'name': '평온', 'score': 2}]},
+        {'source': 'cache', 'emotions': [{'name': 'joy', 'score': 6}, {'name': '설렘', 'score': 8},
+                                         {'name': '긴장', 'score': 1}]},
+        {'source': 'fallback', 'emotions': [{'name': 'joy', 'score': 0}, {'name': '분노', 'score': 0},
+                                            {'name': '공포', 'score': 0}]},
+    ]
+    summary = analyze._summarize(results, 12.34)
+
+    assert (summary['total'], summary['model'], summary['cache'], summary['fallback']) == (3, 1, 1, 1)
+    # 기본 감정(fallback)은 평균과 순위에 넣지 않는다
+    assert summary['meanJoy'] == 8
+    assert summary['topEmotions'] == [{'name': '설렘', 'count': 2, 'meanScore': 6},
+                                      {'name': '긴장', 'count': 1, 'meanScore': 1},
+                                      {'name': '평온', 'count': 1, 'meanScore': 2}]
+    assert analyze._summarize([], 0)['meanJoy'] is None
+
+
+def _single(app, key, if_none_match=None):
+    event = {'httpMethod': 'POST', 'body': json.dumps({'bucket': 'uploads', 'key': key})}
+    if if_none_match is not None:
+        event['headers'] = {'If-None-Match': if_none_match}
+    return app.lambda_handler(event, None)
+
+
+def _uploaded_event(key, etag):
+    return {'detail': {'bucket': {'name': 'uploads'}, 'object': {'key': key, 'etag': etag}}}
+
+
+def test_normalize_and_extract_etag(analyze):
+    assert [analyze._normalize_etag(value) for value in ('"abc"', 'W/"abc"', ' abc ', '', None, '""')] == \
+        ['abc', 'abc', 'abc', None, None, None]
+    assert analyze._extract_etag(_uploaded_event('c1/a.jpg', 'abc')) == 'abc'
+    # HTTP 요청의 ETag는 예전 버전일 수 있으므로 믿지 않는다
+    assert analyze._extract_etag({'headers': {'If-None-Match': '"abc"'}, 'body': '{"etag": "abc"}'}) is None
+    assert analyze._if_none_match({'headers': {'if-none-match': 'W/"abc"'}}) == 'abc'
+
+
+def test_repeated_http_request_is_served_from_the_result_cache(analyze, fake_s3):
+    [key] = _add_photos(fake_s3, 1)
+    etag = fake_s3.objects[('uploads', key)]['ETag']
+
+    first = _single(analyze, key)
+    assert first['statusCode'] == 200 and first['headers']['ETag'] == etag
+    reads = fake_s3.count('get_object')
+
+    second = _single(analyze, key)
+    assert json.loads(second['body'])['emotions'] == json.loads(first['body'])['emotions']
+    assert second['headers']['ETag'] == etag
+    # RESULT_ETAG_TTL 안의 반복 요청은 HEAD도 하지 않고, 이미지를 다시 받거나 모델을 다시 부르지도 않는다
+    assert fake_s3.count('head_object') == 1 and fake_s3.count('get_object') == reads
+    assert len(analyze.bedrock.requests) == 1
+
+
+def test_remembered_etag_expires_and_is_rechecked_with_head(analyze, fake_s3, monkeypatch):
+    [key] = _add_photos(fake_s3, 1)
+    first_etag = _single(analyze, key)['headers']['ETag']
+    fake_s3.add('uploads', key, image_bytes((200, 100), color=(10, 200, 30)))
+
+    # TTL 안에서는 바뀐 원본을 아직 모른다 (이전 버전 결과)
+    assert _single(analyze, key)['headers']['ETag'] == first_etag
+    later = time.time() + analyze.RESULT_ETAG_TTL + 1
+    monkeypatch.setattr(cache_module.time, 'time', lambda: later)
+    response = _single(analyze, key)
+    assert response['headers']['ETag'] == fake_s3.objects[('uploads', key)]['ETag'] != first_etag
+    assert fake_s3.count('head_object') == 2
+
+
+def test_matching_if_none_match_returns_304(analyze, fake_s3):
+    [key] = _add_photos(fake_s3, 1)
+    etag = _single(analyze, key)['headers']['ETag']
+
+    response = _single(analyze, key, if_none_match=etag)
+    assert (response['statusCode'], response['body'], response['headers']['ETag']) == (304, '', etag)
+
+
+def test_stale_if_none_match_gets_the_current_version(load_analyze, fake_s3):
+    analyze = load_analyze(RESULT_ETAG_TTL_SECONDS='0')
+    [key] = _add_photos(fake_s3, 1)
+    old_etag = _single(analyze, key)['headers']['ETag']
+    fake_s3.add('uploads', key, image_bytes((200, 100), color=(10, 200, 30)))
+
+    response = _single(analyze, key, if_none_match=old_etag)
+    assert response['statusCode'] == 200
+    assert response['headers']['ETag'] == fake_s3.objects[('uploads', key)]['ETag'] != old_etag
+    assert len(analyze.bedrock.requests) == 2
+
+
+def test_event_etag_skips_the_head_request(analyze, fake_s3):
+    [key] = _add_photos(fake_s3, 1)
+    etag = fake_s3.objects[('uploads', key)]['ETag'].strip('"')
+
+    for _ in range(2):
+        assert analyze.lambda_handler(_uploaded_event(key, etag), None)['statusCode'] == 200
+    assert fake_s3.count('head_object') == 0
+    assert len(analyze.bedrock.requests) == 1
+
+
+def test_fallback_results_are_not_cached_or_tagged(load_analyze, fake_s3):
+    app = load_analyze(respond=lambda model_id, request: RuntimeError('throttled'))
+    [key] = _add_photos(fake_s3, 1)
+
+    for _ in range(2):
+        response = _single(app, key)
+        assert 'ETag' not in response['headers']
+        assert json.loads(response['body'])['warning'] == 'throttled'
+    assert len(app.bedrock.requests) == 2
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from atlas import build_atlas, crop_decode_scale, face_crop_boxes, pack_shelves, scale_boxes, slice_atlas, tile_sizes
+
+
+def _face(number, size, color):
+    return {'face_number': number, 'source_key': f'c1/{number}.jpg', 'bbox': [0, 0, size[0], size[1]],
+            'confidence': 99.0, 'image': Image.new('RGB', size, color)}
+
+
+def test_face_crop_boxes_adds_margin_and_clamps_to_image():
+    details = [
+        {'BoundingBox': {'Left': 0.25, 'Top': 0.25, 'Width': 0.5, 'Height': 0.5}},
+        {'BoundingBox': {'Left': 0.0, 'Top': 0.9, 'Width': 0.2, 'Height': 0.2}},
+    ]
+    boxes = face_crop_boxes(details, 200, 100)
+
+    # 여백은 짧은 변의 10%: 100x50 얼굴이면 5px
+    assert boxes.tolist() == [[45, 20, 155, 80], [0, 88, 42, 100]]
+    assert face_crop_boxes([], 200, 100).shape == (0, 4)
+
+
+def test_crop_decode_scale_keeps_every_crop_above_the_minimum():
+    boxes = np.array([[0, 0, 1000, 800], [0, 0, 600, 600]])
+    # 600px 얼굴이 256px 이상 남아야 하므로 256/600까지만 줄인다
+    assert crop_decode_scale(boxes, 256) == pytest.approx(256 / 600)
+    assert crop_decode_scale(np.array([[0, 0, 200, 100]]), 256) == 1.0
+    assert crop_decode_scale(boxes, 0) == 1.0
+    assert crop_decode_scale(np.empty((0, 4)), 256) == 1.0
+
+
+def test_scale_boxes_maps_to_decoded_coordinates():
+    boxes = np.array([[100, 50, 500, 450], [0, 0, 1, 1]])
+    assert scale_boxes(boxes, 0.5, 0.25).tolist() == [[50, 12, 250, 112], [0, 0, 1, 1]]
+
+
+def test_tile_sizes_keeps_aspect_ratio_and_small_tiles():
+    assert tile_sizes([(1024, 512), (100, 300), (40, 40)], 256).tolist() == [[256, 128], [85, 256], [40, 40]]
+    assert tile_sizes([(1024, 512)], 0).tolist() == [[1024, 512]]
+
+
+def test_pack_shelves_wraps_rows_in_input_order():
+    positions, size = pack_shelves(np.array([[60, 30], [50, 40], [30, 10], [90, 20]]), max_width=120)
+
+    assert positions.tolist() == [[0, 0], [60, 0], [0, 40], [30, 40]]
+    assert size == (120, 60)
+
+
+def test_pack_shelves_places_wide_tile_alone():
+    positions, size = pack_shelves(np.array([[300, 10], [20, 20]]), max_width=100)
+
+    assert positions.tolist() == [[0, 0], [0, 10]]
+    assert size == (300, 30)
+
+
+def test_build_and_slice_atlas_round_trip():
+    faces = [_face(1, (40, 30), (255, 0, 0)), _face(2, (600, 300), (0, 255, 0)), _face(3, (20, 50), (0, 0, 255))]
+    atlas_image, index = build_atlas(faces, 'c1', 'c1/atlas.jpg', max_width=300, tile_edge=200)
+
+    assert (index['width'], index['height']) == atlas_image.size
+    assert [face['rect'] for face in index['faces']] == [[0, 0, 40, 30], [40, 0, 200, 100], [240, 0, 20, 50]]
+
+    sliced = slice_atlas(atlas_image, index)
+    assert [face['face_number'] for face in sliced] == [1, 2, 3]
+    assert [face['image'].size for face in sliced] == [(40, 30), (200, 100), (20, 50)]
+    assert [face['image'].getpixel((5, 5)) for face in sliced] == [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+    assert sliced[1]['bbox'] == [0, 0, 600, 300]
@@ -0,0 +1,145 @@
+import threading
+
+import pytest
+from botocore.exceptions import ReadTimeoutError
+
+from sp_common.bedrock_pool import RegionalBedrockPool, is_retryable, parse_model_regions, parse_regions
+
+from .conftest import client_error
+
+NOVA_PRO = 'amazon.nova-pro-v1:0'
+
+
+class RegionClients:
+    """client_factory 자리에 넣는 stub. 리전별 behavior(model_id)가 응답을 돌려주거나 예외를 올린다."""
+
+    def __init__(self, **behaviors):
+        self.behaviors = {region.replace('_', '-'): behavior for region, behavior in behaviors.items()}
+        self.calls = []
+        self.budgets = []
+        self._lock = threading.Lock()
+
+    def __call__(self, region, budget_ms):
+        with self._lock:
+            self.budgets.append((region, budget_ms))
+        return _Client(self, region)
+
+
+class _Client:
+    def __init__(self, owner, region):
+        self.owner = owner
+        self.region = region
+
+    def invoke_model(self, modelId, **kwargs):
+        with self.owner._lock:
+            self.owner.calls.append((self.region, modelId))
+        result = self.owner.behaviors[self.region](modelId)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def ok(model_id):
+    return {'body': model_id}
+
+
+def throttled(model_id):
+    return client_error('ThrottlingException', 'InvokeModel', 429)
+
+
+def test_parse_regions_and_model_regions():
+    assert parse_regions(' ap-northeast-2, ,us-east-1 ') == ['ap-northeast-2', 'us-east-1']
+    assert parse_regions('', default='us-west-2') == ['us-west-2']
+    assert parse_model_regions('') == {}
+    assert parse_model_regions('{"m": {"us-east-1": "us.m"}}') == {'m': {'us-east-1': 'us.m'}}
+
+
+def test_retryable_errors():
+    assert is_retryable(throttled(None))
+    assert is_retryable(ReadTimeoutError(endpoint_url='https://bedrock'))
+    assert not is_retryable(client_error('ValidationException', 'InvokeModel'))
+    assert not is_retryable(ValueError('bad body'))
+
+
+def test_candidates_map_model_ids_and_keep_preference_order():
+    pool = RegionalBedrockPool(['ap-northeast-2', 'us-east-1'], model_regions={
+        NOVA_PRO: {'us-east-1': 'us.nova', 'ap-northeast-2': 'apac.nova', 'us-west-2': 'us.nova'},
+    })
+    assert pool.candidates(NOVA_PRO) == [('ap-northeast-2', 'apac.nova'), ('us-east-1', 'us.nova'),
+                                         ('us-west-2', 'us.nova')]
+    assert pool.candidates('other') == [('ap-northeast-2', 'other'), ('us-east-1', 'other')]
+
+
+def test_faster_regions_are_tried_first_and_failed_regions_cool_down():
+    pool = RegionalBedrockPool(['a', 'b', 'c'], cooldown_seconds=60)
+    pool._record_success('a', 900)
+    pool._record_success('b', 100)
+    assert [region for region, _ in pool.candidates('m')] == ['c', 'b', 'a']
+
+    pool._record_error('c')
+    assert [region for region, _ in pool.candidates('m')] == ['b', 'a', 'c']
+    assert pool.snapshot()['regions']['c'] == {'latencyMs': None, 'errorRate': 0.2, 'calls': 1, 'errors': 1,
+                                               'coolingDown': True}
+
+
+def test_throttled_region_fails_over_to_the_next():
+    clients = RegionClients(ap_northeast_2=throttled, us_east_1=ok)
+    pool = RegionalBedrockPool(['ap-northeast-2', 'us-east-1'], client_factory=clients)
+
+    assert pool.invoke_model(modelId='m', body='{}') == {'body': 'm'}
+    assert [region for region, _ in clients.calls] == ['ap-northeast-2', 'us-east-1']
+    snapshot = pool.snapshot()
+    assert snapshot['failovers'] == 1 and snapshot['regions']['ap-northeast-2']['coolingDown']
+    # 다음 호출은 식어 있는 리전을 건너뛰고 성공한 리전부터 간다
+    pool.invoke_model(modelId='m', body='{}')
+    assert clients.calls[-1][0] == 'us-east-1' and len(clients.calls) == 3
+
+
+def test_non_retryable_errors_are_raised_without_failover():
+    clients = RegionClients(a=lambda model_id: client_error('ValidationException', 'InvokeModel'), b=ok)
+    pool = RegionalBedrockPool(['a', 'b'], client_factory=clients)
+
+    with pytest.raises(Exception, match='ValidationException'):
+        pool.invoke_model(modelId='m', body='{}')
+    assert clients.calls == [('a', 'm')]
+    # 요청 오류는 리전 점수에 넣지 않는다
+    assert pool.snapshot()['regions']['a']['errors'] == 0
+
+
+def test_last_region_error_is_raised_when_all_fail():
+    clients = RegionClients(a=throttled, b=throttled)
+    pool = RegionalBedrockPool(['a', 'b'], client_factory=clients)
+
+    with pytest.raises(Exception, match='ThrottlingException'):
+        pool.invoke_model(modelId='m', body='{}')
+    assert len(clients.calls) == 2
+
+
+def test_budget_is_passed_to_the_client_factory():
+    clients = RegionClients(a=ok)
+    RegionalBedrockPool(['a'], client_factory=clients).invoke_model(modelId='m', body='{}', budget_ms=5000)
+
+    [(region, budget)] = clients.budgets
+    assert region == 'a' and 4900 < budget <= 5000
+
+
+def test_slow_primary_is_hedged_to_the_next_region():
+    release = threading.Event()
+
+    def slow(model_id):
+        release.wait(5)
+        return {'body': 'slow'}
+
+    clients = RegionClients(a=slow, b=ok)
+    pool = RegionalBedrockPool(['a', 'b'], client_factory=clients, hedge_percentile=0.5, hedge_min_samples=3)
+    for elapsed_ms in (10, 20, 30):
+        pool._record_success('a', elapsed_ms)
+    pool._record_success('b', 100)
+    try:
+        assert pool.invoke_model(modelId='m', body='{}') == {'body': 'm'}
+    finally:
+        release.set()
+
+    snapshot = pool.snapshot()
+    assert (snapshot['hedges'], snapshot['hedgeWins']) == (1, 1)
+    assert sorted(region for region, _ in clients.calls) == ['a', 'b']
@@ -0,0 +1,205 @@
+import os
+
+import pytest
+
+from sp_common import cache as cache_module
+from sp_common.cache import DiskLRUCache, LRUCache, S3JsonStore, TieredCache, cache_key
+
+from .conftest import image_bytes
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, 'time', clock)
+    return clock
+
+
+class BrokenStore:
+    def get(self, key):
+        raise RuntimeError('read failed')
+
+    def put(self, key, value, stored_at):
+        raise RuntimeError('write failed')
+
+
+def test_cache_key_is_stable_and_separates_parts():
+    assert cache_key('bucket', 'key', '"etag"') == cache_key('bucket', 'key', '"etag"')
+    assert cache_key('a', 'bc') != cache_key('ab', 'c')
+    assert cache_key('a', None) == cache_key('a', '')
+    assert len(cache_key('x')) == 64
+
+
+def test_lru_evicts_least_recently_used(clock):
+    lru = LRUCache(max_entries=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+
+    assert (lru.get('a'), lru.get('b'), lru.get('c')) == (1, None, 3)
+    assert len(lru) == 2
+
+
+def test_lru_ttl(clock):
+    lru = LRUCache(max_entries=4, ttl_seconds=10)
+    lru.put('a', 1)
+    clock.now += 10
+    assert lru.get('a') == 1
+    clock.now += 1
+    assert lru.get('a') is None
+    assert len(lru) == 0
+
+
+def test_tiered_cache_promotes_persistent_hits_and_counts_stats(fake_s3, clock):
+    store = S3JsonStore(fake_s3, 'cache-bucket', '_cache/')
+    writer = TieredCache('test', ttl_seconds=60, persistent_store=store)
+    writer.put('k', {'faces': [1, 2]})
+    assert ('cache-bucket', '_cache/k.json') in fake_s3.objects
+
+    # 새 컨테이너: 메모리는 비어 있고 영속 계층에서 읽어 메모리로 올린다
+    reader = TieredCache('test', ttl_seconds=60, persistent_store=store)
+    assert reader.get('k') == {'faces': [1, 2]}
+    assert reader.get('k') == {'faces': [1, 2]}
+    assert reader.get('missing') is None
+    assert reader.stats == {'memory_hits': 1, 'persistent_hits': 1, 'misses': 1, 'writes': 0, 'expired': 0, 'errors': 0}
+    assert fake_s3.count('get_object') == 2
+
+    reader.reset_stats()
+    assert reader.stats['memory_hits'] == 0
+
+
+def test_tiered_cache_ttl_uses_original_store_time(fake_s3, clock):
+    store = S3JsonStore(fake_s3, 'cache-bucket', '_cache/')
+    TieredCache('test', ttl_seconds=60, persistent_store=store).put('k', 'value')
+
+    clock.now += 50
+    reader = TieredCache('test', ttl_seconds=60, persistent_store=store)
+    assert reader.get('k') == 'value'
+    # 메모리로 올라간 항목도 영속 계층에 저장된 시각 기준으로 만료된다
+    clock.now += 11
+    assert reader.get('k') is None
+    assert reader.stats['misses'] == 1
+
+
+def test_tiered_cache_deletes_expired_persistent_entries_on_read(fake_s3, clock):
+    store = S3JsonStore(fake_s3, 'cache-bucket', '_cache/')
+    TieredCache('test', ttl_seconds=60, persistent_store=store).put('k', 'value')
+
+    clock.now += 61
+    reader = TieredCache('test', ttl_seconds=60, persistent_store=store)
+    assert reader.get('k') is None
+    assert ('cache-bucket', '_cache/k.json') not in fake_s3.objects
+    assert reader.stats['expired'] == 1
+
+
+def test_tiered_cache_sweep_deletes_entries_older_than_the_ttl(fake_s3, clock):
+    cache = TieredCache('test', ttl_seconds=60, persistent_store=S3JsonStore(fake_s3, 'cache-bucket', '_cache/'))
+    cache.put('old', 1)
+    clock.now += 61
+    cache.put('new', 2)
+    fake_s3.add('cache-bucket', 'other/keep.json', b'{}')
+
+    assert cache.sweep() == 1
+    assert sorted(key for _, key in fake_s3.objects) == ['_cache/new.json', 'other/keep.json']
+    assert TieredCache('test', persistent_store=S3JsonStore(fake_s3, 'cache-bucket', '_cache/')).sweep() == 0
+
+
+def test_tiered_cache_skips_large_values_and_swallows_store_errors(fake_s3, clock):
+    small = TieredCache('test', persistent_store=S3JsonStore(fake_s3, 'cache-bucket', '_cache/'), max_item_bytes=16)
+    small.put('big', 'x' * 100)
+    assert fake_s3.count('put_object') == 0
+    assert small.get('big') == 'x' * 100
+
+    broken = TieredCache('test', persistent_store=BrokenStore())
+    broken.put('k', 'v')
+    assert broken.get('k') == 'v'
+    assert broken.get('other') is None
+    assert broken.stats['errors'] == 2
+    assert broken.log_stats()['misses'] == 1
+
+
+def test_crop_face_reuses_cached_detections_for_the_same_etag(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('crop_face', CROP_FACE_DETECTION_CACHE_BUCKET='cache-bucket')
+    monkeypatch.setattr(app, 's3', fake_s3)
+    monkeypatch.setattr(app.detection_cache.persistent, 's3', fake_s3)
+    detections = []
+
+    def detect(detector, image, image_data):
+        detections.append(detector.name)
+        return [{'BoundingBox': {'Left': 0.25, 'Top': 0.25, 'Width': 0.5, 'Height': 0.5}, 'Confidence': 98.0}]
+
+    monkeypatch.setattr(app.detector_policy, 'detect', detect)
+    fake_s3.add('uploads', 'c1/a.jpg', image_bytes((200, 100)), etag='"v1"')
+
+    first = app._prepare_image_faces('uploads', 'c1/a.jpg')
+    second = app._prepare_image_faces('uploads', 'c1/a.jpg')
+    assert len(detections) == 1
+    assert first['faces'][0]['bbox'] == second['faces'][0]['bbox'] == [45, 20, 155, 80]
+
+    # 객체가 바뀌면(ETag) 다시 검출한다
+    fake_s3.add('uploads', 'c1/a.jpg', image_bytes((200, 100)), etag='"v2"')
+    app._prepare_image_faces('uploads', 'c1/a.jpg')
+    assert len(detections) == 2
+
+
+def test_disk_lru_evicts_least_recently_used_by_size(tmp_path):
+    disk = DiskLRUCache(str(tmp_path), max_bytes=10)
+    disk.put('a', b'1234')
+    disk.put('b', b'5678')
+    assert disk.get('a') == b'1234'
+    disk.put('c', b'90ab')
+
+    assert disk.get('b') is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['a', 'c']
+    assert disk.size_bytes == 8
+    assert disk.stats == {'hits': 1, 'misses': 1, 'writes': 3, 'evictions': 1, 'errors': 0}
+
+
+def test_disk_lru_overwrite_and_oversized_values(tmp_path):
+    disk = DiskLRUCache(str(tmp_path), max_bytes=10)
+    disk.put('a', b'12345678')
+    disk.put('a', b'12')
+    assert (disk.get('a'), disk.size_bytes) == (b'12', 2)
+
+    disk.put('big', b'x' * 11)
+    assert disk.get('big') is None and not (tmp_path / 'big').exists()
+
+
+def test_disk_lru_reloads_existing_files_and_drops_partial_writes(tmp_path):
+    first = DiskLRUCache(str(tmp_path), max_bytes=100)
+    first.put('old', b'old')
+    first.put('new', b'new')
+    (tmp_path / 'new.123.tmp').write_bytes(b'half')
+    os.utime(tmp_path / 'old', (1, 1))
+
+    # 새 컨테이너가 같은 디렉터리를 열면 수정 시각 순서로 다시 읽고, 더 작은 한도에 맞춰 오래된 것부터 지운다
+    second = DiskLRUCache(str(tmp_path), max_bytes=3)
+    assert second.get('new') == b'new' and second.get('old') is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['new']
+
+
+def test_disk_lru_treats_missing_files_as_misses(tmp_path):
+    disk = DiskLRUCache(str(tmp_path), max_bytes=100)
+    disk.put('a', b'1234')
+    (tmp_path / 'a').unlink()
+
+    assert disk.get('a') is None
+    assert (disk.size_bytes, disk.stats['errors']) == (0, 1)
+
+
+def test_crop_face_sweeps_the_detection_cache_on_schedule(load_lambda, fake_s3, clock):
+    app = load_lambda('crop_face', clients={'s3': fake_s3}, CROP_FACE_DETECTION_CACHE_BUCKET='cache-bucket')
+    app.detection_cache.put('k', [])
+    clock.now += app.DETECTION_CACHE_TTL + 1
+
+    assert app.lambda_handler({'sweepDetectionCache': True}, None) == {'deleted': 1}
+    assert not fake_s3.objects
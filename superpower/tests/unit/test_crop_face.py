@@ -0,0 +1,124 @@
+import pytest
+from PIL import Image
+
+from .conftest import image_bytes
+
+FACES_PER_KEY = {'c1/a.jpg': 2, 'c1/b.jpg': 0, 'c1/c.jpg': 3, 'c1/d.jpg': 1}
+
+
+@pytest.fixture
+def crop_face(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('crop_face', CROP_FACE_DETECTION_CACHE='false')
+    monkeypatch.setattr(app, 's3', fake_s3)
+
+    def prepare(bucket, key, deadline=None):
+        if key.endswith('broken.jpg'):
+            raise ValueError('cannot identify image file')
+        faces = [{'image': Image.new('RGB', (8, 8)), 'confidence': 99.0, 'detection_method': 'stub',
+                  'bbox': [0, 0, 8, 8]} for _ in range(FACES_PER_KEY.get(key, 1))]
+        return {'source_key': key, 'faces': faces}
+
+    monkeypatch.setattr(app, '_prepare_image_faces', prepare)
+    return app
+
+
+def _numbers(results):
+    return [(result['source_key'], [face['face_number'] for face in result['faces']]) for result in results]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_faces_are_numbered_in_key_order(crop_face, fake_s3, workers):
+    keys = list(FACES_PER_KEY)
+    results, total = crop_face._process_images('in', keys, 'c1', start_index=5, max_workers=workers)
+
+    assert total == 11
+    assert _numbers(results) == [('c1/a.jpg', [6, 7]), ('c1/b.jpg', []), ('c1/c.jpg', [8, 9, 10]), ('c1/d.jpg', [11])]
+    assert [result['faces_found'] for result in results] == [2, 0, 3, 1]
+    assert {key for (bucket, key) in fake_s3.objects} == {f'c1/{number}.jpg' for number in range(6, 12)}
+
+
+def test_sequential_and_concurrent_paths_agree_on_failures(crop_face, fake_s3, monkeypatch):
+    upload_face = crop_face._upload_face
+
+    def flaky_upload(source_key, connection_id, face_index, face):
+        # c.jpg의 두 번째 얼굴만 실패한다
+        if source_key == 'c1/c.jpg' and face_index == 4:
+            raise RuntimeError('upload failed')
+        return upload_face(source_key, connection_id, face_index, face)
+
+    monkeypatch.setattr(crop_face, '_upload_face', flaky_upload)
+    keys = ['c1/a.jpg', 'c1/broken.jpg', 'c1/c.jpg', 'c1/d.jpg']
+
+    outcomes = []
+    for workers in (1, 4):
+        fake_s3.objects.clear()
+        results, total = crop_face._process_images('in', keys, 'c1', max_workers=workers, emit_face=flaky_upload)
+        outcomes.append((_numbers(results), [bool(result.get('error')) for result in results], total))
+
+    assert outcomes[0] == outcomes[1]
+    numbers, errors, total = outcomes[0]
+    # 검출 전에 실패한 이미지는 번호를 쓰지 않고, 업로드에 실패한 이미지는 번호를 비운 채로 남긴다
+    assert numbers == [('c1/a.jpg', [1, 2]), ('c1/broken.jpg', []), ('c1/c.jpg', []), ('c1/d.jpg', [6])]
+    assert errors == [False, True, True, False]
+    assert total == 6
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_partial_uploads_are_deleted_when_an_image_fails(crop_face, fake_s3, monkeypatch, workers):
+    upload_face = crop_face._upload_face
+
+    def flaky_upload(source_key, connection_id, face_index, face):
+        if source_key == 'c1/c.jpg' and face_index == 5:
+            raise RuntimeError('upload failed')
+        return upload_face(source_key, connection_id, face_index, face)
+
+    # _discard_faces는 업로드 모드(_upload_face)일 때만 지우므로 모듈 함수 자체를 바꿔 끼운다
+    monkeypatch.setattr(crop_face, '_upload_face', flaky_upload)
+    crop_face._process_images('in', ['c1/a.jpg', 'c1/c.jpg'], 'c1', max_workers=workers, emit_face=flaky_upload)
+
+    # c.jpg의 3, 4번은 올라갔다가 지워지고 a.jpg의 1, 2번만 남는다
+    assert sorted(key for (bucket, key) in fake_s3.objects) == ['c1/1.jpg', 'c1/2.jpg']
+    assert fake_s3.count('delete_object') == 2
+
+
+def test_atlas_mode_collects_faces_without_uploading(crop_face, fake_s3):
+    results, total = crop_face._process_images('in', ['c1/a.jpg', 'c1/c.jpg'], 'c1', max_workers=4,
+                                               emit_face=crop_face._collect_atlas_face)
+
+    assert total == 5
+    assert all(face['s3_key'] == 'c1/atlas.jpg' for result in results for face in result['faces'])
+    assert fake_s3.count('put_object') == 0
+
+
+def _noise_face(number, key):
+    return {'face_number': number, 'source_image': key, 'bbox': [0, 0, 64, 64], 'confidence': 99.0,
+            'image': Image.effect_noise((64, 64), 80).convert('RGB')}
+
+
+def test_incremental_atlas_reuses_lossless_tiles(crop_face, fake_s3):
+    first = _noise_face(1, 'c1/a.jpg')
+    original = first['image'].tobytes()
+    crop_face._write_face_atlas('c1', [{'faces': [first]}], include_previous=True)
+
+    for number in (2, 3):
+        crop_face._write_face_atlas('c1', [{'faces': [_noise_face(number, 'c1/b.jpg')]}], include_previous=True)
+
+    # 이전 얼굴은 JPEG이 아니라 atlas.png에서 잘라 쓰므로 여러 번 다시 합쳐도 픽셀이 그대로다
+    tiles = crop_face._load_face_atlas('c1')
+    assert [face['face_number'] for face in tiles] == [1, 2, 3]
+    assert tiles[0]['image'].tobytes() == original
+    assert fake_s3.objects[('sp-croped-faces-bucket', 'c1/atlas.jpg')]['ContentType'] == 'image/jpeg'
+
+
+def test_faces_are_cropped_from_a_reduced_decode(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('crop_face', CROP_FACE_DETECTION_CACHE='false', CROP_FACE_CROP_MIN_EDGE='256')
+    monkeypatch.setattr(app, 's3', fake_s3)
+    fake_s3.add('in', 'c1/big.jpg', image_bytes((4000, 3000)))
+    box = {'Left': 0.25, 'Top': 0.25, 'Width': 0.25, 'Height': 0.25}
+    monkeypatch.setattr(app.detector_policy, 'detect', lambda detector, image, data: [{'BoundingBox': box,
+                                                                                         'Confidence': 99.0}])
+
+    [face] = app._prepare_image_faces('in', 'c1/big.jpg')['faces']
+    # 원본 기준 1150x900 크롭을 1/4 draft(1000x750)에서 잘랐다. bbox는 원본 좌표 그대로다
+    assert face['bbox'] == [925, 675, 2075, 1575]
+    assert face['image'].size == (288, 225)
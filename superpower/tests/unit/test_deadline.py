@@ -0,0 +1,144 @@
+import pytest
+
+from sp_common import deadline as deadline_module
+from sp_common.deadline import Deadline, StageSkipped, TimeoutClientPool, parse_budgets
+
+from .conftest import FakeBedrock, LambdaContext, image_bytes
+
+
+class FakeClock:
+    """deadline 모듈의 time 자리에 넣는 시계. advance()로만 움직인다."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, ms):
+        self.now += ms / 1000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(deadline_module, 'time', fake)
+    return fake
+
+
+def test_parse_budgets_overrides_defaults_and_skips_bad_items():
+    defaults = {'analysis': 20000, 'upload': 5000}
+    assert parse_budgets(' analysis:1500, generation:30000, bogus, prompt:x, :10', defaults) == \
+        {'analysis': 1500, 'upload': 5000, 'generation': 30000}
+    assert parse_budgets(None, defaults) == defaults
+    assert defaults == {'analysis': 20000, 'upload': 5000}
+
+
+def test_unbounded_deadline_allows_everything(clock):
+    deadline = Deadline(budgets={'analysis': 10}, minimums={'analysis': 10_000})
+    assert not deadline.bounded
+    assert deadline.remaining_ms() is None and deadline.budget_ms('analysis') is None
+    assert deadline.allows('analysis', reserve_ms=50_000)
+    with deadline.run('analysis') as budget:
+        assert budget is None
+
+
+def test_budget_is_capped_by_stage_budget_and_remaining_time(clock):
+    deadline = Deadline(LambdaContext(10_500), budgets={'analysis': 4000}, safety_ms=500)
+    assert deadline.remaining_ms() == 10_000
+    assert deadline.budget_ms('analysis') == 4000
+    assert deadline.budget_ms('analysis', reserve_ms=7000) == 3000
+    # 예산이 정해지지 않은 단계는 남은 시간 전부
+    assert deadline.budget_ms('upload', reserve_ms=1000) == 9000
+
+    clock.advance(9_500)
+    assert deadline.remaining_ms() == 500
+    clock.advance(5_000)
+    assert deadline.remaining_ms() == 0
+
+
+def test_allows_records_skipped_stages_under_their_minimum(clock):
+    deadline = Deadline(LambdaContext(6_000), minimums={'generation': 8000, 'upload': 1000})
+    assert deadline.allows('upload')
+    assert not deadline.allows('generation', label='c1/a.jpg')
+
+    [skipped] = deadline.report()['stages']
+    assert (skipped['stage'], skipped['status']) == ('c1/a.jpg', 'skipped')
+    assert skipped['reason'] == 'budget 5500ms < minimum 8000ms'
+
+
+def test_run_records_elapsed_time_and_failures(clock):
+    deadline = Deadline(LambdaContext(30_500), budgets={'analysis': 20000})
+    with deadline.run('analysis', reserve_ms=15_000) as budget:
+        clock.advance(1000)
+    assert budget == 15_000
+
+    with pytest.raises(ValueError):
+        with deadline.run('prompt'):
+            raise ValueError('bad json')
+
+    ran, failed = deadline.report()['stages']
+    assert ran == {'stage': 'analysis', 'status': 'ran', 'budgetMs': 15_000, 'elapsedMs': 1000.0}
+    assert (failed['status'], failed['reason'], failed['budgetMs']) == ('failed', 'bad json', 29_000)
+    assert deadline.report()['remainingMs'] == 29_000
+
+
+@pytest.mark.parametrize('budget_ms, seconds', [
+    (1000, 1), (2999, 2), (7999, 5), (8000, 8), (59_000, 45), (600_000, 60),
+])
+def test_timeout_for_picks_the_longest_step_within_budget(budget_ms, seconds):
+    assert TimeoutClientPool('bedrock-runtime', 'us-east-1').timeout_for(budget_ms) == seconds
+
+
+def test_timeout_for_skips_budgets_below_the_smallest_step():
+    pool = TimeoutClientPool('bedrock-runtime', 'us-east-1')
+    with pytest.raises(StageSkipped, match='smallest client timeout 1s'):
+        pool.timeout_for(999)
+
+
+def test_timeout_clients_are_reused_per_step():
+    pool = TimeoutClientPool('bedrock-runtime', 'us-east-1', connect_timeout=2)
+    client = pool.get(1500)
+    assert pool.get(1999) is client
+    assert pool.get(2000) is not client
+
+    config = client.meta.config
+    assert (config.read_timeout, config.connect_timeout, config.retries['total_max_attempts']) == (1, 1, 1)
+
+
+def test_make_pet_skips_model_stages_when_time_is_short(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false', FALLBACK_POOL_ENABLED='false',
+                      PET_RENDITIONS='')
+    monkeypatch.setattr(app, 'bedrock', FakeBedrock(lambda model_id, request: pytest.fail('model was called')))
+    original = image_bytes((320, 240))
+    fake_s3.add('uploads', 'c1/photo.jpg', original)
+
+    deadline = Deadline(LambdaContext(3_000), app.STAGE_BUDGETS, app.STAGE_MINIMUMS)
+    result = app._process_upload('uploads', 'c1/photo.jpg', 'two-stage', deadline=deadline)
+
+    assert result['prompt'].startswith('Original uploaded image')
+    assert fake_s3.objects[('sp-complete-bucket', 'c1/photo.jpg')]['Body'] == original
+    skipped = {stage['stage'] for stage in result['stages']['stages'] if stage['status'] == 'skipped'}
+    assert {'analysis', 'fallback_generation'} <= skipped
+
+
+def test_make_pet_s3_stages_use_budget_bound_clients(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false', FALLBACK_POOL_ENABLED='false',
+                      PET_RENDITIONS='')
+    monkeypatch.setattr(app, 'bedrock', FakeBedrock(lambda model_id, request: pytest.fail('model was called')))
+    fake_s3.add('uploads', 'c1/photo.jpg', image_bytes((320, 240)))
+    budgets = []
+    monkeypatch.setattr(app.s3_timeout_clients, 'get', lambda budget_ms: budgets.append(budget_ms) or fake_s3)
+
+    deadline = Deadline(LambdaContext(3_000), app.STAGE_BUDGETS, app.STAGE_MINIMUMS)
+    app._process_upload('uploads', 'c1/photo.jpg', 'two-stage', deadline=deadline)
+
+    # s3_read는 upload 몫을 남기고, upload는 남은 시간 전부를 timeout 예산으로 받는다
+    assert len(budgets) == 2
+    assert budgets[0] <= 3_000 - 500 - app.STAGE_MINIMUMS['upload']
+    assert 0 < budgets[1] <= 3_000 - 500
+
+
+def test_make_pet_without_a_deadline_keeps_the_default_s3_client(load_lambda, fake_s3):
+    app = load_lambda('make_pet', clients={'s3': fake_s3})
+    assert app._s3_for(None) is app.s3
@@ -0,0 +1,127 @@
+import io
+
+import pytest
+from PIL import Image
+
+import detectors
+from detectors import DetectorPolicy, LocalFaceDetector, RekognitionDetector, build_jpeg_proxy
+
+from .conftest import image_bytes
+
+
+class FakeRekognition:
+    def __init__(self):
+        self.requests = []
+
+    def detect_faces(self, Image, Attributes):
+        self.requests.append(Image['Bytes'])
+        return {'FaceDetails': [{'BoundingBox': {'Left': 0.1, 'Top': 0.2, 'Width': 0.3, 'Height': 0.4},
+                                 'Confidence': 99.5, 'Landmarks': [], 'Pose': {}}]}
+
+
+class StubDetector:
+    def __init__(self, name, available=True):
+        self.name = name
+        self.available = available
+
+    def detect(self, image, image_data):
+        return []
+
+
+class FakeTime:
+    def __init__(self, ticks):
+        self.ticks = ticks
+
+    def perf_counter(self):
+        return next(self.ticks)
+
+
+def _open(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_proxy_keeps_small_images_as_is():
+    data = image_bytes((320, 200))
+    assert build_jpeg_proxy(_open(data), data, max_edge=1600) is data
+    assert build_jpeg_proxy(_open(data), data, max_edge=0) is data
+
+
+def test_proxy_downscales_to_max_edge():
+    data = image_bytes((3000, 1500))
+    proxy = build_jpeg_proxy(_open(data), data, max_edge=600)
+
+    with _open(proxy) as image:
+        assert image.format == 'JPEG'
+        assert max(image.size) <= 600
+        assert image.size[0] == 2 * image.size[1]
+
+
+def test_downscale_returns_a_new_image():
+    image = Image.new('L', (800, 400), 90)
+    proxy = detectors._downscale(image, 200, 'L')
+    assert proxy.size == (200, 100) and proxy is not image
+    assert image.size == (800, 400)
+
+    small = detectors._downscale(image, 1000, 'L')
+    assert small is not image and small.size == image.size
+
+
+def test_proxy_reencodes_images_over_the_byte_limit():
+    buffer = io.BytesIO()
+    Image.effect_noise((320, 200), 60).convert('RGB').save(buffer, format='PNG')
+    data = buffer.getvalue()
+    proxy = build_jpeg_proxy(_open(data), data, max_edge=1600, max_bytes=len(data) - 1)
+
+    assert _open(proxy).format == 'JPEG'
+    assert len(proxy) < len(data)
+
+
+def test_rekognition_detector_sends_proxy_and_keeps_box_and_confidence():
+    client = FakeRekognition()
+    data = image_bytes((2400, 1200))
+    faces = RekognitionDetector(client, max_edge=800).detect(_open(data), data)
+
+    assert faces == [{'BoundingBox': {'Left': 0.1, 'Top': 0.2, 'Width': 0.3, 'Height': 0.4}, 'Confidence': 99.5}]
+    assert max(_open(client.requests[0]).size) <= 800
+
+
+@pytest.mark.skipif(not hasattr(detectors.cv2, 'CascadeClassifier'),
+                    reason='needs opencv-python-headless 4.x (crop_face/requirements.txt)')
+def test_local_detector_finds_nothing_in_a_flat_image():
+    data = image_bytes((640, 480))
+    assert LocalFaceDetector(max_edge=320).detect(_open(data), data) == []
+
+
+def test_policy_fixed_modes():
+    remote, local = StubDetector('remote'), StubDetector('local')
+    assert DetectorPolicy(remote, local, mode='rekognition').choose(10, 10) is remote
+    assert DetectorPolicy(remote, local, mode='local').choose(4000, 4000) is local
+
+
+def test_auto_policy_uses_local_for_small_images_when_available():
+    remote, local = StubDetector('remote'), StubDetector('local')
+    policy = DetectorPolicy(remote, local, mode='auto', local_max_pixels=640 * 640)
+
+    assert policy.choose(640, 640) is local
+    assert policy.choose(1024, 768) is remote
+    assert DetectorPolicy(remote, StubDetector('local', available=False), mode='auto',
+                          local_max_pixels=640 * 640).choose(10, 10) is remote
+
+
+def test_auto_policy_diverts_on_latency_but_still_probes_remote(monkeypatch):
+    remote, local = StubDetector('remote'), StubDetector('local')
+    policy = DetectorPolicy(remote, local, mode='auto', latency_threshold_ms=500, smoothing=0.5, probe_every=3)
+
+    ticks = iter([0.0, 1.0, 10.0, 10.2, 20.0, 25.0])
+    monkeypatch.setattr(detectors, 'time', FakeTime(ticks))
+    policy.detect(remote, None, b'')
+    assert policy.remote_latency_ms == pytest.approx(1000)
+
+    choices = [policy.choose(4000, 3000) for _ in range(6)]
+    assert choices == [local, local, remote, local, local, remote]
+
+    # 빠른 Rekognition 호출은 이동평균을 내리고, 로컬 검출 시간은 반영하지 않는다
+    policy.detect(remote, None, b'')
+    assert policy.remote_latency_ms == pytest.approx(600)
+    policy.detect(local, None, b'')
+    assert policy.remote_latency_ms == pytest.approx(600)
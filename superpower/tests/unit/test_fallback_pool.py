@@ -0,0 +1,151 @@
+import base64
+import io
+
+import pytest
+from botocore.exceptions import ClientError
+from PIL import Image
+
+from fallback_pool import S3FallbackPool
+
+from .conftest import FakeBedrock, LambdaContext, client_error, image_bytes
+
+POOL_BUCKET = 'pool-bucket'
+
+
+def test_take_prefers_the_requested_prompt_and_deletes_the_image(fake_s3):
+    pool = S3FallbackPool(fake_s3, POOL_BUCKET, prompt_count=3)
+    pool.add(0, b'zero')
+    pool.add(2, b'two-a')
+    pool.add(2, b'two-b')
+    assert pool.depth() == {0: 1, 1: 0, 2: 2}
+
+    index, image, remaining = pool.take(preferred_index=2)
+    assert (index, remaining) == (2, 1) and image in (b'two-a', b'two-b')
+    assert pool.depth() == {0: 1, 1: 0, 2: 1}
+    assert all(key.startswith('fallback-pool/') and key.endswith('.png') for _, key in fake_s3.objects)
+
+
+def test_empty_pool_counts_misses(fake_s3):
+    pool = S3FallbackPool(fake_s3, POOL_BUCKET, prompt_count=2)
+    assert pool.stats() == {'hits': 0, 'misses': 0, 'hitRate': None}
+    assert pool.take() is None
+
+    pool.add(1, b'one')
+    assert pool.take(preferred_index=0)[0] == 1
+    assert pool.stats() == {'hits': 1, 'misses': 1, 'hitRate': 0.5}
+
+
+def test_take_skips_images_taken_by_another_container(fake_s3, monkeypatch):
+    pool = S3FallbackPool(fake_s3, POOL_BUCKET, prompt_count=1)
+    pool.add(0, b'kept')
+    listed = pool._keys(0) + ['fallback-pool/0/already-taken.png']
+    monkeypatch.setattr(pool, '_keys', lambda index: list(listed))
+
+    assert pool.take()[1] == b'kept'
+
+
+def test_take_raises_other_s3_errors(fake_s3, monkeypatch):
+    pool = S3FallbackPool(fake_s3, POOL_BUCKET, prompt_count=1)
+    pool.add(0, b'image')
+
+    def denied(**kwargs):
+        raise client_error('AccessDenied', status=403)
+
+    monkeypatch.setattr(fake_s3, 'get_object', denied)
+    with pytest.raises(ClientError):
+        pool.take()
+
+
+def _png(shade):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (shade, 0, 0)).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def analysis_down(model_id, request):
+    """분석(Nova Pro)은 실패하고 Canvas만 응답한다."""
+    if 'taskType' not in request:
+        return RuntimeError('analysis throttled')
+    return {'images': [_png(i) for i in range(request['imageGenerationConfig']['numberOfImages'])]}
+
+
+@pytest.fixture
+def make_pet(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false', PET_RENDITIONS='',
+                      FALLBACK_POOL_BUCKET=POOL_BUCKET, FALLBACK_POOL_TARGET='7')
+    monkeypatch.setattr(app, 'bedrock', FakeBedrock(analysis_down))
+    fake_s3.add('uploads', 'c1/photo.jpg', image_bytes((320, 240)))
+    return app
+
+
+def canvas_requests(app):
+    return [request for model_id, request in app.bedrock.requests if model_id == app.CANVAS_MODEL_ID]
+
+
+def test_analysis_failure_is_served_from_the_pool(make_pet, fake_s3):
+    make_pet.fallback_pool.add(1, b'pooled-png')
+    result = make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage')
+
+    assert result['prompt'] == make_pet.FALLBACK_PROMPTS[1] + ' (fallback pool)'
+    assert fake_s3.objects[('sp-complete-bucket', 'c1/photo.jpg')]['Body'] == b'pooled-png'
+    assert canvas_requests(make_pet) == []
+    assert make_pet.fallback_pool.depth()[1] == 0
+
+
+def test_empty_pool_falls_back_to_live_generation(make_pet):
+    result = make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage')
+
+    assert result['prompt'].endswith(' (fallback generation)')
+    [request] = canvas_requests(make_pet)
+    assert request['textToImageParams']['text'] + ' (fallback generation)' == result['prompt']
+
+
+def test_pool_read_errors_fall_back_to_live_generation(make_pet, monkeypatch):
+    def broken_take(preferred_index=None):
+        raise client_error('AccessDenied', 'ListObjectsV2', 403)
+
+    monkeypatch.setattr(make_pet.fallback_pool, 'take', broken_take)
+    assert make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage')['prompt'].endswith(' (fallback generation)')
+
+
+def test_refill_tops_each_prompt_up_to_target_in_batches(make_pet):
+    make_pet.fallback_pool.add(0, b'existing')
+    result = make_pet.lambda_handler({'refillFallbackPool': True}, None)
+
+    prompt_count = len(make_pet.FALLBACK_PROMPTS)
+    assert result['added'] == {0: 6, **{index: 7 for index in range(1, prompt_count)}}
+    assert make_pet.fallback_pool.depth() == {index: 7 for index in range(prompt_count)}
+    # Canvas 한 번에 최대 5장이므로 6장/7장은 두 번씩 부른다
+    assert sorted(r['imageGenerationConfig']['numberOfImages'] for r in canvas_requests(make_pet)) == \
+        sorted([5, 1] + [5, 2] * (prompt_count - 1))
+
+
+def test_refill_stops_a_prompt_when_canvas_fails(make_pet, monkeypatch):
+    monkeypatch.setattr(make_pet, 'bedrock', FakeBedrock(lambda model_id, request: RuntimeError('quota')))
+    result = make_pet.lambda_handler({'refillFallbackPool': True}, None)
+
+    assert set(result['added'].values()) == {0}
+    assert len(make_pet.bedrock.requests) == len(make_pet.FALLBACK_PROMPTS)
+
+
+def test_refill_passes_the_remaining_budget_to_canvas(make_pet, monkeypatch):
+    budgets = []
+    invoke = make_pet.bedrock.invoke_model
+
+    def invoke_model(budget_ms=None, **kwargs):
+        budgets.append(budget_ms)
+        return invoke(budget_ms=budget_ms, **kwargs)
+
+    monkeypatch.setattr(make_pet.bedrock, 'invoke_model', invoke_model)
+    make_pet.lambda_handler({'refillFallbackPool': True}, LambdaContext(remaining_ms=15000))
+
+    assert budgets and all(budget is not None and budget <= 15000 - 500 - make_pet.STAGE_MINIMUMS['upload']
+                           for budget in budgets)
+
+
+def test_refill_stops_when_the_invocation_is_out_of_time(make_pet):
+    result = make_pet.lambda_handler({'refillFallbackPool': True}, LambdaContext(remaining_ms=5000))
+
+    assert set(result['added'].values()) == {0}
+    assert canvas_requests(make_pet) == []
+    assert sorted(result['skipped']) == sorted(f'refill-{index}' for index in range(len(make_pet.FALLBACK_PROMPTS)))
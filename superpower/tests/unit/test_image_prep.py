@@ -0,0 +1,84 @@
+import io
+
+import pytest
+from PIL import Image
+
+from sp_common.image_prep import describe, prepare_for_model, sniff_format
+
+from .conftest import image_bytes
+
+
+def _noise(size, fmt, mode='RGB', **save_args):
+    image = Image.effect_noise(size, 50).convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **save_args)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('fmt, expected', [
+    ('JPEG', 'jpeg'), ('PNG', 'png'), ('GIF', 'gif'), ('WEBP', 'webp'), ('BMP', 'bmp'), ('TIFF', 'tiff'),
+])
+def test_sniff_format(fmt, expected):
+    assert sniff_format(image_bytes(fmt=fmt)) == expected
+
+
+def test_sniff_format_heif_brands_and_unknown():
+    assert sniff_format(b'\x00\x00\x00\x18ftypheic' + b'\x00' * 8) == 'heic'
+    assert sniff_format(b'\x00\x00\x00\x18ftypavif' + b'\x00' * 8) == 'avif'
+    assert sniff_format(b'%PDF-1.7') is None
+
+
+def test_small_supported_image_is_passed_through():
+    data = image_bytes((320, 240), fmt='PNG')
+    result = prepare_for_model(data, max_edge=1280)
+
+    assert result['bytes'] is data
+    assert (result['format'], result['reencoded'], result['saved_bytes']) == ('png', False, 0)
+    assert (result['width'], result['height']) == (320, 240)
+
+
+def test_large_image_is_downscaled_to_jpeg():
+    data = _noise((2400, 1600), 'PNG')
+    result = prepare_for_model(data, max_edge=600)
+
+    assert result['reencoded'] and result['format'] == 'jpeg'
+    assert (result['width'], result['height']) == (600, 400)
+    assert Image.open(io.BytesIO(result['bytes'])).size == (600, 400)
+    assert result['saved_bytes'] > 0
+    assert 'png' in describe(result)
+
+
+def test_unsupported_format_is_converted_even_when_small():
+    result = prepare_for_model(image_bytes((100, 80), fmt='BMP'), max_edge=1280)
+
+    assert (result['original_format'], result['format'], result['reencoded']) == ('bmp', 'jpeg', True)
+    assert Image.open(io.BytesIO(result['bytes'])).format == 'JPEG'
+
+
+def test_transparency_is_flattened_on_white():
+    image = Image.new('RGBA', (2000, 1000), (0, 0, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    result = prepare_for_model(buffer.getvalue(), max_edge=500, max_bytes=10)
+
+    prepared = Image.open(io.BytesIO(result['bytes']))
+    assert prepared.mode == 'RGB'
+    assert all(channel > 245 for channel in prepared.getpixel((10, 10)))
+
+
+def test_exif_orientation_is_applied_before_fitting():
+    image = Image.effect_noise((1600, 800), 50).convert('RGB')
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 90도 회전
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', exif=exif)
+    result = prepare_for_model(buffer.getvalue(), max_edge=400)
+
+    assert Image.open(io.BytesIO(result['bytes'])).size == (200, 400)
+
+
+def test_undecodable_bytes_are_returned_unchanged():
+    result = prepare_for_model(b'not an image')
+
+    assert result['bytes'] == b'not an image'
+    assert (result['format'], result['reencoded']) == ('jpeg', False)
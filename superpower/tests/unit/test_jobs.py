@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from jobs import InMemoryJobStore, LambdaJobQueue, LocalJobQueue, S3JobStore, new_job, update_job
+
+
+class FakeLambda:
+    def __init__(self, error=None):
+        self.error = error
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.error is not None:
+            raise self.error
+        self.invocations.append((FunctionName, InvocationType, json.loads(Payload)))
+
+
+def test_new_and_updated_job_records():
+    job = new_job('uploads', 'c1/a.jpg', 'single', 'conn-1', variants=2, preview=True)
+    assert (job['status'], job['result'], job['error']) == ('queued', None, None)
+    assert job['createdAt'] == job['updatedAt']
+
+    done = update_job(job, 'succeeded', result={'imageKey': 'c1/a.png'})
+    assert done['status'] == 'succeeded' and done['result'] == {'imageKey': 'c1/a.png'}
+    assert done['updatedAt'] >= job['updatedAt']
+    # 원래 레코드는 바꾸지 않는다
+    assert job['status'] == 'queued'
+    assert update_job(done, 'failed', error='boom')['result'] == {'imageKey': 'c1/a.png'}
+
+
+@pytest.mark.parametrize('store_kind', ['memory', 's3'])
+def test_job_stores_round_trip(store_kind, fake_s3):
+    store = InMemoryJobStore() if store_kind == 'memory' else S3JobStore(fake_s3, 'jobs-bucket')
+    job = new_job('uploads', 'c1/a.jpg')
+    assert store.get(job['jobId']) is None
+
+    store.put(job)
+    assert store.get(job['jobId']) == job
+    store.put(update_job(job, 'running'))
+    assert store.get(job['jobId'])['status'] == 'running'
+
+
+def test_lambda_queue_invokes_the_function_asynchronously():
+    client = FakeLambda()
+    job = new_job('uploads', 'c1/a.jpg')
+    LambdaJobQueue(client, 'MakePetFunction').submit(job)
+
+    assert client.invocations == [('MakePetFunction', 'Event', {'petJob': job})]
+
+
+def test_local_queue_runs_jobs_and_joins():
+    done = []
+    queue = LocalJobQueue(lambda job: done.append(job['jobId']), max_workers=2)
+    jobs = [new_job('uploads', f'c1/{i}.jpg') for i in range(5)]
+    for job in jobs:
+        queue.submit(job)
+    queue.join()
+
+    assert sorted(done) == sorted(job['jobId'] for job in jobs)
+
+
+@pytest.fixture
+def processed():
+    return []
+
+
+@pytest.fixture
+def make_pet(load_lambda, fake_s3, monkeypatch, processed):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, JOB_STORE='memory', JOB_QUEUE='local',
+                      NEAR_DUP_ENABLED='false', FALLBACK_POOL_ENABLED='false')
+
+    def process_upload(bucket, key, prompt_mode, connection_id=None, job_id=None, variants=1, preview=False,
+                       deadline=None):
+        processed.append({'key': key, 'mode': prompt_mode, 'connectionId': connection_id, 'jobId': job_id,
+                          'variants': variants, 'preview': preview})
+        if key.endswith('broken.jpg'):
+            raise ValueError('analysis failed')
+        return {'imageKey': key.replace('.jpg', '.png')}
+
+    monkeypatch.setattr(app, '_process_upload', process_upload)
+    return app
+
+
+def _post(app, body):
+    return app.lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+
+
+def _get(app, job_id):
+    response = app.lambda_handler({'httpMethod': 'GET', 'pathParameters': {'jobId': job_id}}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_http_call_returns_202_and_job_completes(make_pet, processed):
+    response = _post(make_pet, {'bucket': 'uploads', 'key': 'c1/a.jpg', 'promptMode': 'single', 'variants': '3',
+                                'connectionId': 'conn-1'})
+    assert response['statusCode'] == 202
+    job_id = json.loads(response['body'])['jobId']
+
+    make_pet.job_queue.join()
+    status, job = _get(make_pet, job_id)
+    assert status == 200
+    assert (job['status'], job['result']) == ('succeeded', {'imageKey': 'c1/a.png'})
+    assert processed == [{'key': 'c1/a.jpg', 'mode': 'single', 'connectionId': 'conn-1', 'jobId': job_id,
+                         'variants': 3, 'preview': False}]
+
+
+def test_failed_job_is_recorded_without_raising(make_pet):
+    job_id = json.loads(_post(make_pet, {'bucket': 'uploads', 'key': 'c1/broken.jpg'})['body'])['jobId']
+    make_pet.job_queue.join()
+
+    status, job = _get(make_pet, job_id)
+    assert (job['status'], job['error'], job['result']) == ('failed', 'analysis failed', None)
+
+
+def test_unknown_job_and_missing_key(make_pet):
+    assert _get(make_pet, 'nope')[0] == 404
+    assert _post(make_pet, {'bucket': 'uploads'})['statusCode'] == 400
+
+
+def test_sync_flag_waits_for_the_result(make_pet):
+    response = _post(make_pet, {'bucket': 'uploads', 'key': 'c1/a.jpg', 'sync': 'true'})
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == {'imageKey': 'c1/a.png'}
+    assert make_pet.job_store is None
+
+
+def test_enqueue_failure_marks_job_failed(make_pet, monkeypatch):
+    monkeypatch.setattr(make_pet, 'job_store', InMemoryJobStore())
+    monkeypatch.setattr(make_pet, 'job_queue', LambdaJobQueue(FakeLambda(error=RuntimeError('throttled')), 'fn'))
+
+    response = _post(make_pet, {'bucket': 'uploads', 'key': 'c1/a.jpg'})
+    assert response['statusCode'] == 500
+    [job] = make_pet.job_store._jobs.values()
+    assert (job['status'], job['error']) == ('failed', 'enqueue failed: throttled')
+
+
+def test_pet_job_event_runs_the_job(make_pet):
+    job = new_job('uploads', 'c1/a.jpg', variants=2)
+    finished = make_pet.lambda_handler({'petJob': job}, None)
+
+    assert finished['status'] == 'succeeded'
+    assert make_pet.job_store.get(job['jobId'])['status'] == 'succeeded'
@@ -0,0 +1,86 @@
+import pytest
+
+from sp_common import vision
+
+from .conftest import FakeBedrock, image_bytes
+
+ANALYSIS_TEXT = 'A small fluffy dragon with round eyes.\nEMOTIONS: {"emotions":[{"name":"joy","score":9},' \
+                '{"name":"평온","score":5},{"name":"설렘","score":3}]}'
+PROMPT_TEXT = '{"text": "a cute baby dragon", "navigationText": "귀여운 아기 용"}'
+
+
+def pet_model(model_id, request):
+    """system 지시문이 있으면 프롬프트 변환, 없으면 비전 분석 요청이다."""
+    return PROMPT_TEXT if 'system' in request else ANALYSIS_TEXT
+
+
+@pytest.fixture
+def load_make_pet(load_lambda, fake_s3, monkeypatch):
+    def load(respond=pet_model, **env):
+        app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false',
+                          FALLBACK_POOL_ENABLED='false', **env)
+        monkeypatch.setattr(app, 'bedrock', FakeBedrock(respond))
+        return app
+
+    return load
+
+
+def test_same_bytes_skip_both_model_calls(load_make_pet):
+    app = load_make_pet()
+    data = image_bytes()
+
+    first = app._get_canvas_prompt(data)
+    assert first['source'] == 'model'
+    assert first['prompt'] == {'text': 'a cute baby dragon', 'navigationText': '귀여운 아기 용'}
+    assert first['analysis'] == 'A small fluffy dragon with round eyes.'
+    assert len(app.bedrock.requests) == 2
+
+    second = app._get_canvas_prompt(data)
+    assert second['source'] == 'cache'
+    assert (second['analysis'], second['prompt']) == (first['analysis'], first['prompt'])
+    assert len(app.bedrock.requests) == 2
+
+
+def test_cached_prompt_survives_a_new_container(load_make_pet, fake_s3):
+    data = image_bytes()
+    load_make_pet()._get_canvas_prompt(data)
+    assert any(key.startswith('prompts/') for (bucket, key) in fake_s3.objects)
+
+    fresh = load_make_pet()
+    assert fresh._get_canvas_prompt(data)['source'] == 'cache'
+    assert fresh.bedrock.requests == []
+
+
+def test_prompt_modes_are_cached_separately(load_make_pet):
+    app = load_make_pet()
+    data = image_bytes()
+    app._get_canvas_prompt(data, mode='two-stage')
+
+    # 지시문이 다르면 프롬프트 캐시 키도 다르다 (비전 분석은 모드와 상관없이 같이 쓴다)
+    assert app._get_canvas_prompt(data, mode='single')['source'] == 'vision-cache'
+    assert app._get_canvas_prompt(data, mode='single')['source'] == 'cache'
+    assert len(app.bedrock.requests) == 3
+
+
+def test_shared_vision_analysis_only_runs_the_prompt_call(load_make_pet):
+    app = load_make_pet()
+    data = image_bytes()
+    app.vision_cache.put(vision.vision_cache_key(vision.content_hash(data)),
+                         vision.parse_response(ANALYSIS_TEXT))
+
+    result = app._get_canvas_prompt(data)
+    assert result['source'] == 'vision-cache'
+    assert [('system' in request) for _, request in app.bedrock.requests] == [True]
+
+
+def test_unusable_prompt_is_not_cached(load_make_pet):
+    # 먼저 시작한 프롬프트 변환과 분석이 끝난 뒤의 재시도가 모두 실패한다
+    responses = iter(['not json at all', 'still not json', PROMPT_TEXT])
+    app = load_make_pet(lambda model_id, request: next(responses) if 'system' in request else ANALYSIS_TEXT)
+    data = image_bytes()
+
+    with pytest.raises(ValueError):
+        app._get_canvas_prompt(data)
+    # 분석 결과는 vision 캐시에 남아 두 번째 호출은 프롬프트 변환만 다시 한다
+    assert app._get_canvas_prompt(data)['source'] == 'vision-cache'
+    assert app._get_canvas_prompt(data)['source'] == 'cache'
@@ -0,0 +1,184 @@
+import base64
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from sp_common.output_keys import variant_key
+
+from .conftest import FakeBedrock, image_bytes
+
+ANALYSIS_TEXT = 'A small fluffy dragon.\nEMOTIONS: {"emotions":[{"name":"joy","score":9}]}'
+PROMPT_TEXT = '{"text": "a cute baby dragon", "navigationText": "귀여운 아기 용"}'
+COMPLETE_BUCKET = 'sp-complete-bucket'
+
+
+def _png(size, shade):
+    buffer = io.BytesIO()
+    Image.new('RGB', (size, size), (shade % 256, 80, 160)).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def pet_model(model_id, request):
+    """Canvas는 요청한 장 수만큼 (seed + 순번)으로 색을 달리한 PNG를, Nova Pro는 분석/프롬프트 텍스트를 돌려준다."""
+    if 'taskType' in request:
+        config = request['imageGenerationConfig']
+        seed = config.get('seed', 0)
+        return {'images': [_png(config['width'], seed + i) for i in range(config['numberOfImages'])]}
+    return PROMPT_TEXT if 'system' in request else ANALYSIS_TEXT
+
+
+def canvas_requests(app):
+    return [request for model_id, request in app.bedrock.requests if model_id == app.CANVAS_MODEL_ID]
+
+
+@pytest.fixture
+def load_make_pet(load_lambda, fake_s3, monkeypatch):
+    def load(respond=pet_model, **env):
+        env = {'NEAR_DUP_ENABLED': 'false', 'FALLBACK_POOL_ENABLED': 'false', 'PET_RENDITIONS': '', **env}
+        app = load_lambda('make_pet', clients={'s3': fake_s3}, **env)
+        monkeypatch.setattr(app, 'bedrock', FakeBedrock(respond))
+        fake_s3.add('uploads', 'c1/photo.jpg', image_bytes((320, 240)))
+        return app
+
+    return load
+
+
+@pytest.fixture
+def make_pet(load_make_pet):
+    return load_make_pet()
+
+
+def test_variant_keys():
+    assert variant_key('c1/photo.png', 0) == 'c1/photo.png'
+    assert variant_key('c1/photo.png', 3) == 'c1/photo_v3.png'
+    assert variant_key('c1/photo', 1) == 'c1/photo_v1'
+
+
+def test_up_to_five_variants_use_one_canvas_call(make_pet):
+    images = make_pet._generate_variants('a dragon', '', 4, seed=10)
+
+    [request] = canvas_requests(make_pet)
+    assert request['imageGenerationConfig'] == {'numberOfImages': 4, 'width': 1024, 'height': 1024, 'seed': 10}
+    # 빈 negativeText는 보내지 않는다
+    assert 'negativeText' not in request['textToImageParams']
+    assert len(images) == 4
+
+
+def test_more_variants_are_split_into_parallel_calls_with_shifted_seeds(make_pet):
+    images = make_pet._generate_variants('a dragon', 'blurry', 7, seed=make_pet.CANVAS_MAX_SEED - 1)
+
+    configs = sorted((r['imageGenerationConfig']['seed'], r['imageGenerationConfig']['numberOfImages'])
+                     for r in canvas_requests(make_pet))
+    assert configs == [(0, 2), (make_pet.CANVAS_MAX_SEED - 1, 5)]
+    # 결과는 호출 순서(첫 묶음 5장, 다음 묶음 2장)대로 이어 붙인다
+    assert len(images) == 7
+    assert Image.open(io.BytesIO(images[5])).getpixel((0, 0))[0] == 0
+
+
+def test_process_upload_saves_variants_with_original_key_last(make_pet, fake_s3):
+    result = make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage', variants=3)
+
+    assert result['output']['variants'] == ['c1/photo.jpg', 'c1/photo_v1.jpg', 'c1/photo_v2.jpg']
+    puts = [key for operation, bucket, key, _ in fake_s3.calls if operation == 'put_object' and bucket == COMPLETE_BUCKET]
+    assert sorted(puts) == sorted(result['output']['variants'])
+    assert puts[-1] == 'c1/photo.jpg'
+
+    metadata = fake_s3.objects[(COMPLETE_BUCKET, 'c1/photo_v2.jpg')]['Metadata']
+    assert (metadata['variant-index'], metadata['variant-count'], metadata['variant-group']) == ('2', '3', 'c1/photo.jpg')
+    # 분석/프롬프트는 변형 수와 상관없이 한 번씩만 부른다
+    assert len(make_pet.bedrock.requests) == 3
+
+
+def test_same_upload_gets_the_same_seed(make_pet):
+    make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage')
+    make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage')
+
+    first, second = canvas_requests(make_pet)
+    assert first['imageGenerationConfig']['seed'] == second['imageGenerationConfig']['seed']
+
+
+def test_requested_variants_are_clamped(load_make_pet):
+    app = load_make_pet(PET_VARIANTS='2', PET_MAX_VARIANTS='6')
+    assert [app._requested_variants(value) for value in (None, '', 'x', '0', '4', 99)] == [2, 2, 2, 1, 4, 6]
+
+
+class FakeApiGateway:
+    class exceptions:
+        class GoneException(Exception):
+            pass
+
+    def __init__(self):
+        self.messages = []
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.messages.append((ConnectionId, json.loads(Data)))
+
+
+@pytest.fixture
+def image_complete(load_lambda, fake_s3):
+    gateway = FakeApiGateway()
+    app = load_lambda('image_complete', clients={'s3': fake_s3, 'apigatewaymanagementapi': gateway})
+    return app, gateway
+
+
+def _complete_event(key):
+    return {'detail': {'bucket': {'name': COMPLETE_BUCKET}, 'object': {'key': key}}}
+
+
+def test_image_complete_notifies_once_with_all_variant_urls(image_complete, fake_s3, make_pet):
+    app, gateway = image_complete
+    make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage', variants=3)
+
+    for key in ('c1/photo_v1.jpg', 'c1/photo_v2.jpg', 'c1/photo.jpg'):
+        assert app.lambda_handler(_complete_event(key), None)['statusCode'] == 200
+
+    [(connection_id, message)] = gateway.messages
+    assert connection_id == 'c1'
+    assert message['aiPrompt'] == 'a cute baby dragon'
+    assert [url.split('?')[0].rsplit('/', 1)[-1] for url in message['variantUrls']] == ['photo_v1.jpg', 'photo_v2.jpg']
+
+
+def test_preview_is_published_before_the_final_image(make_pet, fake_s3, monkeypatch):
+    gateway = FakeApiGateway()
+    monkeypatch.setattr(make_pet, 'apigateway', gateway)
+    result = make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage', preview=True)
+
+    assert result['output']['preview'] == 'c1/photo_preview.jpg'
+    stored = fake_s3.objects[(COMPLETE_BUCKET, 'c1/photo_preview.jpg')]
+    assert stored['Metadata']['preview'] == 'true'
+    assert Image.open(io.BytesIO(stored['Body'])).size == (make_pet.PREVIEW_SIZE, make_pet.PREVIEW_SIZE)
+
+    # 미리보기와 최종 이미지는 같은 프롬프트/seed로 만든다
+    preview_request, final_request = sorted(canvas_requests(make_pet), key=lambda r: r['imageGenerationConfig']['width'])
+    assert preview_request['imageGenerationConfig']['seed'] == final_request['imageGenerationConfig']['seed']
+    assert preview_request['textToImageParams'] == final_request['textToImageParams']
+
+    stages = [message['stage'] for _, message in gateway.messages]
+    assert stages.index('preview') < stages.index('saved')
+    preview_message = gateway.messages[stages.index('preview')][1]
+    assert 'c1/photo_preview.jpg' in preview_message['previewUrl']
+
+
+def test_preview_failure_does_not_block_the_final_image(load_make_pet, fake_s3):
+    def respond(model_id, request):
+        if request.get('imageGenerationConfig', {}).get('width') == 512:
+            return RuntimeError('preview throttled')
+        return pet_model(model_id, request)
+
+    app = load_make_pet(respond, PREVIEW_SIZE='512')
+    result = app._process_upload('uploads', 'c1/photo.jpg', 'two-stage', preview=True)
+
+    assert result['output']['preview'] is None
+    assert result['prompt'] == 'a cute baby dragon'
+    assert (COMPLETE_BUCKET, 'c1/photo.jpg') in fake_s3.objects
+    assert (COMPLETE_BUCKET, 'c1/photo_preview.jpg') not in fake_s3.objects
+
+
+def test_image_complete_skips_preview_objects(image_complete, make_pet):
+    app, gateway = image_complete
+    make_pet._process_upload('uploads', 'c1/photo.jpg', 'two-stage', preview=True)
+
+    app.lambda_handler(_complete_event('c1/photo_preview.jpg'), None)
+    assert gateway.messages == []
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from .conftest import FakeBedrock, image_bytes
+
+PROMPT_TEXT = '{"text": "a cute baby dragon", "navigationText": "귀여운 아기 용"}'
+
+
+@pytest.fixture
+def make_pet(load_lambda, fake_s3):
+    return load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false', FALLBACK_POOL_ENABLED='false')
+
+
+@pytest.mark.parametrize('raw', [
+    '```json\n{"text": "a dragon", "navigationText": "용"}\n```',
+    'Sure! Here is the prompt: {"text": "a dragon", "navigationText": "용"} Hope it helps.',
+    '{“text”: “a dragon”, “navigationText”: “용”}',
+    '{"text": "a dragon", "navigationText": "용",}',
+])
+def test_repair_json_text_recovers_common_model_mistakes(make_pet, raw):
+    assert json.loads(make_pet._repair_json_text(raw)) == {'text': 'a dragon', 'navigationText': '용'}
+
+
+def test_parse_canvas_prompt_trims_and_defaults_navigation_text(make_pet):
+    assert make_pet._parse_canvas_prompt('{"text": "  a dragon  "}') == {'text': 'a dragon', 'navigationText': ''}
+    assert make_pet._parse_canvas_prompt('```\n{"text": "a", "navigationText": " 용 "}\n```') == \
+        {'text': 'a', 'navigationText': '용'}
+
+
+@pytest.mark.parametrize('raw', [
+    '["text"]',
+    '{"navigationText": "용"}',
+    '{"text": "   "}',
+    '{"text": 3}',
+    '{"text": "a", "navigationText": ["용"]}',
+])
+def test_parse_canvas_prompt_rejects_wrong_schema(make_pet, raw):
+    with pytest.raises(ValueError):
+        make_pet._parse_canvas_prompt(raw)
+
+
+def test_parse_canvas_prompt_raises_when_not_repairable(make_pet):
+    with pytest.raises(json.JSONDecodeError):
+        make_pet._parse_canvas_prompt('no json here')
+
+
+def test_select_prompt_mode(load_lambda):
+    fixed = load_lambda('make_pet', PROMPT_MODE='single')
+    assert fixed._select_prompt_mode('c1/a.jpg') == 'single'
+    assert fixed._select_prompt_mode('c1/a.jpg', requested='two-stage') == 'two-stage'
+    assert fixed._select_prompt_mode('c1/a.jpg', requested='bogus') == 'single'
+    assert load_lambda('make_pet', PROMPT_MODE='bogus')._select_prompt_mode('c1/a.jpg') == 'two-stage'
+
+
+def test_ab_prompt_mode_is_sticky_per_key_and_split_by_percent(load_lambda):
+    ab = load_lambda('make_pet', PROMPT_MODE='ab', PROMPT_MODE_SINGLE_PERCENT='30')
+    keys = [f'c{i}/upload.jpg' for i in range(2000)]
+    modes = [ab._select_prompt_mode(key) for key in keys]
+
+    assert modes == [ab._select_prompt_mode(key) for key in keys]
+    assert 0.25 < modes.count('single') / len(keys) < 0.35
+    assert {load_lambda('make_pet', PROMPT_MODE='ab', PROMPT_MODE_SINGLE_PERCENT=percent)._select_prompt_mode(keys[0])
+            for percent in ('0', '100')} == {'two-stage', 'single'}
+
+
+def test_single_mode_uses_one_image_call(make_pet, monkeypatch):
+    monkeypatch.setattr(make_pet, 'bedrock', FakeBedrock(lambda model_id, request: PROMPT_TEXT))
+
+    result = make_pet._get_canvas_prompt(image_bytes(), mode='single')
+    assert result['source'] == 'model'
+    assert result['prompt'] == {'text': 'a cute baby dragon', 'navigationText': '귀여운 아기 용'}
+    assert result['analysis'] == 'a cute baby dragon'
+
+    [(model_id, request)] = make_pet.bedrock.requests
+    assert model_id == make_pet.ANALYSIS_MODEL_ID
+    assert 'image' in request['messages'][0]['content'][0]
+    assert request['messages'][0]['content'][1]['text'] == make_pet.SINGLE_CALL_INSTRUCTION
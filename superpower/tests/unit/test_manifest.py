@@ -0,0 +1,170 @@
+import json
+
+import pytest
+from PIL import Image
+
+from manifest import (InMemoryManifestStore, ManifestConflict, S3ManifestStore, empty_manifest, pending_entries,
+                      record_results)
+
+from .conftest import LambdaContext
+
+
+def _result(key, numbers, error=None):
+    result = {'source_key': key, 'faces_found': len(numbers), 'faces': [{'face_number': n} for n in numbers]}
+    if error:
+        result['error'] = error
+    return result
+
+
+def test_pending_entries_returns_new_and_changed_objects():
+    manifest = empty_manifest('c1')
+    manifest['processed'] = {'c1/a.jpg': {'etag': '"1"', 'faces': [1]}, 'c1/b.jpg': {'etag': '"2"', 'faces': []}}
+    entries = [{'Key': 'c1/a.jpg', 'ETag': '"1"'}, {'Key': 'c1/b.jpg', 'ETag': '"3"'}, {'Key': 'c1/c.jpg', 'ETag': '"4"'}]
+
+    assert [entry['Key'] for entry in pending_entries(manifest, entries)] == ['c1/b.jpg', 'c1/c.jpg']
+
+
+def test_record_results_skips_failed_images_and_keeps_last_index():
+    manifest = empty_manifest('c1')
+    manifest['last_index'] = 7
+    entries = [{'Key': 'c1/a.jpg', 'ETag': '"1"'}, {'Key': 'c1/b.jpg', 'ETag': '"2"'}]
+
+    record_results(manifest, entries, [_result('c1/a.jpg', [8, 9]), _result('c1/b.jpg', [], error='boom')], 9)
+    assert manifest['processed'] == {'c1/a.jpg': {'etag': '"1"', 'faces': [8, 9]}}
+    assert manifest['last_index'] == 9
+
+    # 번호는 되돌리지 않는다 (지운 얼굴 번호를 재사용하지 않도록)
+    record_results(manifest, entries, [], 3)
+    assert manifest['last_index'] == 9
+    # 실패한 이미지는 다음 호출에서 다시 처리된다
+    assert [entry['Key'] for entry in pending_entries(manifest, entries)] == ['c1/b.jpg']
+
+
+def test_s3_store_round_trip_and_fallbacks(fake_s3):
+    store = S3ManifestStore(fake_s3, 'faces')
+    assert store.load('c1') == empty_manifest('c1')
+
+    manifest = record_results(empty_manifest('c1'), [{'Key': 'c1/a.jpg', 'ETag': '"1"'}], [_result('c1/a.jpg', [1])], 1)
+    store.save('c1', manifest)
+    assert ('faces', '_manifests/c1.json') in fake_s3.objects
+    assert store.load('c1') == manifest
+
+    fake_s3.add('faces', '_manifests/c1.json', json.dumps({'version': 99}).encode(), content_type='application/json')
+    assert store.load('c1') == empty_manifest('c1')
+
+
+def _reserve(count):
+    def change(manifest):
+        start = manifest['last_index']
+        manifest['last_index'] = start + count
+        return start
+    return change
+
+
+def test_s3_store_update_writes_conditionally(fake_s3):
+    store = S3ManifestStore(fake_s3, 'faces')
+    assert store.update('c1', _reserve(2)) == ({**empty_manifest('c1'), 'last_index': 2}, 0)
+    assert store.update('c1', _reserve(3))[1] == 2
+
+    conditions = [(params['IfMatch'], params['IfNoneMatch']) for op, _, _, params in fake_s3.calls if op == 'put_object']
+    # 처음에는 객체가 없을 때만, 그다음에는 읽은 ETag일 때만 쓴다
+    assert conditions[0] == (None, '*') and conditions[1][0] is not None
+
+
+def test_s3_store_update_retries_when_another_invocation_wrote_first(fake_s3):
+    store, other = S3ManifestStore(fake_s3, 'faces'), S3ManifestStore(fake_s3, 'faces')
+    store.update('c1', _reserve(2))
+    seen = []
+
+    def reserve_one(manifest):
+        seen.append(manifest['last_index'])
+        if len(seen) == 1:
+            # 이 호출이 읽은 뒤 같은 connectionId의 다른 호출이 먼저 번호 3개를 가져간다
+            other.update('c1', _reserve(3))
+        return _reserve(1)(manifest)
+
+    manifest, start = store.update('c1', reserve_one)
+    assert seen == [2, 5]
+    assert (start, manifest['last_index'], store.load('c1')['last_index']) == (5, 6, 6)
+
+
+def test_s3_store_update_gives_up_after_repeated_conflicts(fake_s3, monkeypatch):
+    store = S3ManifestStore(fake_s3, 'faces')
+    monkeypatch.setattr('manifest.time.sleep', lambda seconds: None)
+
+    def always_overtaken(manifest):
+        fake_s3.add('faces', '_manifests/c1.json', json.dumps(empty_manifest('c1')).encode(), etag=f'"{len(fake_s3.calls)}"')
+
+    with pytest.raises(ManifestConflict):
+        store.update('c1', always_overtaken, attempts=3)
+
+
+def test_in_memory_store_returns_copies():
+    store = InMemoryManifestStore()
+    manifest = empty_manifest('c1')
+    store.save('c1', manifest)
+    manifest['last_index'] = 5
+
+    loaded = store.load('c1')
+    loaded['processed']['x'] = {}
+    assert store.load('c1') == empty_manifest('c1')
+
+
+@pytest.fixture
+def incremental_crop_face(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('crop_face', CROP_FACE_INCREMENTAL='true', CROP_FACE_MANIFEST_STORE='memory',
+                      CROP_FACE_DETECTION_CACHE='false', CROP_FACE_MAX_WORKERS='1')
+    monkeypatch.setattr(app, 's3', fake_s3)
+    prepared_keys = []
+
+    def prepare(bucket, key, deadline=None):
+        prepared_keys.append(key)
+        return {'source_key': key, 'faces': [{'image': Image.new('RGB', (8, 8)), 'confidence': 99.0,
+                                              'detection_method': 'stub', 'bbox': [0, 0, 8, 8]}]}
+
+    monkeypatch.setattr(app, '_prepare_image_faces', prepare)
+    return app, prepared_keys
+
+
+def test_incremental_handler_only_processes_new_or_changed_images(incremental_crop_face, fake_s3):
+    app, prepared_keys = incremental_crop_face
+    fake_s3.add('uploads', 'c1/a.jpg', b'a')
+    fake_s3.add('uploads', 'c1/b.jpg', b'b')
+    event = {'bucket': 'uploads', 'key': 'c1/b.jpg'}
+
+    first = app.lambda_handler(event, LambdaContext())['body']
+    assert (first['faces_found'], first['last_index'], first['skipped_images']) == (2, 2, 0)
+
+    second = app.lambda_handler(event, LambdaContext())['body']
+    assert (second['faces_found'], second['last_index'], second['skipped_images']) == (0, 2, 2)
+
+    fake_s3.add('uploads', 'c1/b.jpg', b'b2')
+    fake_s3.add('uploads', 'c1/c.jpg', b'c')
+    third = app.lambda_handler(event, LambdaContext())['body']
+    assert [face['face_number'] for result in third['results'] for face in result['faces']] == [3, 4]
+    assert prepared_keys == ['c1/a.jpg', 'c1/b.jpg', 'c1/b.jpg', 'c1/c.jpg']
+
+
+def test_concurrent_invocations_do_not_reuse_face_numbers(incremental_crop_face, fake_s3, monkeypatch):
+    app, prepared_keys = incremental_crop_face
+    fake_s3.add('uploads', 'c1/a.jpg', b'a')
+    fake_s3.add('uploads', 'c1/b.jpg', b'b')
+    real_prepare_all = app._prepare_all
+    overtaken = []
+
+    def prepare_all(bucket, keys, deadline=None):
+        prepared = real_prepare_all(bucket, keys, deadline)
+        if not overtaken:
+            # 첫 호출이 검출하는 동안 c1/c.jpg가 올라와 다른 호출이 a, b, c를 먼저 처리하고 번호 1..3을 가져간다
+            overtaken.append(True)
+            fake_s3.add('uploads', 'c1/c.jpg', b'c')
+            app.lambda_handler({'bucket': 'uploads', 'key': 'c1/c.jpg'}, LambdaContext())
+        return prepared
+
+    monkeypatch.setattr(app, '_prepare_all', prepare_all)
+    first = app.lambda_handler({'bucket': 'uploads', 'key': 'c1/b.jpg'}, LambdaContext())['body']
+    # 다른 호출이 이미 기록한 이미지는 번호를 예약하지도, 다시 올리지도 않는다
+    assert (first['faces_found'], first['last_index'], first['skipped_images']) == (0, 3, 2)
+    manifest = app.manifest_store.load('c1')
+    assert {key: entry['faces'] for key, entry in manifest['processed'].items()} == \
+        {'c1/a.jpg': [1], 'c1/b.jpg': [2], 'c1/c.jpg': [3]}
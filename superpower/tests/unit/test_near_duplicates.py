@@ -0,0 +1,190 @@
+import io
+import json
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image, ImageDraw
+
+from near_duplicates import MultiIndexHash, S3NearDuplicateIndexStore, dhash, hamming
+
+from .conftest import FakeBedrock
+
+ANALYSIS_TEXT = 'A small fluffy dragon.\nEMOTIONS: {"emotions":[{"name":"joy","score":9}]}'
+PROMPT_TEXT = '{"text": "a cute baby dragon", "navigationText": "귀여운 아기 용"}'
+
+
+def _photo(size=(640, 480), fmt='JPEG', quality=90, seed=1):
+    """seed가 같으면 같은 장면을 size/포맷/품질만 바꿔 저장한다."""
+    rng = random.Random(seed)
+    image = Image.linear_gradient('L').resize((640, 480)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y, radius = rng.randrange(640), rng.randrange(480), rng.randrange(20, 200)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.resize(size).save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def test_dhash_is_stable_across_reencoding_and_resizing():
+    original = dhash(_photo())
+    assert hamming(original, dhash(_photo(size=(320, 240), quality=60))) <= 6
+    assert hamming(original, dhash(_photo(fmt='PNG'))) <= 6
+    assert hamming(original, dhash(_photo(seed=2))) > 6
+
+
+def test_search_matches_brute_force():
+    rng = random.Random(7)
+    index = MultiIndexHash()
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    # 몇몇 해시는 기존 해시에서 몇 비트만 뒤집은 것으로 넣는다
+    hashes += [hashes[i] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for i in range(0, 300, 10)]
+    for number, value in enumerate(hashes):
+        index.add(value, {'content_hash': str(number)})
+
+    for _ in range(200):
+        probe = hashes[rng.randrange(len(hashes))]
+        for _ in range(rng.randrange(12)):
+            probe ^= 1 << rng.randrange(64)
+        for max_distance in (0, 3, 6, 10):
+            expected = min((hamming(probe, value) for value in hashes), default=None)
+            found = index.search(probe, max_distance)
+            if expected is None or expected > max_distance:
+                assert found is None
+            else:
+                assert found[0] == expected
+                assert hamming(probe, hashes[int(found[1]['content_hash'])]) == expected
+
+
+def test_search_returns_closest_record():
+    index = MultiIndexHash()
+    index.add(0b1111, {'content_hash': 'far'})
+    index.add(0b0001, {'content_hash': 'near'})
+
+    assert index.search(0, 6) == (1, {'content_hash': 'near'})
+    assert index.search(0, 0) is None
+    assert MultiIndexHash().search(0, 6) is None
+
+
+def test_document_round_trip_and_version_check():
+    index = MultiIndexHash()
+    index.add(0xFFFF_0000_FFFF_0000, {'content_hash': 'a', 'generated_key': 'c1/a.png'})
+
+    restored = MultiIndexHash.from_document(index.to_document())
+    assert restored.search(0xFFFF_0000_FFFF_0001, 2) == (1, {'content_hash': 'a', 'generated_key': 'c1/a.png'})
+    assert len(MultiIndexHash.from_document({'version': 99, 'entries': [['00', {}]]})) == 0
+
+
+def test_store_appends_entries_and_loads_them_incrementally(fake_s3):
+    writer = S3NearDuplicateIndexStore(fake_s3, 'cache')
+    reader = S3NearDuplicateIndexStore(fake_s3, 'cache')
+    assert len(reader.load()) == 0
+
+    writer.append(0x1000_0000_0000_0001, {'content_hash': 'a'}, now=1000.0)
+    writer.append(0xF000_0000_0000_0002, {'content_hash': 'b'}, now=1001.0)
+    index = reader.load()
+    assert [record['content_hash'] for record in index.records] == ['a', 'b']
+    # 항목마다 band(첫 hex 자리)별 shard 아래 객체 하나
+    assert ('cache', 'near-duplicates/v2/entries/1/0000001000000-a.json') in fake_s3.objects
+    assert ('cache', 'near-duplicates/v2/entries/f/0000001001000-b.json') in fake_s3.objects
+
+    writer.append(0x1000_0000_0000_0003, {'content_hash': 'c'}, now=1200.0)
+    writer.append(0x1000_0000_0000_0004, {'content_hash': 'a'}, now=1201.0)
+    fake_s3.calls.clear()
+    refreshed = reader.load(index)
+    assert refreshed is index
+    assert [record['content_hash'] for record in index.records] == ['a', 'b', 'c']
+    # 새로 읽을 때는 스냅샷을 다시 받지 않고 커서(시계 차이 여유 포함) 뒤 항목만 나열한다
+    assert not any(call[2].startswith('near-duplicates/v2/shards/') for call in fake_s3.calls)
+    starts = {call[2]: call[3]['StartAfter'] for call in fake_s3.calls if call[0] == 'list_objects_v2'}
+    assert starts['near-duplicates/v2/entries/1/'] == 'near-duplicates/v2/entries/1/0000000940000'
+
+
+def test_concurrent_appends_are_not_lost(fake_s3):
+    stores = [S3NearDuplicateIndexStore(fake_s3, 'cache') for _ in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda n: stores[n % 8].append(n << 40, {'content_hash': f'h{n}'}, now=1000.0), range(64)))
+
+    assert len(S3NearDuplicateIndexStore(fake_s3, 'cache').load()) == 64
+
+
+def test_compact_folds_entries_into_shard_snapshots(fake_s3):
+    writer = S3NearDuplicateIndexStore(fake_s3, 'cache')
+    writer.append(0x1000_0000_0000_0001, {'content_hash': 'a'}, now=1000.0)
+    writer.append(0x1000_0000_0000_0002, {'content_hash': 'b'}, now=1001.0)
+
+    assert writer.compact()['1'] == 2
+    snapshot = json.loads(fake_s3.objects[('cache', 'near-duplicates/v2/shards/1.json')]['Body'])
+    assert snapshot['through'] == 1001000
+    assert [record['content_hash'] for _, record in snapshot['entries']] == ['a', 'b']
+    # 새 항목이 없으면 스냅샷을 다시 쓰지 않는다
+    puts = fake_s3.count('put_object')
+    assert sum(writer.compact().values()) == 0
+    assert fake_s3.count('put_object') == puts
+
+    writer.append(0x1000_0000_0000_0003, {'content_hash': 'c'}, now=5000.0)
+    writer.compact()
+    # 스냅샷 이후 항목만 더 읽어 전체를 복원한다
+    fake_s3.calls.clear()
+    index = S3NearDuplicateIndexStore(fake_s3, 'cache').load()
+    assert sorted(record['content_hash'] for record in index.records) == ['a', 'b', 'c']
+    assert fake_s3.count('get_object') == 16 + 1
+
+
+def test_compact_retries_when_a_snapshot_changes_underneath(fake_s3, monkeypatch):
+    store = S3NearDuplicateIndexStore(fake_s3, 'cache')
+    store.append(0x1000_0000_0000_0001, {'content_hash': 'a'}, now=1000.0)
+    real_put = fake_s3.put_object
+    raced = []
+
+    def put_object(**kwargs):
+        if kwargs['Key'].endswith('shards/1.json') and not raced:
+            # 다른 컨테이너가 먼저 스냅샷을 썼다
+            raced.append(True)
+            real_put(Bucket='cache', Key=kwargs['Key'], Body=json.dumps(
+                {'version': 1, 'through': 999000, 'entries': [['1000000000000009', {'content_hash': 'z'}]]}))
+        return real_put(**kwargs)
+
+    monkeypatch.setattr(fake_s3, 'put_object', put_object)
+    monkeypatch.setattr('near_duplicates.time.sleep', lambda seconds: None)
+    assert store.compact()['1'] == 1
+
+    snapshot = json.loads(fake_s3.objects[('cache', 'near-duplicates/v2/shards/1.json')]['Body'])
+    assert [record['content_hash'] for _, record in snapshot['entries']] == ['z', 'a']
+
+
+@pytest.fixture
+def make_pet(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='true', FALLBACK_POOL_ENABLED='false')
+    monkeypatch.setattr(app, 'bedrock', FakeBedrock(
+        lambda model_id, request: PROMPT_TEXT if 'system' in request else ANALYSIS_TEXT))
+    return app
+
+
+def test_make_pet_reuses_prompt_for_a_reencoded_upload(make_pet):
+    first = make_pet._get_canvas_prompt(_photo())
+    assert first['source'] == 'model'
+    make_pet._remember_near_duplicate(first, 'c1/pet.png').result()
+    calls = len(make_pet.bedrock.requests)
+
+    near = make_pet._get_canvas_prompt(_photo(size=(480, 360), quality=70))
+    assert near['source'] == 'near-duplicate'
+    assert near['prompt'] == first['prompt']
+    assert near['reuse_record'] == {'content_hash': first['content_hash'], 'generated_key': 'c1/pet.png'}
+    assert len(make_pet.bedrock.requests) == calls
+
+    assert make_pet._get_canvas_prompt(_photo(seed=2))['source'] == 'model'
+
+
+def test_make_pet_remembers_in_memory_and_appends_in_the_background(make_pet, fake_s3):
+    first = make_pet._get_canvas_prompt(_photo())
+    make_pet._load_near_duplicate_index()
+    future = make_pet._remember_near_duplicate(first, 'c1/pet.png')
+    # 같은 컨테이너는 S3 쓰기를 기다리지 않고 바로 찾는다
+    assert make_pet._get_canvas_prompt(_photo(size=(480, 360), quality=70))['source'] == 'near-duplicate'
+
+    future.result()
+    entries = [key for _, key in fake_s3.objects if key.startswith('near-duplicates/v2/entries/')]
+    assert len(entries) == 1 and entries[0].endswith(f"-{first['content_hash']}.json")
+    assert make_pet.lambda_handler({'compactNearDuplicateIndex': True}, None)['added'] == 1
@@ -0,0 +1,160 @@
+import json
+import threading
+
+import pytest
+
+from sp_common.progress import ProgressNotifier, connection_id_from_key
+
+from .conftest import FakeBedrock, client_error, image_bytes
+
+ANALYSIS_TEXT = 'A small fluffy dragon with round eyes and tiny wings.\nEMOTIONS: {"emotions":[{"name":"joy","score":9}]}'
+PROMPT_TEXT = '{"text": "a cute baby dragon", "navigationText": "귀여운 아기 용"}'
+
+
+class FakeApiGateway:
+    def __init__(self, error=None):
+        self.error = error
+        self.messages = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        self.messages.append((ConnectionId, json.loads(Data)))
+
+
+def test_connection_id_from_key():
+    assert connection_id_from_key('abc123/photo.jpg') == 'abc123'
+    assert connection_id_from_key('photo.jpg') is None
+    assert connection_id_from_key('/photo.jpg') is None
+    assert connection_id_from_key(None) is None
+
+
+def test_notifier_without_connection_is_a_no_op():
+    notifier = ProgressNotifier(FakeApiGateway(), connection_id=None)
+    assert notifier.send('analysis') is None
+    notifier.partial('analysis', 'text')
+    notifier.close()
+    assert notifier.sent == 0
+
+
+def test_stage_messages_are_sent_in_order_with_extra_fields():
+    client = FakeApiGateway()
+    notifier = ProgressNotifier(client, 'conn-1', 'photo.jpg', extra={'jobId': 'j1'})
+    for stage in ('analysis', 'prompt', 'generation'):
+        notifier.send(stage)
+    notifier.close()
+
+    assert [message['stage'] for _, message in client.messages] == ['analysis', 'prompt', 'generation']
+    assert client.messages[0] == ('conn-1', {'type': 'progress', 'stage': 'analysis', 'fileName': 'photo.jpg',
+                                             'jobId': 'j1'})
+    assert notifier.sent == 3 and notifier.first_sent_ms is not None
+
+
+def test_partials_are_throttled_while_one_is_in_flight():
+    client = FakeApiGateway()
+    client.release.clear()
+    notifier = ProgressNotifier(client, 'conn-1', min_interval_ms=0)
+    for length in range(1, 6):
+        notifier.partial('analysis', 'x' * length)
+    client.release.set()
+    notifier.close()
+
+    assert [message['partial'] for _, message in client.messages] == ['x']
+
+
+def test_partials_respect_min_interval():
+    client = FakeApiGateway()
+    notifier = ProgressNotifier(client, 'conn-1', min_interval_ms=60_000)
+    notifier.partial('analysis', 'first')
+    notifier._partial_in_flight.result()
+    notifier.partial('analysis', 'second')
+    notifier.close()
+
+    assert [message['partial'] for _, message in client.messages] == ['first']
+
+
+def test_gone_connection_disables_further_messages():
+    client = FakeApiGateway(error=client_error('GoneException', 'PostToConnection', 410))
+    notifier = ProgressNotifier(client, 'conn-1')
+    notifier.send('analysis').result()
+
+    assert notifier.enabled is False
+    assert notifier.send('prompt') is None
+    notifier.close()
+
+
+@pytest.fixture
+def make_pet(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false', FALLBACK_POOL_ENABLED='false',
+                      PROMPT_CACHE_ENABLED='false', STREAM_PROMPT_START_CHARS='0')
+    monkeypatch.setattr(app, 'bedrock', FakeBedrock(
+        lambda model_id, request: PROMPT_TEXT if 'system' in request else ANALYSIS_TEXT, chunk_chars=8))
+    return app
+
+
+def test_streamed_analysis_starts_prompt_when_description_ends(make_pet):
+    client = FakeApiGateway()
+    progress = ProgressNotifier(client, 'conn-1', 'photo.jpg', min_interval_ms=0)
+    result = make_pet._get_canvas_prompt(image_bytes(), progress=progress)
+    progress.close()
+
+    assert result['early_prompt'] is True
+    assert result['analysis'] == 'A small fluffy dragon with round eyes and tiny wings.'
+    stages = [message['stage'] for _, message in client.messages]
+    assert stages[0] == 'analysis' and 'prompt' in stages
+    partials = [message['partial'] for _, message in client.messages if 'partial' in message]
+    # 부분 분석에는 감정 JSON이 섞이지 않는다
+    assert partials and all('EMOTIONS' not in partial and result['analysis'].startswith(partial) for partial in partials)
+    # 프롬프트 변환은 한 번만 불렸다 (이른 시작 결과를 그대로 썼다)
+    assert sum('system' in request for _, request in make_pet.bedrock.requests) == 1
+
+
+def test_stream_error_event_fails_the_analysis(make_pet, monkeypatch):
+    def broken_stream(budget_ms=None, **kwargs):
+        return {'body': iter([{'modelStreamErrorException': {'message': 'stream broke'}}])}
+
+    monkeypatch.setattr(make_pet.bedrock, 'invoke_model_with_response_stream', broken_stream)
+    with pytest.raises(RuntimeError, match='modelStreamErrorException'):
+        make_pet._get_canvas_prompt(image_bytes())
+
+
+def test_failed_analysis_cancels_the_queued_early_prompt(make_pet, monkeypatch):
+    from concurrent.futures import Future
+
+    submitted = []
+
+    def queue(fn, *args):
+        # 실행기가 바빠 아직 시작하지 못한 프롬프트 변환
+        submitted.append(Future())
+        return submitted[-1]
+
+    def analysis_then_error(budget_ms=None, modelId=None, body=None, **kwargs):
+        # 설명이 끝난 뒤(감정 JSON이 시작된 뒤) 스트림이 끊긴다
+        return {'body': iter([{'chunk': {'bytes': json.dumps({'contentBlockDelta': {'delta': {'text': ANALYSIS_TEXT}}})}},
+                              {'modelStreamErrorException': {'message': 'stream broke'}}])}
+
+    monkeypatch.setattr(make_pet.prompt_executor, 'submit', queue)
+    monkeypatch.setattr(make_pet.bedrock, 'invoke_model_with_response_stream', analysis_then_error)
+    with pytest.raises(RuntimeError, match='modelStreamErrorException'):
+        make_pet._get_canvas_prompt(image_bytes())
+
+    [future] = submitted
+    assert future.cancelled()
+
+
+def test_abandon_early_prompt_cancels_a_queued_build(make_pet):
+    from concurrent.futures import Future
+
+    queued = Future()
+    make_pet._abandon_early_prompt(queued)
+    assert queued.cancelled()
+
+    running = Future()
+    running.set_running_or_notify_cancel()
+    make_pet._abandon_early_prompt(running)
+    running.set_exception(RuntimeError('late failure'))
+    assert not running.cancelled()
+    make_pet._abandon_early_prompt(None)
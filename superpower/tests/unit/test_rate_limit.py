@@ -0,0 +1,343 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from sp_common import rate_limit as rate_limit_module
+from sp_common.rate_limit import (DynamoDBLimiterStore, FileLimiterStore, InMemoryLimiterStore, RateLimited,
+                                  RateLimiter, StreamBody, build_store, is_throttle, parse_limits)
+
+from .conftest import client_error
+
+MODEL = 'amazon.nova-pro-v1:0'
+
+
+class FakeClock:
+    """rate_limit 모듈의 time 자리에 넣는 시계. sleep()은 기다리지 않고 시간만 앞으로 보낸다."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        # 실제 sleep처럼 조금이라도 시간이 흐르게 한다 (부동소수 오차로 남은 아주 짧은 대기가 끝나지 않는 것을 막음)
+        self.now += max(seconds, 0.001)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limit_module, 'time', fake)
+    return fake
+
+
+def limiter(**kwargs):
+    limits = {MODEL: kwargs.pop('limits', {'rate': 1, 'burst': 2, 'concurrency': 4})}
+    return RateLimiter(limits=limits, **kwargs)
+
+
+def state(limiter_, scope=''):
+    return limiter_.store.items()[f"{scope}/{MODEL}"]
+
+
+def test_parse_limits():
+    assert parse_limits('') == {}
+    assert parse_limits('{"m": {"rate": 0.5, "burst": 2}}') == {'m': {'rate': 0.5, 'burst': 2}}
+    for bad in ('0', '-1', 'true', '"5"'):
+        with pytest.raises(ValueError, match='m.rate must be a positive number'):
+            parse_limits(f'{{"m": {{"rate": {bad}}}}}')
+
+
+def test_is_throttle():
+    assert is_throttle(client_error('ThrottlingException', 'InvokeModel'))
+    assert not is_throttle(client_error('ValidationException', 'InvokeModel'))
+    assert not is_throttle(RuntimeError('ThrottlingException'))
+    # 스트림 이벤트 오류는 첫 글자가 소문자이고, ModelStreamErrorException도 스로틀로 본다
+    assert is_throttle(client_error('throttlingException'), stream=True)
+    assert is_throttle(client_error('ModelStreamErrorException'), stream=True)
+    assert not is_throttle(client_error('ModelStreamErrorException'))
+
+
+def test_tokens_refill_at_the_configured_rate(clock):
+    rate_limiter = limiter()
+    for _ in range(3):
+        rate_limiter.release(MODEL, rate_limiter.acquire(MODEL))
+
+    # 버킷(2개)을 다 쓴 세 번째 호출은 토큰 하나가 찰 때까지(1초) 기다렸다
+    assert clock.slept == [pytest.approx(1.0)]
+    assert rate_limiter.snapshot()[f"/{MODEL}"] == {'admitted': 3, 'delayed': 1, 'rejected': 0, 'throttled': 0,
+                                                    'rate': 1, 'inFlight': 0}
+
+
+def test_wait_longer_than_max_wait_is_rejected(clock):
+    rate_limiter = limiter(max_wait_ms=500)
+    rate_limiter.acquire(MODEL)
+    rate_limiter.acquire(MODEL)
+
+    with pytest.raises(RateLimited, match='no slot within 500ms'):
+        rate_limiter.acquire(MODEL)
+    assert clock.slept == [] and state(rate_limiter)['rejected'] == 1
+
+
+def test_scopes_are_limited_separately(clock):
+    rate_limiter = limiter(max_wait_ms=0)
+    for scope in ('us-east-1', 'us-east-1', 'ap-northeast-2', 'ap-northeast-2'):
+        rate_limiter.acquire(MODEL, scope)
+    with pytest.raises(RateLimited):
+        rate_limiter.acquire(MODEL, 'us-east-1')
+
+
+def test_full_concurrency_polls_with_growing_backoff(clock):
+    rate_limiter = limiter(limits={'rate': 100, 'burst': 100, 'concurrency': 1}, lease_seconds=30,
+                           poll_ms=50, max_poll_ms=400, max_wait_ms=2000)
+    rate_limiter.acquire(MODEL)
+    with pytest.raises(RateLimited):
+        rate_limiter.acquire(MODEL)
+
+    # 50ms 간격으로 계속 보지 않고 (jitter를 빼면) 50, 100, 200, 400, 400 ...ms로 늘어난다
+    assert len(clock.slept) < 10
+    assert all(25 / 1000 <= slept <= min(400, 50 * 2 ** n) / 1000 for n, slept in enumerate(clock.slept))
+    assert max(clock.slept) > 200 / 1000
+
+
+def test_concurrency_is_counted_by_leases_that_expire(clock):
+    rate_limiter = limiter(limits={'rate': 100, 'burst': 100, 'concurrency': 1}, lease_seconds=30)
+    lease = rate_limiter.acquire(MODEL)
+    with pytest.raises(RateLimited):
+        rate_limiter.acquire(MODEL, max_wait_ms=0)
+
+    rate_limiter.release(MODEL, lease)
+    rate_limiter.acquire(MODEL, max_wait_ms=0)
+    # 돌려받지 못한 lease도 lease_seconds 뒤에는 자리가 풀린다
+    clock.now += 31
+    rate_limiter.acquire(MODEL, max_wait_ms=0)
+
+
+def test_throttle_halves_the_rate_and_backs_off_exponentially(clock):
+    rate_limiter = limiter(limits={'rate': 8, 'burst': 8, 'concurrency': 4}, base_backoff_ms=200, min_rate=3)
+    for streak, base_ms in ((1, 200), (2, 400)):
+        rate_limiter.release(MODEL, rate_limiter.acquire(MODEL), throttled=True)
+        current = state(rate_limiter)
+        assert current['throttle_streak'] == streak and current['tokens'] <= 0
+        assert base_ms * 0.5 <= (current['blocked_until'] - clock.now) * 1000 <= base_ms
+        clock.now = current['blocked_until'] + 1
+
+    # 8 → 4 → 3(min_rate)
+    assert state(rate_limiter)['rate'] == 3
+    assert rate_limiter.snapshot()[f"/{MODEL}"]['throttled'] == 2
+
+
+def test_success_recovers_the_rate_additively(clock):
+    rate_limiter = limiter(limits={'rate': 10, 'burst': 10, 'concurrency': 4}, recovery=0.1)
+    rate_limiter.release(MODEL, rate_limiter.acquire(MODEL), throttled=True)
+    clock.now = state(rate_limiter)['blocked_until']
+
+    rates = []
+    for _ in range(7):
+        rate_limiter.release(MODEL, rate_limiter.acquire(MODEL))
+        rates.append(state(rate_limiter)['rate'])
+    assert rates == pytest.approx([6, 7, 8, 9, 10, 10, 10])
+    assert state(rate_limiter)['throttle_streak'] == 0
+
+
+def test_call_retries_throttles_but_not_other_errors(clock):
+    rate_limiter = limiter(max_attempts=3)
+    results = iter([client_error('ThrottlingException', 'InvokeModel'), 'ok'])
+
+    def flaky():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert rate_limiter.call(MODEL, flaky) == 'ok'
+    assert state(rate_limiter)['throttled'] == 1 and state(rate_limiter)['leases'] == {}
+
+    calls = []
+
+    def invalid():
+        calls.append(1)
+        raise client_error('ValidationException', 'InvokeModel')
+
+    with pytest.raises(ClientError, match='ValidationException'):
+        rate_limiter.call(MODEL, invalid)
+    assert len(calls) == 1
+
+
+def test_call_gives_up_after_the_allowed_attempts(clock):
+    rate_limiter = limiter(max_wait_ms=60_000)
+    calls = []
+
+    def throttled():
+        calls.append(1)
+        raise client_error('ThrottlingException', 'InvokeModel')
+
+    with pytest.raises(ClientError, match='ThrottlingException'):
+        rate_limiter.call(MODEL, throttled, attempts=2)
+    assert len(calls) == 2
+
+
+def _chunk(text):
+    return {'chunk': {'bytes': json.dumps({'contentBlockDelta': {'delta': {'text': text}}})}}
+
+
+def test_stream_lease_is_held_until_the_body_is_drained(clock):
+    rate_limiter = limiter()
+    response = rate_limiter.call(MODEL, lambda: {'body': iter([_chunk('a'), _chunk('b')])}, stream=True)
+    assert rate_limiter.snapshot()[f"/{MODEL}"]['inFlight'] == 1
+
+    assert len(list(response['body'])) == 2
+    assert rate_limiter.snapshot()[f"/{MODEL}"]['inFlight'] == 0
+    assert state(rate_limiter)['throttled'] == 0
+
+
+def test_stream_throttle_event_slows_the_rate(clock):
+    rate_limiter = limiter(limits={'rate': 4, 'burst': 4, 'concurrency': 4})
+    events = [_chunk('a'), {'throttlingException': {'message': 'slow down'}}]
+    response = rate_limiter.call(MODEL, lambda: {'body': iter(events)}, stream=True)
+
+    # 이벤트는 그대로 호출하는 쪽에 전달한다
+    assert list(response['body']) == events
+    assert (state(rate_limiter)['throttled'], state(rate_limiter)['rate']) == (1, 2)
+
+
+class ClosableStream:
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_body_finishes_once_on_close_or_error():
+    finished = []
+    stream = ClosableStream([_chunk('a')])
+    body = StreamBody(stream, finished.append)
+    body.close()
+    body.close()
+    assert finished == [None] and stream.closed
+
+    def broken():
+        yield _chunk('a')
+        raise ConnectionError('reset')
+
+    finished.clear()
+    with pytest.raises(ConnectionError):
+        list(StreamBody(broken(), finished.append))
+    assert len(finished) == 1 and isinstance(finished[0], ConnectionError)
+
+
+def test_file_store_shares_state_between_instances(tmp_path):
+    first = FileLimiterStore(str(tmp_path))
+    assert first.update('us-east-1/m', lambda state: ({'count': 1}, 'created')) == 'created'
+
+    second = FileLimiterStore(str(tmp_path))
+    second.update('us-east-1/m', lambda state: (dict(state, count=state['count'] + 1), None))
+    assert first.items() == {'us-east-1/m': {'count': 2}}
+
+
+class FakeDynamoDB:
+    """update_item의 ConditionExpression(version, attribute_not_exists)과 조건 실패 시 ALL_OLD 반환만 흉내 낸다."""
+
+    def __init__(self):
+        self.items = {}
+        self.updates = []
+        self.before_update = None
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression, ExpressionAttributeValues,
+                    ExpressionAttributeNames=None, ReturnValuesOnConditionCheckFailure=None):
+        if self.before_update is not None:
+            hook, self.before_update = self.before_update, None
+            hook()
+        key = Key['limiter_key']['S']
+        self.updates.append(key)
+        current = self.items.get(key)
+        if ConditionExpression == 'attribute_not_exists(limiter_key)':
+            ok = current is None
+        else:
+            ok = current is not None and current['version'] == ExpressionAttributeValues[':version']
+        if not ok:
+            error = client_error('ConditionalCheckFailedException', 'UpdateItem')
+            if ReturnValuesOnConditionCheckFailure == 'ALL_OLD' and current is not None:
+                error.response['Item'] = current
+            raise error
+        self.items[key] = {'limiter_key': Key['limiter_key'], 'state': ExpressionAttributeValues[':state'],
+                           'version': ExpressionAttributeValues[':next']}
+        return {}
+
+
+def test_dynamodb_store_versions_each_write_without_reading(clock):
+    client = FakeDynamoDB()
+    store = DynamoDBLimiterStore('limiter', client=client)
+    store.update('k', lambda state: ({'n': 1}, None))
+    store.update('k', lambda state: ({'n': state['n'] + 1}, None))
+
+    assert client.items['k']['version'] == {'N': '2'}
+    assert client.updates == ['k', 'k']
+    # 지표는 테이블을 다시 읽지 않고 마지막으로 쓴 state로 만든다
+    client.update_item = None
+    assert store.items() == {'k': {'n': 2}}
+
+
+def test_dynamodb_store_retries_with_the_item_returned_by_a_failed_condition(clock):
+    client = FakeDynamoDB()
+    store = DynamoDBLimiterStore('limiter', client=client)
+    other = DynamoDBLimiterStore('limiter', client=client)
+    store.update('k', lambda state: ({'n': 0}, None))
+
+    # 이 컨테이너가 계산한 뒤 쓰기 전에 다른 컨테이너가 먼저 고친다
+    client.before_update = lambda: other.update('k', lambda state: ({'n': (state or {'n': 0})['n'] + 10}, None))
+    seen = []
+    store.update('k', lambda state: (seen.append(state['n']) or {'n': state['n'] + 1}, None))
+
+    # other는 처음에 항목이 없다고 보고 썼다가 실패한 응답의 항목(n=0)으로 다시 계산한다
+    assert seen == [0, 10]
+    assert json.loads(client.items['k']['state']['S']) == {'n': 11}
+    assert client.items['k']['version'] == {'N': '3'}
+
+
+def test_dynamodb_store_gives_up_when_contended_and_raises_other_errors(clock):
+    client = FakeDynamoDB()
+    store = DynamoDBLimiterStore('limiter', client=client, max_retries=3)
+
+    def always_conflict(**kwargs):
+        raise client_error('ConditionalCheckFailedException', 'UpdateItem')
+
+    client.update_item = always_conflict
+    with pytest.raises(RateLimited, match='contended'):
+        store.update('k', lambda state: ({}, None))
+
+    def denied(**kwargs):
+        raise client_error('AccessDeniedException', 'UpdateItem', 403)
+
+    client.update_item = denied
+    with pytest.raises(ClientError, match='AccessDeniedException'):
+        store.update('k', lambda state: ({}, None))
+
+
+def test_limiter_over_dynamodb_store(clock):
+    rate_limiter = RateLimiter(store=DynamoDBLimiterStore('limiter', client=FakeDynamoDB()),
+                               limits={MODEL: {'rate': 1, 'burst': 1, 'concurrency': 1}}, max_wait_ms=0)
+    lease = rate_limiter.acquire(MODEL, 'us-east-1')
+    with pytest.raises(RateLimited):
+        rate_limiter.acquire(MODEL, 'us-east-1')
+    rate_limiter.release(MODEL, lease, 'us-east-1')
+
+    assert rate_limiter.snapshot() == {f"us-east-1/{MODEL}": {'admitted': 1, 'delayed': 0, 'rejected': 1,
+                                                               'throttled': 0, 'rate': 1, 'inFlight': 0}}
+
+
+def test_build_store(tmp_path):
+    assert isinstance(build_store('memory'), InMemoryLimiterStore)
+    assert isinstance(build_store('bogus'), InMemoryLimiterStore)
+    assert isinstance(build_store('file', directory=str(tmp_path)), FileLimiterStore)
+    with pytest.raises(ValueError, match='BEDROCK_LIMITER_TABLE'):
+        build_store('dynamodb')
@@ -0,0 +1,150 @@
+import base64
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from sp_common.output_keys import format_ladder, parse_ladder, rendition_key
+from sp_common.renditions import render_ladder
+
+from .conftest import FakeBedrock, image_bytes
+
+COMPLETE_BUCKET = 'sp-complete-bucket'
+
+
+def test_parse_ladder_normalizes_and_skips_bad_items():
+    spec = ' 512:webp, 256 , 256:JPG, 128:gif, x:png, 0:png, -5:png, 512:webp, ,64:png'
+    assert parse_ladder(spec) == [(512, 'webp'), (256, 'webp'), (256, 'jpeg'), (64, 'png')]
+    assert parse_ladder('') == [] and parse_ladder(None) == []
+
+
+def test_format_ladder_round_trips():
+    ladder = [(512, 'webp'), (256, 'jpeg')]
+    assert format_ladder(ladder) == '512:webp,256:jpeg'
+    assert parse_ladder(format_ladder(ladder)) == ladder
+
+
+def test_rendition_key():
+    assert rendition_key('c1/photo.png', 512, 'webp') == 'c1/photo_512.webp'
+    assert rendition_key('c1/photo.png', 256, 'jpeg') == 'c1/photo_256.jpg'
+    assert rendition_key('c1/photo', 64, 'png') == 'c1/photo_64.png'
+
+
+def test_render_ladder_keeps_order_sizes_and_formats():
+    ladder = [(256, 'jpeg'), (512, 'webp'), (256, 'webp'), (2000, 'png')]
+    renditions = render_ladder(image_bytes((1000, 500), fmt='PNG'), ladder)
+
+    assert [(r['edge'], r['format']) for r in renditions] == ladder
+    assert [(r['width'], r['height']) for r in renditions] == [(256, 128), (512, 256), (256, 128), (1000, 500)]
+    assert [r['content_type'] for r in renditions] == ['image/jpeg', 'image/webp', 'image/webp', 'image/png']
+    for rendition in renditions:
+        decoded = Image.open(io.BytesIO(rendition['bytes']))
+        assert decoded.format == rendition['format'].upper()
+        assert decoded.size == (rendition['width'], rendition['height'])
+
+
+def test_render_ladder_flattens_alpha_for_jpeg():
+    buffer = io.BytesIO()
+    Image.new('RGBA', (300, 300), (0, 0, 0, 0)).save(buffer, format='PNG')
+    [jpeg, webp] = render_ladder(buffer.getvalue(), [(100, 'jpeg'), (100, 'webp')])
+
+    assert all(channel > 245 for channel in Image.open(io.BytesIO(jpeg['bytes'])).convert('RGB').getpixel((50, 50)))
+    assert Image.open(io.BytesIO(webp['bytes'])).mode == 'RGBA'
+
+
+def test_render_ladder_empty():
+    assert render_ladder(b'not an image', []) == []
+
+
+def _canvas_png(model_id, request):
+    if 'taskType' in request:
+        config = request['imageGenerationConfig']
+        buffer = io.BytesIO()
+        Image.new('RGB', (config['width'], config['height']), (200, 80, 40)).save(buffer, format='PNG')
+        return {'images': [base64.b64encode(buffer.getvalue()).decode('ascii')] * config['numberOfImages']}
+    if 'system' in request:
+        return '{"text": "a cute baby dragon", "navigationText": "귀여운 아기 용"}'
+    return 'A small fluffy dragon.\nEMOTIONS: {"emotions":[{"name":"joy","score":9}]}'
+
+
+@pytest.fixture
+def load_make_pet(load_lambda, fake_s3, monkeypatch):
+    def load(**env):
+        env = {'NEAR_DUP_ENABLED': 'false', 'FALLBACK_POOL_ENABLED': 'false', **env}
+        app = load_lambda('make_pet', clients={'s3': fake_s3}, **env)
+        monkeypatch.setattr(app, 'bedrock', FakeBedrock(_canvas_png))
+        fake_s3.add('uploads', 'c1/photo.jpg', image_bytes((320, 240)))
+        return app
+
+    return load
+
+
+def test_make_pet_stores_renditions_before_the_original(load_make_pet, fake_s3):
+    app = load_make_pet(PET_RENDITIONS='512:webp,256:jpeg')
+    result = app._process_upload('uploads', 'c1/photo.jpg', 'two-stage')
+
+    assert [(r['key'], r['format'], r['width']) for r in result['output']['renditions']] == \
+        [('c1/photo_512.webp', 'webp', 512), ('c1/photo_256.jpg', 'jpeg', 256)]
+    puts = [key for operation, bucket, key, _ in fake_s3.calls if operation == 'put_object' and bucket == COMPLETE_BUCKET]
+    assert puts[-1] == 'c1/photo.jpg'
+    assert set(puts) == {'c1/photo.jpg', 'c1/photo_512.webp', 'c1/photo_256.jpg'}
+
+    webp = fake_s3.objects[(COMPLETE_BUCKET, 'c1/photo_512.webp')]
+    assert webp['ContentType'] == 'image/webp'
+    assert webp['Metadata'] == {'rendition': '512:webp', 'variant-group': 'c1/photo.jpg'}
+    assert fake_s3.objects[(COMPLETE_BUCKET, 'c1/photo.jpg')]['Metadata']['renditions'] == '512:webp,256:jpeg'
+
+
+def test_make_pet_without_ladder_or_with_failed_transcode_saves_only_the_png(load_make_pet, fake_s3, monkeypatch):
+    app = load_make_pet(PET_RENDITIONS='')
+    assert app._process_upload('uploads', 'c1/photo.jpg', 'two-stage')['output']['renditions'] == []
+
+    def broken_render(*args):
+        raise OSError('encoder missing')
+
+    app = load_make_pet(PET_RENDITIONS='256:webp')
+    monkeypatch.setattr(app, 'render_ladder', broken_render)
+    result = app._process_upload('uploads', 'c1/photo.jpg', 'two-stage')
+
+    assert result['output']['renditions'] == []
+    assert 'renditions' not in fake_s3.objects[(COMPLETE_BUCKET, 'c1/photo.jpg')]['Metadata']
+    assert (COMPLETE_BUCKET, 'c1/photo_256.webp') not in fake_s3.objects
+
+
+class FakeApiGateway:
+    class exceptions:
+        class GoneException(Exception):
+            pass
+
+    def __init__(self):
+        self.messages = []
+
+    def post_to_connection(self, ConnectionId, Data):
+        self.messages.append((ConnectionId, json.loads(Data)))
+
+
+@pytest.fixture
+def image_complete(load_lambda, fake_s3):
+    gateway = FakeApiGateway()
+    app = load_lambda('image_complete', clients={'s3': fake_s3, 'apigatewaymanagementapi': gateway})
+    return app, gateway
+
+
+def _complete_event(key):
+    return {'detail': {'bucket': {'name': COMPLETE_BUCKET}, 'object': {'key': key}}}
+
+
+def test_image_complete_lists_rendition_urls_and_skips_rendition_objects(image_complete, load_make_pet):
+    app, gateway = image_complete
+    load_make_pet(PET_RENDITIONS='512:webp,256:jpeg')._process_upload('uploads', 'c1/photo.jpg', 'two-stage')
+
+    for key in ('c1/photo_512.webp', 'c1/photo_256.jpg'):
+        assert 'Rendition' in app.lambda_handler(_complete_event(key), None)['body']
+    assert gateway.messages == []
+
+    app.lambda_handler(_complete_event('c1/photo.jpg'), None)
+    [(_, message)] = gateway.messages
+    assert [(r['maxEdge'], r['format'], r['contentType']) for r in message['renditions']] == \
+        [(512, 'webp', 'image/webp'), (256, 'jpeg', 'image/jpeg')]
+    assert [r['url'].split('?')[0].rsplit('/', 1)[-1] for r in message['renditions']] == ['photo_512.webp', 'photo_256.jpg']
@@ -0,0 +1,217 @@
+import base64
+import hashlib
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from sp_common.output_keys import box_rendition_key
+from sp_common.renditions import decode_for_ladder, render_image
+
+from .conftest import client_error, image_bytes
+
+RESIZED_BUCKET = 'test-bucket'
+
+
+def _noise_jpeg(size):
+    buffer = io.BytesIO()
+    Image.effect_noise(size, 40).convert('RGB').save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def test_decode_for_ladder_drafts_large_jpegs():
+    image = decode_for_ladder(Image.open(io.BytesIO(_noise_jpeg((2000, 1000)))), [(256, 'webp'), (500, 'jpeg')])
+    # draft는 1/2~1/8로만 줄이므로 가장 큰 사본(500)보다 작아지지 않는 선에서 줄인다
+    assert 500 <= max(image.size) < 2000
+
+    png = Image.open(io.BytesIO(image_bytes((800, 400), fmt='PNG')))
+    assert decode_for_ladder(png, [(100, 'webp')]).size == (800, 400)
+
+
+def test_render_image_never_upscales():
+    image = Image.new('RGB', (120, 80), (10, 20, 30))
+    [small, large] = render_image(image, [(60, 'png'), (1000, 'png')])
+
+    assert (small['width'], small['height']) == (60, 40)
+    assert (large['width'], large['height']) == (120, 80)
+    assert image.size == (120, 80)
+
+
+@pytest.fixture
+def load_resize(load_lambda, fake_s3, tmp_path):
+    def load(**env):
+        env = {'RESIZE_TMP_CACHE_DIR': str(tmp_path / 'renditions'), **env}
+        return load_lambda('resize_image', clients={'s3': fake_s3}, **env)
+
+    return load
+
+
+def _uploaded(key, bucket='uploads'):
+    return {'detail': {'bucket': {'name': bucket}, 'object': {'key': key}}}
+
+
+def test_small_original_is_copied_without_reencoding(load_resize, fake_s3):
+    app = load_resize()
+    original = image_bytes((200, 150))
+    fake_s3.add('uploads', 'c1/photo.jpg', original)
+
+    body = json.loads(app.lambda_handler(_uploaded('c1/photo.jpg'), None)['body'])
+    assert body['message'] == 'Image copied without resizing.'
+    assert fake_s3.objects[(RESIZED_BUCKET, 'c1/photo.jpg')]['Body'] == original
+
+
+def test_ladder_is_rendered_from_one_decode(load_resize, fake_s3):
+    app = load_resize(RESIZE_RENDITIONS='300:original,600:webp,150:jpeg')
+    fake_s3.add('uploads', 'c1/photo.png', image_bytes((1200, 600), fmt='PNG'), content_type='image/png')
+
+    body = json.loads(app.lambda_handler(_uploaded('c1/photo.png'), None)['body'])
+    assert [(r['key'], r['format'], r['width'], r['height']) for r in body['renditions']] == [
+        ('c1/photo.png', 'png', 300, 150),
+        ('c1/photo_600.webp', 'webp', 600, 300),
+        ('c1/photo_150.jpg', 'jpeg', 150, 75),
+    ]
+    assert 'decode_ms' in body['timings'] and 'upload_ms' in body['timings']
+    stored = {r['key']: fake_s3.objects[(RESIZED_BUCKET, r['key'])] for r in body['renditions']}
+    assert [item['ContentType'] for item in stored.values()] == ['image/png', 'image/webp', 'image/jpeg']
+    assert Image.open(io.BytesIO(stored['c1/photo_600.webp']['Body'])).size == (600, 300)
+
+
+def test_original_format_falls_back_to_png_for_other_formats(load_resize):
+    app = load_resize(RESIZE_RENDITIONS='100:original')
+    [rendition], _ = app.render(image_bytes((400, 200), fmt='BMP'), 'image/bmp')
+
+    assert (rendition['format'], rendition['content_type'], rendition['width']) == ('png', 'image/png', 100)
+
+
+def test_non_images_and_corrupt_images_are_skipped(load_resize, fake_s3):
+    app = load_resize()
+    fake_s3.add('uploads', 'c1/notes.txt', b'plain text, not an image', content_type='text/plain')
+    fake_s3.add('uploads', 'c1/broken.jpg', _noise_jpeg((800, 600))[:3000])
+
+    for key in ('c1/notes.txt', 'c1/broken.jpg'):
+        response = app.lambda_handler(_uploaded(key), None)
+        assert response['statusCode'] == 200 and 'skipped' in response['body']
+    assert not any(bucket == RESIZED_BUCKET for bucket, _ in fake_s3.objects)
+
+
+def test_box_rendition_key():
+    assert box_rendition_key('c1/photo.png', 100, 50, 'webp') == 'c1/photo_100x50.webp'
+    assert box_rendition_key('c1/photo.png', 100, None, 'jpeg') == 'c1/photo_100x.jpg'
+    assert box_rendition_key('c1/photo', None, 80, 'png') == 'c1/photo_x80.png'
+    assert box_rendition_key('c1/photo.png', 100, 50, 'webp', '9b2c') == 'c1/photo_100x50.9b2c.webp'
+
+
+def _resize(app, if_none_match=None, **params):
+    event = {'httpMethod': 'GET', 'queryStringParameters': params}
+    if if_none_match is not None:
+        event['headers'] = {'If-None-Match': if_none_match}
+    return app.lambda_handler(event, None)
+
+
+@pytest.fixture
+def pet(fake_s3):
+    fake_s3.add('sp-complete-bucket', 'c1/photo.png', image_bytes((400, 200), fmt='PNG'), content_type='image/png',
+                etag='"v1"')
+
+
+@pytest.mark.parametrize('params', [
+    {'width': '128'},
+    {'key': 'c1/photo.png', 'bucket': 'sp-user-input-temporary-bucket', 'width': '128'},
+    {'key': 'c1/photo.png'},
+    {'key': 'c1/photo.png', 'width': '0'},
+    {'key': 'c1/photo.png', 'width': '4096'},
+    {'key': 'c1/photo.png', 'width': '-5'},
+    # 허용 목록(RESIZE_ALLOWED_SIZES)에 없는 크기는 렌더링하지 않는다
+    {'key': 'c1/photo.png', 'width': '100'},
+    {'key': 'c1/photo.png', 'width': '128', 'height': '129'},
+    {'key': 'c1/photo.png', 'width': '128', 'format': 'gif'},
+])
+def test_resize_request_validation(load_resize, pet, fake_s3, params):
+    response = _resize(load_resize(), **params)
+    assert response['statusCode'] == 400
+    assert fake_s3.calls == []
+
+
+def test_resize_on_read_goes_cold_then_hot_then_warm(load_resize, pet, fake_s3, tmp_path):
+    app = load_resize()
+    cold = _resize(app, key='c1/photo.png', width='128', height='128', format='jpg')
+    assert (cold['statusCode'], cold['headers']['X-Cache']) == (200, 'cold')
+    assert cold['headers']['X-Rendition-Key'] == 'test-bucket/on-demand/sp-complete-bucket/c1/photo_128x128.v1.jpg'
+    assert cold['headers']['Content-Type'] == 'image/jpeg'
+    data = base64.b64decode(cold['body'])
+    assert Image.open(io.BytesIO(data)).size == (128, 64)
+    assert cold['headers']['ETag'] == f'"{hashlib.md5(data).hexdigest()}"'
+    stored = fake_s3.objects[(RESIZED_BUCKET, 'on-demand/sp-complete-bucket/c1/photo_128x128.v1.jpg')]
+    assert stored['Body'] == data
+
+    hot = _resize(app, key='c1/photo.png', width='128', height='128', format='jpg')
+    assert hot['headers']['X-Cache'] == 'hot' and hot['body'] == cold['body']
+    # 원본 ETag는 RESIZE_SOURCE_ETAG_TTL_SECONDS 동안 메모리에서 재사용한다
+    assert fake_s3.count('head_object') == 1
+
+    # 다른 컨테이너(/tmp가 빈)는 S3에 저장된 사본을 받는다
+    other = load_resize(RESIZE_TMP_CACHE_DIR=str(tmp_path / 'other'))
+    warm = _resize(other, key='c1/photo.png', width='128', height='128', format='jpg')
+    assert warm['headers']['X-Cache'] == 'warm' and warm['body'] == cold['body']
+    assert fake_s3.count('put_object') == 1
+    assert other.tmp_cache.size_bytes == len(data)
+
+
+def test_rewritten_originals_are_not_served_from_stale_renditions(load_resize, pet, fake_s3):
+    app = load_resize(RESIZE_SOURCE_ETAG_TTL_SECONDS='0')
+    first = _resize(app, key='c1/photo.png', width='128')
+    assert Image.open(io.BytesIO(base64.b64decode(first['body']))).size == (128, 64)
+
+    # make_pet이 같은 키에 새 결과를 쓴 경우
+    fake_s3.add('sp-complete-bucket', 'c1/photo.png', image_bytes((200, 400), fmt='PNG'), content_type='image/png',
+                etag='"v2"')
+    second = _resize(app, key='c1/photo.png', width='128')
+    assert second['headers']['X-Cache'] == 'cold'
+    assert second['headers']['X-Rendition-Key'].endswith('c1/photo_128x.v2.webp')
+    assert Image.open(io.BytesIO(base64.b64decode(second['body']))).size == (128, 256)
+    assert second['headers']['ETag'] != first['headers']['ETag']
+
+
+def test_resize_on_read_never_upscales(load_resize, pet):
+    response = _resize(load_resize(), key='c1/photo.png', width='2048')
+    assert Image.open(io.BytesIO(base64.b64decode(response['body']))).size == (400, 200)
+
+
+def test_matching_if_none_match_returns_304(load_resize, pet):
+    app = load_resize()
+    etag = _resize(app, key='c1/photo.png', width='128')['headers']['ETag']
+
+    response = _resize(app, if_none_match=etag, key='c1/photo.png', width='128')
+    assert (response['statusCode'], response['body']) == (304, '')
+
+
+def test_large_stored_renditions_redirect_to_s3(load_resize, pet):
+    response = _resize(load_resize(RESIZE_RESPONSE_MAX_BYTES='10'), key='c1/photo.png', width='128')
+
+    assert response['statusCode'] == 302
+    assert response['headers']['Location'].startswith(
+        'https://test-bucket.s3.amazonaws.com/on-demand/sp-complete-bucket/c1/photo_128x.v1.webp')
+
+
+def test_unstored_renditions_are_returned_inline_and_not_cached(load_resize, pet, fake_s3, monkeypatch):
+    app = load_resize(RESIZE_RESPONSE_MAX_BYTES='10')
+
+    def put_object(**kwargs):
+        raise client_error('SlowDown', 'PutObject', 503)
+
+    monkeypatch.setattr(fake_s3, 'put_object', put_object)
+    for _ in range(2):
+        response = _resize(app, key='c1/photo.png', width='128')
+        # presigned URL은 404가 되므로 한도를 넘어도 본문으로 보낸다
+        assert (response['statusCode'], response['headers']['X-Cache']) == (200, 'cold')
+    assert app.tmp_cache.size_bytes == 0
+
+
+def test_missing_and_non_image_originals(load_resize, fake_s3):
+    app = load_resize()
+    assert _resize(app, key='c1/missing.png', width='128')['statusCode'] == 404
+
+    fake_s3.add('sp-complete-bucket', 'c1/notes.txt', b'not an image')
+    response = _resize(app, key='c1/notes.txt', width='128')
+    assert response['statusCode'] == 400 and json.loads(response['body'])['reason'] == 'not_image'
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from sp_common import vision
+
+from .conftest import FakeBedrock, image_bytes
+
+VISION_TEXT = ('A small fluffy dragon with round eyes.\n'
+               'EMOTIONS: {"emotions":[{"name":"joy","score":9},{"name":"설렘","score":"20"},{"name":"평온","score":-3}]}')
+PROMPT_TEXT = '{"text": "a cute baby dragon", "navigationText": "귀여운 아기 용"}'
+
+
+def test_parse_response_splits_description_and_clamps_scores():
+    assert vision.parse_response(VISION_TEXT) == {
+        'description': 'A small fluffy dragon with round eyes.',
+        'emotions': [{'name': 'joy', 'score': 9}, {'name': '설렘', 'score': 15}, {'name': '평온', 'score': 0}],
+    }
+
+
+def test_description_of_partial_stream():
+    assert vision.description_of('A small fluffy dra') == 'A small fluffy dra'
+    assert vision.description_of('A dragon.\nEMOTIONS: {"emo') == 'A dragon.'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('```json\n{"emotions":[{"name":"joy","score":3}]}\n```', [{'name': 'joy', 'score': 3}]),
+    ('{"emotions":[{"name":"joy","score":"x"},{"score":5},"bad"]}', [{'name': 'joy', 'score': 0}]),
+    ('{"emotions": [', []),
+    ('no json', []),
+    ('[1, 2]', []),
+    ('', []),
+])
+def test_parse_emotions_tolerates_bad_output(text, expected):
+    assert vision.parse_emotions(text) == expected
+
+
+def test_cacheable_needs_description_and_emotions():
+    assert vision.cacheable(vision.parse_response(VISION_TEXT))
+    assert not vision.cacheable({'description': 'A dragon.', 'emotions': []})
+    assert not vision.cacheable({'description': '', 'emotions': [{'name': 'joy', 'score': 1}]})
+
+
+def test_cache_key_depends_on_image_and_instruction_version():
+    first, second = image_bytes(color=(1, 2, 3)), image_bytes(color=(3, 2, 1))
+    assert vision.vision_cache_key(vision.content_hash(first)) != vision.vision_cache_key(vision.content_hash(second))
+    assert vision.vision_cache_key(vision.content_hash(first)) == vision.vision_cache_key(vision.content_hash(first))
+
+
+def test_build_request_carries_image_format_and_instruction():
+    [content] = vision.build_request('aGk=', 'png')['messages']
+    assert content['content'][0]['image'] == {'format': 'png', 'source': {'bytes': 'aGk='}}
+    assert content['content'][1]['text'] == vision.VISION_INSTRUCTION
+
+
+def pet_model(model_id, request):
+    return PROMPT_TEXT if 'system' in request else VISION_TEXT
+
+
+@pytest.fixture
+def make_pet(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('make_pet', clients={'s3': fake_s3}, NEAR_DUP_ENABLED='false', FALLBACK_POOL_ENABLED='false')
+    monkeypatch.setattr(app, 'bedrock', FakeBedrock(pet_model))
+    return app
+
+
+@pytest.fixture
+def analyze(load_lambda, fake_s3, monkeypatch):
+    app = load_lambda('analyzeSentiment', clients={'s3': fake_s3}, RESULT_CACHE_ENABLED='false')
+    monkeypatch.setattr(app, 'bedrock', FakeBedrock(lambda model_id, request: VISION_TEXT))
+    return app
+
+
+def _analyze_request(key):
+    return {'httpMethod': 'POST', 'body': json.dumps({'bucket': 'uploads', 'key': key})}
+
+
+def test_analyze_sentiment_reuses_the_analysis_make_pet_cached(make_pet, analyze, fake_s3):
+    photo = image_bytes((320, 240))
+    fake_s3.add('uploads', 'c1/photo.jpg', photo)
+    make_pet._get_canvas_prompt(photo)
+
+    response = analyze.lambda_handler(_analyze_request('c1/photo.jpg'), None)
+    assert json.loads(response['body'])['emotions'][0] == {'name': 'joy', 'score': 9}
+    assert analyze.bedrock.requests == []
+
+
+def test_analyze_sentiment_caches_for_make_pet(make_pet, analyze, fake_s3):
+    photo = image_bytes((320, 240))
+    fake_s3.add('uploads', 'c1/photo.jpg', photo)
+    analyze.lambda_handler(_analyze_request('c1/photo.jpg'), None)
+
+    result = make_pet._get_canvas_prompt(photo)
+    assert result['analysis'] == 'A small fluffy dragon with round eyes.'
+    # 비전 분석은 건너뛰고 프롬프트 변환만 불렀다
+    assert [('system' in request) for _, request in make_pet.bedrock.requests] == [True]
+
+
+def test_unreadable_emotions_are_not_cached(analyze, fake_s3, monkeypatch):
+    monkeypatch.setattr(analyze, 'bedrock', FakeBedrock(lambda model_id, request: 'A dragon.\nEMOTIONS: oops'))
+    fake_s3.add('uploads', 'c1/photo.jpg', image_bytes((320, 240)))
+
+    for _ in range(2):
+        emotions = json.loads(analyze.lambda_handler(_analyze_request('c1/photo.jpg'), None)['body'])['emotions']
+        assert len(emotions) == 3 and emotions[0] == {'name': 'joy', 'score': 0}
+    assert len(analyze.bedrock.requests) == 2